@@ -0,0 +1,309 @@
+"""
+Controle de admissão na frente do agente (rotas /chat, /chat/stream e Telegram).
+
+Cada mensagem pode custar duas chamadas pagas ao Gemini e escritas no SQLite; sem limite, um único
+chat (ou script) abusivo ocupa os workers e atrasa os pacientes de verdade. Três camadas:
+- baldes de fichas por conversa/chat e por IP (limitar): acima da taxa, 429 na hora;
+- limite de mensagens em atendimento por processo (ADMISSAO_MAX_EM_VOO);
+- fila de espera limitada por processo (ADMISSAO_FILA, no máximo ADMISSAO_ESPERA_MAX_S): cheia ou
+  esgotada, 429 com Retry-After. Quem entra na fila é atendido em ordem de chegada.
+
+Os baldes ficam no SQLite (tabela 'admissao_baldes', uma transação por mensagem), como o
+session_store, para a taxa de um chat valer entre os workers do gunicorn. As vagas e a fila ficam na
+memória do processo: quem termina passa a vaga direto para o primeiro da fila, que acorda na hora
+(threads esperam numa Condition, o asgi.py num Future). Com N workers, o serviço atende no máximo
+N x ADMISSAO_MAX_EM_VOO mensagens ao mesmo tempo; as vagas de um worker morrem com ele.
+"""
+import asyncio
+import collections
+import math
+import os
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import database_tools
+from database_pool import write_transaction
+from metrics import definir, incrementar, observar
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# --- Configuração da admissão (pode ser ajustada pelo .env) ---
+ADMISSAO = os.getenv("ADMISSAO", "1") == "1"
+ADMISSAO_MAX_EM_VOO = int(os.getenv("ADMISSAO_MAX_EM_VOO", "32"))  # Mensagens em atendimento (por worker)
+ADMISSAO_FILA = int(os.getenv("ADMISSAO_FILA", "64"))  # Mensagens esperando vaga (por worker)
+ADMISSAO_ESPERA_MAX_S = float(os.getenv("ADMISSAO_ESPERA_MAX_S", "10"))
+ADMISSAO_RETRY_AFTER_S = float(os.getenv("ADMISSAO_RETRY_AFTER_S", "2"))  # Retry-After quando a fila recusa
+# Baldes de fichas: 'taxa' fichas por segundo, até 'rajada' acumuladas. Taxa 0 desliga o balde.
+ADMISSAO_CHAT_TAXA = float(os.getenv("ADMISSAO_CHAT_TAXA", "0.2"))  # 12 mensagens/min por conversa
+ADMISSAO_CHAT_RAJADA = float(os.getenv("ADMISSAO_CHAT_RAJADA", "8"))
+ADMISSAO_IP_TAXA = float(os.getenv("ADMISSAO_IP_TAXA", "1"))
+ADMISSAO_IP_RAJADA = float(os.getenv("ADMISSAO_IP_RAJADA", "30"))
+# Proxies confiáveis na frente da API (ex: 1 no Render): o IP do cliente vem do X-Forwarded-For
+ADMISSAO_PROXIES = int(os.getenv("ADMISSAO_PROXIES", "0"))
+ADMISSAO_PURGA_A_CADA = 500  # A cada N consumos de fichas, apaga os baldes que já estariam cheios
+
+RESPOSTA_OCUPADO = ("Estamos com muitas mensagens neste momento. 🙏 "
+                    "Por favor, envie sua mensagem de novo em alguns instantes.")
+
+
+class AdmissaoRecusada(Exception):
+    """A mensagem não foi admitida. 'motivo': chat, ip, fila_cheia ou espera."""
+
+    def __init__(self, motivo: str, retry_after_s: float):
+        super().__init__(f"Mensagem recusada pelo controle de admissão ({motivo})")
+        self.motivo = motivo
+        self.retry_after_s = retry_after_s
+
+    @property
+    def retry_after(self) -> str:
+        """Valor do header Retry-After (segundos inteiros, no mínimo 1)."""
+        return str(max(1, math.ceil(self.retry_after_s)))
+
+
+def ip_do_cliente(remote_addr: Optional[str], x_forwarded_for: Optional[str]) -> Optional[str]:
+    """IP de quem mandou a requisição: com ADMISSAO_PROXIES = N, o N-ésimo endereço a partir do fim do X-Forwarded-For."""
+    if ADMISSAO_PROXIES and x_forwarded_for:
+        enderecos = [e.strip() for e in x_forwarded_for.split(",") if e.strip()]
+        if enderecos:
+            return enderecos[max(0, len(enderecos) - ADMISSAO_PROXIES)]
+    return remote_addr
+
+
+class _Espera:
+    """Lugar na fila. 'admitida' vira True (com a Condition do controle) quando recebe uma vaga."""
+    __slots__ = ("admitida", "loop", "futuro")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.admitida = False
+        self.loop = loop
+        self.futuro = loop.create_future() if loop is not None else None
+
+
+def _acordar(futuro: "asyncio.Future") -> None:
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+class Vaga:
+    """Vaga de uma mensagem no limite do processo. liberar() pode ser chamado mais de uma vez."""
+    __slots__ = ("controle", "espera", "ativa", "liberada")
+
+    def __init__(self, controle: Optional["ControleDeAdmissao"], espera: Optional[_Espera] = None):
+        self.controle = controle
+        self.espera = espera
+        self.ativa = espera is None
+        self.liberada = controle is None
+
+    def liberar(self) -> None:
+        if self.liberada:
+            return
+        self.controle._liberar(self)
+
+    def __enter__(self) -> "Vaga":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.liberar()
+
+
+class ControleDeAdmissao:
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._cond = threading.Condition()
+        self._em_voo = 0
+        self._fila: Deque[_Espera] = collections.deque()
+        self._consumos = 0
+        self._stats = {"admitidas": 0, "enfileiradas": 0, "recusadas_chat": 0, "recusadas_ip": 0,
+                       "recusadas_fila_cheia": 0, "recusadas_espera": 0, "espera_total_s": 0.0, "espera_max_s": 0.0}
+
+    def _contar(self, chave: str, n: float = 1) -> None:
+        with self._cond:
+            self._stats[chave] += n
+
+    def _recusar(self, motivo: str, retry_after_s: float) -> AdmissaoRecusada:
+        self._contar(f"recusadas_{motivo}")
+        incrementar("clinica_admissao_recusadas_total", motivo=motivo)
+        log.info("Mensagem recusada pelo controle de admissão",
+                 extra=campos(motivo=motivo, retry_after_s=round(retry_after_s, 1)))
+        return AdmissaoRecusada(motivo, retry_after_s)
+
+    # --- Baldes de fichas por conversa e por IP ---
+
+    def limitar(self, chat: Optional[str] = None, ip: Optional[str] = None) -> None:
+        """Gasta uma ficha do balde da conversa e do IP (as duas ou nenhuma). Levanta AdmissaoRecusada se faltar."""
+        if not ADMISSAO:
+            return
+        baldes = []
+        if chat and ADMISSAO_CHAT_TAXA > 0:
+            baldes.append(("chat", f"chat:{chat}", ADMISSAO_CHAT_TAXA, ADMISSAO_CHAT_RAJADA))
+        if ip and ADMISSAO_IP_TAXA > 0:
+            baldes.append(("ip", f"ip:{ip}", ADMISSAO_IP_TAXA, ADMISSAO_IP_RAJADA))
+        if not baldes:
+            return
+        motivo, espera = write_transaction(self.db_file, lambda conn: self._consumir(conn, baldes, time.time()))
+        if motivo is not None:
+            raise self._recusar(motivo, espera)
+        with self._cond:
+            self._consumos += 1
+            purgar = self._consumos % ADMISSAO_PURGA_A_CADA == 0
+        if purgar:
+            self.purgar_baldes()
+
+    @staticmethod
+    def _consumir(conn, baldes: List[Tuple[str, str, float, float]], agora: float) -> Tuple[Optional[str], float]:
+        novos, motivo, espera = [], None, 0.0
+        for (tipo, chave, taxa, rajada) in baldes:
+            row = conn.execute("SELECT fichas, atualizado_em FROM admissao_baldes WHERE chave = ?", (chave,)).fetchone()
+            fichas = rajada if row is None else min(rajada, row[0] + max(0.0, agora - row[1]) * taxa)
+            if fichas < 1 and (1 - fichas) / taxa > espera:
+                motivo, espera = tipo, (1 - fichas) / taxa
+            novos.append((chave, fichas - 1, agora))
+        if motivo is None:
+            conn.executemany("INSERT OR REPLACE INTO admissao_baldes (chave, fichas, atualizado_em) VALUES (?, ?, ?)",
+                             novos)
+        return motivo, espera
+
+    def purgar_baldes(self) -> int:
+        """Apaga os baldes parados há tempo suficiente para estarem cheios (o mesmo que não ter linha)."""
+        cheio_em = max([r / t for (t, r) in ((ADMISSAO_CHAT_TAXA, ADMISSAO_CHAT_RAJADA),
+                                             (ADMISSAO_IP_TAXA, ADMISSAO_IP_RAJADA)) if t > 0] or [0])
+        return write_transaction(self.db_file, lambda conn: conn.execute(
+            "DELETE FROM admissao_baldes WHERE atualizado_em < ?", (time.time() - cheio_em,)).rowcount)
+
+    # --- Limite do processo e fila de espera ---
+
+    def _chegar(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Vaga:
+        """Vaga livre agora (ativa) ou lugar no fim da fila. Levanta AdmissaoRecusada se a fila estiver cheia."""
+        with self._cond:
+            # Com gente na fila, quem chega vai para o fim dela (mesmo que uma vaga tenha acabado de abrir)
+            if self._em_voo < ADMISSAO_MAX_EM_VOO and not self._fila:
+                self._em_voo += 1
+                vaga = Vaga(self)
+            elif len(self._fila) < ADMISSAO_FILA:
+                vaga = Vaga(self, _Espera(loop))
+                self._fila.append(vaga.espera)
+            else:
+                vaga = None
+            self._publicar()
+        if vaga is None:
+            raise self._recusar("fila_cheia", ADMISSAO_RETRY_AFTER_S)
+        if vaga.ativa:
+            self._contar("admitidas")
+            incrementar("clinica_admissao_admitidas_total")
+        else:
+            self._contar("enfileiradas")
+            incrementar("clinica_admissao_enfileiradas_total")
+        return vaga
+
+    def _fim_da_espera(self, vaga: Vaga, inicio: float) -> Vaga:
+        """Depois da espera: admitida (recebeu a vaga, mesmo que no último instante) ou sai da fila com 429."""
+        espera = time.monotonic() - inicio
+        with self._cond:
+            vaga.ativa = vaga.espera.admitida
+            if not vaga.ativa:
+                self._fila.remove(vaga.espera)
+                vaga.liberada = True
+                self._publicar()
+            else:
+                self._stats["espera_total_s"] += espera
+                self._stats["espera_max_s"] = max(self._stats["espera_max_s"], espera)
+        observar("clinica_admissao_espera_segundos", espera)
+        if not vaga.ativa:
+            raise self._recusar("espera", ADMISSAO_RETRY_AFTER_S)
+        self._contar("admitidas")
+        incrementar("clinica_admissao_admitidas_total")
+        return vaga
+
+    def _espera_max(self, espera_max_s: Optional[float]) -> float:
+        return ADMISSAO_ESPERA_MAX_S if espera_max_s is None else espera_max_s
+
+    def entrar(self, espera_max_s: Optional[float] = None) -> Vaga:
+        """
+        Pega uma vaga para atender a mensagem, esperando na fila até 'espera_max_s'
+        (padrão ADMISSAO_ESPERA_MAX_S). Levanta AdmissaoRecusada se a fila estiver cheia ou o tempo acabar.
+        Use com 'with' (ou chame vaga.liberar() no fim do atendimento).
+        """
+        if not ADMISSAO:
+            return Vaga(None)
+        vaga = self._chegar()
+        if vaga.ativa:
+            return vaga
+        inicio = time.monotonic()
+        try:
+            with self._cond:
+                self._cond.wait_for(lambda: vaga.espera.admitida, self._espera_max(espera_max_s))
+            return self._fim_da_espera(vaga, inicio)
+        except AdmissaoRecusada:
+            raise
+        except BaseException:
+            vaga.liberar()
+            raise
+
+    async def entrar_async(self, espera_max_s: Optional[float] = None) -> Vaga:
+        """Versão do entrar() para o asgi.py: a espera é um Future do event loop, sem ocupar threads."""
+        if not ADMISSAO:
+            return Vaga(None)
+        vaga = self._chegar(asyncio.get_running_loop())
+        if vaga.ativa:
+            return vaga
+        inicio = time.monotonic()
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(vaga.espera.futuro), self._espera_max(espera_max_s))
+            except asyncio.TimeoutError:
+                pass
+            return self._fim_da_espera(vaga, inicio)
+        except AdmissaoRecusada:
+            raise
+        except BaseException:
+            # Inclusive o cliente desconectar (CancelledError) enquanto espera na fila
+            vaga.liberar()
+            raise
+
+    def _liberar(self, vaga: Vaga) -> None:
+        with self._cond:
+            # O fim do stream e o fechamento da resposta podem chamar ao mesmo tempo
+            if vaga.liberada:
+                return
+            vaga.liberada = True
+            if vaga.espera is not None and not vaga.espera.admitida:
+                self._fila.remove(vaga.espera)  # Desistiu ainda na fila
+            elif self._fila:
+                # A vaga passa direto para o primeiro da fila: o total em atendimento não muda
+                proximo = self._fila.popleft()
+                proximo.admitida = True
+                if proximo.loop is not None:
+                    proximo.loop.call_soon_threadsafe(_acordar, proximo.futuro)
+                self._cond.notify_all()
+            else:
+                self._em_voo -= 1
+            self._publicar()
+
+    def _publicar(self) -> None:
+        # Gauges somados entre os workers pelo metrics: o total é o do serviço inteiro
+        definir("clinica_admissao_em_voo", self._em_voo)
+        definir("clinica_admissao_na_fila", len(self._fila))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["em_voo"] = self._em_voo
+            stats["na_fila"] = len(self._fila)
+        return stats
+
+
+_controle: Optional[ControleDeAdmissao] = None
+_controle_lock = threading.Lock()
+
+
+def get_admission() -> ControleDeAdmissao:
+    """Retorna o ControleDeAdmissao do processo (criado na primeira chamada)."""
+    global _controle
+    if _controle is None:
+        with _controle_lock:
+            if _controle is None:
+                _controle = ControleDeAdmissao(database_tools.DATABASE_FILE)
+    return _controle
+
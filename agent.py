@@ -1,7 +1,22 @@
+import asyncio
+import contextvars
+import functools
 import json
-from typing import List, Dict, Any
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Generator, Iterator, List, Optional, Tuple
 
-from config import model, generation_config 
+from chat_stream import Evento, ExtratorDeResposta, evento_fim, evento_progresso, texto_do_trecho
+from config import get_model, model_pronto
+from history_compaction import compact_history, estimate_tokens
+from intent_router import degraded_reply, route_message
+from metrics import MedicaoMensagem, incrementar, observar
+from model_client import CLIENTE_MODELO, ModeloIndisponivel
+from prompt_prefix import PrefixoDoPrompt, PrefixoPreparado
+from response_templates import render_degraded, render_tool_result
+from structured_log import campos, get_logger
+from tool_results import compactar
 
 from database_tools import (
     tool_obter_info_clinica, 
@@ -43,9 +58,12 @@ Regras de Ferramentas:
 - A ferramenta "tool_marcar_agendamento" ou "tool_marcar_exame" SÓ deve ser chamada quando você tiver o Nome, Especialidade/Exame e o ID do horário.
 - A ferramenta "tool_cancelar_agendamento" ou "tool_cancelar_exame" SÓ deve ser chamada quando você tiver o ID do agendamento/exame.
 - Use a ferramenta "tool_obter_info_clinica" para perguntas sobre endereço, convênios ou horário de funcionamento.
+- As buscas de horários ("tool_consultar_horarios_disponiveis" e "tool_consultar_horarios_exames") trazem poucos horários por vez. Se o usuário citar data, período do dia (manha, tarde, noite) ou médico, passe esses filtros (datas em AAAA-MM-DD). Se ele pedir mais opções, repita a busca com "cursor" = ID do último horário mostrado.
+- Se o usuário pedir várias coisas na mesma mensagem (ex: "quais meus agendamentos e meus exames?"), chame TODAS as ferramentas necessárias de uma vez, no formato 1b. Elas rodam na ordem da lista.
 
 Regras de Resposta FINAL (Após usar uma ferramenta):
 - Depois de chamar uma ferramenta e receber o 'tool_result', você deve fazer uma SEGUNDA chamada à IA (RAG) para gerar a resposta final com base no resultado.
+- Se chamou várias ferramentas, você recebe todos os resultados juntos: responda a todos os pedidos do usuário numa única resposta.
 - A resposta final deve ser sempre a ação: "RESPONDER_AO_USUARIO".
 
 Estrutura de JSON de Resposta (Sua Saída):
@@ -62,6 +80,17 @@ Estrutura de JSON de Resposta (Sua Saída):
      }}
    }}
 
+1b. Se você for chamar **várias ferramentas** de uma vez:
+   {{
+     "acao": "CHAMAR_FERRAMENTA",
+     "payload_acao": {{
+       "chamadas": [
+         {{"tool_name": "nome_da_funcao_1", "tool_args": {{"argumento1": "valor1"}}}},
+         {{"tool_name": "nome_da_funcao_2", "tool_args": {{}}}}
+       ]
+     }}
+   }}
+
 2. Se você precisar de **mais informações** do usuário:
    {{
      "acao": "PEDIR_MAIS_INFO",
@@ -88,117 +117,570 @@ Estrutura de JSON de Resposta (Sua Saída):
 """
 
 
-def process_web_message(user_message: str, chat_history: List[Dict[str, Any]]) -> str:
-    if not model:
-        return "Desculpe, a IA não está configurada corretamente (GEMINI_API_KEY ausente)."
+log = get_logger(__name__)
 
-    full_system_prompt = FULL_SYSTEM_PROMPT_TEMPLATE
-    
-    # 1. CRÍTICO: Monta o conteúdo da conversa, injetando o System Prompt como o primeiro item.
-    # Isso contorna o erro 'unexpected keyword argument system_instruction' em versões antigas.
-    
-    # Primeiro item: O System Prompt
-    contents_for_api = [{
-        "role": "user",
-        "parts": [{"text": full_system_prompt}]
-    }]
-    
-    # Adiciona o histórico de conversas anterior
-    contents_for_api.extend(chat_history)
-    
-    # Adiciona a mensagem atual do usuário
-    contents_for_api.append({
+# Ferramentas que recebem o ID do chat (e o nome, nas marcações) forçados pelo backend
+TOOLS_COM_ID_DO_USUARIO = ["tool_marcar_agendamento", "tool_listar_meus_agendamentos", "tool_cancelar_agendamento",
+                           "tool_marcar_exame", "tool_listar_meus_exames_agendados", "tool_cancelar_exame"]
+
+# Ferramentas que gravam no banco: numa ação com várias ferramentas, cada uma roda sozinha e na ordem pedida
+TOOLS_DE_ESCRITA = {"tool_marcar_agendamento", "tool_cancelar_agendamento", "tool_marcar_exame", "tool_cancelar_exame"}
+
+# Máximo de ferramentas numa mesma ação CHAMAR_FERRAMENTA (as que passarem disso são ignoradas)
+MAX_CHAMADAS_POR_ACAO = int(os.getenv("MAX_CHAMADAS_POR_ACAO", "5"))
+
+# Pool limitado para rodar as ferramentas (SQLite) fora do event loop na versão async
+# (e as leituras de uma ação com várias ferramentas, em paralelo)
+TOOL_THREADS = int(os.getenv("TOOL_THREADS", "8"))
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_THREADS, thread_name_prefix="tool")
+
+
+# System prompt e ferramentas: montados uma vez por processo (e, se possível, no cache de contexto do Gemini)
+PREFIXO = PrefixoDoPrompt(FULL_SYSTEM_PROMPT_TEMPLATE, AVAILABLE_TOOLS.values())
+
+
+def _build_contents(user_message: str, chat_history: List[Dict[str, Any]],
+                    prefixo: PrefixoPreparado) -> List[Dict[str, Any]]:
+    """
+    Monta o conteúdo da conversa, injetando o System Prompt como o primeiro item.
+    Isso contorna o erro 'unexpected keyword argument system_instruction' em versões antigas.
+    Com o cache de contexto, o System Prompt já está no cache e não entra aqui.
+    """
+    # Histórico de conversas anterior, compactado para caber no orçamento de tokens
+    historico, stats = compact_history(chat_history)
+    if stats['mensagens_invalidas']:
+        log.warning("Histórico com mensagens fora do formato, descartadas", extra=campos(
+            mensagens_invalidas=stats['mensagens_invalidas']))
+
+    # Prefixo fixo (o mesmo objeto em toda mensagem) + histórico + mensagem atual do usuário
+    contents_for_api = prefixo.contents(historico, {
         "role": "user",
         "parts": [{"text": user_message}]
     })
 
-    print(f"--- Processando Nova Mensagem Web: {user_message} (Histórico recebido: {len(chat_history)} mensagens) ---")
+    fixos = PREFIXO.tokens_sistema + estimate_tokens(user_message)
+    observar("clinica_prompt_tokens", fixos + stats['tokens_depois'])
+    log.debug("Prompt montado", extra=campos(
+        tokens_antes=fixos + stats['tokens_antes'], tokens_depois=fixos + stats['tokens_depois'],
+        mensagens_resumidas=stats['mensagens_resumidas'], tool_outputs_removidos=stats['tool_outputs_removidos']))
+    return contents_for_api
+
+
+def _tamanho(chat_history) -> int:
+    # Só para o log: o histórico vem do cliente e pode nem ser uma lista (compact_history descarta)
+    return len(chat_history) if isinstance(chat_history, list) else 0
+
+
+# Modelo no lugar do config.get_model() (os benchmarks trocam por um falso: agent.model = ...)
+model = None
+
+
+def _modelo():
+    return model if model is not None else get_model()
+
+
+async def _modelo_async():
+    # A 1a criação importa o google.generativeai (~1s): fora do event loop
+    if model is not None or model_pronto():
+        return _modelo()
+    return await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, _modelo)
+
+
+def _prefixo() -> Optional[PrefixoPreparado]:
+    # None sem modelo. Na 1a vez converte as ferramentas e cria o cache de contexto (rede)
+    return PREFIXO.preparar(_modelo())
+
+
+async def _prefixo_async() -> Optional[PrefixoPreparado]:
+    modelo = await _modelo_async()
+    if not modelo or PREFIXO.pronto(modelo):
+        return PREFIXO.preparar(modelo)
+    return await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, PREFIXO.preparar, modelo)
+
+
+def _model_kwargs(prefixo: PrefixoPreparado) -> Dict[str, Any]:
+    # Parâmetros comuns às chamadas (sync, async e stream): os mesmos objetos em toda mensagem
+    return prefixo.registrar_chamada()
+
+
+def _prepare_tool_args(tool_name: str, tool_args: Dict[str, Any], chat_id: str = "WEB_CHAT_ID") -> Dict[str, Any]:
+    # Para agendamentos e cancelamentos, forçamos os IDs de usuário (o chat do Telegram ou o fixo do site)
+    if tool_name in TOOLS_COM_ID_DO_USUARIO:
+        tool_args['telegram_chat_id'] = str(chat_id)
+        if tool_name in ["tool_marcar_agendamento", "tool_marcar_exame"] and 'nome_paciente' not in tool_args:
+            tool_args['nome_paciente'] = "Paciente Web"
+    return tool_args
+
+
+def _chamadas(payload: Dict[str, Any]) -> List[Tuple[Any, Dict[str, Any]]]:
+    """
+    [(tool_name, tool_args)] da ação CHAMAR_FERRAMENTA: a lista "chamadas" (várias ferramentas de uma vez)
+    ou o formato de uma ferramenta só ("tool_name" e "tool_args" direto no payload).
+    """
+    lista = payload.get("chamadas")
+    if not isinstance(lista, list) or not lista:
+        lista = [payload]
+    chamadas = [(c.get("tool_name"), c.get("tool_args") or {}) for c in lista if isinstance(c, dict)]
+    if len(chamadas) > MAX_CHAMADAS_POR_ACAO:
+        log.warning("Ferramentas demais numa ação, as últimas foram ignoradas",
+                    extra=campos(pedidas=len(chamadas), limite=MAX_CHAMADAS_POR_ACAO))
+        chamadas = chamadas[:MAX_CHAMADAS_POR_ACAO]
+    return chamadas
+
+
+def _desconhecida(chamadas: List[Tuple[Any, Dict[str, Any]]]) -> Optional[Any]:
+    # A ação inteira é recusada (nada roda) se alguma ferramenta não existe; "" para uma lista vazia
+    if not chamadas:
+        return ""
+    return next((tool_name for (tool_name, _) in chamadas if tool_name not in AVAILABLE_TOOLS), None)
+
+
+def _lotes(chamadas: List[Tuple[str, Dict[str, Any]]]) -> List[List[Tuple[str, Dict[str, Any]]]]:
+    """
+    Divide as chamadas em lotes que rodam um depois do outro: leituras seguidas ficam no mesmo lote
+    (rodam juntas) e cada escrita forma um lote sozinha. Assim "cancele o 3 e mostre meus agendamentos"
+    lista os agendamentos já sem o 3, como se as ferramentas rodassem uma a uma.
+    """
+    lotes: List[List[Tuple[str, Dict[str, Any]]]] = []
+    for chamada in chamadas:
+        if chamada[0] in TOOLS_DE_ESCRITA or not lotes or lotes[-1][0][0] in TOOLS_DE_ESCRITA:
+            lotes.append([chamada])
+        else:
+            lotes[-1].append(chamada)
+    return lotes
+
+
+def _preparar_lote(lote, chat_id: str) -> List[Tuple[str, Dict[str, Any]]]:
+    preparadas = [(tool_name, _prepare_tool_args(tool_name, tool_args, chat_id)) for (tool_name, tool_args) in lote]
+    for (tool_name, tool_args) in preparadas:
+        log.info("Chamando ferramenta", extra=campos(ferramenta=tool_name, tool_args=tool_args))
+    return preparadas
+
+
+def _registrar_lote(preparadas, feitas, medicao: MedicaoMensagem, resultados: List[tuple]) -> None:
+    for ((tool_name, tool_args), (tool_result, duracao)) in zip(preparadas, feitas):
+        medicao.ferramenta(tool_name, duracao, tool_result)
+        log.debug("Resultado da ferramenta", extra=campos(ferramenta=tool_name, resultado=tool_result))
+        resultados.append((tool_name, tool_args, tool_result))
+
+
+def _executar_ferramentas(chamadas, chat_id: str, medicao: MedicaoMensagem) -> List[tuple]:
+    """
+    Roda as ferramentas da ação e devolve [(tool_name, tool_args, tool_result)] na ordem pedida.
+    Uma ferramenta sozinha roda na própria thread; as leituras de um lote com várias rodam juntas no TOOL_EXECUTOR.
+    """
+    observar("clinica_ferramentas_por_acao", len(chamadas))
+    resultados: List[tuple] = []
+    for lote in _lotes(chamadas):
+        preparadas = _preparar_lote(lote, chat_id)
+        if len(preparadas) == 1:
+            feitas = [_run_tool_timed(AVAILABLE_TOOLS[preparadas[0][0]], preparadas[0][1])]
+        else:
+            futuros = [TOOL_EXECUTOR.submit(_no_contexto(_run_tool_timed, AVAILABLE_TOOLS[tool_name], tool_args))
+                       for (tool_name, tool_args) in preparadas]
+            feitas = [futuro.result() for futuro in futuros]
+        _registrar_lote(preparadas, feitas, medicao, resultados)
+    return resultados
+
+
+async def _executar_ferramentas_async(chamadas, chat_id: str, medicao: MedicaoMensagem) -> List[tuple]:
+    """Versão async de _executar_ferramentas: toda ferramenta roda no TOOL_EXECUTOR (o SQLite é bloqueante)."""
+    loop = asyncio.get_running_loop()
+    observar("clinica_ferramentas_por_acao", len(chamadas))
+    resultados: List[tuple] = []
+    for lote in _lotes(chamadas):
+        preparadas = _preparar_lote(lote, chat_id)
+        feitas = await asyncio.gather(*(
+            loop.run_in_executor(TOOL_EXECUTOR, _no_contexto(_run_tool_timed, AVAILABLE_TOOLS[tool_name], tool_args))
+            for (tool_name, tool_args) in preparadas))
+        _registrar_lote(preparadas, feitas, medicao, resultados)
+    return resultados
+
+
+def _renderizar(resultados: List[tuple]) -> Optional[str]:
+    # Resposta direto dos templates só se TODAS as ferramentas tiverem um; senão, tudo vai numa 2a chamada só
+    partes = [render_tool_result(tool_name, tool_args, tool_result) for (tool_name, tool_args, tool_result) in resultados]
+    if not partes or any(parte is None for parte in partes):
+        return None
+    return "\n\n".join(partes)
+
+
+def _build_rag_contents(contents_for_api, ai_json_response_str: str, resultados: List[tuple]) -> List[Dict[str, Any]]:
+    # Monta o RAG (Round de Resposta) para a Segunda Chamada
+    # Usamos contents_for_api (que tem o histórico e o system prompt)
+    tool_response_content = [
+        {"role": "user", "parts": [{"text": "O usuário enviou uma nova mensagem."}]},
+        {"role": "model", "parts": [{"text": ai_json_response_str}]}, # Resultado da 1a IA
+        # Um functionResponse por ferramenta, todos na mesma mensagem (uma 2a chamada só).
+        # Forma compacta do resultado (tabela por colunas, códigos curtos) quando ela é menor que o texto
+        {"role": "tool", "parts": [{"functionResponse": {"name": tool_name, "response": compactar(tool_result)}}
+                                   for (tool_name, _, tool_result) in resultados]}
+    ]
+
+    # Conteúdo completo para a 2a chamada: contents_for_api + Chamada de Ferramenta + Resultado da Ferramenta
+    return contents_for_api + tool_response_content
+
+
+def _no_contexto(fn, *args):
+    # run_in_executor não leva os contextvars: assim os logs da thread mantêm os IDs de correlação
+    return functools.partial(contextvars.copy_context().run, fn, *args)
+
 
+def _run_tool_timed(tool_function, tool_args: Dict[str, Any]):
+    # Roda no TOOL_EXECUTOR: mede só a ferramenta, sem o tempo esperando uma thread livre
+    inicio = time.perf_counter()
+    resultado = tool_function(**tool_args)
+    return resultado, time.perf_counter() - inicio
+
+
+def _resposta_degradada(user_message: str, erro: ModeloIndisponivel, resultados: List[tuple]) -> str:
+    # IA fora do ar (breaker aberto ou sem resposta no prazo): se as ferramentas já rodaram, o resultado delas
+    log.warning("IA indisponível, resposta degradada",
+                extra=campos(motivo=erro.motivo, ferramentas=[tool_name for (tool_name, _, _) in resultados]))
+    if resultados:
+        return "\n\n".join(render_degraded(tool_name, tool_args, tool_result)
+                           for (tool_name, tool_args, tool_result) in resultados)
+    return degraded_reply(user_message)
+
+
+def _final_reply(final_ai_json_str: str) -> str:
+    final_ai_data = json.loads(final_ai_json_str)
+    action = final_ai_data.get("acao")
+
+    # A IA deve agora sempre responder
+    if action == "RESPONDER_AO_USUARIO":
+        final_response_text = final_ai_data.get("payload_acao", {}).get("resposta_para_usuario", 
+            "Desculpe, a IA não gerou uma resposta final, mesmo após os dados do DB.")
+        log.debug("Ação: responder com dados do DB")
+        return final_response_text
+    else:
+        log.warning("RAG: a IA não gerou uma resposta final, mesmo após os dados do DB", extra=campos(acao=action))
+        return "Desculpe, tive um problema ao processar sua solicitação após consultar os dados."
+
+
+# ----------------------------------------------------------------------------------------
+# Atendimento de uma mensagem: um pipeline só (_atendimento) para /chat, async e os dois streams.
+# O pipeline decide (roteador, ação da IA, ferramentas, template x RAG, resposta degradada) e, a
+# cada efeito, pede ao condutor com um 'yield': cada versão só muda como roda esses pedidos
+# (síncrono ou no event loop, chamando o modelo de uma vez ou em streaming e emitindo eventos).
+# ----------------------------------------------------------------------------------------
+
+# Pedidos do pipeline ao condutor: (tipo, argumentos...) -> o condutor devolve o resultado com send()
+_ROTEADOR = "roteador"        # (_ROTEADOR, mensagem) -> route_message(mensagem)
+_PREFIXO = "prefixo"          # (_PREFIXO,) -> PrefixoPreparado ou None
+_MODELO = "modelo"            # (_MODELO, contents, prefixo) -> texto completo da resposta da IA
+_PROGRESSO = "progresso"      # (_PROGRESSO, tool_name) -> None (só os streams emitem o evento)
+_FERRAMENTAS = "ferramentas"  # (_FERRAMENTAS, chamadas, chat_id, medicao) -> [(tool_name, tool_args, tool_result)]
+
+
+def _atendimento(user_message: str, chat_history: List[Dict[str, Any]], chat_id: str, medicao: MedicaoMensagem,
+                 fluxo: str) -> Generator[tuple, Any, str]:
+    """Fluxo completo de uma mensagem; devolve (return) a resposta final. Ver _Conducao."""
+    # Atalho: saudações, despedidas e informações fixas são respondidas sem chamar a IA
+    fast_reply = yield _ROTEADOR, user_message
+    medicao.etapa("roteador")
+    if fast_reply is not None:
+        medicao.caminho = "roteador"
+        return fast_reply
+
+    prefixo = yield _PREFIXO,
+    if prefixo is None:
+        medicao.caminho = "sem_modelo"
+        return "Desculpe, a IA não está configurada corretamente (GEMINI_API_KEY ausente)."
+
+    contents_for_api = _build_contents(user_message, chat_history, prefixo)
+    medicao.etapa("prompt")
+
+    log.info("Processando nova mensagem", extra=campos(
+        fluxo=fluxo, mensagem=user_message, historico_mensagens=_tamanho(chat_history)))
+
+    resultados: List[tuple] = []  # Para a resposta degradada, se a IA cair no meio
     try:
         # --- PRIMEIRA CHAMADA À IA (Decisão: Chamada de Ferramenta, Pedido de Info ou Resposta Simples) ---
-        ai_response = model.generate_content(
-            contents=contents_for_api,                  # Usa a lista com o System Prompt injetado
-            # system_instruction=full_system_prompt,    # REMOVIDO PARA COMPATIBILIDADE COM VERSÕES ANTIGAS
-            tools=list(AVAILABLE_TOOLS.values()),   
-            config=generation_config                
-        )
-
-        ai_json_response_str = ai_response.text.strip()
+        medicao.llm()
+        ai_json_response_str = (yield _MODELO, contents_for_api, prefixo).strip()
+        medicao.etapa("llm_1")
+
         ai_data = json.loads(ai_json_response_str)
         action = ai_data.get("acao")
         payload = ai_data.get("payload_acao", {})
+        medicao.etapa("json")
 
         # 2. Lógica da Ação
         if action == "RESPONDER_AO_USUARIO":
+            medicao.caminho = "resposta"
             return payload.get("resposta_para_usuario", "Desculpe, a IA não gerou uma resposta.")
-        
+
         elif action == "PEDIR_MAIS_INFO":
+            medicao.caminho = "pergunta"
             return payload.get("pergunta_para_usuario", "Qual informação específica você gostaria de saber?")
-        
+
         elif action == "CHAMAR_FERRAMENTA":
-            tool_name = payload.get("tool_name")
-            tool_args = payload.get("tool_args", {})
-            
-            if tool_name in AVAILABLE_TOOLS:
-                tool_function = AVAILABLE_TOOLS[tool_name]
-                
-                # Para agendamentos e cancelamentos, forçamos os IDs de usuário
-                if tool_name in ["tool_marcar_agendamento", "tool_listar_meus_agendamentos", "tool_cancelar_agendamento",
-                                 "tool_marcar_exame", "tool_listar_meus_exames_agendados", "tool_cancelar_exame"]:
-                    tool_args['telegram_chat_id'] = "WEB_CHAT_ID"
-                    if tool_name in ["tool_marcar_agendamento", "tool_marcar_exame"] and 'nome_paciente' not in tool_args:
-                        tool_args['nome_paciente'] = "Paciente Web"
-
-                # 3. Executa a ferramenta
-                print(f"--- Chamando Ferramenta: {tool_name} com args: {tool_args} ---")
-                tool_result = tool_function(**tool_args)
-                print(f"--- Resultado da Ferramenta: {tool_result} ---")
-
-                # 4. Monta o RAG (Round de Resposta) para a Segunda Chamada
-                # Usamos contents_for_api (que tem o histórico e o system prompt)
-                tool_response_content = [
-                    {"role": "user", "parts": [{"text": "O usuário enviou uma nova mensagem."}]},
-                    {"role": "model", "parts": [{"text": ai_json_response_str}]}, # Resultado da 1a IA
-                    {"role": "tool", "parts": [{"functionResponse": {"name": tool_name, "response": tool_result}}]}
-                ]
-                
-                # Conteúdo completo para a 2a chamada: contents_for_api + Chamada de Ferramenta + Resultado da Ferramenta
-                final_rag_content = contents_for_api + tool_response_content
+            chamadas = _chamadas(payload)
+            desconhecida = _desconhecida(chamadas)
+
+            if desconhecida is None:
+                yield _PROGRESSO, chamadas[0][0]
+
+                # 3. Executa as ferramentas (várias leituras na mesma ação rodam em paralelo)
+                resultados = yield _FERRAMENTAS, chamadas, chat_id, medicao
+                medicao.etapa("ferramenta")
+
+                # 4. Se as ferramentas têm template, a resposta sai direto (sem a 2a chamada à IA)
+                rendered = _renderizar(resultados)
+                medicao.etapa("template")
+                if rendered is not None:
+                    log.debug("Ação: responder com template", extra=campos(ferramentas=len(resultados)))
+                    medicao.caminho = "template"
+                    return rendered
+
+                # 5. Conteúdo completo para a 2a chamada (com o resultado de todas as ferramentas)
+                final_rag_content = _build_rag_contents(contents_for_api, ai_json_response_str, resultados)
 
                 # --- SEGUNDA CHAMADA À IA (RAG: Gerar a Resposta Final Amigável) ---
-                final_ai_response = model.generate_content(
-                    contents=final_rag_content,
-                    # system_instruction=full_system_prompt,  # REMOVIDO PARA COMPATIBILIDADE COM VERSÕES ANTIGAS
-                    tools=list(AVAILABLE_TOOLS.values()),   
-                    config=generation_config                
-                )
-
-                final_ai_json_str = final_ai_response.text.strip()
-                final_ai_data = json.loads(final_ai_json_str)
-                action = final_ai_data.get("acao")
-                
-                # A IA deve agora sempre responder
-                if action == "RESPONDER_AO_USUARIO":
-                    final_response_text = final_ai_data.get("payload_acao", {}).get("resposta_para_usuario", 
-                        "Desculpe, a IA não gerou uma resposta final, mesmo após os dados do DB.")
-                    print(f"--- Ação: Responder com dados do DB ---")
-                    return final_response_text
-                else:
-                    print("ERRO RAG: A IA não gerou uma resposta final, mesmo após os dados do DB.")
-                    return "Desculpe, tive um problema ao processar sua solicitação após consultar os dados."
+                medicao.llm()
+                final_ai_json_str = (yield _MODELO, final_rag_content, prefixo).strip()
+                medicao.etapa("llm_2")
+                medicao.caminho = "rag"
+                return _final_reply(final_ai_json_str)
             else:
-                print(f"ERRO: A IA solicitou uma ferramenta desconhecida: {tool_name}")
+                log.warning("A IA solicitou uma ferramenta desconhecida", extra=campos(ferramenta=desconhecida))
+                medicao.caminho = "ferramenta_desconhecida"
                 return "Desculpe, a IA pediu uma ferramenta que eu não conheço."
         else:
-            print(f"Ação desconhecida recebida da IA: {action}")
+            log.warning("Ação desconhecida recebida da IA", extra=campos(acao=action))
+            medicao.caminho = "acao_desconhecida"
             return f"Desculpe, recebi uma ação desconhecida ({action}) e não sei o que fazer."
 
+    except ModeloIndisponivel as e:
+        medicao.caminho = "degradado"
+        return _resposta_degradada(user_message, e, resultados)
+
     except json.JSONDecodeError:
-        print("ERRO FATAL: Gemini retornou um JSON inválido.")
-        # Printa a string para debug
-        # print(ai_json_response_str) 
+        log.error("Gemini retornou um JSON inválido")
+        incrementar("clinica_json_invalido_total")
+        medicao.caminho = "json_invalido"
         return "Desculpe, a resposta da IA veio em um formato inválido."
 
-    except Exception as e:
-        print(f"Erro inesperado na função process_web_message: {e}")
-        return "Desculpe, ocorreu um erro interno grave. Tente novamente ou verifique os logs no Render."
\ No newline at end of file
+    except Exception:
+        log.exception(f"Erro inesperado na função {fluxo}")
+        medicao.caminho = "erro"
+        return "Desculpe, ocorreu um erro interno grave. Tente novamente ou verifique os logs no Render."
+
+
+class _Conducao:
+    """
+    Leva o _atendimento adiante: proximo() devolve o próximo pedido (None quando terminou, com a
+    resposta em resposta_final). O condutor atende o pedido e guarda o resultado em 'resultado'
+    ou chama falhou(erro): a exceção é levantada dentro do pipeline, no ponto do pedido, e cai
+    nos mesmos 'except' (IA indisponível, JSON inválido, erro inesperado).
+    """
+
+    def __init__(self, pipeline: Generator[tuple, Any, str]):
+        self._pipeline = pipeline
+        self._erro: Optional[BaseException] = None
+        self.resultado: Any = None
+        self.resposta_final: Optional[str] = None
+
+    def proximo(self) -> Optional[tuple]:
+        try:
+            if self._erro is not None:
+                erro, self._erro = self._erro, None
+                return self._pipeline.throw(erro)
+            resultado, self.resultado = self.resultado, None
+            return self._pipeline.send(resultado)
+        except StopIteration as fim:
+            self.resposta_final = fim.value
+            return None
+
+    def falhou(self, erro: BaseException) -> None:
+        self._erro = erro
+
+
+def _atender(pedido: tuple) -> Any:
+    """Pedidos comuns às versões síncronas (/chat e /chat/stream no Flask)."""
+    tipo = pedido[0]
+    if tipo == _ROTEADOR:
+        return route_message(pedido[1])
+    if tipo == _PREFIXO:
+        return _prefixo()
+    if tipo == _FERRAMENTAS:
+        return _executar_ferramentas(*pedido[1:])
+    if tipo == _MODELO:
+        contents, prefixo = pedido[1:]
+        return CLIENTE_MODELO.gerar(prefixo.modelo, contents=contents, **_model_kwargs(prefixo)).text
+    return None  # _PROGRESSO: sem eventos
+
+
+async def _atender_async(pedido: tuple) -> Any:
+    """Pedidos comuns às versões async: o que toca no SQLite roda no TOOL_EXECUTOR, fora do event loop."""
+    tipo = pedido[0]
+    if tipo == _ROTEADOR:
+        return await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, _no_contexto(route_message, pedido[1]))
+    if tipo == _PREFIXO:
+        return await _prefixo_async()
+    if tipo == _FERRAMENTAS:
+        return await _executar_ferramentas_async(*pedido[1:])
+    if tipo == _MODELO:
+        contents, prefixo = pedido[1:]
+        return (await CLIENTE_MODELO.gerar_async(prefixo.modelo, contents=contents, **_model_kwargs(prefixo))).text
+    return None
+
+
+def process_web_message(user_message: str, chat_history: List[Dict[str, Any]], chat_id: str = "WEB_CHAT_ID") -> str:
+    # Tempo total, por etapa e chamadas ao modelo vão para as métricas (rota /metrics)
+    medicao = MedicaoMensagem()
+    try:
+        conducao = _Conducao(_atendimento(user_message, chat_history, chat_id, medicao, "process_web_message"))
+        while True:
+            pedido = conducao.proximo()
+            if pedido is None:
+                return conducao.resposta_final
+            try:
+                conducao.resultado = _atender(pedido)
+            except Exception as e:
+                conducao.falhou(e)
+    finally:
+        medicao.concluir()
+
+
+async def process_web_message_async(user_message: str, chat_history: List[Dict[str, Any]],
+                                    chat_id: str = "WEB_CHAT_ID") -> str:
+    """
+    Versão assíncrona de process_web_message, usada pelo servidor ASGI (asgi.py).
+    As chamadas ao Gemini são aguardadas (generate_content_async) e as ferramentas,
+    que fazem I/O no SQLite, rodam no TOOL_EXECUTOR para não travar o event loop.
+    As respostas são exatamente as mesmas da versão síncrona.
+    """
+    medicao = MedicaoMensagem()
+    try:
+        conducao = _Conducao(_atendimento(user_message, chat_history, chat_id, medicao, "process_web_message_async"))
+        while True:
+            pedido = conducao.proximo()
+            if pedido is None:
+                return conducao.resposta_final
+            try:
+                conducao.resultado = await _atender_async(pedido)
+            except Exception as e:
+                conducao.falhou(e)
+    finally:
+        medicao.concluir()
+
+
+# ----------------------------------------------------------------------------------------
+# Streaming (rota /chat/stream): mesmo pipeline, mas as chamadas ao Gemini usam stream=True e os
+# eventos (progresso, texto, fim; ver chat_stream.py) saem conforme a resposta é gerada.
+# ----------------------------------------------------------------------------------------
+
+def process_web_message_stream(user_message: str, chat_history: List[Dict[str, Any]],
+                               chat_id: str = "WEB_CHAT_ID") -> Iterator[Evento]:
+    """
+    Versão em streaming de process_web_message (Flask). Gera (evento, dados): "progresso" assim
+    que a IA escolhe uma ferramenta, "texto" com cada trecho novo da resposta e, por último, "fim"
+    com a resposta completa, igual à que process_web_message devolveria.
+    """
+    medicao = MedicaoMensagem()
+    enviado = ""
+    gerador = _process_web_message_stream(user_message, chat_history, chat_id, medicao)
+    try:
+        while True:
+            try:
+                evento, dados = next(gerador)
+            except StopIteration as fim:
+                resposta = fim.value
+                break
+            medicao.primeiro_evento()
+            enviado += dados.get("texto", "") if evento == "texto" else ""
+            yield evento, dados
+        for evento in evento_fim(resposta, enviado):
+            medicao.primeiro_evento()
+            yield evento
+    finally:
+        medicao.concluir()
+
+
+def _consumir_stream(extrator: ExtratorDeResposta, resposta_em_trechos) -> Iterator[Evento]:
+    for trecho in resposta_em_trechos:
+        yield from extrator.alimentar(texto_do_trecho(trecho))
+
+
+def _process_web_message_stream(user_message: str, chat_history: List[Dict[str, Any]], chat_id: str,
+                                medicao: MedicaoMensagem) -> Generator[Evento, None, str]:
+    conducao = _Conducao(_atendimento(user_message, chat_history, chat_id, medicao, "process_web_message_stream"))
+    progresso_enviado = False
+    while True:
+        pedido = conducao.proximo()
+        if pedido is None:
+            return conducao.resposta_final
+        try:
+            if pedido[0] == _MODELO:
+                # O texto de respostas/perguntas e o progresso saem durante a geração
+                contents, prefixo = pedido[1:]
+                extrator = ExtratorDeResposta()
+                yield from _consumir_stream(extrator, CLIENTE_MODELO.gerar(
+                    prefixo.modelo, contents=contents, stream=True, **_model_kwargs(prefixo)))
+                progresso_enviado |= extrator.progresso_enviado
+                conducao.resultado = extrator.bruto
+            elif pedido[0] == _PROGRESSO:
+                if not progresso_enviado:
+                    progresso_enviado = True
+                    yield evento_progresso(pedido[1])
+            else:
+                conducao.resultado = _atender(pedido)
+        except Exception as e:
+            conducao.falhou(e)
+
+
+async def process_web_message_stream_async(user_message: str, chat_history: List[Dict[str, Any]],
+                                           chat_id: str = "WEB_CHAT_ID") -> AsyncIterator[Evento]:
+    """Versão assíncrona de process_web_message_stream, para o servidor ASGI (asgi.py)."""
+    medicao = MedicaoMensagem()
+    enviado = ""
+    # Geradores async não têm 'return valor': a resposta final volta pela lista
+    resposta = []
+    try:
+        async for evento, dados in _process_web_message_stream_async(user_message, chat_history, chat_id,
+                                                                      medicao, resposta):
+            medicao.primeiro_evento()
+            enviado += dados.get("texto", "") if evento == "texto" else ""
+            yield evento, dados
+        for evento in evento_fim(resposta[0], enviado):
+            medicao.primeiro_evento()
+            yield evento
+    finally:
+        medicao.concluir()
+
+
+async def _consumir_stream_async(extrator: ExtratorDeResposta, resposta_em_trechos) -> AsyncIterator[Evento]:
+    async for trecho in resposta_em_trechos:
+        for evento in extrator.alimentar(texto_do_trecho(trecho)):
+            yield evento
+
+
+async def _process_web_message_stream_async(user_message: str, chat_history: List[Dict[str, Any]], chat_id: str,
+                                            medicao: MedicaoMensagem, resposta: List[str]) -> AsyncIterator[Evento]:
+    conducao = _Conducao(_atendimento(user_message, chat_history, chat_id, medicao,
+                                      "process_web_message_stream_async"))
+    progresso_enviado = False
+    while True:
+        pedido = conducao.proximo()
+        if pedido is None:
+            resposta.append(conducao.resposta_final)
+            return
+        try:
+            if pedido[0] == _MODELO:
+                contents, prefixo = pedido[1:]
+                extrator = ExtratorDeResposta()
+                async for evento in _consumir_stream_async(extrator, await CLIENTE_MODELO.gerar_async(
+                        prefixo.modelo, contents=contents, stream=True, **_model_kwargs(prefixo))):
+                    yield evento
+                progresso_enviado |= extrator.progresso_enviado
+                conducao.resultado = extrator.bruto
+            elif pedido[0] == _PROGRESSO:
+                if not progresso_enviado:
+                    progresso_enviado = True
+                    yield evento_progresso(pedido[1])
+            else:
+                conducao.resultado = await _atender_async(pedido)
+        except Exception as e:
+            conducao.falhou(e)
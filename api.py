@@ -1,13 +1,29 @@
 # api.py
 # ISAQUE DE OLIVEIRA DOS SANTOS
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS  # <-- NOVO: Importar CORS
 
 # ----------------------------------------------------------------------------------------
 # ALTERAÇÃO CRÍTICA: Corrigido o erro de importação e alterado para a nova função web
 # ----------------------------------------------------------------------------------------
-from agent import process_web_message 
+from admission import AdmissaoRecusada, get_admission, ip_do_cliente
+from agent import process_web_message, process_web_message_stream
 # (A função handle_message original foi renomeada no agent.py para process_web_message)
+from availability_index import get_availability_index
+from chat_stream import CONTENT_TYPE_SSE, HEADERS_SSE, formatar_sse
+from database_migrations import run_migrations
+from database_tools import DATABASE_FILE
+from metrics import CONTENT_TYPE, gerar_metricas
+from session_store import get_session_store
+from structured_log import contexto_log, get_logger, novo_request_id
+from telegram_ingest import handle_update, TELEGRAM_WEBHOOK_SECRET
+
+# Aplica as migrações pendentes do banco ao subir (seguro com vários workers)
+run_migrations(DATABASE_FILE)
+# Monta o índice de horários livres já na subida (e não na primeira busca de um paciente)
+get_availability_index(DATABASE_FILE).warm_up()
+
+log = get_logger(__name__)
 
 app = Flask(__name__)
 CORS(app) # <-- NOVO: Ativa o CORS para todas as rotas
@@ -18,29 +34,123 @@ CORS(app) # <-- NOVO: Ativa o CORS para todas as rotas
 def home():
     return "API do Chatbot da Clínica está online ✅"
 
+def _carregar_conversa(store, data):
+    """(conversation_id, histórico, histórico inicial mandado pelo front-end antigo ou None)."""
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        return conversation_id, store.get_history(conversation_id), None
+    # Compatibilidade: o front-end antigo (Wix) ainda pode mandar o histórico inteiro
+    chat_history = data.get('chat_history', []) # Espera uma lista de dicts
+    return store.new_conversation_id(), chat_history, chat_history
+
+def _admitir(data):
+    """Baldes da conversa e do IP e depois uma vaga no limite do processo (ver admission.py). Levanta AdmissaoRecusada."""
+    controle = get_admission()
+    controle.limitar(chat=data.get('conversation_id'),
+                     ip=ip_do_cliente(request.remote_addr, request.headers.get('X-Forwarded-For')))
+    return controle.entrar()
+
+def _recusada(e):
+    # 429 com Retry-After: o front-end (ou o script) sabe quando pode tentar de novo
+    return (jsonify({"error": "Muitas mensagens. Tente novamente em instantes.", "motivo": e.motivo}),
+            429, {"Retry-After": e.retry_after})
+
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
         
-        # ----------------------------------------------------------------------------------------
-        # NOVO: Recebe o histórico de conversas do front-end (Wix)
-        # ----------------------------------------------------------------------------------------
-        chat_history = data.get('chat_history', []) # Espera uma lista de dicts
-
         if not user_message:
             return jsonify({"error": "Mensagem vazia"}), 400
 
-        # Aqui chamamos a nova função que processa a mensagem com o histórico
-        bot_reply = process_web_message(user_message, chat_history)
+        try:
+            vaga = _admitir(data)
+        except AdmissaoRecusada as e:
+            return _recusada(e)
+
+        with vaga:
+            # ----------------------------------------------------------------------------------------
+            # O histórico fica no servidor (session_store), identificado pelo 'conversation_id'.
+            # O front-end só precisa mandar a mensagem nova e o ID que devolvemos na 1a resposta.
+            # ----------------------------------------------------------------------------------------
+            store = get_session_store()
+            conversation_id, chat_history, historico_inicial = _carregar_conversa(store, data)
 
-        return jsonify({"reply": bot_reply})
+            # Aqui chamamos a nova função que processa a mensagem com o histórico
+            # (os logs da mensagem levam o request_id e o conversation_id)
+            with contexto_log(request_id=novo_request_id(), conversation_id=conversation_id):
+                bot_reply = process_web_message(user_message, chat_history)
+                store.append_turn(conversation_id, user_message, bot_reply, historico_inicial)
+
+        return jsonify({"reply": bot_reply, "conversation_id": conversation_id})
     except Exception as e:
         # Se for um erro que a IA não conseguiu tratar, retorna um erro 500
-        print(f"Erro na rota /chat: {e}")
+        log.exception("Erro na rota /chat")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    # Mesmo corpo do /chat, mas a resposta vem em Server-Sent Events (ver chat_stream.py):
+    # progresso da ferramenta e o texto saem enquanto o Gemini ainda está gerando
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return jsonify({"error": "Mensagem vazia"}), 400
+
+    try:
+        vaga = _admitir(data)
+    except AdmissaoRecusada as e:
+        return _recusada(e)
+
+    try:
+        store = get_session_store()
+        conversation_id, chat_history, historico_inicial = _carregar_conversa(store, data)
+    except BaseException:
+        vaga.liberar()
+        raise
+    request_id = novo_request_id()
+
+    def eventos():
+        # Roda depois que a rota retornou: o contexto dos logs é aberto aqui dentro
+        with contexto_log(request_id=request_id, conversation_id=conversation_id):
+            try:
+                for evento, dados in process_web_message_stream(user_message, chat_history):
+                    if evento == "fim":
+                        store.append_turn(conversation_id, user_message, dados["reply"], historico_inicial)
+                        dados["conversation_id"] = conversation_id
+                    yield formatar_sse(evento, dados)
+            except Exception as e:
+                log.exception("Erro na rota /chat/stream")
+                yield formatar_sse("erro", {"error": str(e)})
+            finally:
+                vaga.liberar()
+
+    resposta = Response(eventos(), content_type=CONTENT_TYPE_SSE, headers=HEADERS_SSE)
+    # Cliente que desconecta antes do 1o evento: o gerador nem começa, mas a vaga tem que voltar
+    resposta.call_on_close(vaga.liberar)
+    return resposta
+
+@app.route('/webhook/telegram', methods=['POST'])
+def telegram_webhook():
+    # Responde ao Telegram na hora; a IA roda depois, nos workers do telegram_ingest.
+    # Se o Telegram não recebe o 200 rápido, ele reenvia o mesmo update.
+    if TELEGRAM_WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != TELEGRAM_WEBHOOK_SECRET:
+        return jsonify({"error": "Token do webhook inválido"}), 403
+
+    status = handle_update(request.get_json(silent=True))
+    if status == "invalido":
+        return jsonify({"error": "Update inválido"}), 400
+    if status == "fila_cheia":
+        # Sem espaço na fila: o Telegram reenvia o update mais tarde
+        return jsonify({"error": "Fila cheia"}), 503
+    return jsonify({"ok": True, "status": status})
+
+@app.route('/metrics')
+def metrics():
+    # Formato de texto do Prometheus, somando todos os workers do gunicorn (ver metrics.py)
+    return Response(gerar_metricas(), content_type=CONTENT_TYPE)
+
 if __name__ == '__main__':
     # Nota: No Render, o gunicorn vai rodar o 'gunicorn api:app', então este if __name__ é ignorado.
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
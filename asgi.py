@@ -0,0 +1,181 @@
+# asgi.py
+# Versão assíncrona (FastAPI) da API do chatbot.
+# Mesmo contrato JSON do api.py (Flask), mas um único processo consegue manter
+# centenas de conversas em andamento, porque as chamadas ao Gemini são aguardadas
+# em vez de bloquear um worker inteiro.
+#
+# Para rodar: uvicorn asgi:app --host 0.0.0.0 --port 8000
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from admission import AdmissaoRecusada, get_admission, ip_do_cliente
+from agent import TOOL_EXECUTOR, process_web_message_async, process_web_message_stream_async
+from availability_index import get_availability_index
+from chat_stream import CONTENT_TYPE_SSE, HEADERS_SSE, formatar_sse
+from config import GEMINI_WARMUP, warm_up_model
+from database_migrations import run_migrations
+from database_tools import DATABASE_FILE
+from metrics import CONTENT_TYPE, gerar_metricas
+from session_store import get_session_store
+from structured_log import contexto_log, get_logger, novo_request_id
+from telegram_ingest import handle_update, TELEGRAM_WEBHOOK_SECRET
+
+# Aplica as migrações pendentes do banco ao subir (seguro com vários workers)
+run_migrations(DATABASE_FILE)
+# Monta o índice de horários livres já na subida (e não na primeira busca de um paciente)
+get_availability_index(DATABASE_FILE).warm_up()
+
+log = get_logger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # O modelo carrega numa thread depois que o servidor sobe (e não no import do app)
+    if GEMINI_WARMUP:
+        warm_up_model(em_segundo_plano=True)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.get("/", response_class=PlainTextResponse)
+async def home():
+    return "API do Chatbot da Clínica está online ✅"
+
+
+async def _carregar_conversa(store, data):
+    """(conversation_id, histórico, histórico inicial mandado pelo front-end antigo ou None)."""
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        historico = await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, store.get_history, conversation_id)
+        return conversation_id, historico, None
+    # Compatibilidade: o front-end antigo (Wix) ainda pode mandar o histórico inteiro
+    chat_history = data.get('chat_history', []) # Espera uma lista de dicts
+    return store.new_conversation_id(), chat_history, chat_history
+
+
+async def _admitir(request: Request, data):
+    """Baldes da conversa e do IP e depois uma vaga no limite do processo (ver admission.py). Levanta AdmissaoRecusada."""
+    controle = get_admission()
+    ip = ip_do_cliente(request.client.host if request.client else None, request.headers.get("x-forwarded-for"))
+    await asyncio.get_running_loop().run_in_executor(
+        TOOL_EXECUTOR, partial(controle.limitar, chat=data.get('conversation_id'), ip=ip))
+    return await controle.entrar_async()
+
+
+def _recusada(e: AdmissaoRecusada) -> JSONResponse:
+    return JSONResponse({"error": "Muitas mensagens. Tente novamente em instantes.", "motivo": e.motivo},
+                        status_code=429, headers={"Retry-After": e.retry_after})
+
+
+@app.post("/chat")
+async def chat(request: Request):
+    try:
+        data = await request.json()
+        user_message = (data.get('message') or '').strip()
+
+        if not user_message:
+            return JSONResponse({"error": "Mensagem vazia"}, status_code=400)
+
+        try:
+            vaga = await _admitir(request, data)
+        except AdmissaoRecusada as e:
+            return _recusada(e)
+
+        # Histórico guardado no servidor (session_store); o acesso ao SQLite roda fora do event loop
+        loop = asyncio.get_running_loop()
+        try:
+            store = get_session_store()
+            conversation_id, chat_history, historico_inicial = await _carregar_conversa(store, data)
+
+            with contexto_log(request_id=novo_request_id(), conversation_id=conversation_id):
+                bot_reply = await process_web_message_async(user_message, chat_history)
+            await loop.run_in_executor(
+                TOOL_EXECUTOR, store.append_turn, conversation_id, user_message, bot_reply, historico_inicial
+            )
+        finally:
+            await loop.run_in_executor(TOOL_EXECUTOR, vaga.liberar)
+
+        return {"reply": bot_reply, "conversation_id": conversation_id}
+    except Exception as e:
+        log.exception("Erro na rota /chat (async)")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    # Mesmo corpo do /chat, em Server-Sent Events (ver chat_stream.py)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    user_message = (data.get('message') or '').strip()
+    if not user_message:
+        return JSONResponse({"error": "Mensagem vazia"}, status_code=400)
+
+    try:
+        vaga = await _admitir(request, data)
+    except AdmissaoRecusada as e:
+        return _recusada(e)
+
+    try:
+        store = get_session_store()
+        conversation_id, chat_history, historico_inicial = await _carregar_conversa(store, data)
+    except BaseException:
+        await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, vaga.liberar)
+        raise
+    request_id = novo_request_id()
+
+    async def eventos():
+        with contexto_log(request_id=request_id, conversation_id=conversation_id):
+            try:
+                async for evento, dados in process_web_message_stream_async(user_message, chat_history):
+                    if evento == "fim":
+                        await asyncio.get_running_loop().run_in_executor(
+                            TOOL_EXECUTOR, store.append_turn, conversation_id, user_message, dados["reply"],
+                            historico_inicial)
+                        dados["conversation_id"] = conversation_id
+                    yield formatar_sse(evento, dados)
+            except Exception as e:
+                log.exception("Erro na rota /chat/stream (async)")
+                yield formatar_sse("erro", {"error": str(e)})
+            finally:
+                await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, vaga.liberar)
+
+    # A tarefa de fundo cobre o cliente que desconecta antes de o gerador começar
+    return StreamingResponse(eventos(), media_type=CONTENT_TYPE_SSE, headers=HEADERS_SSE,
+                             background=BackgroundTask(vaga.liberar))
+
+
+@app.post("/webhook/telegram")
+async def telegram_webhook(request: Request):
+    # Responde ao Telegram na hora; a IA roda depois, nos workers do telegram_ingest
+    if TELEGRAM_WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TELEGRAM_WEBHOOK_SECRET:
+        return JSONResponse({"error": "Token do webhook inválido"}, status_code=403)
+
+    try:
+        update = await request.json()
+    except ValueError:
+        update = None
+    # O dedupe grava no SQLite: roda fora do event loop
+    status = await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, handle_update, update)
+    if status == "invalido":
+        return JSONResponse({"error": "Update inválido"}, status_code=400)
+    if status == "fila_cheia":
+        return JSONResponse({"error": "Fila cheia"}, status_code=503)
+    return {"ok": True, "status": status}
+
+
+@app.get("/metrics")
+async def metrics():
+    # Lê e grava no SQLite: roda fora do event loop
+    texto = await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, gerar_metricas)
+    return Response(texto, media_type=CONTENT_TYPE)
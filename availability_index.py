@@ -0,0 +1,303 @@
+import bisect
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database_pool import get_connection, write_transaction
+from reference_cache import get_reference_cache
+from schedule_engine import TIPOS, decode_virtual, get_schedule_engine, is_virtual
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+CHANGELOG_MANTER = int(os.getenv("AVAILABILITY_CHANGELOG_KEEP", "10000"))  # Entradas mantidas no horarios_changelog
+CHANGELOG_PURGE_EVERY = 500  # A cada N alterações feitas por este processo, apaga as entradas antigas
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Cada horário livre vira um único int ordenável: (segundos << 48) | (dono << 32) | id.
+# Ordenar as chaves = ordenar por data/hora; um int gasta bem menos memória que uma tupla com string.
+# Limites: até 65535 médicos/exames e 4 bilhões de horários por tabela.
+_DONO_BITS = 16
+_ID_BITS = 32
+
+
+def _to_ts(data_hora: str) -> int:
+    return int((datetime.fromisoformat(data_hora) - _EPOCH).total_seconds())
+
+
+def format_ts(ts: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+
+
+def _key(ts: int, dono: int, horario_id: int) -> int:
+    return (ts << (_DONO_BITS + _ID_BITS)) | (dono << _ID_BITS) | horario_id
+
+
+def _decode(key: int) -> Tuple[int, int, int]:
+    return key >> (_DONO_BITS + _ID_BITS), (key >> _ID_BITS) & 0xFFFF, key & 0xFFFFFFFF
+
+
+def _add(lista: List[int], key: int) -> None:
+    i = bisect.bisect_left(lista, key)
+    if i == len(lista) or lista[i] != key:
+        lista.insert(i, key)
+
+
+def _remove(lista: Optional[List[int]], key: int) -> None:
+    if not lista:
+        return
+    i = bisect.bisect_left(lista, key)
+    if i < len(lista) and lista[i] == key:
+        del lista[i]
+
+
+class AvailabilityIndex:
+    """
+    Índice em memória dos horários livres, ordenados por data/hora:
+    - consultas: uma lista por médico e uma por especialidade;
+    - exames: uma lista por exame.
+
+    Construído uma vez (na subida ou na primeira busca) e atualizado aos poucos:
+    - as ferramentas de marcar/cancelar chamam refresh_slot() depois de gravar;
+    - alterações feitas por outros processos (outros workers, scripts) são lidas da
+      'horarios_changelog' (migração 6) quando o 'PRAGMA data_version' da conexão muda;
+      horários novos são encontrados pelo id (maior que o último visto).
+    Se o changelog já foi podado além do ponto em que este processo parou, reconstrói tudo.
+
+    As buscas também juntam os horários gerados pelos modelos da agenda recorrente (schedule_engine),
+    que não têm linha no banco até serem marcados.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        self._local = threading.local()  # data_version visto por cada thread (é por conexão)
+        self._loaded = False
+        self._por_dono: Dict[str, Dict[int, List[int]]] = {}
+        self._por_especialidade: Dict[str, List[int]] = {}
+        self._especialidade_do_medico: Dict[int, str] = {}
+        self._ultimo_seq = 0
+        self._ultimo_id: Dict[str, int] = {}
+        self._ref_version = None
+        self._alteracoes = 0
+        self.stats = {"builds": 0, "catch_ups": 0, "changelog_aplicado": 0, "novos_aplicados": 0, "buscas": 0}
+
+    # --- Carga e sincronização ---
+
+    def _build(self, conn) -> None:
+        cache = get_reference_cache(self.db_file)
+        conn.execute("BEGIN")  # Uma leitura consistente: changelog, ids e horários do mesmo instante
+        try:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM horarios_changelog").fetchone()[0]
+            por_dono = {}
+            ultimo_id = {}
+            for tipo, (tabela, dono) in TIPOS.items():
+                listas: Dict[int, List[int]] = {}
+                for (horario_id, dono_id, ts) in conn.execute(
+                        f"SELECT id, {dono}, CAST(strftime('%s', data_hora_inicio) AS INTEGER) "
+                        f"FROM {tabela} WHERE status = 'disponivel'"):
+                    listas.setdefault(dono_id, []).append(_key(ts, dono_id, horario_id))
+                for lista in listas.values():
+                    lista.sort()
+                por_dono[tipo] = listas
+                ultimo_id[tipo] = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabela}").fetchone()[0]
+        finally:
+            conn.execute("COMMIT")
+
+        especialidade_do_medico = {m[0]: m[2] for m in cache.get_medicos()}
+        por_especialidade: Dict[str, List[int]] = {}
+        for medico_id, lista in por_dono["consulta"].items():
+            especialidade = especialidade_do_medico.get(medico_id)
+            if especialidade is not None:
+                por_especialidade.setdefault(especialidade, []).extend(lista)
+        for lista in por_especialidade.values():
+            lista.sort()
+
+        self._por_dono = por_dono
+        self._por_especialidade = por_especialidade
+        self._especialidade_do_medico = especialidade_do_medico
+        self._ultimo_seq = seq
+        self._ultimo_id = ultimo_id
+        self._ref_version = cache.version
+        self._loaded = True
+        self.stats["builds"] += 1
+        total = sum(len(lista) for listas in por_dono.values() for lista in listas.values())
+        log.info("Horários livres carregados no índice", extra=campos(total=total))
+
+    def _set(self, tipo: str, key: int, livre: bool) -> None:
+        _, dono, _ = _decode(key)
+        listas = [self._por_dono[tipo].setdefault(dono, []) if livre else self._por_dono[tipo].get(dono)]
+        if tipo == "consulta":
+            especialidade = self._especialidade_do_medico.get(dono)
+            if especialidade is not None:
+                listas.append(self._por_especialidade.setdefault(especialidade, []) if livre
+                              else self._por_especialidade.get(especialidade))
+        for lista in listas:
+            if livre:
+                _add(lista, key)
+            else:
+                _remove(lista, key)
+
+    def _apply_current(self, conn, tipo: str, horario_id: int) -> None:
+        """Coloca (ou tira) o horário do índice conforme o estado atual da linha no banco."""
+        tabela, dono = TIPOS[tipo]
+        horario_id = int(horario_id)  # Os IDs vindos do JSON da IA podem chegar como texto
+        row = conn.execute(
+            f"SELECT {dono}, CAST(strftime('%s', data_hora_inicio) AS INTEGER), status FROM {tabela} WHERE id = ?",
+            (horario_id,)).fetchone()
+        if row:
+            self._set(tipo, _key(row[1], row[0], horario_id), row[2] == "disponivel")
+
+    def _catch_up(self, conn) -> None:
+        """Aplica o que outros processos mudaram desde a última sincronização."""
+        menor_seq = conn.execute("SELECT MIN(seq) FROM horarios_changelog").fetchone()[0]
+        if menor_seq is not None and menor_seq > self._ultimo_seq + 1:
+            log.warning("Changelog podado além do ponto sincronizado, reconstruindo o índice")
+            self._build(conn)
+            return
+
+        self.stats["catch_ups"] += 1
+        for (seq, tipo, horario_id, dono_antigo, inicio_antigo) in conn.execute(
+                "SELECT seq, tipo, horario_id, dono_antigo, inicio_antigo FROM horarios_changelog "
+                "WHERE seq > ? ORDER BY seq", (self._ultimo_seq,)).fetchall():
+            if tipo in TIPOS:
+                self._set(tipo, _key(_to_ts(inicio_antigo), dono_antigo, horario_id), False)
+                self._apply_current(conn, tipo, horario_id)
+                self.stats["changelog_aplicado"] += 1
+            self._ultimo_seq = seq
+
+        for tipo, (tabela, dono) in TIPOS.items():
+            for (horario_id, dono_id, ts, status) in conn.execute(
+                    f"SELECT id, {dono}, CAST(strftime('%s', data_hora_inicio) AS INTEGER), status "
+                    f"FROM {tabela} WHERE id > ? ORDER BY id", (self._ultimo_id[tipo],)).fetchall():
+                if status == "disponivel":
+                    self._set(tipo, _key(ts, dono_id, horario_id), True)
+                    self.stats["novos_aplicados"] += 1
+                self._ultimo_id[tipo] = horario_id
+
+    def _ensure_fresh(self, conn) -> None:
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._loaded and getattr(self._local, "data_version", None) == data_version:
+            return  # Ninguém gravou no banco desde a última conferência desta thread
+
+        with self._lock:
+            if not self._loaded or get_reference_cache(self.db_file).version != self._ref_version:
+                self._build(conn)  # Primeira carga ou médicos/especialidades mudaram
+            else:
+                self._catch_up(conn)
+        self._local.data_version = data_version
+
+    def warm_up(self) -> None:
+        """Constrói o índice agora (ex: na subida do servidor) em vez de na primeira busca."""
+        self._ensure_fresh(get_connection(self.db_file))
+
+    def refresh_slot(self, tipo: str, horario_id: int) -> None:
+        """Atualização incremental depois que este processo marcou ou cancelou um horário."""
+        conn = get_connection(self.db_file)
+        with self._lock:
+            if not self._loaded:
+                return  # Ainda não construído: a primeira busca já lê o estado atual
+            self._apply_current(conn, tipo, int(horario_id))
+            self._alteracoes += 1
+            podar = self._alteracoes % CHANGELOG_PURGE_EVERY == 0
+        if podar:
+            write_transaction(self.db_file, lambda c: c.execute(
+                "DELETE FROM horarios_changelog WHERE seq <= (SELECT MAX(seq) FROM horarios_changelog) - ?",
+                (CHANGELOG_MANTER,)))
+
+    def invalidate(self) -> None:
+        """Descarta o índice: a próxima busca reconstrói tudo a partir do banco."""
+        with self._lock:
+            self._loaded = False
+
+    # --- Buscas ---
+
+    def livres(self, tipo: str, donos: Optional[Iterable[int]] = None, especialidades: Optional[Iterable[str]] = None,
+               inicio: Optional[str] = None, fim: Optional[str] = None, limite: Optional[int] = None,
+               horas: Optional[Tuple[int, int]] = None, depois_de: Optional[int] = None) -> List[Tuple[int, int, str]]:
+        """
+        Próximos horários livres em ordem de data/hora, como (id, dono, 'AAAA-MM-DD HH:MM:SS').
+        - donos: IDs de médicos (consulta) ou de exames (exame);
+        - especialidades: nomes exatos das especialidades (só consulta);
+        - inicio/fim: janela [inicio, fim) em 'AAAA-MM-DD[ HH:MM[:SS]]'; limite: quantidade máxima;
+        - horas: faixa de horas do dia [de, até), ex: (12, 18) para a tarde;
+        - depois_de: ID de um horário já mostrado (cursor); a busca continua logo depois dele.
+        """
+        conn = get_connection(self.db_file)
+        self._ensure_fresh(conn)
+        chave_inicio = _key(_to_ts(inicio), 0, 0) if inicio else 0
+        chave_fim = _key(_to_ts(fim), 0, 0) if fim else None
+        cursor = None  # (segundos, dono, id) do horário do cursor
+        if depois_de is not None:
+            if is_virtual(depois_de):
+                ts, dono = decode_virtual(depois_de)
+                cursor = (ts, dono, int(depois_de))
+            else:
+                # A chave do cursor sai da linha no banco (o horário pode já ter sido marcado por alguém)
+                tabela, dono = TIPOS[tipo]
+                row = conn.execute(
+                    f"SELECT {dono}, CAST(strftime('%s', data_hora_inicio) AS INTEGER) FROM {tabela} WHERE id = ?",
+                    (depois_de,)).fetchone()
+                if row:
+                    cursor = (row[1], row[0], depois_de)
+            if cursor:
+                # Depois de qualquer id com o mesmo (instante, dono): o id virtual não cabe nos 32 bits da chave
+                chave_inicio = max(chave_inicio, _key(cursor[0], cursor[1], min(cursor[2], 0xFFFFFFFF)) + 1)
+
+        with self._lock:
+            self.stats["buscas"] += 1
+            listas = []
+            if especialidades is not None:
+                listas += [self._por_especialidade.get(e) for e in especialidades]
+            if donos is not None:
+                listas += [self._por_dono[tipo].get(d) for d in donos]
+            iteradores = []
+            for lista in listas:
+                if lista:
+                    i = bisect.bisect_left(lista, chave_inicio)
+                    iteradores.append(map(lista.__getitem__, range(i, len(lista))))
+
+            encontrados = []
+            anterior = None
+            for key in heapq.merge(*iteradores) if len(iteradores) != 1 else iteradores[0]:
+                if chave_fim is not None and key >= chave_fim:
+                    break
+                if key == anterior:
+                    continue  # Mesmo horário vindo da lista do médico e da especialidade
+                anterior = key
+                ts, dono, horario_id = _decode(key)
+                if horas is not None and not horas[0] <= ts // 3600 % 24 < horas[1]:
+                    continue
+                encontrados.append((ts, dono, horario_id))
+                if limite is not None and len(encontrados) >= limite:
+                    break
+
+        agenda = get_schedule_engine(self.db_file)
+        if agenda.tem_modelos(tipo):
+            # Médicos das especialidades pedidas + donos explícitos
+            donos_agenda = set(donos or ())
+            if especialidades is not None:
+                especialidades = set(especialidades)
+                donos_agenda.update(m for (m, e) in self._especialidade_do_medico.items() if e in especialidades)
+            virtuais = agenda.livres(tipo, donos_agenda, _to_ts(inicio) if inicio else None,
+                                     _to_ts(fim) if fim else None, horas, cursor, limite)
+            if virtuais:
+                encontrados = sorted(encontrados + virtuais)[:limite]
+        return [(horario_id, dono, format_ts(ts)) for (ts, dono, horario_id) in encontrados]
+
+
+_indexes: Dict[str, AvailabilityIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_availability_index(db_file: str) -> AvailabilityIndex:
+    """Retorna o índice de horários do processo para o arquivo informado."""
+    index = _indexes.get(db_file)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(db_file, AvailabilityIndex(db_file))
+    return index
@@ -0,0 +1,70 @@
+"""
+Utilitários compartilhados pelos scripts de benchmark.
+Os benchmarks nunca tocam no clinic.db versionado: sempre trabalham numa cópia temporária.
+"""
+import contextlib
+import io
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from database_migrations import run_migrations
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLINIC_DB = os.path.join(REPO_DIR, "clinic.db")
+
+
+def copy_clinic_db() -> str:
+    """
+    Copia o clinic.db para um diretório temporário, aplica as migrações na cópia
+    e retorna o caminho dela.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="clinic_bench_")
+    db_file = os.path.join(tmp_dir, "clinic.db")
+    shutil.copyfile(CLINIC_DB, db_file)
+    with silence_stdout():
+        run_migrations(db_file)
+    return db_file
+
+
+@contextlib.contextmanager
+def silence_stdout():
+    """Engole os prints e os logs (structured_log) das ferramentas durante as medições."""
+    anterior = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(anterior)
+
+
+def time_calls(fn, iterations: int) -> list:
+    """Executa fn() 'iterations' vezes e devolve as latências em microssegundos."""
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+    return latencies
+
+
+def percentile(values: list, pct: float) -> float:
+    """Percentil simples (nearest-rank) sobre uma lista de números."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "mean_us": statistics.fmean(latencies) if latencies else 0.0,
+        "p50_us": percentile(latencies, 50),
+        "p95_us": percentile(latencies, 95),
+        "p99_us": percentile(latencies, 99),
+    }
@@ -0,0 +1,154 @@
+"""
+Benchmark do índice de horários livres (availability_index) num banco sintético grande.
+
+Semeia N horários de consulta (50 médicos em 10 especialidades) e N/5 de exame, metade livres,
+e compara "próximos 10 horários livres de cardiologia a partir da data X":
+- SQL com JOIN em medicos + especialidade LIKE '%x%' + ORDER BY data_hora_inicio + LIMIT;
+- índice em memória (listas ordenadas + bisect).
+Mostra também o custo da consulta antiga da ferramenta, que trazia TODOS os horários livres.
+
+Depois confere a atualização incremental: marcar/cancelar pelas ferramentas e escritas feitas
+por OUTRA conexão (UPDATE e INSERT) aparecem no índice.
+
+Uso: python -m benchmarks.bench_availability_index [num_horarios]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database_pool
+import database_tools
+from availability_index import get_availability_index
+from benchmarks._common import silence_stdout, summarize, time_calls
+from database_migrations import run_migrations
+from database_setup import setup_database
+
+ESPECIALIDADES = ["Cardiologia", "Dermatologia", "Pediatria", "Ortopedia", "Neurologia",
+                  "Ginecologia", "Oftalmologia", "Psiquiatria", "Urologia", "Endocrinologia"]
+NUM_MEDICOS = 50
+DATA_X = "2026-06-01 00:00:00"
+
+SQL_ANTIGO = """
+    SELECT h.id, m.nome, h.data_hora_inicio
+    FROM horarios_disponiveis h JOIN medicos m ON h.medico_id = m.id
+    WHERE m.especialidade LIKE ? AND h.status = 'disponivel' AND h.data_hora_inicio >= ?
+    ORDER BY h.data_hora_inicio LIMIT 10
+"""
+SQL_FERRAMENTA_ANTIGA = """
+    SELECT h.id, m.nome, h.data_hora_inicio
+    FROM horarios_disponiveis h JOIN medicos m ON h.medico_id = m.id
+    WHERE m.especialidade LIKE ? AND h.status = 'disponivel'
+    ORDER BY h.data_hora_inicio
+"""
+
+
+def seed(num_horarios: int) -> str:
+    db_file = os.path.join(tempfile.mkdtemp(prefix="clinic_index_"), "clinic.db")
+    with silence_stdout():
+        setup_database(db_file)
+    rng = random.Random(7)
+
+    def _seed(conn):
+        conn.executemany("INSERT INTO medicos (nome, especialidade) VALUES (?, ?)",
+                         ((f"Dr(a). Médico {i}", ESPECIALIDADES[i % len(ESPECIALIDADES)]) for i in range(NUM_MEDICOS)))
+        medicos = [r[0] for r in conn.execute("SELECT id FROM medicos")]
+        exames = [r[0] for r in conn.execute("SELECT id FROM exames")]
+        # Horários de 30 em 30 minutos a partir de 2026-01-01, espalhados entre os médicos
+        conn.executemany(
+            "INSERT INTO horarios_disponiveis (medico_id, data_hora_inicio, status) "
+            "VALUES (?, datetime('2026-01-01', '+' || ? || ' minutes'), ?)",
+            ((rng.choice(medicos), (i // NUM_MEDICOS) * 30, "disponivel" if rng.random() < 0.5 else "agendado")
+             for i in range(num_horarios)))
+        conn.executemany(
+            "INSERT INTO horarios_exames (exame_id, data_hora_inicio, status) "
+            "VALUES (?, datetime('2026-01-01', '+' || ? || ' minutes'), ?)",
+            ((rng.choice(exames), (i // len(exames)) * 30, "disponivel" if rng.random() < 0.5 else "agendado")
+             for i in range(num_horarios // 5)))
+
+    database_pool.write_transaction(db_file, _seed)
+    with silence_stdout():
+        run_migrations(db_file)
+    return db_file
+
+
+def incremental(db_file: str) -> bool:
+    index = get_availability_index(db_file)
+    conn = database_pool.get_connection(db_file)
+    ok = True
+
+    def primeiro_livre():
+        return index.livres("consulta", especialidades=["Cardiologia"], inicio=DATA_X, limite=1)[0]
+
+    with silence_stdout():
+        # Marcar pela ferramenta: sai do índice; cancelar: volta
+        horario_id = primeiro_livre()[0]
+        database_tools.tool_marcar_agendamento(horario_id, "Paciente Teste", "chat_teste")
+        ok &= primeiro_livre()[0] != horario_id
+        agendamento_id = conn.execute("SELECT MAX(id) FROM agendamentos").fetchone()[0]
+        database_tools.tool_cancelar_agendamento(agendamento_id, "chat_teste")
+        ok &= primeiro_livre()[0] == horario_id
+
+    # Outro processo (conexão separada) ocupa o horário e cria um novo antes dele
+    outro = sqlite3.connect(db_file)
+    outro.execute("UPDATE horarios_disponiveis SET status = 'agendado' WHERE id = ?", (horario_id,))
+    novo_id = outro.execute(
+        "INSERT INTO horarios_disponiveis (medico_id, data_hora_inicio, status) "
+        "VALUES ((SELECT id FROM medicos WHERE especialidade = 'Cardiologia' LIMIT 1), '2026-05-31 23:59:00', 'disponivel')"
+    ).lastrowid
+    outro.commit()
+    outro.close()
+    with silence_stdout():
+        antes_de_x = index.livres("consulta", especialidades=["Cardiologia"], inicio="2026-05-31 23:59:00", limite=2)
+    ok &= antes_de_x[0][0] == novo_id and antes_de_x[1][0] != horario_id
+
+    print(f"Atualização incremental (ferramentas + escrita de outra conexão): {'OK' if ok else 'FALHOU'} "
+          f"stats={index.stats}")
+    return ok
+
+
+def run(num_horarios: int = 1_000_000, iterations: int = 2000) -> bool:
+    inicio = time.perf_counter()
+    db_file = seed(num_horarios)
+    database_tools.DATABASE_FILE = db_file
+    print(f"Banco sintético: {num_horarios} horários de consulta + {num_horarios // 5} de exame "
+          f"({time.perf_counter() - inicio:.1f}s)")
+
+    index = get_availability_index(db_file)
+    inicio = time.perf_counter()
+    with silence_stdout():
+        index.warm_up()
+    print(f"Construção do índice: {time.perf_counter() - inicio:.2f}s")
+
+    conn = database_pool.get_connection(db_file)
+    cache_nomes = dict(conn.execute("SELECT id, nome FROM medicos"))
+
+    def sql_antigo():
+        return conn.execute(SQL_ANTIGO, ("%Cardio%", DATA_X)).fetchall()
+
+    def com_indice():
+        return [(i, cache_nomes[m], d) for (i, m, d) in
+                index.livres("consulta", especialidades=["Cardiologia"], inicio=DATA_X, limite=10)]
+
+    # Mesmos horários (empates no mesmo instante podem vir em outra ordem no SQL)
+    assert [r[2] for r in sql_antigo()] == [r[2] for r in com_indice()]
+    antes = summarize(time_calls(sql_antigo, max(20, iterations // 20)))
+    depois = summarize(time_calls(com_indice, iterations))
+    exame = summarize(time_calls(lambda: index.livres("exame", donos=[1], inicio=DATA_X, limite=10), iterations))
+    print(f"Próximos 10 de cardiologia após {DATA_X[:10]}: SQL p50={antes['p50_us'] / 1000:.2f}ms "
+          f"p99={antes['p99_us'] / 1000:.2f}ms | índice p50={depois['p50_us']:.1f}us p99={depois['p99_us']:.1f}us")
+    print(f"Próximos 10 de um exame: índice p50={exame['p50_us']:.1f}us p99={exame['p99_us']:.1f}us")
+    ferramenta = summarize(time_calls(lambda: conn.execute(SQL_FERRAMENTA_ANTIGA, ("%Cardio%",)).fetchall(), 5))
+    print(f"Consulta antiga da ferramenta (todos os livres de cardiologia): p50={ferramenta['p50_us'] / 1000:.0f}ms")
+
+    ok = depois["p99_us"] < 1000 and exame["p99_us"] < 1000
+    ok = incremental(db_file) and ok
+    database_pool.close_all_connections()
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000) else 1)
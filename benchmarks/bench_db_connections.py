@@ -0,0 +1,51 @@
+"""
+Micro-benchmark: latência das ferramentas de leitura com conexão nova por chamada
+(comportamento antigo) vs. conexão de longa duração do database_pool.
+
+Uso: python -m benchmarks.bench_db_connections [iteracoes]
+"""
+import sqlite3
+import sys
+
+import database_pool
+import database_tools
+from benchmarks._common import copy_clinic_db, silence_stdout, summarize, time_calls
+
+READ_CALLS = {
+    "tool_obter_info_clinica": lambda: database_tools.tool_obter_info_clinica("endereco"),
+    "tool_consultar_horarios_disponiveis": lambda: database_tools.tool_consultar_horarios_disponiveis("Cardio"),
+    "tool_listar_meus_agendamentos": lambda: database_tools.tool_listar_meus_agendamentos("WEB_CHAT_ID"),
+    "tool_consultar_exames_disponiveis": lambda: database_tools.tool_consultar_exames_disponiveis(),
+    "tool_consultar_horarios_exames": lambda: database_tools.tool_consultar_horarios_exames("Sangue"),
+}
+
+
+def _connect_per_call(db_file):
+    # Reproduz o comportamento antigo: abre uma conexão padrão a cada chamada.
+    # O CPython fecha a conexão assim que a ferramenta retorna (contagem de referências).
+    return sqlite3.connect(db_file)
+
+
+def run(iterations: int = 2000) -> dict:
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    results = {}
+
+    for tool_name, call in READ_CALLS.items():
+        with silence_stdout():
+            database_tools.get_connection = _connect_per_call
+            antes = summarize(time_calls(call, iterations))
+
+            database_tools.get_connection = database_pool.get_connection
+            call()  # Aquece a conexão da thread
+            depois = summarize(time_calls(call, iterations))
+
+        results[tool_name] = {"connect_per_call": antes, "pooled": depois}
+        print(f"{tool_name:40s} antes p50={antes['p50_us']:8.1f}us  depois p50={depois['p50_us']:8.1f}us  "
+              f"ganho={antes['p50_us'] / max(depois['p50_us'], 0.001):4.1f}x")
+
+    database_pool.close_all_connections()
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
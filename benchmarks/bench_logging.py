@@ -0,0 +1,92 @@
+"""
+Custo de logar no caminho da requisição: print() síncrono (como antes) x structured_log (fila + thread).
+
+Mede o tempo gasto NA THREAD QUE LOGA, para a mesma linha de log, com três destinos do stdout:
+- memória (StringIO): só o custo de CPU;
+- arquivo: escrita de verdade;
+- lento: cada write espera 0.2ms (stdout num pipe/coletor de logs sob pressão).
+Com print, a requisição paga a escrita; com o structured_log, só enfileira (a thread do listener escreve).
+Também confere a redação: o nome do paciente não aparece no arquivo de logs.
+
+Uso: python -m benchmarks.bench_logging [registros]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+import structured_log
+from benchmarks._common import summarize
+from structured_log import campos, contexto_log, get_logger
+
+log = get_logger("bench")
+NOME = "Maria da Silva Teste"
+
+
+class SaidaLenta(io.StringIO):
+    def write(self, texto: str) -> int:
+        time.sleep(0.0002)
+        return super().write(texto)
+
+
+def _medir(saida, registrar, n: int) -> dict:
+    original = sys.stdout
+    sys.stdout = saida
+    latencias = []
+    try:
+        with contexto_log(request_id="bench", chat_id=123):
+            for i in range(n):
+                inicio = time.perf_counter()
+                registrar(i)
+                latencias.append((time.perf_counter() - inicio) * 1_000_000)
+        inicio_flush = time.perf_counter()
+        structured_log.flush_logs(timeout=60)
+        drenagem = time.perf_counter() - inicio_flush
+    finally:
+        sys.stdout = original
+    return {**summarize(latencias), "total_ms": sum(latencias) / 1000, "drenagem_s": drenagem}
+
+
+def com_print(i: int) -> None:
+    print(f"--- FERRAMENTA DB: Tentando agendar ID {i} para {NOME} ---")
+
+
+def com_log(i: int) -> None:
+    log.info("Tentando agendar consulta", extra=campos(horario_id=i, nome_paciente=NOME))
+
+
+def run(n: int = 5000) -> bool:
+    arquivo = os.path.join(tempfile.mkdtemp(prefix="bench_logs_"), "logs.txt")
+    destinos = {
+        "memória": lambda: io.StringIO(),
+        "arquivo": lambda: open(arquivo, "a", encoding="utf-8"),
+        "lento (0.2ms/write)": lambda: SaidaLenta(),
+    }
+    ok = True
+    for nome, criar in destinos.items():
+        resultados = {}
+        for (modo, registrar) in (("print", com_print), ("structured_log", com_log)):
+            saida = criar()
+            resultados[modo] = _medir(saida, registrar, n if "lento" not in nome else n // 5)
+            if hasattr(saida, "close") and not isinstance(saida, io.StringIO):
+                saida.close()
+        p, l = resultados["print"], resultados["structured_log"]
+        print(f"{nome:<20} print: p50={p['p50_us']:.1f}us p99={p['p99_us']:.1f}us total={p['total_ms']:.0f}ms | "
+              f"structured_log: p50={l['p50_us']:.1f}us p99={l['p99_us']:.1f}us total={l['total_ms']:.0f}ms "
+              f"(thread de escrita drenou em {l['drenagem_s'] * 1000:.0f}ms)")
+        if "lento" in nome:
+            ok &= l["p99_us"] < p["p50_us"]  # Com stdout lento, a requisição não pode mais esperar a escrita
+
+    with open(arquivo, encoding="utf-8") as f:
+        conteudo = f.read()
+    redigido = conteudo.count(NOME) == n and '"nome_paciente": "h:' in conteudo  # Só os prints têm o nome
+    print(f"Nome do paciente só nas linhas do print (redação no structured_log): {redigido}")
+    print(f"Estatísticas da fila: {structured_log.get_log_stats()}")
+    ok &= redigido
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000) else 1)
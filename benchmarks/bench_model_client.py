@@ -0,0 +1,215 @@
+"""
+Cliente do modelo (model_client.py) sob falhas injetadas no modelo falso.
+
+Cada cenário roda as mesmas mensagens pelo agent.process_web_message, antes (chamada direta ao
+modelo, como era) e depois (CLIENTE_MODELO), e mostra respostas boas, degradadas, erros e latência:
+1. falhas passageiras (503/429): as novas tentativas recuperam quase todas;
+2. cauda longa (chamadas 15x mais lentas): p99 sem e com hedge;
+3. travamentos: antes o worker fica preso até a chamada voltar; depois, no máximo o prazo;
+4. queda total da API por alguns segundos: o breaker abre, as mensagens recebem a resposta degradada
+   na hora (sem bater na API) e ele fecha sozinho depois que a API volta.
+Também confere que uma marcação feita antes de a IA cair chega ao paciente (resposta degradada
+da 2a chamada) e que as séries clinica_modelo_* aparecem no /metrics.
+
+Os tempos são escalados (latência de 40ms, prazo de 0.5s) para o teste levar segundos.
+
+Uso: python -m benchmarks.bench_model_client [--mensagens 200]
+"""
+import argparse
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+import database_tools
+import metrics
+import model_client
+from benchmarks._common import copy_clinic_db, percentile, silence_stdout
+from benchmarks.fake_model import Falhas, FakeGeminiModel, Latencia
+
+MENSAGEM = "Quero marcar uma consulta"
+BOA = "Claro! Qual especialidade você procura?"
+LATENCIA = "lognormal:40,0.3"
+
+
+class _ChamadaDireta:
+    """Como era antes: modelo.generate_content sem prazo, sem novas tentativas e sem breaker."""
+
+    def gerar(self, modelo, contents, stream: bool = False, **kwargs):
+        return modelo.generate_content(contents, stream=stream, **kwargs)
+
+
+def _configurar(timeout_s: float = 0.5, deadline_s: float = 1.5, hedge: bool = False) -> model_client.ClienteDoModelo:
+    model_client.MODEL_TIMEOUT_S = timeout_s
+    model_client.MODEL_DEADLINE_S = deadline_s
+    model_client.MODEL_BACKOFF_BASE_S = 0.02
+    model_client.MODEL_BACKOFF_MAX_S = 0.2
+    model_client.MODEL_HEDGE = hedge
+    model_client.MODEL_HEDGE_MIN_S = 0.05
+    model_client.MODEL_BREAKER_ABERTO_S = 1.0
+    return model_client.ClienteDoModelo()
+
+
+def rodar(cliente, falhas: str, mensagens: int, seed: int = 7, aquecer: int = 0) -> Dict[str, Any]:
+    import agent
+
+    agent.CLIENTE_MODELO = cliente
+    modelo = FakeGeminiModel(Latencia(LATENCIA), falhas=Falhas(falhas, seed=seed))
+    modelo.TRAVA_S = 3.0
+    agent.model = modelo
+    with silence_stdout():
+        if aquecer:
+            # Latências sem falha para o p95 do hedge (MIN_AMOSTRAS_HEDGE)
+            falhas_reais, modelo.falhas = modelo.falhas, Falhas()
+            for _ in range(aquecer):
+                agent.process_web_message(MENSAGEM, [])
+            modelo.falhas = falhas_reais
+        tempos, respostas = [], []
+        for _ in range(mensagens):
+            inicio = time.perf_counter()
+            respostas.append(agent.process_web_message(MENSAGEM, []))
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    return {"boas": respostas.count(BOA),
+            "degradadas": sum(r.startswith("Desculpe, nosso assistente") for r in respostas),
+            "erros": sum(r.startswith("Desculpe, ocorreu um erro") for r in respostas),
+            "p50": percentile(tempos, 50), "p99": percentile(tempos, 99), "max": max(tempos),
+            "pedidos": modelo.get_stats()["pedidos"], "cliente": getattr(cliente, "get_stats", dict)()}
+
+
+def _linha(nome: str, r: Dict[str, Any], mensagens: int) -> None:
+    extra = r["cliente"]
+    detalhes = (f"retries={extra['retries']} hedges={extra['hedges']} barradas pelo breaker={extra['rejeitadas_breaker']}"
+                if extra else "")
+    print(f"  {nome:<22} boas {r['boas']:>4}/{mensagens}  degradadas {r['degradadas']:>3}  erros {r['erros']:>3}  "
+          f"p50 {r['p50']:>6.0f}ms  p99 {r['p99']:>6.0f}ms  max {r['max']:>6.0f}ms  pedidos à API {r['pedidos']:>4}  {detalhes}")
+
+
+def cenario_falhas(mensagens: int) -> bool:
+    print("\n1. Falhas passageiras (20% 503, 5% 429):")
+    antes = rodar(_ChamadaDireta(), "indisponivel:0.2,limite:0.05", mensagens)
+    depois = rodar(_configurar(), "indisponivel:0.2,limite:0.05", mensagens)
+    _linha("antes (direto)", antes, mensagens)
+    _linha("depois (cliente)", depois, mensagens)
+    # 25% de falha por tentativa e 2 novas tentativas: ~1.6% das mensagens ainda caem na resposta degradada
+    return depois["boas"] >= 0.95 * mensagens and depois["erros"] == 0
+
+
+def cenario_cauda(mensagens: int) -> bool:
+    print("\n2. Cauda longa (5% das chamadas 15x mais lentas):")
+    sem = rodar(_configurar(timeout_s=2.0, deadline_s=3.0), "lento:0.05:15", mensagens, aquecer=40)
+    com = rodar(_configurar(timeout_s=2.0, deadline_s=3.0, hedge=True), "lento:0.05:15", mensagens, aquecer=40)
+    _linha("sem hedge", sem, mensagens)
+    _linha("com hedge (p95)", com, mensagens)
+    print(f"  hedges: {com['cliente']['hedges']} ({100 * com['cliente']['hedges'] / com['cliente']['chamadas']:.1f}% das "
+          f"chamadas, limite {100 * model_client.MODEL_HEDGE_MAX_FRACAO:.0f}%), o hedge respondeu antes em "
+          f"{com['cliente']['hedges_venceram']}")
+    return com["p99"] < sem["p99"] and com["boas"] == mensagens
+
+
+def cenario_trava(mensagens: int) -> bool:
+    mensagens = max(20, mensagens // 5)  # Antes, cada travamento segura o "worker" por TRAVA_S
+    print(f"\n3. Travamentos (5% das chamadas não respondem; {mensagens} mensagens):")
+    antes = rodar(_ChamadaDireta(), "trava:0.05", mensagens, seed=3)
+    depois = rodar(_configurar(), "trava:0.05", mensagens, seed=3)
+    _linha("antes (direto)", antes, mensagens)
+    _linha("depois (cliente)", depois, mensagens)
+    prazo_ms = model_client.MODEL_DEADLINE_S * 1000
+    print(f"  worker preso no máximo: antes {antes['max']:.0f}ms, depois {depois['max']:.0f}ms (prazo {prazo_ms:.0f}ms)")
+    return depois["max"] < prazo_ms + 200 and depois["boas"] >= 0.98 * mensagens
+
+
+def cenario_queda() -> bool:
+    import agent
+
+    print("\n4. Queda total da API por 2s (uma mensagem a cada 20ms):")
+    resultados = {}
+    for nome, cliente in (("antes (direto)", _ChamadaDireta()), ("depois (cliente)", _configurar())):
+        agent.CLIENTE_MODELO = cliente
+        modelo = FakeGeminiModel(Latencia(LATENCIA))
+        agent.model = modelo
+        linha_do_tempo: List[tuple] = []
+        inicio = time.perf_counter()
+        with silence_stdout():
+            while time.perf_counter() - inicio < 5.0:
+                agora = time.perf_counter() - inicio
+                modelo.fora_do_ar = 1.0 <= agora < 3.0
+                t = time.perf_counter()
+                resposta = agent.process_web_message(MENSAGEM, [])
+                linha_do_tempo.append((agora, (time.perf_counter() - t) * 1000, resposta))
+                time.sleep(0.02)
+        na_queda = [(ms, r) for (agora, ms, r) in linha_do_tempo if 1.0 <= agora < 3.0]
+        recuperou = next((agora for (agora, _, r) in linha_do_tempo if agora >= 3.0 and r == BOA), None)
+        resultados[nome] = {
+            "mensagens": len(na_queda), "p50": percentile([ms for (ms, _) in na_queda], 50),
+            "erros": sum(r.startswith("Desculpe, ocorreu um erro") for (_, r) in na_queda),
+            "degradadas": sum(r.startswith("Desculpe, nosso assistente") for (_, r) in na_queda),
+            "pedidos_na_queda": modelo.get_stats()["falhas"].get("ServiceUnavailable", 0),
+            "recuperou_s": None if recuperou is None else recuperou - 3.0,
+            "estado": getattr(cliente, "breaker", None) and cliente.breaker.estado}
+        r = resultados[nome]
+        print(f"  {nome:<22} na queda: {r['mensagens']} mensagens, p50 {r['p50']:.0f}ms, erros {r['erros']}, "
+              f"degradadas {r['degradadas']}, pedidos à API que falharam {r['pedidos_na_queda']}; "
+              + ("sem resposta boa depois da volta" if r["recuperou_s"] is None
+                 else f"respostas boas de novo {r['recuperou_s']:.2f}s depois da volta"))
+    depois = resultados["depois (cliente)"]
+    return (depois["erros"] == 0 and depois["estado"] == model_client.FECHADO
+            and depois["pedidos_na_queda"] < resultados["antes (direto)"]["pedidos_na_queda"])
+
+
+def conferir_marcacao_degradada() -> bool:
+    """A ferramenta marcou e a IA caiu na 2a chamada: o paciente recebe a confirmação mesmo assim."""
+    import agent
+    import response_templates
+
+    class _CaiNaSegunda(FakeGeminiModel):
+        def generate_content(self, contents, stream: bool = False, **kwargs):
+            self.fora_do_ar = any("functionResponse" in p for p in contents[-1].get("parts", []))
+            return super().generate_content(contents, stream=stream, **kwargs)
+
+    agent.CLIENTE_MODELO = _configurar()
+    agent.model = _CaiNaSegunda()
+    response_templates.TOOL_RENDER_MODE["tool_marcar_agendamento"] = "llm"
+    horario = database_tools.tool_consultar_horarios_disponiveis("Cardiologia", limite=1).dados["itens"][0][0]
+    with silence_stdout():
+        resposta = agent.process_web_message(f"Quero o ID {horario}, meu nome é Ana Teste", [])
+    ok = "confirmad" in resposta.lower() or "sucesso" in resposta.lower()
+    print(f"\nMarcação com a IA fora do ar na 2a chamada: {resposta[:90]!r}... {'OK' if ok else 'FALHOU'}")
+    return ok
+
+
+def conferir_metricas() -> bool:
+    texto = metrics.renderizar({"contadores": {((n, tuple(map(tuple, l)))): v for (n, l, v) in metrics.retrato()["contadores"]},
+                                "histogramas": {}})
+    series = ["clinica_modelo_retries_total", "clinica_modelo_hedges_total", "clinica_modelo_falhas_total",
+              "clinica_modelo_breaker_estado", "clinica_modelo_breaker_aberturas_total"]
+    faltando = [s for s in series if f"\n{s}" not in texto]
+    print(f"Séries no /metrics: {'todas' if not faltando else 'faltando ' + ', '.join(faltando)}")
+    return not faltando
+
+
+def run(mensagens: int = 200) -> bool:
+    import response_templates
+    from schedule_engine import adicionar_modelo
+
+    logging.disable(logging.CRITICAL)
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    for dia_semana in range(7):
+        adicionar_modelo(database_tools.DATABASE_FILE, "consulta", 1, dia_semana, "07:00", "19:00", 20)
+    metrics.METRICS_FLUSH_S = 0
+    print(f"Modelo falso {LATENCIA}; prazo por tentativa 0.5s, por chamada 1.5s; {mensagens} mensagens por cenário")
+    ok = cenario_falhas(mensagens)
+    ok &= cenario_cauda(mensagens)
+    ok &= cenario_trava(mensagens)
+    ok &= cenario_queda()
+    ok &= conferir_marcacao_degradada()
+    ok &= conferir_metricas()
+    response_templates.TOOL_RENDER_MODE["tool_marcar_agendamento"] = "template"
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cliente do modelo sob falhas injetadas")
+    parser.add_argument("--mensagens", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.mensagens) else 1)
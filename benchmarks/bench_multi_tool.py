@@ -0,0 +1,252 @@
+"""
+Várias ferramentas numa mesma ação CHAMAR_FERRAMENTA (lista "chamadas"), com o modelo falso.
+
+Conversas roteirizadas com mensagens de vários pedidos ("meus agendamentos e meus exames"):
+- antes: o protocolo de uma ferramenta por ação; o modelo só atende o 1o pedido e o paciente precisa
+  mandar cada um dos outros numa mensagem nova (aqui: cada pedido vira uma mensagem);
+- depois: a mensagem inteira vira uma ação com todas as ferramentas e uma 2a chamada (RAG) só.
+Conta mensagens e chamadas ao modelo nos dois modos de resposta (templates e sempre com a 2a chamada)
+e confere que, com a 2a chamada, a resposta de cada mensagem é a junção das respostas dos pedidos
+separados. Também confere que as leituras da ação rodam juntas e as escritas sozinhas e em ordem,
+que /chat, async e os dois streams respondem igual e a resposta degradada com a IA fora do ar.
+
+Uso: python -m benchmarks.bench_multi_tool [--latencia fixa:100] [--ferramenta-ms 30]
+"""
+import argparse
+import asyncio
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import database_tools
+from benchmarks._common import copy_clinic_db, silence_stdout
+from benchmarks.fake_model import FakeGeminiModel, Latencia
+
+CHAT_ID = "MULTI_BENCH"
+
+# Conversas: cada mensagem é a lista dos pedidos que o paciente juntou nela
+CONVERSAS: List[Tuple[str, List[List[str]]]] = [
+    ("agenda e exames", [["Quero o ID {horario}, meu nome é Ana Teste"], ["meus agendamentos", "meus exames"]]),
+    ("informações", [["qual o endereço", "quais convênios", "horário de funcionamento"]]),
+    ("duas especialidades", [["horários de Cardiologia", "Dermatologia"], ["Quero o ID {horario}, meu nome é Ana Teste"]]),
+    ("cancelar e conferir", [["Quero o ID {horario}, meu nome é Ana Teste"],
+                             ["cancelar o agendamento {agendamento}", "meus agendamentos"]]),
+    ("exames", [["exame de sangue", "ECG"], ["quais exames", "meus exames"]]),
+    ("pergunta e resposta", [["quero marcar uma consulta"], ["Cardiologia"]]),
+]
+
+
+def _preparar_banco() -> None:
+    from schedule_engine import adicionar_modelo
+
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    for dia_semana in range(7):
+        adicionar_modelo(database_tools.DATABASE_FILE, "consulta", 1, dia_semana, "07:00", "19:00", 20)
+
+
+def _preencher(pedido: str) -> str:
+    valores: Dict[str, Any] = {}
+    if "{horario}" in pedido:
+        valores["horario"] = database_tools.tool_consultar_horarios_disponiveis("Cardiologia", limite=1).dados["itens"][0][0]
+    if "{agendamento}" in pedido:
+        with sqlite3.connect(database_tools.DATABASE_FILE) as conn:
+            valores["agendamento"] = conn.execute(
+                "SELECT MAX(id) FROM agendamentos WHERE telegram_chat_id = ?", (CHAT_ID,)).fetchone()[0]
+    return pedido.format(**valores)
+
+
+def rodar(protocolo: str, modo: str, latencia: str) -> Dict[str, Any]:
+    """Roda todas as conversas num banco novo; protocolo 'antes' (um pedido por mensagem) ou 'depois'."""
+    import agent
+    import response_templates
+
+    _preparar_banco()
+    modos = dict(response_templates.TOOL_RENDER_MODE)
+    if modo == "llm":
+        for tool_name in response_templates.TOOL_RENDER_MODE:
+            response_templates.TOOL_RENDER_MODE[tool_name] = "llm"
+    modelo = FakeGeminiModel(Latencia(latencia), multiplas_ferramentas=(protocolo == "depois"))
+    agent.model = modelo
+    respostas, mensagens = [], 0
+    inicio = time.perf_counter()
+    try:
+        with silence_stdout():
+            for (_, turnos) in CONVERSAS:
+                for pedidos in turnos:
+                    pedidos = [_preencher(p) for p in pedidos]
+                    if protocolo == "depois":
+                        envios = [" e ".join(pedidos)]
+                    else:
+                        envios = pedidos
+                    partes = [agent.process_web_message(envio, [], CHAT_ID) for envio in envios]
+                    mensagens += len(envios)
+                    respostas.append("\n\n".join(partes))
+    finally:
+        response_templates.TOOL_RENDER_MODE.update(modos)
+    return {"mensagens": mensagens, "chamadas": modelo.get_stats()["chamadas"], "respostas": respostas,
+            "segundos": time.perf_counter() - inicio}
+
+
+def comparar(latencia: str) -> bool:
+    ok = True
+    pedidos = sum(len(p) for (_, turnos) in CONVERSAS for p in turnos)
+    print(f"{len(CONVERSAS)} conversas, {sum(len(t) for (_, t) in CONVERSAS)} mensagens com {pedidos} pedidos; "
+          f"modelo falso {latencia}")
+    print(f"{'modo':<10} {'protocolo':<10} {'mensagens':>9} {'chamadas ao modelo':>19} {'tempo':>8}")
+    for modo in ("template", "llm"):
+        resultado = {protocolo: rodar(protocolo, modo, latencia) for protocolo in ("antes", "depois")}
+        for (protocolo, r) in resultado.items():
+            print(f"{modo:<10} {protocolo:<10} {r['mensagens']:>9} {r['chamadas']:>19} {r['segundos']:>7.2f}s")
+        antes, depois = resultado["antes"], resultado["depois"]
+        economia = 1 - depois["chamadas"] / antes["chamadas"]
+        print(f"{'':<10} {'':<10} {'':>9} {f'-{100 * economia:.0f}%':>19}")
+        ok &= depois["chamadas"] < antes["chamadas"]
+        if modo == "llm":
+            # Com a 2a chamada, o modelo falso devolve os resultados: a resposta única tem que juntar os mesmos
+            diferentes = [i for (i, (a, d)) in enumerate(zip(antes["respostas"], depois["respostas"])) if a != d]
+            print(f"Respostas iguais às dos pedidos separados: "
+                  f"{'OK' if not diferentes else 'FALHOU nas mensagens ' + str(diferentes)}")
+            ok &= not diferentes
+    return ok
+
+
+def conferir_paralelismo(ferramenta_ms: float) -> bool:
+    """Com cada ferramenta levando ferramenta_ms: as leituras se sobrepõem; a escrita roda sozinha, na ordem."""
+    import agent
+    from metrics import MedicaoMensagem
+
+    _preparar_banco()
+    originais = dict(agent.AVAILABLE_TOOLS)
+    linha_do_tempo, lock = [], threading.Lock()
+
+    def _lenta(tool_name, fn):
+        def ferramenta(**kwargs):
+            inicio = time.perf_counter()
+            time.sleep(ferramenta_ms / 1000)
+            resultado = fn(**kwargs)
+            with lock:
+                linha_do_tempo.append((tool_name, inicio, time.perf_counter()))
+            return resultado
+        return ferramenta
+
+    for (tool_name, fn) in originais.items():
+        agent.AVAILABLE_TOOLS[tool_name] = _lenta(tool_name, fn)
+    horario = database_tools.tool_consultar_horarios_disponiveis("Cardiologia", limite=1).dados["itens"][0][0]
+    leituras = [("tool_listar_meus_agendamentos", {}), ("tool_listar_meus_exames_agendados", {}),
+                ("tool_obter_info_clinica", {"topic": "endereco"})]
+    escrita = ("tool_marcar_agendamento", {"horario_id": horario, "nome_paciente": "Ana Teste"})
+    ok = True
+    try:
+        with silence_stdout():
+            inicio = time.perf_counter()
+            agent._executar_ferramentas(leituras, CHAT_ID, MedicaoMensagem())
+            juntas = (time.perf_counter() - inicio) * 1000
+            linha_do_tempo.clear()
+            resultados = agent._executar_ferramentas([leituras[0], escrita, leituras[0], leituras[1]],
+                                                     CHAT_ID, MedicaoMensagem())
+    finally:
+        agent.AVAILABLE_TOOLS.update(originais)
+    print(f"\n3 leituras de {ferramenta_ms:.0f}ms numa ação: {juntas:.0f}ms (uma a uma: {3 * ferramenta_ms:.0f}ms)")
+    ok &= juntas < 2 * ferramenta_ms
+
+    (_, ini_escrita, fim_escrita) = next(t for t in linha_do_tempo if t[0] == escrita[0])
+    outras = [t for t in linha_do_tempo if t[0] != escrita[0]]
+    sozinha = all(fim <= ini_escrita or ini >= fim_escrita for (_, ini, fim) in outras)
+    antes_dela = sum(1 for (_, _, fim) in outras if fim <= ini_escrita)
+    depois_dela = sum(1 for (_, ini, _) in outras if ini >= fim_escrita)
+    # A listagem depois da marcação já mostra o horário marcado (e a de antes, não)
+    ordem = antes_dela == 1 and depois_dela == 2 and str(resultados[0][2]) != str(resultados[2][2])
+    print(f"Leitura, escrita, 2 leituras: escrita sozinha {'OK' if sozinha else 'FALHOU'}, "
+          f"ordem (1 antes, 2 depois, listagem já com a marcação) {'OK' if ordem else 'FALHOU'}")
+    return ok and sozinha and ordem
+
+
+def conferir_fluxos() -> bool:
+    """/chat, async, stream e stream async: a mesma resposta para uma mensagem com vários pedidos."""
+    import agent
+    import response_templates
+
+    _preparar_banco()
+    modos = dict(response_templates.TOOL_RENDER_MODE)
+    for tool_name in response_templates.TOOL_RENDER_MODE:
+        response_templates.TOOL_RENDER_MODE[tool_name] = "llm"
+    agent.model = FakeGeminiModel()
+    mensagem = "meus agendamentos e meus exames e qual o endereço"
+
+    async def _async_stream():
+        eventos = [e async for e in agent.process_web_message_stream_async(mensagem, [], CHAT_ID)]
+        return eventos
+
+    try:
+        with silence_stdout():
+            respostas = {"sync": agent.process_web_message(mensagem, [], CHAT_ID),
+                         "async": asyncio.run(agent.process_web_message_async(mensagem, [], CHAT_ID))}
+            eventos = {"stream": list(agent.process_web_message_stream(mensagem, [], CHAT_ID)),
+                       "stream async": asyncio.run(_async_stream())}
+    finally:
+        response_templates.TOOL_RENDER_MODE.update(modos)
+    progresso = all(ev[0][0] == "progresso" for ev in eventos.values())
+    for (fluxo, ev) in eventos.items():
+        respostas[fluxo] = ev[-1][1]["reply"]
+    iguais = len(set(respostas.values())) == 1 and respostas["sync"].count("\n\n") >= 2
+    print(f"\n4 fluxos com 3 ferramentas: respostas iguais {'OK' if iguais else 'FALHOU'}, "
+          f"evento de progresso nos streams {'OK' if progresso else 'FALHOU'}")
+    return iguais and progresso
+
+
+def conferir_degradada() -> bool:
+    """As ferramentas rodaram e a IA caiu na 2a chamada: o paciente recebe o resultado de todas."""
+    import agent
+    import model_client
+    import response_templates
+
+    class _CaiNaSegunda(FakeGeminiModel):
+        def generate_content(self, contents, stream: bool = False, **kwargs):
+            self.fora_do_ar = any("functionResponse" in p for p in contents[-1].get("parts", []))
+            return super().generate_content(contents, stream=stream, **kwargs)
+
+    _preparar_banco()
+    modos = dict(response_templates.TOOL_RENDER_MODE)
+    for tool_name in response_templates.TOOL_RENDER_MODE:
+        response_templates.TOOL_RENDER_MODE[tool_name] = "llm"
+    model_client.MODEL_BACKOFF_BASE_S = model_client.MODEL_BACKOFF_MAX_S = 0.01
+    agent.CLIENTE_MODELO = model_client.ClienteDoModelo()
+    agent.model = _CaiNaSegunda()
+    try:
+        with silence_stdout():
+            resposta = agent.process_web_message("meus agendamentos e qual o endereço", [], CHAT_ID)
+            esperada = "\n\n".join([
+                response_templates.render_degraded("tool_listar_meus_agendamentos", {"telegram_chat_id": CHAT_ID},
+                                                   database_tools.tool_listar_meus_agendamentos(telegram_chat_id=CHAT_ID)),
+                response_templates.render_degraded("tool_obter_info_clinica", {"topic": "endereco"},
+                                                   database_tools.tool_obter_info_clinica(topic="endereco"))])
+    finally:
+        response_templates.TOOL_RENDER_MODE.update(modos)
+    ok = resposta == esperada
+    print(f"IA fora do ar na 2a chamada, 2 ferramentas: {resposta[:70]!r}... {'OK' if ok else 'FALHOU'}")
+    return ok
+
+
+def run(latencia: str = "fixa:100", ferramenta_ms: float = 30) -> bool:
+    import intent_router
+
+    logging.disable(logging.CRITICAL)
+    # Sem o atalho do roteador: aqui só interessa o caminho que passa pelo modelo
+    intent_router.FAST_PATH_ENABLED = False
+    ok = comparar(latencia)
+    ok &= conferir_paralelismo(ferramenta_ms)
+    ok &= conferir_fluxos()
+    ok &= conferir_degradada()
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Várias ferramentas numa ação: chamadas ao modelo economizadas")
+    parser.add_argument("--latencia", default="fixa:100", help="Latência do modelo falso (ver benchmarks/fake_model.py)")
+    parser.add_argument("--ferramenta-ms", type=float, default=30, help="Atraso somado a cada ferramenta no teste de paralelismo")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.latencia, args.ferramenta_ms) else 1)
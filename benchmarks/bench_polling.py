@@ -0,0 +1,95 @@
+"""
+Modo polling (telegram_polling.py) contra um Telegram falso local, com modelo falso.
+
+1. Mensagens de vários chats chegam em rajadas; o poller busca em lotes (long polling)
+   e os workers respondem em paralelo, na ordem de cada chat.
+2. Reinício: um poller novo lê o offset gravado e não reprocessa nada.
+3. Mede updates/s e o lag de ponta a ponta (mensagem -> resposta pronta).
+
+Uso: python -m benchmarks.bench_polling [chats] [mensagens_por_chat] [latencia_ms]
+"""
+import sys
+import threading
+import time
+
+import agent
+import database_tools
+import telegram_ingest
+import telegram_sender
+from benchmarks._common import copy_clinic_db, silence_stdout
+from benchmarks.bench_webhook_ingest import EchoModel
+from benchmarks.telegram_standin import TelegramStandIn
+from telegram_polling import TelegramPoller
+
+
+def _esperar_respostas(telegram: TelegramStandIn, total: int, timeout: float = 60) -> bool:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if len(telegram.mensagens) >= total:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _rodar_poller(telegram: TelegramStandIn):
+    poller = TelegramPoller("TESTE", api_base=telegram.base_url, poll_timeout=1)
+    thread = threading.Thread(target=poller.run, daemon=True)
+    thread.start()
+    return poller, thread
+
+
+def run(chats: int = 20, por_chat: int = 5, latencia_ms: float = 100) -> bool:
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    agent.model = EchoModel(latencia_ms / 1000)
+    total = chats * por_chat
+
+    with TelegramStandIn() as telegram:
+        telegram_sender._sender = telegram_sender.TelegramSender(
+            "TESTE", api_base=telegram.base_url, chat_rate=100, chat_burst=100, global_rate=1000)
+
+        with silence_stdout():
+            poller, thread = _rodar_poller(telegram)
+            inicio = time.perf_counter()
+            for i in range(por_chat):
+                for chat_id in range(1, chats + 1):
+                    telegram.add_update(chat_id, f"mensagem {i}")
+                time.sleep(0.01)  # Rajadas: o long polling devolve várias de uma vez
+            entregues = _esperar_respostas(telegram, total)
+            duracao = time.perf_counter() - inicio
+            stats = poller.get_stats()
+            poller.stop()
+            thread.join(5)
+
+        recebidas = telegram.por_chat()
+        em_ordem = all([t for (_, t) in recebidas.get(c, [])] ==
+                       [f"eco: mensagem {i}" for i in range(por_chat)] for c in range(1, chats + 1))
+        ingestao = stats["ingestao"]
+        print(f"{total} mensagens ({chats} chats), modelo {latencia_ms:.0f}ms; {stats['chamadas']} getUpdates")
+        print(f"Respostas entregues: {entregues} em {duracao:.2f}s ({total / duracao:.0f} updates/s); "
+              f"ordem por chat: {em_ordem}")
+        print(f"Lag de ponta a ponta: médio={ingestao['lag_medio_s']:.2f}s máx={ingestao['lag_max_s']:.2f}s "
+              f"(o 'date' do Telegram tem resolução de 1s)")
+
+        # Reinício: o offset gravado faz o poller novo pedir só o que ainda não foi confirmado
+        offset_gravado = stats["offset"]
+        extra = telegram.add_update(1, "depois do reinício")
+        with silence_stdout():
+            poller, thread = _rodar_poller(telegram)
+            retomou = poller.offset == offset_gravado == extra
+            entregue_extra = _esperar_respostas(telegram, total + 1, timeout=10)
+            time.sleep(0.3)
+            poller.stop()
+            thread.join(5)
+            telegram_ingest.close_dispatcher()
+        sem_repeticao = len(telegram.mensagens) == total + 1
+        print(f"Reinício: retomou do offset {offset_gravado}: {retomou}; "
+              f"nova mensagem respondida: {entregue_extra}; sem reprocessar: {sem_repeticao}")
+
+    ok = entregues and em_ordem and retomou and entregue_extra and sem_repeticao
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    args = [float(a) for a in sys.argv[1:]]
+    sys.exit(0 if run(*(int(a) for a in args[:2]), *args[2:3]) else 1)
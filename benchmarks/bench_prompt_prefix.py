@@ -0,0 +1,140 @@
+"""
+Prefixo fixo do prompt (prompt_prefix.py): bytes por pedido e CPU para montar cada chamada.
+
+1. Com o modelo falso, que serializa cada pedido como iria para a API (contents + declarações das
+   ferramentas + nome do cache), roda as mesmas mensagens pelo agent.process_web_message em 3 modos:
+   - antes: system prompt no contents e as funções em 'tools', convertidas a cada chamada;
+   - compartilhado (PROMPT_CACHE=0): mesmos bytes, mas ferramentas convertidas uma vez e a
+     mensagem do system prompt é o mesmo objeto em toda mensagem;
+   - cache (PROMPT_CACHE=1): o prefixo vai uma vez para o cache; os pedidos levam só o nome.
+   Mostra bytes por mensagem e por chamada, tokens do prefixo reaproveitados e confere que as
+   respostas são as mesmas nos 3 modos.
+2. Se o google.generativeai estiver instalado: tempo do _prepare_request do SDK (monta o pedido,
+   sem rede) com as funções x com as ferramentas já convertidas, e o tamanho do pedido serializado.
+
+Uso: python -m benchmarks.bench_prompt_prefix [--repeticoes 20]
+"""
+import argparse
+import logging
+import sys
+import time
+import warnings
+from typing import Any, Dict
+
+import database_tools
+import prompt_prefix
+from benchmarks._common import copy_clinic_db, silence_stdout
+from benchmarks.fake_model import FakeGeminiModel, sdk_falso
+
+# Todos os caminhos com IA: resposta, pergunta, template e RAG (2 chamadas)
+MENSAGENS = [
+    "Vocês atendem criança com febre?",
+    "Quero marcar uma consulta",
+    "Tem horário de Cardiologia?",
+    "Quero fazer exame de sangue",
+    "Quais são os meus agendamentos?",
+    "Quero o ID 999999, meu nome é Ana Teste",
+]
+FERRAMENTAS_RAG = ("tool_consultar_horarios_exames", "tool_listar_meus_agendamentos", "tool_marcar_agendamento")
+
+
+def rodar_modo(modo: str, repeticoes: int) -> Dict[str, Any]:
+    import agent
+
+    converter_original = prompt_prefix._converter_ferramentas
+    prompt_prefix.PROMPT_CACHE = modo == "cache"
+    if modo == "antes":
+        # Como era: as funções Python em 'tools' a cada chamada (o modelo converte toda vez)
+        prompt_prefix._converter_ferramentas = lambda ferramentas: list(ferramentas)
+    modelo = FakeGeminiModel()
+    agent.model = modelo
+    stats_antes = prompt_prefix.get_prefix_stats()
+    respostas = []
+    try:
+        inicio = time.perf_counter()
+        with silence_stdout(), sdk_falso():
+            for _ in range(repeticoes):
+                respostas += [agent.process_web_message(m, []) for m in MENSAGENS]
+        segundos = time.perf_counter() - inicio
+    finally:
+        prompt_prefix._converter_ferramentas = converter_original
+    stats = modelo.get_stats()
+    prefixo = {k: v - stats_antes[k] for (k, v) in prompt_prefix.get_prefix_stats().items()}
+    mensagens = repeticoes * len(MENSAGENS)
+    return {"modo": modo, "bytes_por_mensagem": stats["bytes_enviados"] / mensagens,
+            "bytes_por_chamada": stats["bytes_enviados"] / stats["chamadas"], "chamadas": stats["chamadas"],
+            "ms_por_mensagem": segundos * 1000 / mensagens, "tokens_reusados": prefixo["tokens_reusados"],
+            "tokens_em_cache": prefixo["tokens_em_cache"], "caches": stats["caches_criados"], "respostas": respostas}
+
+
+def conferir_compartilhamento() -> bool:
+    """Duas mensagens seguidas usam os mesmos objetos do prefixo (sem cópia por mensagem)."""
+    import agent
+
+    prompt_prefix.PROMPT_CACHE = False
+    preparado = agent.PREFIXO.preparar(FakeGeminiModel())
+    a = agent._build_contents("oi", [], preparado)
+    b = agent._build_contents("tudo bem?", [], preparado)
+    kwargs_a, kwargs_b = preparado.registrar_chamada(), preparado.registrar_chamada()
+    return a[0] is b[0] is agent.PREFIXO.mensagem_sistema and kwargs_a["tools"] is kwargs_b["tools"]
+
+
+def medir_sdk(repeticoes: int) -> None:
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            import google.generativeai as genai
+            from google.generativeai.types import content_types
+    except ImportError:
+        print("\ngoogle.generativeai não instalado: pulando a medida do SDK")
+        return
+    import agent
+
+    modelo = genai.GenerativeModel("models/gemini-flash-latest")
+    funcoes = list(agent.AVAILABLE_TOOLS.values())
+    convertidas = content_types.to_function_library(funcoes)
+    prompt_prefix.PROMPT_CACHE = False
+    contents = agent._build_contents("Tem horário de Cardiologia?", [], agent.PREFIXO.preparar(modelo))
+    print("\nSDK (_prepare_request, sem rede), por chamada ao modelo:")
+    for nome, tools in (("funções (antes)", funcoes), ("já convertidas", convertidas)):
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            pedido = modelo._prepare_request(contents=contents, tools=tools, tool_config=None,
+                                             generation_config=prompt_prefix.generation_config)
+        ms = (time.perf_counter() - inicio) * 1000 / repeticoes
+        print(f"  {nome:<16} {ms:>7.2f}ms  pedido serializado: {len(type(pedido).serialize(pedido))} bytes")
+
+
+def run(repeticoes: int = 20) -> bool:
+    import response_templates
+
+    logging.disable(logging.CRITICAL)
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    for tool_name in FERRAMENTAS_RAG:
+        response_templates.TOOL_RENDER_MODE[tool_name] = "llm"
+
+    resultados = [rodar_modo(modo, repeticoes) for modo in ("antes", "compartilhado", "cache")]
+    print(f"{len(MENSAGENS)} mensagens x {repeticoes} (resposta, pergunta, template e RAG); modelo falso sem latência")
+    print(f"{'modo':<14} {'bytes/mensagem':>15} {'bytes/chamada':>14} {'chamadas':>9} {'ms/mensagem':>12} "
+          f"{'tokens reusados':>16} {'em cache':>9} {'caches':>7}")
+    for r in resultados:
+        print(f"{r['modo']:<14} {r['bytes_por_mensagem']:>15.0f} {r['bytes_por_chamada']:>14.0f} {r['chamadas']:>9} "
+              f"{r['ms_por_mensagem']:>12.2f} {r['tokens_reusados']:>16} {r['tokens_em_cache']:>9} {r['caches']:>7}")
+    antes, cache = resultados[0], resultados[2]
+    print(f"Cache de contexto: {100 * (1 - cache['bytes_por_mensagem'] / antes['bytes_por_mensagem']):.0f}% menos bytes por mensagem")
+
+    mesmas = all(r["respostas"] == antes["respostas"] for r in resultados)
+    compartilhado = conferir_compartilhamento()
+    print(f"Mesmas respostas nos 3 modos: {mesmas}; prefixo compartilhado entre mensagens: {compartilhado}")
+    medir_sdk(repeticoes)
+
+    ok = mesmas and compartilhado and cache["bytes_por_mensagem"] < antes["bytes_por_mensagem"] and cache["caches"] == 1
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes e CPU por pedido com o prefixo fixo do prompt")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.repeticoes) else 1)
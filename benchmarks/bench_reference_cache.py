@@ -0,0 +1,79 @@
+"""
+Benchmark do cache de referência (info, medicos, exames): latência por chamada
+das consultas antigas direto no SQLite vs. o caminho com reference_cache.
+No fim confere a invalidação: uma escrita feita por OUTRA conexão é vista pelo cache.
+
+Uso: python -m benchmarks.bench_reference_cache [iteracoes]
+"""
+import sqlite3
+import sys
+import time
+
+import database_pool
+import reference_cache
+from benchmarks._common import copy_clinic_db, silence_stdout, summarize, time_calls
+from reference_cache import get_reference_cache
+
+
+def run(iterations: int = 5000) -> bool:
+    db_file = copy_clinic_db()
+    conn = database_pool.get_connection(db_file)
+    cache = get_reference_cache(db_file)
+
+    def info_sem_cache():
+        return conn.execute("SELECT value FROM info WHERE topic = ?", ("endereco",)).fetchone()[0]
+
+    def exames_sem_cache():
+        return "; ".join(r[0] for r in conn.execute("SELECT nome_exame FROM exames ORDER BY nome_exame;"))
+
+    def horarios_sem_cache():
+        return conn.execute("""
+            SELECT h.id, m.nome, h.data_hora_inicio
+            FROM horarios_disponiveis h JOIN medicos m ON h.medico_id = m.id
+            WHERE m.especialidade LIKE ? AND h.status = 'disponivel'
+            ORDER BY h.data_hora_inicio
+        """, ("%Cardio%",)).fetchall()
+
+    def horarios_com_cache():
+        ids = cache.medicos_por_especialidade("Cardio")
+        rows = conn.execute(
+            f"SELECT id, medico_id, data_hora_inicio FROM horarios_disponiveis "
+            f"WHERE medico_id IN ({', '.join('?' * len(ids))}) AND status = 'disponivel' ORDER BY data_hora_inicio",
+            ids
+        ).fetchall()
+        return [(i, cache.nome_medico(m), d) for (i, m, d) in rows]
+
+    casos = {
+        "info (endereco)": (info_sem_cache, lambda: cache.get_info("endereco")),
+        "lista de exames formatada": (exames_sem_cache, lambda: cache.derived(
+            "lista_exames", lambda: "; ".join(nome for (_, nome) in cache.get_exames()))),
+        "horarios por especialidade": (horarios_sem_cache, horarios_com_cache),
+    }
+
+    with silence_stdout():
+        cache.get_info("endereco")  # Carga inicial fora da medição
+        for nome, (sem_cache, com_cache) in casos.items():
+            assert sem_cache() == com_cache(), nome
+            antes = summarize(time_calls(sem_cache, iterations))
+            depois = summarize(time_calls(com_cache, iterations))
+            print(f"{nome:30s} sem cache p50={antes['p50_us']:7.1f}us  com cache p50={depois['p50_us']:7.1f}us",
+                  file=sys.stderr)
+
+    # Invalidação: outro "worker" (conexão separada) edita a tabela info
+    outro = sqlite3.connect(db_file)
+    outro.execute("UPDATE info SET value = 'Endereço novo' WHERE topic = 'endereco'")
+    outro.commit()
+    outro.close()
+    time.sleep(reference_cache.REFERENCE_CHECK_INTERVAL)
+    with silence_stdout():
+        invalidou = cache.get_info("endereco") == "Endereço novo"
+    print(f"Escrita de outra conexão detectada pelo cache: {'sim' if invalidou else 'NÃO'} "
+          f"(recargas: {cache.stats['loads']})")
+
+    database_pool.close_all_connections()
+    return invalidou
+
+
+if __name__ == "__main__":
+    ok = run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,183 @@
+"""
+Agenda recorrente (schedule_engine) x tabela de horários toda materializada.
+
+Os dois bancos representam a MESMA agenda: 50 médicos (10 especialidades), 12 meses,
+segunda a sexta das 08:00 às 12:00 e das 13:00 às 17:00, de 30 em 30 minutos, com um feriado,
+e os mesmos ~10% de horários já marcados.
+- materializado: uma linha por horário em horarios_disponiveis (~200 mil linhas);
+- agenda: 500 modelos semanais + 1 exceção + só as linhas dos horários marcados.
+
+Compara tamanho do arquivo (depois de VACUUM), tempo de carga do índice e latência das buscas,
+confere que as duas buscas devolvem os mesmos horários e que marcar/listar/cancelar funciona
+pelas ferramentas num horário gerado pelos modelos.
+
+Uso: python -m benchmarks.bench_schedule_engine [meses]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import database_pool
+import database_tools
+from availability_index import get_availability_index
+from benchmarks._common import silence_stdout, summarize, time_calls
+from database_migrations import run_migrations
+from database_setup import setup_database
+from schedule_engine import adicionar_excecao, adicionar_modelo, get_schedule_engine, is_virtual
+
+ESPECIALIDADES = ["Cardiologia", "Dermatologia", "Pediatria", "Ortopedia", "Neurologia",
+                  "Ginecologia", "Oftalmologia", "Psiquiatria", "Urologia", "Endocrinologia"]
+NUM_MEDICOS = 50
+TURNOS = [("08:00", "12:00"), ("13:00", "17:00")]
+DURACAO_MIN = 30
+TAXA_MARCADOS = 0.10
+
+
+def _inicio() -> date:
+    hoje = date.today()
+    return hoje + timedelta(days=7 - hoje.weekday())  # Próxima segunda-feira
+
+
+def _ocorrencias(inicio: date, meses: int):
+    """(índice do médico, 'AAAA-MM-DD HH:MM:SS') de toda a agenda, sem o feriado."""
+    feriado = inicio + timedelta(days=30)
+    dia = inicio
+    fim = inicio + timedelta(days=round(meses * 30.44))
+    while dia < fim:
+        if dia.weekday() < 5 and dia != feriado:
+            for (de, ate) in TURNOS:
+                hora = datetime.combine(dia, datetime.strptime(de, "%H:%M").time())
+                limite = datetime.combine(dia, datetime.strptime(ate, "%H:%M").time())
+                while hora + timedelta(minutes=DURACAO_MIN) <= limite:
+                    for medico in range(NUM_MEDICOS):
+                        yield medico, hora.strftime("%Y-%m-%d %H:%M:%S")
+                    hora += timedelta(minutes=DURACAO_MIN)
+        dia += timedelta(days=1)
+
+
+def _novo_banco(nome: str):
+    db_file = os.path.join(tempfile.mkdtemp(prefix=f"clinic_{nome}_"), "clinic.db")
+    with silence_stdout():
+        setup_database(db_file)
+        run_migrations(db_file)
+
+    def _medicos(conn):
+        conn.executemany("INSERT INTO medicos (nome, especialidade) VALUES (?, ?)",
+                         ((f"Dr(a). Médico {i}", ESPECIALIDADES[i % len(ESPECIALIDADES)]) for i in range(NUM_MEDICOS)))
+        return [r[0] for r in conn.execute("SELECT id FROM medicos ORDER BY id DESC LIMIT ?", (NUM_MEDICOS,))][::-1]
+
+    return db_file, database_pool.write_transaction(db_file, _medicos)
+
+
+def seed(meses: int):
+    inicio = _inicio()
+    rng = random.Random(11)
+    marcados = {o for o in _ocorrencias(inicio, meses) if rng.random() < TAXA_MARCADOS}
+
+    # Tudo materializado: uma linha por horário (livre ou marcado)
+    materializado, medicos = _novo_banco("materializado")
+    database_pool.write_transaction(materializado, lambda conn: conn.executemany(
+        "INSERT INTO horarios_disponiveis (medico_id, data_hora_inicio, status) VALUES (?, ?, ?)",
+        ((medicos[m], d, "agendado" if (m, d) in marcados else "disponivel") for (m, d) in _ocorrencias(inicio, meses))))
+
+    # Agenda: modelos + exceção + só as linhas marcadas
+    agenda, medicos_agenda = _novo_banco("agenda")
+    fim = (inicio + timedelta(days=round(meses * 30.44) - 1)).isoformat()
+    for medico in medicos_agenda:
+        for dia_semana in range(5):
+            for (de, ate) in TURNOS:
+                adicionar_modelo(agenda, "consulta", medico, dia_semana, de, ate, DURACAO_MIN,
+                                 valido_de=inicio.isoformat(), valido_ate=fim)
+    feriado = inicio + timedelta(days=30)
+    adicionar_excecao(agenda, feriado.isoformat(), (feriado + timedelta(days=1)).isoformat(), motivo="Feriado")
+    database_pool.write_transaction(agenda, lambda conn: conn.executemany(
+        "INSERT INTO horarios_disponiveis (medico_id, data_hora_inicio, status) VALUES (?, ?, 'agendado')",
+        ((medicos_agenda[m], d) for (m, d) in sorted(marcados, key=lambda o: o[1]))))
+    return materializado, agenda, inicio
+
+
+def _tamanho(db_file: str) -> int:
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(db_file)
+
+
+def _linhas(db_file: str) -> int:
+    return database_pool.get_connection(db_file).execute("SELECT COUNT(*) FROM horarios_disponiveis").fetchone()[0]
+
+
+def _fluxo_marcacao(inicio: date) -> bool:
+    """Marca um horário gerado pelos modelos, lista, cancela e confere que ele volta uma vez só."""
+    index = get_availability_index(database_tools.DATABASE_FILE)
+    primeiro = index.livres("consulta", especialidades=["Cardiologia"], inicio=inicio.isoformat(), limite=1)[0]
+    horario_id = primeiro[0]
+    with silence_stdout():
+        marcou = database_tools.tool_marcar_agendamento(horario_id, "Paciente Teste", "chat_agenda")
+        sumiu = index.livres("consulta", especialidades=["Cardiologia"], inicio=inicio.isoformat(), limite=1)[0] != primeiro
+        listados = database_tools.tool_listar_meus_agendamentos("chat_agenda")
+        agendamento_id = int(listados.split(":")[0].removeprefix("[ID "))
+        database_tools.tool_cancelar_agendamento(agendamento_id, "chat_agenda")
+        voltou = index.livres("consulta", especialidades=["Cardiologia"], inicio=inicio.isoformat(), limite=2)
+        repetido = database_tools.tool_marcar_agendamento(horario_id, "Outro Paciente", "chat_agenda_2")
+    ok = (is_virtual(horario_id) and marcou == "Agendamento confirmado com sucesso!" and sumiu
+          and primeiro[2] in listados
+          and voltou[0][1:] == primeiro[1:] and voltou[1][1:] != primeiro[1:]  # De volta, pelo id da linha, sem duplicar
+          and repetido == "Agendamento confirmado com sucesso!")  # O ID gerado continua valendo e reaproveita a linha
+    print(f"Marcar/listar/cancelar um horário gerado ({horario_id}): {'OK' if ok else 'FALHOU'} "
+          f"-> '{marcou}' | listado: {listados} | depois de cancelar: {voltou[0]}")
+    return ok
+
+
+def run(meses: int = 12, iterations: int = 1000) -> bool:
+    t0 = time.perf_counter()
+    materializado, agenda, inicio = seed(meses)
+    print(f"{NUM_MEDICOS} médicos, {meses} meses a partir de {inicio} ({time.perf_counter() - t0:.1f}s para semear)")
+
+    resultados = {}
+    for nome, db_file in (("materializado", materializado), ("agenda", agenda)):
+        tamanho = _tamanho(db_file)
+        database_tools.DATABASE_FILE = db_file
+        index = get_availability_index(db_file)
+        t0 = time.perf_counter()
+        with silence_stdout():
+            index.warm_up()
+        carga = time.perf_counter() - t0
+
+        meio_do_ano = (inicio + timedelta(days=180)).isoformat()
+        medico = database_pool.get_connection(db_file).execute("SELECT MAX(id) FROM medicos").fetchone()[0]
+        buscas = {
+            "próximos 10 (cardiologia)": lambda: index.livres(
+                "consulta", especialidades=["Cardiologia"], inicio=inicio.isoformat(), limite=11),
+            "daqui a 6 meses, à tarde": lambda: index.livres(
+                "consulta", especialidades=["Cardiologia"], inicio=meio_do_ano, horas=(12, 18), limite=11),
+            "um médico, 1 semana": lambda: index.livres(
+                "consulta", donos=[medico], inicio=meio_do_ano, fim=(inicio + timedelta(days=187)).isoformat()),
+        }
+        with silence_stdout():
+            latencias = {b: summarize(time_calls(fn, iterations)) for (b, fn) in buscas.items()}
+            ferramenta = summarize(time_calls(lambda: database_tools.tool_consultar_horarios_disponiveis("Cardio"), 200))
+            comparacao = {b: [(d, h) for (_, d, h) in fn()] for (b, fn) in buscas.items()}
+        resultados[nome] = comparacao
+        print(f"\n[{nome}] arquivo={tamanho / 1024:.0f} KB, {_linhas(db_file)} linhas em horarios_disponiveis, "
+              f"carga do índice={carga * 1000:.0f}ms")
+        for b, lat in latencias.items():
+            print(f"  {b}: p50={lat['p50_us']:.0f}us p99={lat['p99_us']:.0f}us")
+        print(f"  tool_consultar_horarios_disponiveis: p50={ferramenta['p50_us']:.0f}us p99={ferramenta['p99_us']:.0f}us")
+
+    iguais = resultados["materializado"] == resultados["agenda"]
+    print(f"\nMesmos horários (médico, data/hora) nas duas versões: {iguais}")
+    print(f"Agenda: {get_schedule_engine(agenda).stats}")
+    ok = _fluxo_marcacao(inicio) and iguais
+    database_pool.close_all_connections()
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 12) else 1)
@@ -0,0 +1,137 @@
+"""
+Tempo de subida: import do app e partida a frio do gunicorn.
+
+1. 'python -X importtime -c "import api"' (e asgi) em processos novos: tempo acumulado do
+   import, com mediana de várias execuções. Falha se passar do limite (regressão) ou se o
+   google.generativeai voltar a ser importado junto com o app (ele só carrega no get_model()).
+2. Quanto custa criar o modelo (get_model(), import do google.generativeai): o que o warm-up
+   tira da primeira mensagem.
+3. Partida a frio do gunicorn, com e sem GUNICORN_PRELOAD: tempo até o '/' responder e
+   confirmação de que o /chat funciona nos workers (benchmarks/fake_app.py: modelo falso,
+   cópia do clinic.db).
+
+Uso: python -m benchmarks.bench_startup [--repeticoes 5] [--fator-limite 1.0]
+(--fator-limite multiplica os limites de LIMITES_IMPORT_MS, para máquinas mais lentas)
+"""
+import argparse
+import os
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks._common import REPO_DIR, copy_clinic_db
+
+# Limites do tempo de import (ms). O asgi é mais caro por causa do próprio FastAPI/pydantic (~0.6s).
+LIMITES_IMPORT_MS = {"api": 700, "asgi": 1200}
+_LINHA_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def _ambiente(**extra) -> dict:
+    return {**os.environ, "PYTHONPATH": REPO_DIR, "PYTHONWARNINGS": "ignore", "LOG_LEVEL": "WARNING", **extra}
+
+
+def medir_import(modulo: str, pasta: str, repeticoes: int) -> dict:
+    """Mediana do tempo acumulado do import (ms) e os módulos carregados junto."""
+    tempos, carregados = [], set()
+    for _ in range(repeticoes):
+        # cwd na pasta da cópia: o DATABASE_FILE é relativo e o import aplica as migrações
+        saida = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                               cwd=pasta, env=_ambiente(), capture_output=True, text=True, timeout=120)
+        for linha in saida.stderr.splitlines():
+            m = _LINHA_IMPORTTIME.match(linha)
+            if not m:
+                continue
+            carregados.add(m.group(4))
+            if m.group(4) == modulo and len(m.group(3)) == 1:
+                tempos.append(int(m.group(2)) / 1000)
+    return {"import_ms": statistics.median(tempos) if tempos else float("inf"), "modulos": carregados}
+
+
+def medir_modelo(pasta: str, repeticoes: int) -> float:
+    codigo = ("import time, config; t = time.perf_counter(); config.get_model(); "
+              "print((time.perf_counter() - t) * 1000)")
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, "-c", codigo], cwd=pasta, capture_output=True, text=True, timeout=120,
+                               env=_ambiente(GEMINI_API_KEY=os.getenv("GEMINI_API_KEY") or "chave-de-teste"))
+        tempos.append(float(saida.stdout.strip().splitlines()[-1]))
+    return statistics.median(tempos)
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def partida_gunicorn(pasta: str, preload: bool, workers: int = 2) -> dict:
+    porta = _porta_livre()
+    base = f"http://127.0.0.1:{porta}"
+    env = _ambiente(FAKE_LATENCIA="0", GUNICORN_PRELOAD="1" if preload else "0")
+    log = tempfile.TemporaryFile()
+    inicio = time.perf_counter()
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "benchmarks.fake_app:app", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+         "--pythonpath", REPO_DIR, "--chdir", pasta, "-w", str(workers), "-b", f"127.0.0.1:{porta}"],
+        env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        pronto = None
+        while time.perf_counter() - inicio < 60:
+            try:
+                if requests.get(base, timeout=1).status_code == 200:
+                    pronto = (time.perf_counter() - inicio) * 1000
+                    break
+            except requests.RequestException:
+                time.sleep(0.01)
+        # Várias mensagens, para passar por todos os workers
+        status = [requests.post(f"{base}/chat", json={"message": "Quero marcar uma consulta"}, timeout=30).status_code
+                  for _ in range(workers * 3)]
+        return {"ate_responder_ms": pronto, "chat_ok": status.count(200) == len(status)}
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=30)
+        if servidor.returncode not in (0, -15):
+            log.seek(0)
+            print(log.read().decode(errors="replace")[-2000:])
+
+
+def run(repeticoes: int = 5, fator_limite: float = 1.0) -> bool:
+    pasta = os.path.dirname(copy_clinic_db())
+    ok = True
+    for modulo, limite in LIMITES_IMPORT_MS.items():
+        limite_import_ms = limite * fator_limite
+        resultado = medir_import(modulo, pasta, repeticoes)
+        sem_genai = not any(m.startswith("google.generativeai") for m in resultado["modulos"])
+        dentro = resultado["import_ms"] <= limite_import_ms
+        print(f"import {modulo}: {resultado['import_ms']:.0f}ms (mediana de {repeticoes}, limite {limite_import_ms:.0f}ms): "
+              f"{'OK' if dentro else 'REGRESSÃO'}; google.generativeai fora do import: {sem_genai}")
+        ok &= dentro and sem_genai
+
+    print(f"get_model() (import do google.generativeai, feito no warm-up): {medir_modelo(pasta, repeticoes):.0f}ms")
+
+    if shutil.which("gunicorn") is None:
+        print("gunicorn não instalado: pulando a partida a frio")
+    else:
+        for preload in (False, True):
+            partida = partida_gunicorn(pasta, preload)
+            print(f"gunicorn 2 workers, preload={'sim' if preload else 'não'}: '/' respondeu em "
+                  f"{partida['ate_responder_ms']:.0f}ms; /chat nos workers: {partida['chat_ok']}")
+            ok &= partida["ate_responder_ms"] is not None and partida["chat_ok"]
+
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempo de import e de partida a frio")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--fator-limite", type=float, default=1.0)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.repeticoes, args.fator_limite) else 1)
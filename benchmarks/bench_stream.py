@@ -0,0 +1,148 @@
+"""
+/chat (JSON no fim) x /chat/stream (Server-Sent Events), com o modelo falso.
+
+Para cada caminho da mensagem (roteador, resposta e pergunta direto da 1a chamada, ferramenta com
+template, ferramenta com a 2a chamada RAG) mede, do envio até:
+- /chat: o corpo chegar (TTFB e total são praticamente o mesmo);
+- /chat/stream: o 1o evento (TTFB: progresso ou texto), o 1o texto e o evento 'fim' (total).
+Roda no api.py (Flask/werkzeug) e no asgi.py (uvicorn), numa cópia do clinic.db. Também confere
+que a resposta final do stream é igual à do /chat e ao texto concatenado dos eventos.
+
+Uso: python -m benchmarks.bench_stream [--latencia fixa:800] [--repeticoes 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import requests
+
+import database_tools
+from benchmarks._common import copy_clinic_db, percentile
+from benchmarks.fake_model import FakeGeminiModel, Latencia
+
+# caminho -> mensagem (sem conversation_id: cada envio é uma conversa nova)
+CENARIOS = {
+    "roteador": "Qual o endereço?",
+    "resposta": "Vocês atendem criança com febre?",
+    "pergunta": "Quero marcar uma consulta",
+    "template": "Tem horário de Cardiologia?",
+    "rag": "Quero fazer exame de sangue",
+}
+FERRAMENTA_RAG = "tool_consultar_horarios_exames"  # Forçada para a 2a chamada no cenário 'rag'
+
+
+def _eventos(corpo: str) -> List[Tuple[str, Dict[str, Any]]]:
+    eventos = []
+    for bloco in corpo.split("\n\n"):
+        linhas = dict(l.split(": ", 1) for l in bloco.splitlines() if ": " in l)
+        if "event" in linhas:
+            eventos.append((linhas["event"], json.loads(linhas["data"])))
+    return eventos
+
+
+def medir_chat(base: str, mensagem: str) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    resposta = requests.post(f"{base}/chat", json={"message": mensagem}, timeout=60)
+    total = (time.perf_counter() - inicio) * 1000
+    return {"ttfb_ms": total, "total_ms": total, "reply": resposta.json()["reply"]}
+
+
+def medir_stream(base: str, mensagem: str) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    medida = {"ttfb_ms": None, "texto_ms": None}
+    corpo = ""
+    with requests.post(f"{base}/chat/stream", json={"message": mensagem}, stream=True, timeout=60) as resposta:
+        for pedaco in resposta.iter_content(chunk_size=None, decode_unicode=True):
+            agora = (time.perf_counter() - inicio) * 1000
+            corpo += pedaco
+            if medida["ttfb_ms"] is None and "event: " in corpo:
+                medida["ttfb_ms"] = agora
+            if medida["texto_ms"] is None and "event: texto" in corpo:
+                medida["texto_ms"] = agora
+    medida["total_ms"] = (time.perf_counter() - inicio) * 1000
+    eventos = _eventos(corpo)
+    fim = next((dados for (nome, dados) in eventos if nome == "fim"), {})
+    medida["reply"] = fim.get("reply")
+    medida["concatenado"] = "".join(dados["texto"] for (nome, dados) in eventos if nome == "texto")
+    medida["progresso"] = any(nome == "progresso" for (nome, _) in eventos)
+    return medida
+
+
+def _p50(medidas: List[Dict[str, Any]], chave: str) -> float:
+    return percentile([m[chave] for m in medidas if m[chave] is not None], 50)
+
+
+def comparar(nome_servidor: str, base: str, repeticoes: int) -> bool:
+    ok = True
+    print(f"\n{nome_servidor}: {'caminho':<10} {'/chat total':>12} {'stream TTFB':>12} {'1o texto':>10} "
+          f"{'stream total':>13}  progresso  mesma resposta")
+    for caminho, mensagem in CENARIOS.items():
+        chat = [medir_chat(base, mensagem) for _ in range(repeticoes)]
+        stream = [medir_stream(base, mensagem) for _ in range(repeticoes)]
+        iguais = all(s["reply"] == chat[0]["reply"] == s["concatenado"] for s in stream)
+        com_progresso = all(s["progresso"] for s in stream)
+        ttfb, total_chat = _p50(stream, "ttfb_ms"), _p50(chat, "total_ms")
+        print(f"{'':<{len(nome_servidor)}}  {caminho:<10} {total_chat:>10.0f}ms {ttfb:>10.0f}ms "
+              f"{_p50(stream, 'texto_ms'):>8.0f}ms {_p50(stream, 'total_ms'):>11.0f}ms  "
+              f"{'sim' if com_progresso else 'não':<9}  {iguais}")
+        ok &= iguais
+        if caminho in ("template", "rag"):
+            ok &= com_progresso
+        if caminho != "roteador":
+            ok &= ttfb < total_chat * 0.8  # O 1o evento tem que chegar bem antes da resposta inteira
+    return ok
+
+
+def _subir_uvicorn(app) -> Tuple[Any, str]:
+    import socket
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        porta = s.getsockname()[1]
+    servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=porta, log_level="warning", lifespan="off"))
+    threading.Thread(target=servidor.run, daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.01)
+    return servidor, f"http://127.0.0.1:{porta}"
+
+
+def run(latencia: str = "fixa:800", repeticoes: int = 5) -> bool:
+    import agent
+    import response_templates
+
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    agent.model = FakeGeminiModel(Latencia(latencia))
+    response_templates.TOOL_RENDER_MODE[FERRAMENTA_RAG] = "llm"
+    logging.disable(logging.CRITICAL)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api  # Depois de apontar o DATABASE_FILE (o import roda as migrações)
+        import asgi
+    from werkzeug.serving import make_server
+
+    print(f"Modelo falso: {latencia} por chamada; 1o trecho do stream em 30% dela; mediana de {repeticoes} envios")
+    flask = make_server("127.0.0.1", 0, api.app, threaded=True)
+    threading.Thread(target=flask.serve_forever, daemon=True).start()
+    uvicorn_servidor, base_asgi = _subir_uvicorn(asgi.app)
+    try:
+        ok = comparar("api.py ", f"http://127.0.0.1:{flask.server_port}", repeticoes)
+        ok &= comparar("asgi.py", base_asgi, repeticoes)
+    finally:
+        flask.shutdown()
+        uvicorn_servidor.should_exit = True
+    print("\nOK" if ok else "\nFALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TTFB do /chat/stream x /chat")
+    parser.add_argument("--latencia", default="fixa:800")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.latencia, args.repeticoes) else 1)
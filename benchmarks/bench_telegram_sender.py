@@ -0,0 +1,153 @@
+"""
+Benchmark/verificação do telegram_sender contra um stand-in local da API do Telegram.
+
+1. Envio antigo (requests.post sem Session, uma conexão por mensagem) vs. o sender com pool keep-alive.
+2. Limites: nenhuma janela de tempo passa do balde global nem do balde por chat.
+3. Ordem das mensagens de cada chat preservada; mensagens enfileiradas juntas são agrupadas.
+4. Retries: 500 com backoff e 429 respeitando o retry_after.
+5. Um erro inesperado no envio (não de rede) devolve False para aquele envio e a thread segue viva.
+
+Uso: python -m benchmarks.bench_telegram_sender [mensagens]
+"""
+import sys
+import time
+
+import requests
+
+from benchmarks._common import silence_stdout
+from benchmarks.telegram_standin import TelegramStandIn
+from telegram_sender import TelegramSender
+
+LATENCIA_API_S = 0.005
+
+
+def _respeita_balde(instantes: list, rate: float, capacity: float) -> bool:
+    """Em qualquer janela [t_i, t_j], no máximo capacity + rate * (t_j - t_i) envios (com folga de 1)."""
+    instantes = sorted(instantes)
+    for i in range(len(instantes)):
+        for j in range(i, len(instantes)):
+            if j - i + 1 > capacity + rate * (instantes[j] - instantes[i]) + 1:
+                return False
+    return True
+
+
+def envio_antigo(total: int) -> dict:
+    with TelegramStandIn(LATENCIA_API_S) as api:
+        url = f"{api.base_url}/botTESTE/sendMessage"
+        inicio = time.perf_counter()
+        for i in range(total):
+            requests.post(url, headers={"Content-Type": "application/json"},
+                          json={"chat_id": i, "text": f"mensagem {i}"}).raise_for_status()
+        decorrido = time.perf_counter() - inicio
+        return {"segundos": decorrido, "conexoes": api.conexoes}
+
+
+def envio_novo(total: int, chats: int) -> dict:
+    with TelegramStandIn(LATENCIA_API_S) as api:
+        sender = TelegramSender("TESTE", api_base=api.base_url, workers=4,
+                                global_rate=total, chat_rate=1, chat_burst=3)
+        inicio = time.perf_counter()
+        with silence_stdout():
+            futures = [sender.send(i % chats, f"mensagem {i}") for i in range(total)]
+            entregues = all(f.result(timeout=60) for f in futures)
+        decorrido = time.perf_counter() - inicio
+        sender.close()
+        stats = sender.get_stats()
+
+        # Todas as mensagens chegaram, na ordem, por chat (as agrupadas vêm separadas por linha em branco)
+        recebidas = api.por_chat()
+        em_ordem = all(
+            "\n\n".join(t for (_, t) in recebidas.get(c, [])).split("\n\n") ==
+            [f"mensagem {i}" for i in range(c, total, chats)]
+            for c in range(chats)
+        )
+        limites = all(_respeita_balde([t for (t, _) in msgs], 1, 3) for msgs in recebidas.values())
+        limites = limites and _respeita_balde([t for (t, _, _) in api.mensagens], total, total)
+        return {"segundos": decorrido, "conexoes": api.conexoes, "entregues": entregues,
+                "em_ordem": em_ordem, "limites": limites, "stats": stats}
+
+
+def envio_global_limitado() -> bool:
+    """60 mensagens para 60 chats com limite global de 30/s: deve levar ~1s e respeitar o balde."""
+    with TelegramStandIn() as api:
+        sender = TelegramSender("TESTE", api_base=api.base_url, workers=4, global_rate=30)
+        with silence_stdout():
+            futures = [sender.send(i, "oi") for i in range(60)]
+            ok = all(f.result(timeout=30) for f in futures)
+        sender.close()
+        instantes = [t for (t, _, _) in api.mensagens]
+        duracao = max(instantes) - min(instantes)
+        print(f"Limite global 30/s: 60 mensagens em {duracao:.2f}s")
+        return ok and duracao >= 0.9 and _respeita_balde(instantes, 30, 30)
+
+
+def agrupamento() -> bool:
+    """Dez respostas enfileiradas de uma vez para o mesmo chat viram poucas requisições, na ordem."""
+    with TelegramStandIn() as api:
+        sender = TelegramSender("TESTE", api_base=api.base_url, workers=1)
+        with silence_stdout():
+            futures = [sender.send("C", f"parte {i}") for i in range(10)]
+            ok = all(f.result(timeout=30) for f in futures)
+        sender.close()
+        textos = "\n\n".join(t for (_, t) in api.por_chat()["C"]).split("\n\n")
+        print(f"Agrupamento: 10 mensagens do mesmo chat em {api.requisicoes} requisições")
+        return ok and textos == [f"parte {i}" for i in range(10)] and api.requisicoes < 10
+
+
+def retries() -> bool:
+    with TelegramStandIn() as api:
+        api.falhas_500["A"] = 2
+        api.falhas_429["B"] = 1
+        api.retry_after = 1
+        sender = TelegramSender("TESTE", api_base=api.base_url, workers=2)
+        inicio = time.monotonic()
+        with silence_stdout():
+            ok_a = sender.send("A", "depois de dois 500").result(timeout=30)
+            ok_b = sender.send("B", "depois de um 429").result(timeout=30)
+        sender.close()
+        espera_429 = api.por_chat()["B"][0][0] - inicio
+        stats = sender.get_stats()
+        print(f"Retries: 500x2 entregue={ok_a}, 429 entregue={ok_b} após {espera_429:.2f}s "
+              f"(retry_after=1s), tentativas extras={stats['tentativas_extras']}")
+        return ok_a and ok_b and espera_429 >= 1.0 and stats["respostas_429"] == 1
+
+
+def erro_inesperado() -> bool:
+    with TelegramStandIn() as api:
+        sender = TelegramSender("TESTE", api_base=api.base_url, workers=1)
+        post = sender._post
+
+        def post_com_erro(chat_id, text):
+            if chat_id == "X":
+                raise AttributeError("'list' object has no attribute 'get'")
+            return post(chat_id, text)
+
+        sender._post = post_com_erro
+        with silence_stdout():
+            falhou = sender.send("X", "vai falhar").result(timeout=5)
+            depois = sender.send("Y", "depois do erro").result(timeout=5)
+        sender.close()
+        print(f"Erro inesperado: envio com erro={falhou}, próximo envio na mesma fila={depois}, "
+              f"falhas={sender.get_stats()['falhas']}")
+        return falhou is False and depois is True and [t for (_, t) in api.por_chat()["Y"]] == ["depois do erro"]
+
+
+def run(total: int = 300) -> bool:
+    antigo = envio_antigo(total)
+    novo = envio_novo(total, chats=total // 3)
+    s = novo["stats"]
+    print(f"Antigo (requests.post):   {total} msgs em {antigo['segundos']:.2f}s, {antigo['conexoes']} conexões TCP")
+    print(f"Novo (pool + fila):       {total} msgs em {novo['segundos']:.2f}s, {novo['conexoes']} conexões TCP, "
+          f"{s['requisicoes']} requisições ({s['agrupadas']} mensagens agrupadas)")
+    print(f"Entregues: {novo['entregues']}  ordem por chat: {novo['em_ordem']}  limites respeitados: {novo['limites']}")
+    ok = novo["entregues"] and novo["em_ordem"] and novo["limites"] and novo["conexoes"] <= 4
+    ok = envio_global_limitado() and ok
+    ok = agrupamento() and ok
+    ok = retries() and ok
+    ok = erro_inesperado() and ok
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 300) else 1)
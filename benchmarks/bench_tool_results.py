@@ -0,0 +1,175 @@
+"""
+Tokens e latência da 2a chamada (RAG) com o resultado das ferramentas em texto x forma compacta
+(tool_results.compactar).
+
+1. Corpus de chamadas reais às ferramentas, numa cópia do clinic.db com agenda recorrente (listas
+   cheias): para cada uma, tokens estimados do functionResponse e do prompt inteiro da 2a chamada,
+   antes (texto) e depois (a menor forma).
+2. Latência da 2a chamada pelo agent.process_web_message, com todas as ferramentas no modo "llm"
+   (sempre há 2a chamada) e o modelo falso cobrando --ms-por-mil-tokens de leitura do prompt.
+   O modelo falso não tem prefill de verdade: a diferença de latência aqui é a diferença de tokens
+   vezes esse custo (mais o custo, real, de montar a forma compacta).
+
+Uso: python -m benchmarks.bench_tool_results [--ms-por-mil-tokens 40] [--repeticoes 20]
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+import database_tools
+import tool_results
+from benchmarks._common import copy_clinic_db, silence_stdout
+from benchmarks.fake_model import FakeGeminiModel, Latencia, decidir
+from history_compaction import estimate_contents_tokens
+
+CHAT_ID = "BENCH_CHAT"
+
+# (mensagem que leva o modelo falso à ferramenta, para a parte de latência)
+MENSAGENS = [
+    "Tem horário de Cardiologia?",
+    "Quero fazer exame de sangue",
+    "Quais são os meus agendamentos?",
+    "Quero ver os meus exames",
+    "Quais exames vocês fazem?",
+    "Quero o ID 999999, meu nome é Ana Teste",
+    "Quero cancelar o agendamento 999999",
+]
+
+
+def _preparar() -> Dict[str, Any]:
+    from schedule_engine import adicionar_modelo
+
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    for (tipo, dono) in (("consulta", 1), ("consulta", 2), ("consulta", 3), ("exame", 1), ("exame", 2), ("exame", 3)):
+        for dia_semana in range(7):
+            adicionar_modelo(database_tools.DATABASE_FILE, tipo, dono, dia_semana, "07:00", "19:00", 20)
+    # Alguns agendamentos do chat de teste, para as listas e os cancelamentos
+    consultas = database_tools.tool_consultar_horarios_disponiveis("Cardiologia", limite=25).dados["itens"]
+    exames = database_tools.tool_consultar_horarios_exames("Sangue", limite=25).dados["itens"]
+    for (horario_id, _, _) in consultas[:4]:
+        database_tools.tool_marcar_agendamento(horario_id, "Ana Teste", CHAT_ID)
+    for (horario_id, _, _) in exames[:3]:
+        database_tools.tool_marcar_exame(horario_id, "Ana Teste", CHAT_ID)
+    return {"consulta_livre": consultas[10][0], "consulta_ocupada": consultas[0][0], "exame_livre": exames[10][0]}
+
+
+def corpus(ids: Dict[str, Any]) -> List[tuple]:
+    """(nome do caso, ferramenta, args) cobrindo listas, vazios, confirmações e erros."""
+    agendamento = database_tools.tool_listar_meus_agendamentos(CHAT_ID).dados["itens"][0][0]
+    return [
+        ("horarios consulta (10)", "tool_consultar_horarios_disponiveis", {"especialidade": "Cardiologia"}),
+        ("horarios consulta (25)", "tool_consultar_horarios_disponiveis", {"especialidade": "Cardiologia", "limite": 25}),
+        ("horarios consulta tarde", "tool_consultar_horarios_disponiveis", {"especialidade": "Pediatria", "periodo": "tarde"}),
+        ("horarios consulta vazio", "tool_consultar_horarios_disponiveis", {"especialidade": "Cardiologia", "data_inicio": "2001-01-01", "data_fim": "2001-01-02"}),
+        ("horarios exame (10)", "tool_consultar_horarios_exames", {"tipo_exame": "Sangue"}),
+        ("horarios exame (25)", "tool_consultar_horarios_exames", {"tipo_exame": "Sangue", "limite": 25}),
+        ("meus agendamentos", "tool_listar_meus_agendamentos", {"telegram_chat_id": CHAT_ID}),
+        ("meus exames", "tool_listar_meus_exames_agendados", {"telegram_chat_id": CHAT_ID}),
+        ("meus agendamentos vazio", "tool_listar_meus_agendamentos", {"telegram_chat_id": "OUTRO"}),
+        ("exames disponiveis", "tool_consultar_exames_disponiveis", {}),
+        ("info endereco", "tool_obter_info_clinica", {"topic": "endereco"}),
+        ("marcar ok", "tool_marcar_agendamento", {"horario_id": ids["consulta_livre"], "nome_paciente": "Ana Teste", "telegram_chat_id": CHAT_ID}),
+        ("marcar ocupado", "tool_marcar_agendamento", {"horario_id": ids["consulta_ocupada"], "nome_paciente": "Ana Teste", "telegram_chat_id": CHAT_ID}),
+        ("marcar inexistente", "tool_marcar_agendamento", {"horario_id": 999999, "nome_paciente": "Ana Teste", "telegram_chat_id": CHAT_ID}),
+        ("marcar exame ok", "tool_marcar_exame", {"horario_exame_id": ids["exame_livre"], "nome_paciente": "Ana Teste", "telegram_chat_id": CHAT_ID}),
+        ("cancelar ok", "tool_cancelar_agendamento", {"agendamento_id": agendamento, "telegram_chat_id": CHAT_ID}),
+        ("cancelar de novo", "tool_cancelar_agendamento", {"agendamento_id": agendamento, "telegram_chat_id": CHAT_ID}),
+        ("cancelar inexistente", "tool_cancelar_agendamento", {"agendamento_id": 999999, "telegram_chat_id": CHAT_ID}),
+    ]
+
+
+def tokens(casos: List[tuple]) -> Dict[str, int]:
+    import agent
+
+    # Prefixo sem cache de contexto: o system prompt conta no prompt, como sempre
+    prefixo = agent.PrefixoPreparado(None, None, (agent.PREFIXO.mensagem_sistema,), {}, [], "compartilhado", 0)
+    totais = {"antes": 0, "depois": 0, "prompt_antes": 0, "prompt_depois": 0}
+    print(f"{'caso':<26} {'resultado: texto':>17} {'compacto':>9} {'prompt RAG: antes':>18} {'depois':>7}  forma")
+    for (nome, tool_name, args) in casos:
+        resultado = agent.AVAILABLE_TOOLS[tool_name](**args)
+        contents = agent._build_contents("mensagem do paciente", [], prefixo)
+        primeira = decidir("mensagem")  # Só o tamanho importa: um JSON de ação típico
+        linha = {}
+        for (chave, compacto) in (("antes", False), ("depois", True)):
+            tool_results.TOOL_RESULT_COMPACTO = compacto
+            rag = agent._build_rag_contents(contents, primeira, [(tool_name, args, resultado)])
+            linha[chave] = estimate_contents_tokens(rag[-1:])
+            linha[f"prompt_{chave}"] = estimate_contents_tokens(rag)
+            linha[f"forma_{chave}"] = "compacta" if isinstance(rag[-1]["parts"][0]["functionResponse"]["response"], dict) else "texto"
+        for chave in totais:
+            totais[chave] += linha[chave]
+        print(f"{nome:<26} {linha['antes']:>17} {linha['depois']:>9} {linha['prompt_antes']:>18} "
+              f"{linha['prompt_depois']:>7}  {linha['forma_depois']}")
+    print(f"{'TOTAL':<26} {totais['antes']:>17} {totais['depois']:>9} {totais['prompt_antes']:>18} {totais['prompt_depois']:>7}")
+    print(f"functionResponse: {100 * (1 - totais['depois'] / totais['antes']):.0f}% menos tokens; "
+          f"prompt da 2a chamada: {100 * (1 - totais['prompt_depois'] / totais['prompt_antes']):.0f}% menos")
+    return totais
+
+
+class _ModeloCronometrado(FakeGeminiModel):
+    """Guarda o tempo de cada 2a chamada (a que traz o functionResponse), por ferramenta."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.segundas: Dict[str, List[float]] = {}
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        inicio = time.perf_counter()
+        resposta = super().generate_content(contents, stream=stream, **kwargs)
+        for parte in contents[-1].get("parts", []):
+            if "functionResponse" in parte:
+                nome = parte["functionResponse"]["name"]
+                self.segundas.setdefault(nome, []).append((time.perf_counter() - inicio) * 1000)
+        return resposta
+
+
+def latencia(ms_por_mil_tokens: float, repeticoes: int) -> Dict[str, float]:
+    import agent
+    import response_templates
+
+    for tool_name in response_templates.TOOL_RENDER_MODE:
+        response_templates.TOOL_RENDER_MODE[tool_name] = "llm"  # Sempre com a 2a chamada
+    tempos = {}
+    for (chave, compacto) in (("antes", False), ("depois", True)):
+        tool_results.TOOL_RESULT_COMPACTO = compacto
+        modelo = _ModeloCronometrado(Latencia("0"), ms_por_mil_tokens=ms_por_mil_tokens)
+        agent.model = modelo
+        with silence_stdout():
+            for _ in range(repeticoes):
+                for mensagem in MENSAGENS:
+                    agent.process_web_message(mensagem, [], chat_id=CHAT_ID)
+        tempos[chave] = modelo.segundas
+
+    print(f"\n2a chamada pelo agent ({len(MENSAGENS)} mensagens x {repeticoes}, {ms_por_mil_tokens:.0f}ms por 1000 tokens "
+          f"de prompt), mediana por ferramenta:")
+    somas = {"antes": 0.0, "depois": 0.0}
+    for tool_name in sorted(tempos["antes"]):
+        medianas = {chave: statistics.median(tempos[chave][tool_name]) for chave in somas}
+        for chave in somas:
+            somas[chave] += medianas[chave]
+        print(f"  {tool_name:<40} {medianas['antes']:>7.2f}ms -> {medianas['depois']:>7.2f}ms")
+    return somas
+
+
+def run(ms_por_mil_tokens: float = 40, repeticoes: int = 20) -> bool:
+    logging.disable(logging.CRITICAL)
+    with silence_stdout():
+        ids = _preparar()
+        casos = corpus(ids)
+    totais = tokens(casos)
+    somas = latencia(ms_por_mil_tokens, repeticoes)
+    print(f"Estatísticas do compactar(): {tool_results.get_compact_stats()}")
+    ok = totais["depois"] < totais["antes"] and somas["depois"] <= somas["antes"]
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokens e latência do RAG: texto x forma compacta")
+    parser.add_argument("--ms-por-mil-tokens", type=float, default=40)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.ms_por_mil_tokens, args.repeticoes) else 1)
@@ -0,0 +1,184 @@
+"""
+Webhook do Telegram (/webhook/telegram no api.py) com modelo e API do Telegram falsos.
+
+1. O 200 volta na hora, mesmo com o "Gemini" levando LATENCIA_MS por chamada.
+2. Updates reenviados (mesmo update_id) não são processados de novo.
+3. As respostas de cada chat chegam na ordem das mensagens; chats diferentes rodam em paralelo.
+4. Com a fila cheia o webhook responde 503 (o Telegram reenvia depois).
+5. Um chat que manda mensagens rápido demais passa do balde do admission.py: as que sobram são
+   descartadas com 'limitado' (200, sem reenvio), cada uma com o aviso de ocupado para o paciente,
+   e as dos outros chats seguem normais.
+6. O update_id fica pendente até o atendimento terminar: se o handler falhar, ou o dispatcher
+   desligar com a mensagem ainda na fila, o reenvio do mesmo update é processado de novo.
+
+Uso: python -m benchmarks.bench_webhook_ingest [chats] [mensagens_por_chat] [latencia_ms]
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+
+import admission
+import agent
+import database_tools
+import telegram_ingest
+import telegram_sender
+from benchmarks._common import copy_clinic_db, percentile, silence_stdout
+from benchmarks.telegram_standin import TelegramStandIn
+
+
+class _Resposta:
+    def __init__(self, text):
+        self.text = text
+
+
+class EchoModel:
+    """Modelo falso que responde 'eco: <mensagem>' depois de 'latencia_s'."""
+
+    def __init__(self, latencia_s: float):
+        self.latencia_s = latencia_s
+
+    @staticmethod
+    def _responder(contents):
+        texto = contents[-1]["parts"][0]["text"]
+        return _Resposta(json.dumps({"acao": "RESPONDER_AO_USUARIO",
+                                     "payload_acao": {"resposta_para_usuario": f"eco: {texto}"}}))
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self.latencia_s)
+        return self._responder(contents)
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.latencia_s)
+        return self._responder(contents)
+
+
+def _update(update_id: int, chat_id: int, texto: str) -> dict:
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "chat": {"id": chat_id}, "text": texto}}
+
+
+def backpressure() -> bool:
+    """Fila de 1 lugar com um worker travado: o segundo update do mesmo chat é recusado e pode voltar depois.
+    (Um chat novo: os do run() já gastaram fichas do balde da admissão.)"""
+    liberar = threading.Event()
+    dispatcher = telegram_ingest.ChatDispatcher(lambda chat_id, texto: liberar.wait(5), workers=1, max_queue=1)
+    with silence_stdout():
+        s1 = telegram_ingest.handle_update(_update(900001, 90, "a"), dispatcher)
+        time.sleep(0.05)  # O worker pega o primeiro e fica travado
+        s2 = telegram_ingest.handle_update(_update(900002, 90, "b"), dispatcher)
+        s3 = telegram_ingest.handle_update(_update(900003, 90, "c"), dispatcher)
+        liberar.set()
+        dispatcher.join(5)
+        s4 = telegram_ingest.handle_update(_update(900003, 90, "c"), dispatcher)  # Reenvio do Telegram
+        dispatcher.close()
+    print(f"Backpressure: {s1}, {s2}, {s3}, reenvio -> {s4}; stats={dispatcher.get_stats()['rejeitadas_fila_cheia']} "
+          "rejeitada(s)")
+    return (s1, s2, s3, s4) == ("enfileirado", "enfileirado", "fila_cheia", "enfileirado")
+
+
+def pendentes() -> bool:
+    """Falha no handler e desligamento com fila: o update_id é liberado e o reenvio entra de novo."""
+    def handler(chat_id, texto):
+        if texto == "falha":
+            raise RuntimeError("falha de teste")
+        liberar.wait(5)
+
+    liberar = threading.Event()
+    dispatcher = telegram_ingest.ChatDispatcher(handler, workers=1)
+    with silence_stdout():
+        telegram_ingest.handle_update(_update(930001, 93, "falha"), dispatcher)
+        dispatcher.join(5)
+        falhou = telegram_ingest.handle_update(_update(930001, 93, "falha"), dispatcher)
+        dispatcher.join(5)
+        liberar.set()
+        telegram_ingest.handle_update(_update(930002, 93, "ok"), dispatcher)
+        dispatcher.join(5)
+        atendido = telegram_ingest.handle_update(_update(930002, 93, "ok"), dispatcher)
+        liberar.clear()
+        telegram_ingest.handle_update(_update(930003, 93, "travado"), dispatcher)
+        time.sleep(0.05)  # O worker pega o 930003 e fica travado; o 930004 fica na fila
+        telegram_ingest.handle_update(_update(930004, 93, "na fila"), dispatcher)
+        dispatcher.close(timeout=0.1)
+        liberar.set()
+        descartado = telegram_ingest.handle_update(_update(930004, 93, "na fila"), dispatcher)
+        dispatcher.close()
+    print(f"Pendentes: reenvio depois de falha -> {falhou}; depois de atendido -> {atendido}; "
+          f"descartado ao desligar -> {descartado}")
+    return (falhou, atendido, descartado) == ("enfileirado", "duplicado", "enfileirado")
+
+
+def limite_por_chat(telegram: TelegramStandIn, mensagens: int = 20) -> bool:
+    """Um chat manda 'mensagens' de uma vez: só a rajada do balde entra; outro chat entra normalmente."""
+    dispatcher = telegram_ingest.ChatDispatcher(lambda chat_id, texto: None, workers=1)
+    with silence_stdout():
+        status = [telegram_ingest.handle_update(_update(910000 + i, 91, f"spam {i}"), dispatcher)
+                  for i in range(mensagens)]
+        outro = telegram_ingest.handle_update(_update(920000, 92, "oi"), dispatcher)
+        dispatcher.close()
+        telegram_sender.get_telegram_sender().flush(30)
+    rajada = int(admission.ADMISSAO_CHAT_RAJADA)
+    # O telegram_sender junta mensagens seguidas do mesmo chat: conta as ocorrências do aviso
+    avisos = sum(texto.count(admission.RESPOSTA_OCUPADO) for (_, texto) in telegram.por_chat().get(91, []))
+    print(f"Limite por chat: {mensagens} mensagens seguidas -> {status.count('enfileirado')} enfileiradas, "
+          f"{status.count('limitado')} limitadas (rajada {rajada}), {avisos} avisos de ocupado; outro chat: {outro}")
+    return status.count("enfileirado") == rajada and status.count("limitado") == mensagens - rajada \
+        and avisos == mensagens - rajada and outro == "enfileirado"
+
+
+def run(chats: int = 20, por_chat: int = 5, latencia_ms: float = 200) -> bool:
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    agent.model = EchoModel(latencia_ms / 1000)
+    with silence_stdout():
+        import api  # Depois de apontar o DATABASE_FILE para a cópia (o api.py roda as migrações ao importar)
+    client = api.app.test_client()
+
+    with TelegramStandIn() as telegram:
+        telegram_sender._sender = telegram_sender.TelegramSender(
+            "TESTE", api_base=telegram.base_url, chat_rate=100, chat_burst=100, global_rate=1000)
+
+        acks, status = [], {}
+        update_id = 1000
+        inicio = time.perf_counter()
+        with silence_stdout():
+            for i in range(por_chat):
+                for chat_id in range(1, chats + 1):
+                    update_id += 1
+                    corpo = _update(update_id, chat_id, f"mensagem {i}")
+                    for _ in range(2 if i == 0 else 1):  # A 1a mensagem de cada chat chega duplicada
+                        t0 = time.perf_counter()
+                        resposta = client.post("/webhook/telegram", json=corpo)
+                        acks.append((time.perf_counter() - t0) * 1000)
+                        s = resposta.get_json().get("status", resposta.status_code)
+                        status[s] = status.get(s, 0) + 1
+            telegram_ingest.get_dispatcher().join(60)
+            telegram_sender.get_telegram_sender().flush(30)
+        total_s = time.perf_counter() - inicio
+
+        recebidas = telegram.por_chat()
+        em_ordem = all([t for (_, t) in recebidas.get(c, [])] ==
+                       [f"eco: mensagem {i}" for i in range(por_chat)] for c in range(1, chats + 1))
+        limitado_ok = limite_por_chat(telegram)
+
+    stats = telegram_ingest.get_ingest_stats()
+    serial_s = chats * por_chat * latencia_ms / 1000
+    print(f"{chats * por_chat} mensagens ({chats} chats), modelo {latencia_ms:.0f}ms por chamada")
+    print(f"Ack do webhook: p50={percentile(acks, 50):.1f}ms p99={percentile(acks, 99):.1f}ms  status={status}")
+    print(f"Respostas entregues em {total_s:.2f}s (em série seriam {serial_s:.1f}s); ordem por chat: {em_ordem}")
+    print(f"Fila: máx={stats['fila_max']} espera média={stats['espera_media_s'] * 1000:.0f}ms "
+          f"máx={stats['espera_max_s'] * 1000:.0f}ms")
+
+    ok = em_ordem and status.get("duplicado") == chats and status.get("enfileirado") == chats * por_chat
+    ok = ok and percentile(acks, 99) < latencia_ms
+    ok = backpressure() and ok
+    ok = pendentes() and ok
+    ok = limitado_ok and ok
+    telegram_ingest.close_dispatcher()
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    args = [float(a) for a in sys.argv[1:]]
+    sys.exit(0 if run(*(int(a) for a in args[:2]), *args[2:3]) else 1)
@@ -0,0 +1,132 @@
+"""
+Verificação das métricas (metrics.py e rota /metrics).
+
+1. Custo no caminho quente: quanto a medição de uma mensagem inteira (todas as etapas,
+   ferramenta, chamadas ao modelo e total) acrescenta, em microssegundos.
+2. Vários processos: sobe o gunicorn com N workers numa cópia do clinic.db e com o modelo
+   falso (benchmarks/fake_app.py), manda mensagens pelo /chat e confere que qualquer worker
+   que atenda o /metrics devolve a soma de TODOS os workers (contagem = mensagens enviadas),
+   num texto válido no formato do Prometheus.
+
+Uso: python -m benchmarks.check_metrics [workers] [mensagens]
+"""
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import database_tools
+import metrics
+from benchmarks._common import REPO_DIR, copy_clinic_db, summarize, time_calls
+
+_LINHA = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*",?)*\})? -?[0-9.e+Inf]+$')
+MENSAGENS = ["Quais exames vocês fazem?", "Quero marcar uma consulta", "Cardiologia", "Qual o endereço?"]
+
+
+def custo_hot_path(iterations: int = 20_000) -> bool:
+    metrics.METRICS_FLUSH_S = 0  # Sem a thread de publicação neste teste
+    database_tools.DATABASE_FILE = copy_clinic_db()  # O retrato final (atexit) vai para a cópia
+
+    def mensagem():
+        m = metrics.MedicaoMensagem()
+        for etapa in ("roteador", "prompt", "llm_1", "json", "ferramenta", "template", "llm_2"):
+            m.etapa(etapa)
+        m.llm()
+        m.llm()
+        m.ferramenta("tool_consultar_horarios_disponiveis", 0.001, "[ID 1: ...]")
+        m.caminho = "rag"
+        m.concluir()
+
+    lat = summarize(time_calls(mensagem, iterations))
+    ok = lat["p50_us"] < 50
+    print(f"Medição de uma mensagem completa: p50={lat['p50_us']:.1f}us p99={lat['p99_us']:.1f}us "
+          f"(chamada ao modelo ~1s, ferramenta ~0.1ms): {'OK' if ok else 'CARO DEMAIS'}")
+    return ok
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _valores(texto: str, nome: str) -> dict:
+    """{labels: valor} das linhas 'nome{labels} valor'."""
+    return {m.group(1) or "": float(m.group(2))
+            for m in re.finditer(rf"^{nome}(\{{.*?\}})? (\S+)$", texto, re.MULTILINE)}
+
+
+def multiprocesso(workers: int = 3, mensagens: int = 60) -> bool:
+    if shutil.which("gunicorn") is None:
+        print("gunicorn não instalado: pulando o teste com vários processos")
+        return True
+    # O DATABASE_FILE é relativo ('clinic.db'): o gunicorn roda dentro do diretório da cópia
+    pasta = os.path.dirname(copy_clinic_db())
+    porta = _porta_livre()
+    # Todas as mensagens saem de 127.0.0.1: sem o balde por IP do admission.py
+    env = {**os.environ, "FAKE_LATENCIA": "fixa:20", "METRICS_FLUSH_S": "0.5", "PYTHONWARNINGS": "ignore",
+           "ADMISSAO_IP_TAXA": "0"}
+    log = tempfile.TemporaryFile()
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "benchmarks.fake_app:app", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+         "--pythonpath", REPO_DIR, "--chdir", pasta, "-w", str(workers), "-b", f"127.0.0.1:{porta}"],
+        env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{porta}"
+    try:
+        for _ in range(300):
+            try:
+                requests.get(base, timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.1)
+
+        def enviar(i: int) -> int:
+            return requests.post(f"{base}/chat", json={"message": MENSAGENS[i % len(MENSAGENS)]}, timeout=30).status_code
+
+        with ThreadPoolExecutor(max_workers=workers * 4) as pool:
+            status = list(pool.map(enviar, range(mensagens)))
+        time.sleep(1.5)  # Dá tempo de todos os workers publicarem o retrato
+
+        # Várias leituras caem em workers diferentes: todas devem ver a soma de todos
+        leituras = [requests.get(f"{base}/metrics", timeout=10) for _ in range(workers * 2)]
+        texto = leituras[-1].text
+        contagens = [sum(_valores(r.text, "clinica_mensagem_segundos_count").values()) for r in leituras]
+        processos = [_valores(r.text, "clinica_metricas_processos").get("", 0) for r in leituras]
+        invalidas = [l for l in texto.splitlines() if l and not l.startswith("#") and not _LINHA.match(l)]
+
+        ok_status = status.count(200) == mensagens
+        ok_soma = all(c == mensagens for c in contagens)
+        ok_processos = all(p == workers for p in processos)
+        ok_formato = not invalidas and leituras[-1].headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        print(f"{workers} workers, {mensagens} mensagens no /chat ({status.count(200)} com 200)")
+        print(f"  clinica_mensagem_segundos_count em {len(leituras)} leituras do /metrics: {contagens}: {ok_soma}")
+        print(f"  processos somados: {processos}: {ok_processos}")
+        print(f"  formato do Prometheus válido: {ok_formato} {invalidas[:3]}")
+        print("  caminhos: " + ", ".join(f"{k} {v:.0f}" for (k, v) in _valores(texto, "clinica_mensagem_segundos_count").items()))
+        print(f"  chamadas ao modelo: {_valores(texto, 'clinica_llm_chamadas_total')}, "
+              f"ferramentas: {len(_valores(texto, 'clinica_ferramenta_segundos_count'))} tipo(s)")
+        return ok_status and ok_soma and ok_processos and ok_formato
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=30)
+        if servidor.returncode not in (0, -15):
+            log.seek(0)
+            print(log.read().decode(errors="replace")[-2000:])
+
+
+def run(workers: int = 3, mensagens: int = 60) -> bool:
+    ok = custo_hot_path() and multiprocesso(workers, mensagens)
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    sys.exit(0 if run(*argumentos) else 1)
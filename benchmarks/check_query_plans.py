@@ -0,0 +1,141 @@
+"""
+Verificação de planos de consulta: semeia um banco temporário com 100 mil horários
+e confirma, via EXPLAIN QUERY PLAN, que as consultas REAIS das ferramentas usam índice
+nas tabelas grandes (nenhum 'SCAN' completo em horários ou agendamentos).
+
+As consultas são capturadas com o trace callback do sqlite3 enquanto as ferramentas rodam,
+então o script continua válido mesmo que o SQL das ferramentas mude. Antes de cada ferramenta o
+índice de horários (availability_index) e o cache de referência são descartados: as buscas de
+horários leem da memória, e sem isso as consultas de carga do índice nunca seriam conferidas.
+Uma ferramenta que não roda nenhuma consulta numa tabela grande também é falha (nada conferido).
+
+A mesma verificação roda no pytest (tests/test_query_plans.py).
+
+Uso: python -m benchmarks.check_query_plans [num_horarios]
+"""
+import os
+import random
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+import database_pool
+import database_tools
+from availability_index import get_availability_index
+from benchmarks._common import silence_stdout
+from database_setup import setup_database
+from reference_cache import get_reference_cache
+
+BIG_TABLES = {"horarios_disponiveis", "horarios_exames", "agendamentos", "agendamentos_exames"}
+
+TOOL_CALLS = {
+    "tool_consultar_horarios_disponiveis": lambda: database_tools.tool_consultar_horarios_disponiveis("Cardio"),
+    "tool_consultar_horarios_exames": lambda: database_tools.tool_consultar_horarios_exames("Sangue"),
+    "tool_listar_meus_agendamentos": lambda: database_tools.tool_listar_meus_agendamentos("chat_42"),
+    "tool_listar_meus_exames_agendados": lambda: database_tools.tool_listar_meus_exames_agendados("chat_42"),
+}
+
+
+def seed_database(db_file: str, num_horarios: int) -> None:
+    """Cria o esquema e insere 'num_horarios' horários de consulta e de exame (90% já ocupados)."""
+    with silence_stdout():
+        setup_database(db_file)
+
+    rng = random.Random(42)
+
+    def _seed(conn):
+        for tabela, coluna_fk in (("horarios_disponiveis", "medico_id"), ("horarios_exames", "exame_id")):
+            conn.executemany(
+                f"INSERT INTO {tabela} ({coluna_fk}, data_hora_inicio, status) "
+                f"VALUES (?, datetime('2026-01-01', '+' || ? || ' minutes'), ?)",
+                ((rng.randint(1, 3), i * 30, "agendado" if rng.random() < 0.9 else "disponivel")
+                 for i in range(num_horarios))
+            )
+        conn.executemany(
+            "INSERT INTO agendamentos (horario_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
+            ((rng.randint(1, num_horarios), "Paciente", f"chat_{rng.randint(1, 5000)}")
+             for _ in range(num_horarios // 2))
+        )
+        conn.executemany(
+            "INSERT INTO agendamentos_exames (horario_exame_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
+            ((rng.randint(1, num_horarios), "Paciente", f"chat_{rng.randint(1, 5000)}")
+             for _ in range(num_horarios // 2))
+        )
+
+    database_pool.write_transaction(db_file, _seed)
+    conn = database_pool.get_connection(db_file)
+    conn.execute("ANALYZE")
+
+
+def full_scans(conn, sql: str) -> list:
+    """Retorna as linhas do plano que fazem SCAN sem índice numa das tabelas grandes."""
+    aliases = {}
+    for tabela in BIG_TABLES:
+        # Descobre os aliases usados no SQL (ex: 'horarios_disponiveis h')
+        for trecho in sql.split(tabela)[1:]:
+            palavras = trecho.split()
+            if palavras and palavras[0].isidentifier() and palavras[0].upper() not in ("ON", "WHERE", "JOIN", "SET"):
+                aliases[palavras[0]] = tabela
+        aliases[tabela] = tabela
+
+    ruins = []
+    for (_, _, _, detalhe) in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        partes = detalhe.split()
+        if partes[0] == "SCAN" and partes[1] in aliases and "USING" not in detalhe:
+            ruins.append(detalhe)
+    return ruins
+
+
+def _tabelas_grandes(sql: str) -> bool:
+    return any(tabela in sql for tabela in BIG_TABLES)
+
+
+def query_plans(num_horarios: int = 100_000) -> Dict[str, List[Tuple[str, str, list]]]:
+    """
+    Roda cada ferramenta num banco semeado e devolve, por ferramenta, os SELECTs que tocam as
+    tabelas grandes: (sql, plano, linhas com SCAN completo).
+    """
+    db_file = os.path.join(tempfile.mkdtemp(prefix="clinic_plans_"), "clinic.db")
+    seed_database(db_file, num_horarios)
+    anterior = database_tools.DATABASE_FILE
+    database_tools.DATABASE_FILE = db_file
+
+    conn = database_pool.get_connection(db_file)
+    planos = {}
+    try:
+        for tool_name, call in TOOL_CALLS.items():
+            # Índice e cache frios: a carga deles também é consulta da ferramenta
+            get_availability_index(db_file).invalidate()
+            get_reference_cache(db_file).refresh()
+            capturadas = []
+            conn.set_trace_callback(capturadas.append)
+            try:
+                with silence_stdout():
+                    call()
+            finally:
+                conn.set_trace_callback(None)
+
+            planos[tool_name] = [
+                (sql, " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)), full_scans(conn, sql))
+                for sql in capturadas if sql.lstrip().upper().startswith("SELECT") and _tabelas_grandes(sql)]
+    finally:
+        database_tools.DATABASE_FILE = anterior
+        database_pool.close_all_connections()
+    return planos
+
+
+def run(num_horarios: int = 100_000) -> bool:
+    tudo_ok = True
+    for tool_name, consultas in query_plans(num_horarios).items():
+        if not consultas:
+            tudo_ok = False
+            print(f"[FALHOU] {tool_name}: nenhuma consulta nas tabelas grandes (nada conferido)")
+        for (_, plano, ruins) in consultas:
+            tudo_ok = tudo_ok and not ruins
+            print(f"[{'OK ' if not ruins else 'FALHOU'}] {tool_name}: {plano}")
+    return tudo_ok
+
+
+if __name__ == "__main__":
+    ok = run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,123 @@
+"""
+Verificação do tamanho do resultado das buscas de horários (o texto que vai para o prompt da IA).
+
+Semeia bancos sintéticos de tamanhos crescentes e compara, para "Cardiologia" e para um exame:
+- o despejo antigo (todos os horários livres numa string só), que cresce com o banco;
+- a resposta atual da ferramenta, limitada a HORARIOS_LIMITE_PADRAO horários + nota do cursor.
+
+Depois confere os filtros num banco pequeno:
+- paginar com o cursor percorre todos os horários, sem repetir nem pular;
+- data_inicio/data_fim, periodo e medico só trazem horários que batem com o filtro;
+- filtros inválidos (data, periodo, limite, cursor) viram "Erro: ..." com o status filtro_invalido
+  (vai para a IA explicar ao usuário).
+
+Uso: python -m benchmarks.check_slot_output_size [num_horarios_grande]
+"""
+import re
+import sys
+
+import database_pool
+import database_tools
+from availability_index import get_availability_index
+from benchmarks._common import silence_stdout
+from benchmarks.bench_availability_index import seed
+from reference_cache import get_reference_cache
+
+_ITEM = re.compile(r"\[ID (\d+): (?:(.+?) - )?(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]")
+_CURSOR = re.compile(r"cursor=(\d+)")
+
+# Estimativa grosseira usada no resto do projeto (history_compaction): ~4 caracteres por token
+CHARS_POR_TOKEN = 4
+
+
+def _despejo_antigo(tipo: str, **filtro) -> str:
+    """O que a ferramenta devolvia antes: todos os horários livres, sem limite."""
+    livres = get_availability_index(database_tools.DATABASE_FILE).livres(tipo, **filtro)
+    return "; ".join(f"[ID {i}: {d}]" for (i, _, d) in livres)
+
+
+def tamanhos(num_horarios: int) -> tuple:
+    database_tools.DATABASE_FILE = seed(num_horarios)
+    exame_id = get_reference_cache(database_tools.DATABASE_FILE).exames_por_nome("Sangue")[0]
+    with silence_stdout():
+        antigo = len(_despejo_antigo("consulta", especialidades=["Cardiologia"]))
+        antigo_exame = len(_despejo_antigo("exame", donos=[exame_id]))
+        novo = len(database_tools.tool_consultar_horarios_disponiveis("Cardio"))
+        novo_exame = len(database_tools.tool_consultar_horarios_exames("Sangue"))
+    print(f"{num_horarios:>9} horários | consulta: antes {antigo:>10} chars (~{antigo // CHARS_POR_TOKEN} tokens), "
+          f"agora {novo} | exame: antes {antigo_exame:>9}, agora {novo_exame}")
+    database_pool.close_all_connections()
+    return novo, novo_exame
+
+
+def _quieto(tool, *args, **kwargs) -> str:
+    with silence_stdout():
+        return tool(*args, **kwargs)
+
+
+def filtros() -> bool:
+    database_tools.DATABASE_FILE = seed(3000)
+    cache = get_reference_cache(database_tools.DATABASE_FILE)
+    ok = True
+
+    # Paginação: seguir o cursor até o fim = a lista completa, na mesma ordem
+    esperado = [i for (i, _, _) in get_availability_index(database_tools.DATABASE_FILE).livres(
+        "consulta", especialidades=["Cardiologia"])]
+    vistos, cursor, paginas = [], None, 0
+    while True:
+        resposta = _quieto(database_tools.tool_consultar_horarios_disponiveis, "Cardio", limite=25, cursor=cursor)
+        if resposta.startswith("Desculpe"):
+            break
+        vistos += [int(m[0]) for m in _ITEM.findall(resposta)]
+        paginas += 1
+        proximo = _CURSOR.search(resposta)
+        if not proximo:
+            break
+        cursor = int(proximo.group(1))
+    paginacao = vistos == esperado
+    print(f"Paginação: {paginas} páginas, {len(vistos)} de {len(esperado)} horários, "
+          f"sem repetir nem pular: {paginacao}")
+    ok &= paginacao
+
+    # Janela de datas (data_fim inclusive) + período da tarde; o banco pequeno vai de 01/01 a 02/01/2026
+    resposta = _quieto(database_tools.tool_consultar_horarios_disponiveis, "Cardio",
+                       data_inicio="01/01/2026", data_fim="2026-01-02", periodo="tarde", limite=25)
+    datas = [d for (_, _, d) in _ITEM.findall(resposta)]
+    janela = bool(datas) and all("2026-01-01" <= d[:10] <= "2026-01-02" and 12 <= int(d[11:13]) < 18
+                                 for d in datas)
+    print(f"Datas + período: {len(datas)} horários entre 01 e 02/01 à tarde: {janela}")
+    ok &= janela
+
+    # Médico: só o médico pedido, dentro da especialidade
+    nome = cache.nome_medico(cache.medicos_por_especialidade("Cardio")[0])
+    resposta = _quieto(database_tools.tool_consultar_horarios_disponiveis, "Cardio", medico=nome)
+    medicos = {m for (_, m, _) in _ITEM.findall(resposta)}
+    so_o_medico = medicos == {nome}
+    print(f"Médico: {medicos}: {so_o_medico}")
+    ok &= so_o_medico
+
+    erros = [_quieto(database_tools.tool_consultar_horarios_disponiveis, "Cardio", data_inicio="amanhã"),
+             _quieto(database_tools.tool_consultar_horarios_exames, "Sangue", periodo="madrugada"),
+             _quieto(database_tools.tool_consultar_horarios_disponiveis, "Cardio", limite="dez"),
+             _quieto(database_tools.tool_consultar_horarios_exames, "Sangue", cursor="próxima")]
+    validacao = all(e.startswith("Erro:") and e.dados["status"] == "filtro_invalido" for e in erros)
+    print(f"Filtros inválidos: {erros}: {validacao}")
+    ok &= validacao
+
+    database_pool.close_all_connections()
+    return ok
+
+
+def run(num_horarios: int = 200_000) -> bool:
+    limite_chars = (database_tools.HORARIOS_LIMITE_PADRAO * 60) + 120  # ~60 chars por horário + nota do cursor
+    resultados = [tamanhos(n) for n in (2_000, num_horarios // 10, num_horarios)]
+    # Mesmo tamanho (a menos de nomes/IDs mais longos) com 100x mais horários
+    limitado = all(max(r) <= limite_chars for r in resultados)
+    print(f"Resposta da ferramenta limitada a ~{limite_chars} chars em todos os tamanhos: {limitado}")
+    ok = filtros() and limitado
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000) else 1)
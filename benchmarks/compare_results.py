@@ -0,0 +1,85 @@
+"""
+Compara dois relatórios JSON do teste de carga (benchmarks/load_test.py), por exemplo de dois commits.
+
+Mostra a diferença de todas as métricas numéricas de "resultado" e sai com código 1 se houver
+regressão acima da tolerância (em %) na latência (p50/p95/p99), na vazão ou na taxa de erros.
+
+Uso: python -m benchmarks.compare_results antes.json depois.json [--tolerancia 10]
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List
+
+# Métricas vigiadas: caminho -> +1 se subir é pior, -1 se cair é pior
+VIGIADAS = {
+    "latencia_ms.p50": 1,
+    "latencia_ms.p95": 1,
+    "latencia_ms.p99": 1,
+    "vazao_rps": -1,
+    "taxa_erros": 1,
+}
+
+
+def achatar(dados: Any, prefixo: str = "") -> Dict[str, float]:
+    """{"a": {"b": 1}} -> {"a.b": 1}, só com os valores numéricos."""
+    if isinstance(dados, dict):
+        planos = {}
+        for chave, valor in dados.items():
+            planos.update(achatar(valor, f"{prefixo}{chave}."))
+        return planos
+    if isinstance(dados, (int, float)) and not isinstance(dados, bool):
+        return {prefixo.rstrip("."): float(dados)}
+    return {}
+
+
+def comparar(antes: Dict[str, Any], depois: Dict[str, Any], tolerancia: float = 10.0) -> List[str]:
+    """Imprime a tabela de diferenças e devolve a lista de regressões."""
+    a, d = achatar(antes["resultado"]), achatar(depois["resultado"])
+    print(f"Antes:  commit {antes['meta'].get('commit')} ({antes['meta'].get('data')})")
+    print(f"Depois: commit {depois['meta'].get('commit')} ({depois['meta'].get('data')})")
+    parametros = ("alvo", "rps_alvo", "duracao_alvo_s", "latencia_modelo", "mix", "pensar_ms", "seed")
+    diferentes = [p for p in parametros if antes["meta"].get(p) != depois["meta"].get(p)]
+    if diferentes:
+        print(f"AVISO: parâmetros diferentes entre as execuções: {', '.join(diferentes)}")
+
+    regressoes = []
+    print(f"\n{'métrica':<40} {'antes':>12} {'depois':>12} {'diferença':>10}")
+    for chave in sorted(a.keys() | d.keys()):
+        va, vd = a.get(chave), d.get(chave)
+        if va is None or vd is None:
+            print(f"{chave:<40} {va if va is not None else '-':>12} {vd if vd is not None else '-':>12}")
+            continue
+        variacao = ((vd - va) / va * 100) if va else (0.0 if vd == va else float("inf"))
+        marca = ""
+        sentido = VIGIADAS.get(chave)
+        if sentido and variacao * sentido > tolerancia:
+            marca = "  <- REGRESSÃO"
+            regressoes.append(f"{chave}: {va:.4g} -> {vd:.4g} ({variacao:+.1f}%)")
+        print(f"{chave:<40} {va:>12.4g} {vd:>12.4g} {variacao:>+9.1f}%{marca}")
+    return regressoes
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compara dois relatórios do teste de carga")
+    parser.add_argument("antes")
+    parser.add_argument("depois")
+    parser.add_argument("--tolerancia", type=float, default=10.0, help="Piora máxima aceita, em %%")
+    args = parser.parse_args(argv)
+
+    with open(args.antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(args.depois, encoding="utf-8") as f:
+        depois = json.load(f)
+    regressoes = comparar(antes, depois, args.tolerancia)
+    if regressoes:
+        print(f"\n{len(regressoes)} regressão(ões) acima de {args.tolerancia}%:")
+        for r in regressoes:
+            print(f"  {r}")
+        return 1
+    print(f"\nSem regressões acima de {args.tolerancia}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
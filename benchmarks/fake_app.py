@@ -0,0 +1,39 @@
+"""
+O app de verdade (api.py e asgi.py) com o modelo falso no lugar do Gemini, para subir um servidor
+de verdade nos testes de carga sem gastar cota. O código de produção não conhece o modelo falso:
+ele só entra aqui, trocando o agent.model como os outros benchmarks.
+
+Uso:
+  FAKE_LATENCIA=lognormal:800,0.4 gunicorn benchmarks.fake_app:app -c gunicorn.conf.py
+  FAKE_LATENCIA=lognormal:800,0.4 uvicorn benchmarks.fake_app:asgi_app
+FAKE_FALHAS=indisponivel:0.1,lento:0.05:10 injeta falhas (ver fake_model.Falhas).
+"""
+import os
+
+import agent
+import config
+from benchmarks.fake_model import Falhas, FakeGeminiModel, Latencia
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# O Gemini de verdade não é usado. Sem o warm-up (que importa o SDK numa thread), a 1a mensagem não
+# importa o google.generativeai no prefixo do prompt ao mesmo tempo (o import sairia pela metade)
+config.GEMINI_WARMUP = False
+
+FAKE_LATENCIA = os.getenv("FAKE_LATENCIA", "lognormal:800,0.4")
+FAKE_FALHAS = os.getenv("FAKE_FALHAS", "")
+
+agent.model = FakeGeminiModel(Latencia(FAKE_LATENCIA), falhas=Falhas(FAKE_FALHAS))
+log.warning("Usando o modelo FALSO: nenhuma chamada ao Gemini", extra=campos(latencia=FAKE_LATENCIA, falhas=FAKE_FALHAS))
+
+
+def __getattr__(nome: str):
+    # Importa só o app pedido: o gunicorn usa o Flask (app) e o uvicorn o FastAPI (asgi_app)
+    if nome == "app":
+        from api import app
+        return app
+    if nome == "asgi_app":
+        from asgi import app as asgi_app
+        return asgi_app
+    raise AttributeError(nome)
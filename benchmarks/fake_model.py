@@ -0,0 +1,504 @@
+"""
+Modelo Gemini falso e determinístico, para medir o sistema sem gastar cota da API.
+
+Tem a mesma interface usada pelo agent.py (generate_content / generate_content_async com .text,
+e stream=True devolvendo os trechos do JSON aos poucos, como o SDK)
+e responde com ações JSON roteirizadas a partir da última mensagem do usuário:
+- "quero marcar uma consulta"              -> PEDIR_MAIS_INFO (qual especialidade?)
+- "Cardiologia" / "exame de sangue"        -> CHAMAR_FERRAMENTA de horários
+- "quero o ID 12, meu nome é Ana"          -> CHAMAR_FERRAMENTA de marcação
+- "meus agendamentos" / "cancelar o agendamento 3" -> listar / cancelar
+- "endereço", "convênios", "quais exames"  -> ferramentas de informação
+- vários pedidos na mesma mensagem ("meus agendamentos e meus exames", separados por "e", vírgula
+  ou ";") -> uma ação CHAMAR_FERRAMENTA com a lista "chamadas" (com multiplas_ferramentas=False,
+  só o 1o pedido, como o protocolo antigo de uma ferramenta por ação)
+- 2a chamada (com o resultado das ferramentas) -> RESPONDER_AO_USUARIO com os resultados
+- qualquer outra coisa                      -> RESPONDER_AO_USUARIO (saudação)
+
+A latência de cada chamada segue uma distribuição configurável (ver Latencia), com semente fixa.
+Cada chamada também é serializada como o pedido que iria para a API (contents + declarações das
+ferramentas + nome do cache): stats['bytes_enviados'] soma os bytes. Como o SDK, ferramentas passadas
+como funções são convertidas em declarações a cada chamada. O prompt_prefix.py usa o SDK de verdade
+(to_function_library, CachedContent.create, GenerativeModel.from_cached_content): dentro de
+sdk_falso(), esses três são trocados por fora e o cache de contexto fica no FakeGeminiModel. Sem o
+sdk_falso(), o modelo falso não tem model_name e o prefixo cai no modo compartilhado (sem rede).
+
+Falhas injetadas (ver Falhas), com os mesmos nomes de exceção do google.api_core, e o timeout de
+request_options respeitado como no SDK (DeadlineExceeded). fora_do_ar=True derruba todas as chamadas.
+capacidade=N atende no máximo N chamadas (sem stream) ao mesmo tempo e as outras esperam a vez, como
+uma cota de throughput da API: acima dela, a fila (e a latência) crescem sem limite.
+
+Uso no código: agent.model = FakeGeminiModel(Latencia("lognormal:800,0.4"), falhas=Falhas("indisponivel:0.1"))
+Uso num servidor de verdade (gunicorn/uvicorn): benchmarks/fake_app.py
+"""
+import asyncio
+import contextlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import unicodedata
+import warnings
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from history_compaction import estimate_contents_tokens
+from prompt_prefix import declaracao_da_ferramenta
+
+ESPECIALIDADES = ["Cardiologia", "Dermatologia", "Pediatria", "Ortopedia", "Neurologia",
+                  "Ginecologia", "Oftalmologia", "Psiquiatria", "Urologia", "Endocrinologia"]
+EXAMES = {"sangue": "Sangue", "ecg": "ECG", "eletrocardiograma": "ECG", "check up": "Check-up", "checkup": "Check-up"}
+
+
+class Latencia:
+    """
+    Distribuição de latência em milissegundos, a partir de uma especificação em texto:
+    - "0" ou "" ........................ sem espera
+    - "fixa:300" ........................ sempre 300ms
+    - "uniforme:100-500" ................ uniforme entre 100 e 500ms
+    - "lognormal:800,0.4" ............... lognormal com mediana 800ms e sigma 0.4 (cauda longa, como a API real)
+    """
+
+    def __init__(self, spec: str = "0", seed: int = 42):
+        self.spec = spec or "0"
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        tipo, _, params = self.spec.partition(":")
+        if tipo in ("0", "nenhuma"):
+            self._amostra = lambda rng: 0.0
+        elif tipo == "fixa":
+            valor = float(params)
+            self._amostra = lambda rng: valor
+        elif tipo == "uniforme":
+            de, ate = (float(v) for v in params.split("-"))
+            self._amostra = lambda rng: rng.uniform(de, ate)
+        elif tipo == "lognormal":
+            mediana, sigma = (float(v) for v in params.split(","))
+            self._amostra = lambda rng: mediana * rng.lognormvariate(0.0, sigma)
+        else:
+            raise ValueError(f"Latência '{spec}' inválida (use fixa:MS, uniforme:MIN-MAX ou lognormal:MEDIANA,SIGMA)")
+
+    def amostra_s(self) -> float:
+        with self._lock:
+            return self._amostra(self._rng) / 1000
+
+    def __repr__(self) -> str:
+        return f"Latencia({self.spec!r})"
+
+
+# Mesmos nomes (e hierarquia) das exceções do google.api_core: o model_client classifica pelo nome
+class ServerError(Exception):
+    pass
+
+
+class ServiceUnavailable(ServerError):
+    pass
+
+
+class DeadlineExceeded(ServerError):
+    pass
+
+
+class TooManyRequests(Exception):
+    pass
+
+
+class ResourceExhausted(TooManyRequests):
+    pass
+
+
+class InvalidArgument(Exception):
+    pass
+
+
+class Falhas:
+    """
+    Falhas sorteadas por chamada, a partir de uma especificação em texto (probabilidades entre 0 e 1):
+    - "indisponivel:0.1" ....... 10% das chamadas: ServiceUnavailable (503) depois de 10% da latência
+    - "limite:0.05" ............ ResourceExhausted (429) na hora
+    - "invalido:0.01" .......... InvalidArgument (400): não adianta tentar de novo
+    - "lento:0.05:10" .......... latência 10x maior (cauda longa; o fator padrão é 10)
+    - "trava:0.01" ............. não responde (até o timeout do request_options, ou TRAVA_S sem ele)
+    Combinações separadas por vírgula: "indisponivel:0.1,lento:0.05".
+    """
+    TIPOS = ("indisponivel", "limite", "invalido", "lento", "trava")
+
+    def __init__(self, spec: str = "", seed: int = 7):
+        self.spec = spec or ""
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.regras: List[Tuple[str, float, float]] = []
+        for parte in filter(None, (p.strip() for p in self.spec.split(","))):
+            tipo, _, resto = parte.partition(":")
+            valores = resto.split(":")
+            if tipo not in self.TIPOS or not valores[0]:
+                raise ValueError(f"Falha '{parte}' inválida (use {', '.join(self.TIPOS)} com a probabilidade, ex: indisponivel:0.1)")
+            self.regras.append((tipo, float(valores[0]), float(valores[1]) if len(valores) > 1 else 10.0))
+
+    def sortear(self) -> Tuple[Optional[str], float]:
+        """(tipo da falha ou None, fator do 'lento')."""
+        if not self.regras:
+            return None, 1.0
+        with self._lock:
+            sorteio = self._rng.random()
+        acumulado = 0.0
+        for (tipo, probabilidade, fator) in self.regras:
+            acumulado += probabilidade
+            if sorteio < acumulado:
+                return tipo, fator
+        return None, 1.0
+
+    def __repr__(self) -> str:
+        return f"Falhas({self.spec!r})"
+
+
+class _BibliotecaFalsa:
+    """Ferramentas já convertidas (como o FunctionLibrary do SDK)."""
+
+    def __init__(self, declaracoes: List[Dict[str, Any]]):
+        self.declaracoes = declaracoes
+
+
+def _declaracoes(tools) -> List[Dict[str, Any]]:
+    if isinstance(tools, _BibliotecaFalsa):
+        return tools.declaracoes
+    if hasattr(tools, "to_proto"):  # FunctionLibrary do SDK (fora do sdk_falso())
+        return [type(t).to_dict(t) for t in tools.to_proto()]
+    return [declaracao_da_ferramenta(f) for f in tools or []]  # Como o SDK faz a cada chamada
+
+
+# --- SDK falso: o que o prompt_prefix usa do google.generativeai, trocado por fora ---
+
+_numeros = itertools.count(1)
+_modelos: "weakref.WeakValueDictionary[str, FakeGeminiModel]" = weakref.WeakValueDictionary()
+_sdk_lock = threading.Lock()
+_sdk_ativo = 0
+
+
+class _CacheFalso:
+    def __init__(self, modelo: "FakeGeminiModel", name: str):
+        self.modelo = modelo
+        self.name = name
+
+
+def _converter_falso(ferramentas) -> _BibliotecaFalsa:
+    return _BibliotecaFalsa([declaracao_da_ferramenta(f) for f in ferramentas])
+
+
+def _criar_cache_falso(cls, model: str, *, contents=None, tools=None, ttl=None, **kwargs) -> _CacheFalso:
+    modelo = _modelos[model]
+    return _CacheFalso(modelo, modelo.criar_cache(contents, tools))
+
+
+def _do_cache_falso(cls, cached_content: _CacheFalso, **kwargs) -> "_ModeloComCache":
+    return _ModeloComCache(cached_content.modelo, cached_content.name)
+
+
+@contextlib.contextmanager
+def sdk_falso():
+    """
+    Troca to_function_library, CachedContent.create e GenerativeModel.from_cached_content do SDK
+    pelos do modelo falso enquanto durar o bloco (o prompt_prefix.py não sabe do modelo falso).
+    """
+    global _sdk_ativo
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # Aviso de descontinuação do google.generativeai
+        import google.generativeai as genai
+        from google.generativeai import caching
+        from google.generativeai.types import content_types
+
+    trocas = [(content_types, "to_function_library", _converter_falso),
+              (caching.CachedContent, "create", classmethod(_criar_cache_falso)),
+              (genai.GenerativeModel, "from_cached_content", classmethod(_do_cache_falso))]
+    originais = [(alvo, nome, alvo.__dict__[nome]) for (alvo, nome, _) in trocas]
+    with _sdk_lock:
+        for alvo, nome, falso in trocas:
+            setattr(alvo, nome, falso)
+        _sdk_ativo += 1
+    try:
+        yield
+    finally:
+        with _sdk_lock:
+            _sdk_ativo -= 1
+            if not _sdk_ativo:
+                for alvo, nome, original in originais:
+                    setattr(alvo, nome, original)
+
+
+class _Resposta:
+    def __init__(self, text: str):
+        self.text = text
+
+
+# stream=True: o JSON sai em trechos de TAMANHO_TRECHO caracteres. O 1o trecho chega depois de
+# FRACAO_PRIMEIRO_TRECHO da latência sorteada e o resto dela se divide entre os demais.
+TAMANHO_TRECHO = 16
+FRACAO_PRIMEIRO_TRECHO = 0.3
+
+
+def _trechos(texto: str, espera: float) -> List[Tuple[float, str]]:
+    """[(pausa antes do trecho, trecho)], somando 'espera' no total."""
+    pedacos = [texto[i:i + TAMANHO_TRECHO] for i in range(0, len(texto), TAMANHO_TRECHO)] or [""]
+    resto = espera * (1 - FRACAO_PRIMEIRO_TRECHO) / max(1, len(pedacos) - 1)
+    return [(espera * FRACAO_PRIMEIRO_TRECHO if i == 0 else resto, p) for (i, p) in enumerate(pedacos)]
+
+
+def _stream(texto: str, espera: float, erro: Exception = None) -> Iterator[_Resposta]:
+    if erro is not None:
+        # Como no SDK, a falha de uma chamada em stream aparece ao ler o 1o trecho
+        time.sleep(espera)
+        raise erro
+    for pausa, pedaco in _trechos(texto, espera):
+        time.sleep(pausa)
+        yield _Resposta(pedaco)
+
+
+class _StreamAsync:
+    """Como o AsyncGenerateContentResponse do SDK: 'async for trecho in resposta'."""
+
+    def __init__(self, texto: str, espera: float, erro: Exception = None):
+        self._trechos = _trechos(texto, espera) if erro is None else []
+        self._espera, self._erro = espera, erro
+
+    async def __aiter__(self):
+        if self._erro is not None:
+            await asyncio.sleep(self._espera)
+            raise self._erro
+        for pausa, pedaco in self._trechos:
+            await asyncio.sleep(pausa)
+            yield _Resposta(pedaco)
+
+
+def _normalizar(texto: str) -> str:
+    sem_acento = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in sem_acento if not unicodedata.combining(c))
+
+
+def _acao(acao: str, **payload) -> str:
+    return json.dumps({"acao": acao, "payload_acao": payload}, ensure_ascii=False)
+
+
+def _ferramenta(tool_name: str, **tool_args) -> str:
+    return _acao("CHAMAR_FERRAMENTA", tool_name=tool_name, tool_args=tool_args)
+
+
+# Separa os pedidos de uma mensagem ("é" não é "e": "meu nome é Ana" não se divide)
+_SEPARADOR_DE_PEDIDOS = re.compile(r"\s*(?:[,;]|\be\b|\btamb[eé]m\b)\s*", re.IGNORECASE)
+
+
+def decidir(texto: str, multiplas: bool = True) -> str:
+    """
+    Ação JSON que o modelo falso devolve para a mensagem do usuário (1a chamada). Quando cada parte
+    da mensagem pede uma ferramenta diferente, todas vão numa ação só (lista "chamadas").
+    """
+    if multiplas:
+        acoes = [json.loads(_decidir_um(parte)) for parte in _SEPARADOR_DE_PEDIDOS.split(texto) if parte.strip()]
+        chamadas = []
+        for acao in acoes:
+            if acao["acao"] != "CHAMAR_FERRAMENTA":
+                chamadas = []  # Parte sem ferramenta (pergunta, saudação): decide pela mensagem inteira
+                break
+            if acao["payload_acao"] not in chamadas:
+                chamadas.append(acao["payload_acao"])
+        if len(chamadas) > 1:
+            return _acao("CHAMAR_FERRAMENTA", chamadas=chamadas)
+    return _decidir_um(texto)
+
+
+def _decidir_um(texto: str) -> str:
+    t = _normalizar(texto)
+    exame = "exame" in t or any(e in t for e in EXAMES)
+
+    cancelar = re.search(r"cancel\w* (?:o |a )?(?:agendamento|consulta|exame)?\s*(?:id )?(\d+)", t)
+    if cancelar:
+        if exame:
+            return _ferramenta("tool_cancelar_exame", agendamento_exame_id=int(cancelar.group(1)))
+        return _ferramenta("tool_cancelar_agendamento", agendamento_id=int(cancelar.group(1)))
+
+    marcar = re.search(r"\bid (\d+)", t)
+    if marcar:
+        nome = re.search(r"meu nome (?:é|e) ([^,.!?]+)", texto, re.IGNORECASE)
+        if not nome:
+            return _acao("PEDIR_MAIS_INFO", pergunta_para_usuario="Qual o seu nome completo?")
+        if exame:
+            return _ferramenta("tool_marcar_exame", horario_exame_id=int(marcar.group(1)),
+                               nome_paciente=nome.group(1).strip())
+        return _ferramenta("tool_marcar_agendamento", horario_id=int(marcar.group(1)),
+                           nome_paciente=nome.group(1).strip())
+
+    if re.search(r"\bmeus (agendamentos|exames)|minhas consultas", t):
+        return _ferramenta("tool_listar_meus_exames_agendados" if exame else "tool_listar_meus_agendamentos")
+
+    for especialidade in ESPECIALIDADES:
+        if _normalizar(especialidade)[:6] in t:
+            return _ferramenta("tool_consultar_horarios_disponiveis", especialidade=especialidade)
+    for termo, tipo_exame in EXAMES.items():
+        if termo in t:
+            return _ferramenta("tool_consultar_horarios_exames", tipo_exame=tipo_exame)
+    if "exames" in t:
+        return _ferramenta("tool_consultar_exames_disponiveis")
+
+    for termo, topic in (("endereco", "endereco"), ("convenio", "convenios_aceitos"), ("funcionamento", "horario_funcionamento")):
+        if termo in t:
+            return _ferramenta("tool_obter_info_clinica", topic=topic)
+
+    if re.search(r"\b(marcar|agendar|consulta)\b", t):
+        return _acao("PEDIR_MAIS_INFO", pergunta_para_usuario="Claro! Qual especialidade você procura?")
+    return _acao("RESPONDER_AO_USUARIO",
+                 resposta_para_usuario="Olá! Em que posso ajudar com agendamentos ou informações da clínica?")
+
+
+class FakeGeminiModel:
+    """Substituto do genai.GenerativeModel: respostas roteirizadas + latência sorteada."""
+
+    TRAVA_S = 600.0  # Quanto uma chamada 'trava' demora sem timeout no request_options
+
+    def __init__(self, latencia: Latencia = None, ms_por_mil_tokens: float = 0.0, falhas: Falhas = None,
+                 capacidade: int = 0, multiplas_ferramentas: bool = True):
+        self.latencia = latencia or Latencia("0")
+        self.multiplas_ferramentas = multiplas_ferramentas
+        self.falhas = falhas or Falhas()
+        self.fora_do_ar = False
+        # Custo de ler o prompt (prefill): soma ms_por_mil_tokens para cada 1000 tokens estimados do prompt
+        self.ms_por_mil_tokens = ms_por_mil_tokens
+        self._vagas = threading.BoundedSemaphore(capacidade) if capacidade else None
+        self._lock = threading.Lock()
+        self._caches: Dict[str, int] = {}  # nome -> bytes guardados no 'servidor'
+        self.stats: Dict[str, Any] = {"chamadas": 0, "espera_total_s": 0.0, "por_acao": {}, "bytes_enviados": 0,
+                                      "caches_criados": 0, "pedidos": 0, "falhas": {}}
+        self._nome = f"models/falso-{next(_numeros)}"
+        _modelos[self._nome] = self
+
+    @property
+    def model_name(self) -> str:
+        # Só dentro do sdk_falso(): fora dele o CachedContent.create de verdade iria para a rede
+        if not _sdk_ativo:
+            raise AttributeError("model_name (o cache de contexto do modelo falso precisa do sdk_falso())")
+        return self._nome
+
+    def criar_cache(self, contents, ferramentas) -> str:
+        """O lado 'servidor' do CachedContent.create: guarda o prefixo e devolve o nome do cache."""
+        with self._lock:
+            self.stats["caches_criados"] += 1
+            nome = f"cachedContents/falso-{self.stats['caches_criados']}"
+        tamanho = len(self._serializar(contents, ferramentas, None))
+        with self._lock:
+            self._caches[nome] = tamanho
+            self.stats["bytes_enviados"] += tamanho
+        return nome
+
+    def _serializar(self, contents, tools, cache: str) -> bytes:
+        pedido = {"contents": contents, "tools": _declaracoes(tools), "cachedContent": cache}
+        return json.dumps(pedido, ensure_ascii=False, default=str).encode()
+
+    def _contar(self, contents, tools, cache: str) -> None:
+        tamanho = len(self._serializar(contents, tools, cache))
+        with self._lock:
+            self.stats["bytes_enviados"] += tamanho
+
+    def _responder(self, contents: List[Dict[str, Any]]) -> _Resposta:
+        ultima = contents[-1]
+        resultados = [p["functionResponse"] for p in ultima.get("parts", []) if "functionResponse" in p]
+        if resultados:
+            # 2a chamada (RAG): devolve o resultado das ferramentas como resposta
+            respostas = []
+            for resultado in resultados:
+                resposta = resultado.get("response")
+                if not isinstance(resposta, str):
+                    resposta = json.dumps(resposta, ensure_ascii=False)  # Forma compacta (tool_results.compactar)
+                respostas.append(resposta)
+            texto = _acao("RESPONDER_AO_USUARIO", resposta_para_usuario="\n\n".join(respostas))
+        else:
+            texto = decidir(ultima["parts"][0].get("text", ""), self.multiplas_ferramentas)
+        acao = json.loads(texto)["acao"]
+        with self._lock:
+            self.stats["chamadas"] += 1
+            self.stats["por_acao"][acao] = self.stats["por_acao"].get(acao, 0) + 1
+        return _Resposta(texto)
+
+    def _esperar(self, contents) -> float:
+        espera = self.latencia.amostra_s()
+        if self.ms_por_mil_tokens:
+            espera += estimate_contents_tokens(contents) / 1000 * self.ms_por_mil_tokens / 1000
+        with self._lock:
+            self.stats["espera_total_s"] += espera
+        return espera
+
+    def _planejar(self, contents, kwargs) -> Tuple[float, Optional[Exception]]:
+        """(quanto esperar, exceção a levantar depois da espera ou None) para esta chamada."""
+        espera = self._esperar(contents)
+        tipo, fator = ("indisponivel", 1.0) if self.fora_do_ar else self.falhas.sortear()
+        erro = None
+        if tipo == "indisponivel":
+            espera, erro = espera * 0.1, ServiceUnavailable("503 The model is overloaded (falso)")
+        elif tipo == "limite":
+            espera, erro = 0.0, ResourceExhausted("429 Resource has been exhausted (falso)")
+        elif tipo == "invalido":
+            espera, erro = 0.0, InvalidArgument("400 Request contains an invalid argument (falso)")
+        elif tipo == "lento":
+            espera *= fator
+        elif tipo == "trava":
+            espera = self.TRAVA_S
+        timeout = (kwargs.get("request_options") or {}).get("timeout")
+        if erro is None and timeout is not None and espera > timeout:
+            espera, erro, tipo = timeout, DeadlineExceeded("504 Deadline Exceeded (falso)"), tipo or "timeout"
+        with self._lock:
+            self.stats["pedidos"] += 1
+            if erro is not None or tipo:
+                chave = type(erro).__name__ if erro is not None else tipo
+                self.stats["falhas"][chave] = self.stats["falhas"].get(chave, 0) + 1
+        return espera, erro
+
+    def generate_content(self, contents, stream: bool = False, _cache: str = None, **kwargs):
+        self._contar(contents, kwargs.get("tools"), _cache)
+        espera, erro = self._planejar(contents, kwargs)
+        if stream:
+            return _stream(None if erro else self._responder(contents).text, espera, erro)
+        with self._vagas or contextlib.nullcontext():
+            time.sleep(espera)
+        if erro is not None:
+            raise erro
+        return self._responder(contents)
+
+    async def generate_content_async(self, contents, stream: bool = False, _cache: str = None, **kwargs):
+        self._contar(contents, kwargs.get("tools"), _cache)
+        espera, erro = self._planejar(contents, kwargs)
+        if stream:
+            return _StreamAsync(None if erro else self._responder(contents).text, espera, erro)
+        while self._vagas is not None and not self._vagas.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        try:
+            await asyncio.sleep(espera)
+        finally:
+            if self._vagas is not None:
+                self._vagas.release()
+        if erro is not None:
+            raise erro
+        return self._responder(contents)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "por_acao": dict(self.stats["por_acao"]), "falhas": dict(self.stats["falhas"])}
+
+
+class _ModeloComCache:
+    """Modelo ligado a um cache do FakeGeminiModel: o prefixo não vai no pedido (só o nome do cache)."""
+
+    def __init__(self, base: FakeGeminiModel, nome: str):
+        self._base = base
+        self.nome = nome
+
+    def _conferir(self, kwargs) -> None:
+        # Mesma regra do SDK para modelos criados com from_cached_content
+        if kwargs.get("tools") or kwargs.get("system_instruction"):
+            raise ValueError("`tools` e `system_instruction` não podem ser usados com cached_content")
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        self._conferir(kwargs)
+        return self._base.generate_content(contents, stream=stream, _cache=self.nome, **kwargs)
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        self._conferir(kwargs)
+        return await self._base.generate_content_async(contents, stream=stream, _cache=self.nome, **kwargs)
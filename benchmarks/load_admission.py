@@ -0,0 +1,295 @@
+"""
+Teste de sobrecarga do controle de admissão (admission.py) contra o /chat de um servidor local.
+
+O modelo falso tem capacidade limitada (--capacidade chamadas ao mesmo tempo, como a cota da API):
+acima dela, as chamadas esperam a vez. Cada cenário roda sem e com a admissão:
+1. Sobrecarga: pacientes novos chegam (Poisson) a --fator vezes a vazão do modelo. Sem admissão a fila
+   cresce durante todo o teste e a latência junto; com admissão, quem passa do limite + fila recebe 429
+   na hora (com Retry-After) e o p99 de quem foi atendido fica limitado pela espera máxima na fila.
+2. Chat abusivo: um script manda mensagens sem parar (--abusivo conexões) na mesma conversa enquanto
+   pacientes chegam a 1/4 da vazão. Com admissão, o balde da conversa corta o script e os pacientes
+   não sentem.
+Também confere, com vários processos (como os workers do gunicorn), que cada um nunca atende mais
+mensagens ao mesmo tempo do que ADMISSAO_MAX_EM_VOO e que o balde de um chat vale para todos juntos;
+que quem espera na fila entra assim que uma vaga abre (sem polling); e o mesmo limite no entrar_async().
+
+Todas as requisições saem de 127.0.0.1: o balde por IP fica desligado aqui (ADMISSAO_IP_TAXA=0).
+
+Uso: python -m benchmarks.load_admission [--duracao 8] [--capacidade 8] [--fator 2]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+
+import requests
+
+import admission
+from benchmarks._common import percentile
+from benchmarks.fake_model import FakeGeminiModel, Latencia
+from benchmarks.load_test import AmbienteLocal
+
+LATENCIA = "lognormal:200,0.3"
+MENSAGEM = "Quero marcar uma consulta"  # 1 chamada ao modelo
+
+
+def _configurar(ligada: bool, capacidade: int) -> None:
+    admission.ADMISSAO = ligada
+    admission.ADMISSAO_MAX_EM_VOO = capacidade
+    admission.ADMISSAO_FILA = 2 * capacidade
+    admission.ADMISSAO_ESPERA_MAX_S = 2.0
+    admission.ADMISSAO_IP_TAXA = 0
+
+
+def _post(url: str, conversation_id: str = None) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    try:
+        r = requests.post(f"{url}/chat", json={"message": MENSAGEM, "conversation_id": conversation_id}, timeout=120)
+        status, retry_after = r.status_code, r.headers.get("Retry-After")
+    except requests.RequestException:
+        status, retry_after = "erro", None
+    return {"ms": (time.perf_counter() - inicio) * 1000, "status": status, "retry_after": retry_after}
+
+
+def _pacientes(url: str, rps: float, duracao: float, seed: int = 42) -> Dict[str, Any]:
+    """Chegadas de Poisson (carga aberta: quem chega não espera o anterior terminar). Vazão até a última resposta."""
+    rng = random.Random(seed)
+    futuros, inicio, proxima = [], time.perf_counter(), 0.0
+    with ThreadPoolExecutor(max_workers=1000) as pool:
+        while proxima < duracao:
+            atraso = inicio + proxima - time.perf_counter()
+            if atraso > 0:
+                time.sleep(atraso)
+            futuros.append(pool.submit(_post, url))
+            proxima += rng.expovariate(rps)
+        medidas = [f.result() for f in futuros]
+    return _resumo(medidas, time.perf_counter() - inicio)
+
+
+def _resumo(medidas: List[Dict[str, Any]], segundos: float) -> Dict[str, Any]:
+    ok = [m["ms"] for m in medidas if m["status"] == 200]
+    recusadas = [m for m in medidas if m["status"] == 429]
+    return {"enviadas": len(medidas), "ok": len(ok), "recusadas": len(recusadas),
+            "erros": len(medidas) - len(ok) - len(recusadas), "vazao": len(ok) / segundos,
+            "p50": percentile(ok, 50), "p95": percentile(ok, 95), "p99": percentile(ok, 99), "max": max(ok or [0]),
+            "p99_429": percentile([m["ms"] for m in recusadas], 99),
+            "com_retry_after": sum(1 for m in recusadas if m["retry_after"])}
+
+
+def _linha(nome: str, r: Dict[str, Any]) -> None:
+    print(f"  {nome:<16} enviadas {r['enviadas']:>4}  200 {r['ok']:>4}  429 {r['recusadas']:>4}  erros {r['erros']:>3}  "
+          f"vazão {r['vazao']:>5.1f}/s  p50 {r['p50']:>6.0f}ms  p95 {r['p95']:>6.0f}ms  p99 {r['p99']:>6.0f}ms  "
+          f"max {r['max']:>6.0f}ms  | 429: p99 {r['p99_429']:>4.0f}ms, com Retry-After {r['com_retry_after']}")
+
+
+def cenario_sobrecarga(ambiente: AmbienteLocal, capacidade: int, fator: float, duracao: float) -> bool:
+    vazao = capacidade / 0.2  # Mediana de 200ms por chamada
+    print(f"\n1. Sobrecarga: pacientes a {fator * vazao:.0f}/s para uma vazão de ~{vazao:.0f}/s do modelo, por {duracao:.0f}s")
+    resultados = {}
+    for nome, ligada in (("sem admissão", False), ("com admissão", True)):
+        _configurar(ligada, capacidade)
+        resultados[nome] = r = _pacientes(ambiente.base_url, fator * vazao, duracao)
+        _linha(nome, r)
+    sem, com = resultados["sem admissão"], resultados["com admissão"]
+    limite_ms = (admission.ADMISSAO_ESPERA_MAX_S + 1.5) * 1000  # Espera na fila + a chamada mais lenta
+    print(f"  p99 de quem foi atendido: {sem['p99']:.0f}ms -> {com['p99']:.0f}ms (limite {limite_ms:.0f}ms); "
+          f"vazão {sem['vazao']:.1f}/s -> {com['vazao']:.1f}/s")
+    return (com["p99"] < limite_ms and com["p99"] < sem["p99"] and com["erros"] == 0
+            and com["com_retry_after"] == com["recusadas"] and com["vazao"] >= 0.8 * sem["vazao"])
+
+
+def cenario_abusivo(ambiente: AmbienteLocal, capacidade: int, abusivo: int, duracao: float) -> bool:
+    vazao = capacidade / 0.2
+    print(f"\n2. Chat abusivo: {abusivo} conexões sem pausa na mesma conversa + pacientes a {vazao / 4:.0f}/s, por {duracao:.0f}s")
+    resultados = {}
+    for nome, ligada in (("sem admissão", False), ("com admissão", True)):
+        _configurar(ligada, capacidade)
+        parar = threading.Event()
+        do_script: List[Dict[str, Any]] = []
+
+        def script():
+            while not parar.is_set():
+                m = _post(ambiente.base_url, conversation_id="script-abusivo")
+                do_script.append(m)
+                if m["status"] == 429:
+                    time.sleep(0.01)  # Nem o script respeita o Retry-After; só não gira em falso
+
+        threads = [threading.Thread(target=script, daemon=True) for _ in range(abusivo)]
+        for t in threads:
+            t.start()
+        pacientes = _pacientes(ambiente.base_url, vazao / 4, duracao)
+        parar.set()
+        for t in threads:
+            t.join()
+        atendidas = sum(1 for m in do_script if m["status"] == 200)
+        resultados[nome] = (pacientes, atendidas)
+        _linha(f"{nome} (pacientes)", pacientes)
+        print(f"  {'':<16} script: {len(do_script)} mensagens, {atendidas} atendidas (chamadas pagas ao modelo)")
+    (sem, atendidas_sem), (com, atendidas_com) = resultados["sem admissão"], resultados["com admissão"]
+    return com["p99"] < sem["p99"] and com["recusadas"] == 0 and atendidas_com < atendidas_sem / 5
+
+
+# --- Limite por processo, baldes entre processos e o entrar_async() ---
+
+def _segurar_vagas(db_file: str, threads: int, vezes: int, fila) -> None:
+    import database_tools
+    database_tools.DATABASE_FILE = db_file
+    controle = admission.ControleDeAdmissao(db_file)
+    intervalos, recusadas, lock = [], [0], threading.Lock()
+
+    def trabalho():
+        for _ in range(vezes):
+            try:
+                with controle.entrar():
+                    inicio = time.time()
+                    time.sleep(0.03)
+                    with lock:
+                        intervalos.append((inicio, time.time()))
+            except admission.AdmissaoRecusada:
+                with lock:
+                    recusadas[0] += 1
+
+    pool = [threading.Thread(target=trabalho) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    # O mesmo chat mandando mensagens por todos os processos: o balde é um só, no SQLite
+    aceitas = 0
+    for _ in range(int(admission.ADMISSAO_CHAT_RAJADA)):
+        try:
+            controle.limitar(chat="o-mesmo-chat")
+            aceitas += 1
+        except admission.AdmissaoRecusada:
+            pass
+    fila.put((intervalos, recusadas[0], aceitas))
+
+
+def _max_simultaneas(intervalos) -> int:
+    eventos = sorted([(a, 1) for (a, _) in intervalos] + [(b, -1) for (_, b) in intervalos], key=lambda e: (e[0], e[1]))
+    atual = maximo = 0
+    for (_, delta) in eventos:
+        atual += delta
+        maximo = max(maximo, atual)
+    return maximo
+
+
+def conferir_entre_processos(db_file: str, limite: int = 4, processos: int = 3) -> bool:
+    _configurar(True, limite)
+    admission.ADMISSAO_FILA = 100
+    admission.ADMISSAO_ESPERA_MAX_S = 30
+    admission.ADMISSAO_CHAT_TAXA = 0.01  # Quase sem reposição durante o teste
+    contexto = multiprocessing.get_context("fork")
+    fila = contexto.Queue()
+    filhos = [contexto.Process(target=_segurar_vagas, args=(db_file, 6, 10, fila)) for _ in range(processos)]
+    for p in filhos:
+        p.start()
+    resultados = [fila.get(timeout=120) for _ in filhos]
+    for p in filhos:
+        p.join()
+    admission.ADMISSAO_CHAT_TAXA = 0.2
+    maximos = [_max_simultaneas(lista) for (lista, _, _) in resultados]
+    atendidas = sum(len(lista) for (lista, _, _) in resultados)
+    aceitas = sum(a for (_, _, a) in resultados)
+    rajada = int(admission.ADMISSAO_CHAT_RAJADA)
+    ok = max(maximos) <= limite and atendidas == processos * 6 * 10 and aceitas == rajada
+    print(f"\n{processos} processos x 6 threads, limite {limite} por processo: {atendidas} atendidas, no máximo "
+          f"{maximos} ao mesmo tempo; o mesmo chat pelos {processos}: {aceitas} aceitas (rajada {rajada}): "
+          f"{'OK' if ok else 'FALHOU'}")
+    return ok
+
+
+def conferir_acordar(db_file: str) -> bool:
+    """Com uma vaga só: quem espera entra logo que a vaga é liberada, sem esperar um poll."""
+    _configurar(True, 1)
+    controle = admission.ControleDeAdmissao(db_file)
+    atrasos = []
+    for _ in range(20):
+        vaga = controle.entrar()
+        entrou = []
+        t = threading.Thread(target=lambda: entrou.append((controle.entrar(), time.perf_counter())))
+        t.start()
+        while controle.get_stats()["na_fila"] == 0:
+            time.sleep(0.001)
+        liberada = time.perf_counter()
+        vaga.liberar()
+        t.join()
+        atrasos.append((entrou[0][1] - liberada) * 1000)
+        entrou[0][0].liberar()
+    p99 = percentile(atrasos, 99)
+    ok = p99 < 10
+    print(f"Vaga liberada -> próximo da fila atendido: p99 {p99:.2f}ms: {'OK' if ok else 'FALHOU'}")
+    return ok
+
+
+@asynccontextmanager
+async def _vaga_async(controle):
+    vaga = await controle.entrar_async()
+    try:
+        yield vaga
+    finally:
+        vaga.liberar()
+
+
+def conferir_async(db_file: str, limite: int = 4) -> bool:
+    _configurar(True, limite)
+    admission.ADMISSAO_FILA = 8
+    controle = admission.ControleDeAdmissao(db_file)
+    intervalos, recusadas = [], []
+
+    async def mensagem():
+        try:
+            async with _vaga_async(controle):
+                inicio = time.time()
+                await asyncio.sleep(0.05)
+                intervalos.append((inicio, time.time()))
+        except admission.AdmissaoRecusada as e:
+            recusadas.append(e.motivo)
+
+    async def rodar():
+        await asyncio.gather(*(mensagem() for _ in range(40)))
+
+    asyncio.run(rodar())
+    maximo = _max_simultaneas(intervalos)
+    # 40 de uma vez: 4 entram, 8 esperam e o resto recebe 'fila_cheia'
+    ok = maximo <= limite and len(intervalos) == limite + 8 and recusadas.count("fila_cheia") == 40 - limite - 8
+    print(f"entrar_async(), 40 mensagens de uma vez, limite {limite} e fila 8: {len(intervalos)} atendidas, "
+          f"{len(recusadas)} recusadas, no máximo {maximo} ao mesmo tempo: {'OK' if ok else 'FALHOU'}")
+    return ok
+
+
+def run(duracao: float = 8, capacidade: int = 8, fator: float = 2, abusivo: int = 16) -> bool:
+    import agent
+    import database_tools
+
+    ambiente = AmbienteLocal("chat", Latencia(LATENCIA))
+    ambiente.modelo = agent.model = FakeGeminiModel(Latencia(LATENCIA), capacidade=capacidade)
+    try:
+        print(f"Modelo falso {LATENCIA}, capacidade {capacidade} chamadas ao mesmo tempo; admissão: "
+              f"{capacidade} em atendimento, fila {2 * capacidade}, espera máxima 2s")
+        ok = cenario_sobrecarga(ambiente, capacidade, fator, duracao)
+        ok &= cenario_abusivo(ambiente, capacidade, abusivo, duracao)
+        print(f"Contadores do processo: {admission.get_admission().get_stats()}")
+    finally:
+        ambiente.fechar()
+    ok &= conferir_entre_processos(database_tools.DATABASE_FILE)
+    ok &= conferir_acordar(database_tools.DATABASE_FILE)
+    ok &= conferir_async(database_tools.DATABASE_FILE)
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sobrecarga do /chat com e sem o controle de admissão")
+    parser.add_argument("--duracao", type=float, default=8)
+    parser.add_argument("--capacidade", type=int, default=8, help="Chamadas ao modelo falso ao mesmo tempo")
+    parser.add_argument("--fator", type=float, default=2, help="Carga oferecida / vazão do modelo")
+    parser.add_argument("--abusivo", type=int, default=16, help="Conexões do script abusivo")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.duracao, args.capacidade, args.fator, args.abusivo) else 1)
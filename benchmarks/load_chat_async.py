@@ -0,0 +1,98 @@
+"""
+Teste de carga com modelo falso: compara a vazão do caminho síncrono
+(process_web_message, limitado a N workers como no 'gunicorn api:app')
+com o caminho assíncrono (process_web_message_async num único event loop).
+
+Cada mensagem faz as duas chamadas ao "Gemini" (ferramenta + RAG), cada uma
+com a latência configurada, e roda uma ferramenta real no SQLite.
+
+Uso: python -m benchmarks.load_chat_async [conversas] [workers_sync] [latencia_ms]
+"""
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import agent
+import database_tools
+import response_templates
+from benchmarks._common import copy_clinic_db, silence_stdout
+
+RESPOSTA_FERRAMENTA = json.dumps({
+    "acao": "CHAMAR_FERRAMENTA",
+    "payload_acao": {"tool_name": "tool_consultar_exames_disponiveis", "tool_args": {}},
+})
+RESPOSTA_FINAL = json.dumps({
+    "acao": "RESPONDER_AO_USUARIO",
+    "payload_acao": {"resposta_para_usuario": "Temos Check-up Geral, ECG e Exame de Sangue."},
+})
+
+
+class _Resposta:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Modelo falso: 1a chamada pede uma ferramenta, a 2a (com o resultado) responde."""
+
+    def __init__(self, latencia_s: float):
+        self.latencia_s = latencia_s
+
+    @staticmethod
+    def _responder(contents):
+        tem_resultado = any("functionResponse" in part for c in contents for part in c.get("parts", []))
+        return _Resposta(RESPOSTA_FINAL if tem_resultado else RESPOSTA_FERRAMENTA)
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self.latencia_s)
+        return self._responder(contents)
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.latencia_s)
+        return self._responder(contents)
+
+
+def _run_sync(conversas: int, workers: int) -> float:
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda i: agent.process_web_message(f"quero agendar um exame ({i})", []), range(conversas)))
+    return time.perf_counter() - inicio
+
+
+async def _run_async(conversas: int) -> float:
+    inicio = time.perf_counter()
+    await asyncio.gather(*(agent.process_web_message_async(f"quero agendar um exame ({i})", []) for i in range(conversas)))
+    return time.perf_counter() - inicio
+
+
+def run(conversas: int = 200, workers_sync: int = 4, latencia_ms: float = 100) -> dict:
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    agent.model = StubModel(latencia_ms / 1000)
+    # Mede o pior caso: sem template, toda mensagem faz as duas chamadas ao modelo
+    response_templates.TOOL_RENDER_MODE["tool_consultar_exames_disponiveis"] = "llm"
+
+    with silence_stdout():
+        duracao_sync = _run_sync(conversas, workers_sync)
+        duracao_async = asyncio.run(_run_async(conversas))
+
+    resultado = {
+        "conversas": conversas,
+        "latencia_modelo_ms": latencia_ms,
+        "sync_workers": workers_sync,
+        "sync_msgs_por_s": conversas / duracao_sync,
+        "async_msgs_por_s": conversas / duracao_async,
+    }
+    print(f"Síncrono ({workers_sync} workers): {resultado['sync_msgs_por_s']:8.1f} msg/s ({duracao_sync:.2f}s)")
+    print(f"Assíncrono (1 processo):  {resultado['async_msgs_por_s']:8.1f} msg/s ({duracao_async:.2f}s)")
+    return resultado
+
+
+if __name__ == "__main__":
+    argumentos = [float(a) for a in sys.argv[1:4]]
+    if argumentos:
+        argumentos[0] = int(argumentos[0])
+    if len(argumentos) > 1:
+        argumentos[1] = int(argumentos[1])
+    run(*argumentos)
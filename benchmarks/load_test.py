@@ -0,0 +1,381 @@
+"""
+Teste de carga offline: conversas roteirizadas contra o /chat (ou o /webhook/telegram) numa taxa alvo,
+com o modelo falso (benchmarks/fake_model.py) no lugar do Gemini.
+
+Roteiros (como um usuário de verdade, lendo os IDs das respostas do bot):
+- agendar:  "quero marcar uma consulta" -> especialidade -> "quero o ID X, meu nome é ..."
+- cancelar: agendar + "meus agendamentos" -> "cancelar o agendamento Y"
+- info:     endereço, convênios e lista de exames (parte respondida sem IA pelo roteador)
+
+As conversas chegam como um processo de Poisson (semente fixa) para dar, em média, --rps requisições
+por segundo; cada conversa manda a próxima mensagem só depois da resposta (e de --pensar ms).
+Sem --url, sobe o api.py num servidor HTTP local (sem o balde por IP da admissão; num servidor de
+verdade, suba-o com ADMISSAO_IP_TAXA=0), numa cópia do clinic.db com agenda recorrente
+(horários não acabam durante o teste). No modo webhook, a API do Telegram é o TelegramStandIn e a
+latência medida vai do POST do update até a resposta chegar ao "Telegram".
+
+Relatório: p50/p95/p99, vazão, erros, esperas por lock do SQLite e chamadas ao modelo, em JSON
+(--saida; padrão benchmarks/results/load_<alvo>_<commit>.json) para comparar entre commits com
+python -m benchmarks.compare_results antes.json depois.json
+
+Uso: python -m benchmarks.load_test [--alvo chat|webhook] [--rps 20] [--duracao 15]
+                                    [--latencia lognormal:800,0.4] [--mix agendar=4,cancelar=2,info=4]
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from benchmarks._common import REPO_DIR, copy_clinic_db, percentile
+from benchmarks.fake_model import FakeGeminiModel, Latencia
+
+_IDS = re.compile(r"\bID (\d+)")
+NOMES = ["Ana Souza", "Bruno Lima", "Carla Mendes", "Diego Alves", "Elisa Rocha", "Fábio Nunes"]
+ESPECIALIDADES_DEMO = ["Cardiologia", "Dermatologia"]  # As do clinic.db de exemplo
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+# --- Roteiros ---
+
+def roteiro_agendar(enviar: Callable[[str], str], rng: random.Random) -> None:
+    enviar("Oi, quero marcar uma consulta")
+    resposta = enviar(rng.choice(ESPECIALIDADES_DEMO))
+    ids = _IDS.findall(resposta)
+    if ids:
+        enviar(f"Quero o ID {rng.choice(ids[:3])}, meu nome é {rng.choice(NOMES)}")
+
+
+def roteiro_cancelar(enviar: Callable[[str], str], rng: random.Random) -> None:
+    roteiro_agendar(enviar, rng)
+    ids = _IDS.findall(enviar("Quais são os meus agendamentos?"))
+    if ids:
+        enviar(f"Quero cancelar o agendamento {ids[-1]}")
+
+
+def roteiro_info(enviar: Callable[[str], str], rng: random.Random) -> None:
+    enviar("Qual o endereço da clínica?")
+    enviar(rng.choice(["Vocês aceitam convênio?", "Qual o horário de funcionamento?"]))
+    enviar("Quais exames vocês fazem?")
+
+
+ROTEIROS = {"agendar": (roteiro_agendar, 3), "cancelar": (roteiro_cancelar, 5), "info": (roteiro_info, 3)}
+
+
+# --- Clientes ---
+
+class ClienteChat:
+    """Uma conversa no /chat (o conversation_id da 1a resposta segue nas próximas)."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.conversation_id = None
+
+    def enviar(self, texto: str) -> Tuple[str, Dict[str, Any]]:
+        inicio = time.perf_counter()
+        resposta = self.session.post(f"{self.base_url}/chat", timeout=120,
+                                     json={"message": texto, "conversation_id": self.conversation_id})
+        medida = {"ms": (time.perf_counter() - inicio) * 1000, "status": resposta.status_code}
+        dados = resposta.json() if resposta.status_code == 200 else {}
+        self.conversation_id = dados.get("conversation_id", self.conversation_id)
+        return dados.get("reply", ""), medida
+
+    def fechar(self) -> None:
+        self.session.close()
+
+
+class ClienteWebhook:
+    """Um chat do Telegram: manda o update ao webhook e espera a resposta chegar ao TelegramStandIn."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, base_url: str, telegram, chat_id: int, secret: Optional[str]):
+        self.base_url = base_url
+        self.telegram = telegram
+        self.chat_id = chat_id
+        self.session = requests.Session()
+        self.headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        self.recebidas = 0
+
+    def enviar(self, texto: str) -> Tuple[str, Dict[str, Any]]:
+        update_id = next(self._update_ids)
+        inicio = time.monotonic()
+        resposta = self.session.post(f"{self.base_url}/webhook/telegram", headers=self.headers, timeout=30, json={
+            "update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": {"id": self.chat_id}, "text": texto}})
+        medida = {"ack_ms": (time.monotonic() - inicio) * 1000, "status": resposta.status_code}
+        if resposta.status_code != 200:
+            medida["ms"] = medida["ack_ms"]
+            return "", medida
+        mensagem = self.telegram.esperar_resposta(self.chat_id, self.recebidas, timeout=120)
+        if mensagem is None:
+            medida.update(ms=(time.monotonic() - inicio) * 1000, status="sem_resposta")
+            return "", medida
+        self.recebidas += 1
+        medida["ms"] = (mensagem[0] - inicio) * 1000
+        return mensagem[1], medida
+
+    def fechar(self) -> None:
+        self.session.close()
+
+
+# --- Ambiente local (api.py + cópia do banco + modelo falso) ---
+
+class AmbienteLocal:
+    def __init__(self, alvo: str, latencia: Latencia):
+        import admission
+        import agent
+        import database_tools
+        from schedule_engine import adicionar_modelo
+
+        database_tools.DATABASE_FILE = copy_clinic_db()
+        # Agenda recorrente para os médicos e exames de exemplo: horários não acabam no meio do teste
+        for (tipo, dono) in (("consulta", 1), ("consulta", 2), ("consulta", 3), ("exame", 1), ("exame", 2), ("exame", 3)):
+            for dia_semana in range(7):
+                adicionar_modelo(database_tools.DATABASE_FILE, tipo, dono, dia_semana, "07:00", "19:00", 20)
+        self.modelo = FakeGeminiModel(latencia)
+        agent.model = self.modelo
+        # Todas as conversas saem de 127.0.0.1: o balde por IP do admission.py barraria o teste inteiro
+        admission.ADMISSAO_IP_TAXA = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            import api  # Depois de apontar o DATABASE_FILE (o api.py roda as migrações ao importar)
+        from werkzeug.serving import make_server
+
+        self.telegram = None
+        if alvo == "webhook":
+            import telegram_sender
+            from benchmarks.telegram_standin import TelegramStandIn
+            self.telegram = TelegramStandIn().__enter__()
+            telegram_sender._sender = telegram_sender.TelegramSender(
+                "TESTE", api_base=self.telegram.base_url, chat_rate=1000, chat_burst=1000, global_rate=10000)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # Sem uma linha de log por requisição
+        self.server = make_server("127.0.0.1", 0, api.app, threaded=True)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def estatisticas(self) -> Dict[str, Any]:
+        import database_pool
+        import intent_router
+        import response_templates
+        import structured_log
+        stats = {
+            "sqlite": database_pool.get_pool_stats(),
+            "modelo": self.modelo.get_stats(),
+            "roteador": intent_router.get_router_stats(),
+            "templates": response_templates.get_render_stats(),
+            "logs": structured_log.get_log_stats(),
+        }
+        if self.telegram is not None:
+            import telegram_ingest
+            stats["ingestao"] = telegram_ingest.get_ingest_stats()
+        return stats
+
+    def fechar(self) -> None:
+        import structured_log
+        self.server.shutdown()
+        if self.telegram is not None:
+            import telegram_ingest
+            telegram_ingest.close_dispatcher()
+            self.telegram.__exit__(None, None, None)
+        structured_log.flush_logs()
+
+
+# --- Gerador de carga ---
+
+def _mix(spec: str) -> List[Tuple[str, float]]:
+    pesos = []
+    for parte in spec.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in ROTEIROS:
+            raise ValueError(f"Roteiro '{nome}' desconhecido (use {', '.join(ROTEIROS)})")
+        pesos.append((nome.strip(), float(peso or 1)))
+    return pesos
+
+
+def _resumo(valores: List[float]) -> Dict[str, float]:
+    if not valores:
+        return {"n": 0}
+    return {"n": len(valores), "media": sum(valores) / len(valores), "p50": percentile(valores, 50),
+            "p95": percentile(valores, 95), "p99": percentile(valores, 99), "max": max(valores)}
+
+
+def _commit() -> Dict[str, Any]:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                             text=True, timeout=10).stdout.strip()
+        sujo = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                   capture_output=True, text=True, timeout=30).stdout.strip())
+        return {"commit": sha or None, "alteracoes_locais": sujo}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "alteracoes_locais": None}
+
+
+def executar(alvo: str = "chat", rps: float = 20, duracao: float = 15, latencia: str = "lognormal:800,0.4",
+             mix: str = "agendar=4,cancelar=2,info=4", pensar_ms: float = 0, url: Optional[str] = None,
+             seed: int = 42, max_conversas: int = 500, logs: Optional[str] = None) -> Dict[str, Any]:
+    if alvo == "webhook" and url:
+        raise ValueError("O modo webhook só roda no ambiente local (as respostas vão para o TelegramStandIn)")
+    pesos = _mix(mix)
+    turnos_medios = sum(ROTEIROS[n][1] * p for (n, p) in pesos) / sum(p for (_, p) in pesos)
+    taxa_conversas = rps / turnos_medios
+    rng = random.Random(seed)
+
+    ambiente = None
+    saida_original = sys.stdout
+    # Os logs do servidor local não entram no relatório: vão para a memória ou para o arquivo de --logs
+    # (um arquivo de verdade mede o custo de escrever os logs, como num servidor)
+    arquivo_logs = open(logs, "w", encoding="utf-8") if logs and url is None else None
+    if url is None:
+        sys.stdout = arquivo_logs or io.StringIO()
+    try:
+        if url is None:
+            ambiente = AmbienteLocal(alvo, Latencia(latencia, seed))
+            url = ambiente.base_url
+            sqlite_antes = ambiente.estatisticas()["sqlite"]
+        secret = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+        medidas: List[Dict[str, Any]] = []
+        lock = threading.Lock()
+        chat_ids = itertools.count(700_000)
+
+        def conversa(n: int, roteiro: str, atraso_ms: float) -> None:
+            cliente = (ClienteWebhook(url, ambiente.telegram, next(chat_ids), secret) if alvo == "webhook"
+                       else ClienteChat(url))
+            rng_conversa = random.Random(seed * 100_003 + n)
+            passo = itertools.count(1)
+
+            def enviar(texto: str) -> str:
+                numero = next(passo)
+                if pensar_ms and numero > 1:
+                    time.sleep(pensar_ms / 1000)
+                try:
+                    resposta, medida = cliente.enviar(texto)
+                except requests.RequestException as e:
+                    resposta, medida = "", {"ms": None, "status": type(e).__name__}
+                medida.update(roteiro=roteiro, passo=numero, atraso_inicio_ms=atraso_ms)
+                with lock:
+                    medidas.append(medida)
+                return resposta
+
+            try:
+                ROTEIROS[roteiro][0](enviar, rng_conversa)
+            finally:
+                cliente.fechar()
+
+        # Chegadas de Poisson: intervalos exponenciais com média 1/taxa
+        inicio = time.perf_counter()
+        agendado = 0.0
+        with ThreadPoolExecutor(max_workers=max_conversas) as pool:
+            for n in itertools.count():
+                agendado += rng.expovariate(taxa_conversas)
+                if agendado >= duracao:
+                    break
+                espera = inicio + agendado - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                roteiro = rng.choices([n for (n, _) in pesos], [p for (_, p) in pesos])[0]
+                atraso_ms = max(0.0, -espera * 1000)
+                pool.submit(conversa, n, roteiro, atraso_ms)
+        total_s = time.perf_counter() - inicio
+
+        ok = [m for m in medidas if m["status"] == 200 and m["ms"] is not None]
+        erros: Dict[str, int] = {}
+        for m in medidas:
+            if m["status"] != 200:
+                erros[str(m["status"])] = erros.get(str(m["status"]), 0) + 1
+        resultado: Dict[str, Any] = {
+            "requisicoes": len(medidas),
+            "erros": erros,
+            "taxa_erros": (len(medidas) - len(ok)) / len(medidas) if medidas else 0.0,
+            "duracao_s": total_s,
+            "vazao_rps": len(ok) / total_s if total_s else 0.0,
+            "latencia_ms": _resumo([m["ms"] for m in ok]),
+            "por_roteiro": {r: _resumo([m["ms"] for m in ok if m["roteiro"] == r]) for r in ROTEIROS},
+            "atraso_inicio_ms": _resumo([m["atraso_inicio_ms"] for m in medidas if m["passo"] == 1]),
+        }
+        if alvo == "webhook":
+            resultado["ack_ms"] = _resumo([m["ack_ms"] for m in medidas if "ack_ms" in m])
+        if ambiente is not None:
+            stats = ambiente.estatisticas()
+            stats["sqlite"] = {k: stats["sqlite"][k] - sqlite_antes.get(k, 0) for k in stats["sqlite"]}
+            resultado.update(stats)
+    finally:
+        try:
+            if ambiente is not None:
+                ambiente.fechar()
+        finally:
+            sys.stdout = saida_original
+            if arquivo_logs is not None:
+                arquivo_logs.close()
+
+    return {
+        "meta": {**_commit(), "data": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "alvo": alvo, "rps_alvo": rps, "duracao_alvo_s": duracao, "latencia_modelo": latencia,
+                 "mix": mix, "pensar_ms": pensar_ms, "url": url if ambiente is None else "local", "seed": seed,
+                 "logs": logs},
+        "resultado": resultado,
+    }
+
+
+def imprimir(relatorio: Dict[str, Any]) -> None:
+    meta, r = relatorio["meta"], relatorio["resultado"]
+    lat = r["latencia_ms"]
+    print(f"Alvo: {meta['alvo']} @ {meta['rps_alvo']} req/s por {meta['duracao_alvo_s']}s, "
+          f"modelo {meta['latencia_modelo']}, mix {meta['mix']} (commit {meta['commit']})")
+    print(f"Requisições: {r['requisicoes']}  erros: {r['erros'] or 0}  vazão: {r['vazao_rps']:.1f} req/s")
+    if lat["n"]:
+        print(f"Latência: p50={lat['p50']:.0f}ms p95={lat['p95']:.0f}ms p99={lat['p99']:.0f}ms máx={lat['max']:.0f}ms")
+    for roteiro, s in r["por_roteiro"].items():
+        if s["n"]:
+            print(f"  {roteiro:<9} n={s['n']:<5} p50={s['p50']:.0f}ms p95={s['p95']:.0f}ms p99={s['p99']:.0f}ms")
+    if "ack_ms" in r and r["ack_ms"]["n"]:
+        print(f"Ack do webhook: p50={r['ack_ms']['p50']:.1f}ms p99={r['ack_ms']['p99']:.1f}ms")
+    print(f"Atraso no início das conversas (gerador saturado se alto): p99={r['atraso_inicio_ms'].get('p99', 0):.0f}ms")
+    if "sqlite" in r:
+        print(f"SQLite: {r['sqlite']}")
+        print(f"Modelo: {r['modelo']['chamadas']} chamadas {r['modelo']['por_acao']}; "
+              f"templates: {r['templates']}; roteador: {r['roteador'].get('roteadas')} sem IA")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Teste de carga offline com modelo Gemini falso")
+    parser.add_argument("--alvo", choices=["chat", "webhook"], default="chat")
+    parser.add_argument("--rps", type=float, default=20, help="Requisições por segundo (média)")
+    parser.add_argument("--duracao", type=float, default=15, help="Segundos gerando conversas novas")
+    parser.add_argument("--latencia", default="lognormal:800,0.4", help="Latência do modelo falso (ver fake_model.Latencia)")
+    parser.add_argument("--mix", default="agendar=4,cancelar=2,info=4", help="Pesos dos roteiros")
+    parser.add_argument("--pensar", type=float, default=0, help="Pausa entre as mensagens de uma conversa (ms)")
+    parser.add_argument("--url", help="Servidor já rodando (ex: gunicorn benchmarks.fake_app:app); sem isso sobe um local")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", help="Arquivo JSON do relatório")
+    parser.add_argument("--logs", help="Grava os logs do servidor local neste arquivo (padrão: descarta em memória)")
+    args = parser.parse_args(argv)
+
+    relatorio = executar(args.alvo, args.rps, args.duracao, args.latencia, args.mix, args.pensar, args.url, args.seed,
+                         logs=args.logs)
+    imprimir(relatorio)
+    saida = args.saida or os.path.join(RESULTS_DIR, f"load_{args.alvo}_{relatorio['meta']['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"Relatório: {saida}")
+    return 0 if relatorio["resultado"]["taxa_erros"] < 0.01 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
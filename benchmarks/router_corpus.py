@@ -0,0 +1,84 @@
+"""
+Corpus de frases em português com a rota esperada do intent_router.
+Mede a taxa de acerto, a fração respondida sem IA e a latência de decisão.
+Rota None = a mensagem deve seguir para o Gemini.
+
+Uso: python -m benchmarks.router_corpus
+"""
+import sys
+
+import database_tools
+import intent_router
+from benchmarks._common import copy_clinic_db, silence_stdout, summarize, time_calls
+
+CORPUS = [
+    # Saudações
+    ("Oi", "saudacao"),
+    ("olá!", "saudacao"),
+    ("Bom dia", "saudacao"),
+    ("boa tarde, tudo bem?", "saudacao"),
+    ("Oiii", "saudacao"),
+    ("E aí", "saudacao"),
+    ("Olá, Clínica Zenith", "saudacao"),
+    # Despedidas
+    ("Obrigado!", "despedida"),
+    ("muito obrigada pela ajuda", "despedida"),
+    ("valeu, tchau", "despedida"),
+    ("Até logo", "despedida"),
+    # Informações da clínica
+    ("Qual o endereço?", "info:endereco"),
+    ("onde fica a clínica?", "info:endereco"),
+    ("Como chego aí?", "info:endereco"),
+    ("qual o horário de funcionamento?", "info:horario_funcionamento"),
+    ("Vocês abrem que horas?", "info:horario_funcionamento"),
+    ("que horas fecha", "info:horario_funcionamento"),
+    ("Quais convênios vocês aceitam?", "info:convenios_aceitos"),
+    ("aceitam plano de saúde?", "info:convenios_aceitos"),
+    ("Vocês aceitam Unimed?", "info:convenios_aceitos"),
+    # Listagens vindas do banco
+    ("Quais exames vocês fazem?", "listar_exames"),
+    ("que tipos de exames tem?", "listar_exames"),
+    ("Quais especialidades vocês têm?", "listar_especialidades"),
+    # Tudo o que envolve fluxo ou entidades específicas vai para a IA
+    ("Oi, quero marcar uma consulta", None),
+    ("bom dia, tem horário para cardiologia?", None),
+    ("Quero agendar um exame de sangue", None),
+    ("quero cancelar meu agendamento", None),
+    ("Quais são meus agendamentos?", None),
+    ("tem vaga amanhã com dermatologista?", None),
+    ("Quais horários disponíveis para o ECG?", None),
+    ("Quero o horário ID 3", None),
+    ("Meu nome é Ana Souza", None),
+    ("sim", None),
+    ("pode ser às 10h", None),
+    ("qual o endereço e o horário de funcionamento?", None),
+    ("Vocês fazem eletrocardiograma?", None),
+    ("obrigado, agora quero marcar outra consulta", None),
+    ("Qual a previsão do tempo amanhã?", None),
+]
+
+
+def run() -> bool:
+    database_tools.DATABASE_FILE = copy_clinic_db()
+    erros = []
+    with silence_stdout():
+        for frase, esperada in CORPUS:
+            obtida = intent_router.classify(frase)
+            if obtida != esperada:
+                erros.append((frase, esperada, obtida))
+            intent_router.route_message(frase)
+        latencias = summarize(time_calls(lambda: intent_router.route_message("Qual o endereço?"), 2000))
+
+    stats = intent_router.get_router_stats()
+    for frase, esperada, obtida in erros:
+        print(f"ERRO: {frase!r}: esperado {esperada}, obtido {obtida}")
+    print(f"Acertos: {len(CORPUS) - len(erros)}/{len(CORPUS)}")
+    print(f"Corpus respondido sem IA: {sum(1 for _, r in CORPUS if r)}/{len(CORPUS)}")
+    print(f"Latência de decisão+resposta (rota info): p50={latencias['p50_us']:.1f}us p99={latencias['p99_us']:.1f}us")
+    print(f"Estatísticas do roteador: roteadas={stats['roteadas']} para_llm={stats['para_llm']} "
+          f"taxa={stats['taxa_roteada']:.2f}")
+    return not erros
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,88 @@
+"""
+Teste de estresse multiprocesso: milhares de agendamentos e cancelamentos concorrentes
+disputando poucos horários. Ao final verifica que nenhum horário ficou com dois
+agendamentos confirmados e que o status de cada horário bate com os agendamentos.
+
+Uso: python -m benchmarks.stress_booking [processos] [tentativas_por_processo] [horarios]
+"""
+import multiprocessing
+import random
+import sys
+import time
+
+import database_pool
+import database_tools
+from benchmarks._common import copy_clinic_db, silence_stdout
+
+
+def _worker(args):
+    db_file, worker_id, tentativas, horario_ids = args
+    database_tools.DATABASE_FILE = db_file
+    rng = random.Random(worker_id)
+    chat_id = f"stress_{worker_id}"
+    sucessos = 0
+
+    with silence_stdout():
+        for _ in range(tentativas):
+            if rng.random() < 0.7:
+                if database_tools.tool_marcar_agendamento(rng.choice(horario_ids), "Paciente Stress", chat_id) \
+                        == "Agendamento confirmado com sucesso!":
+                    sucessos += 1
+            else:
+                # Cancela um agendamento próprio (se houver) para os horários voltarem à disputa
+                row = database_pool.get_connection(db_file).execute(
+                    "SELECT id FROM agendamentos WHERE telegram_chat_id = ? AND status = 'confirmado' LIMIT 1",
+                    (chat_id,)
+                ).fetchone()
+                if row:
+                    database_tools.tool_cancelar_agendamento(row[0], chat_id)
+
+    database_pool.close_all_connections()
+    return sucessos
+
+
+def run(processos: int = 8, tentativas: int = 500, num_horarios: int = 5) -> bool:
+    db_file = copy_clinic_db()
+
+    def _preparar(c):
+        c.execute("DELETE FROM agendamentos")
+        c.execute("DELETE FROM horarios_disponiveis")
+        c.executemany(
+            "INSERT INTO horarios_disponiveis (id, medico_id, data_hora_inicio, status) VALUES (?, 1, ?, 'disponivel')",
+            ((i, f"2030-01-01 {8 + i:02d}:00:00") for i in range(1, num_horarios + 1))
+        )
+
+    database_pool.write_transaction(db_file, _preparar)
+    horario_ids = list(range(1, num_horarios + 1))
+    database_pool.close_all_connections()
+
+    inicio = time.perf_counter()
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(processos) as pool:
+        sucessos = sum(pool.map(_worker, [(db_file, w, tentativas, horario_ids) for w in range(processos)]))
+    duracao = time.perf_counter() - inicio
+
+    conn = database_pool.get_connection(db_file)
+    duplicados = conn.execute("""
+        SELECT horario_id, COUNT(*) FROM agendamentos
+        WHERE status = 'confirmado' GROUP BY horario_id HAVING COUNT(*) > 1
+    """).fetchall()
+    inconsistentes = conn.execute("""
+        SELECT h.id FROM horarios_disponiveis h
+        WHERE (h.status = 'agendado') !=
+              EXISTS (SELECT 1 FROM agendamentos a WHERE a.horario_id = h.id AND a.status = 'confirmado')
+    """).fetchall()
+
+    print(f"{processos * tentativas} operações em {duracao:.2f}s por {processos} processos; "
+          f"{sucessos} agendamentos bem-sucedidos em {num_horarios} horários")
+    print(f"Horários com agendamento duplicado: {len(duplicados)}")
+    print(f"Horários com status inconsistente: {len(inconsistentes)}")
+    print(f"Estatísticas de lock (processo principal): {database_pool.get_pool_stats()}")
+    database_pool.close_all_connections()
+    return not duplicados and not inconsistentes
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:4]]
+    ok = run(*argumentos)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,138 @@
+"""
+Servidor HTTP local que imita a API do Telegram para os benchmarks.
+- sendMessage: registra cada mensagem recebida (chat, texto, instante) e quantas conexões
+  TCP foram abertas. Permite injetar respostas 429 (com retry_after) e 500 por chat.
+- getUpdates: entrega os updates criados com add_update() (long polling com offset/limit/timeout).
+- esperar_resposta(): bloqueia até o bot mandar a próxima mensagem para um chat (testes de carga).
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TelegramStandIn:
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.mensagens = []          # (instante, chat_id, texto) das mensagens aceitas
+        self.requisicoes = 0
+        self.conexoes = 0
+        self.falhas_429 = {}         # chat_id -> quantas respostas 429 ainda devolver
+        self.falhas_500 = {}         # chat_id -> quantas respostas 500 ainda devolver
+        self.retry_after = 1
+        self.updates = []            # Updates ainda não confirmados pelo offset do getUpdates
+        self.offsets_pedidos = []
+        self._proximo_update_id = 1
+        self._lock = threading.Lock()
+        self._novos_updates = threading.Condition(self._lock)
+        self._novas_mensagens = threading.Condition(self._lock)
+        self._mensagens_por_chat = {}  # chat_id -> [(instante, texto)]
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def por_chat(self) -> dict:
+        with self._lock:
+            resultado = {}
+            for (instante, chat_id, texto) in self.mensagens:
+                resultado.setdefault(chat_id, []).append((instante, texto))
+            return resultado
+
+    def esperar_resposta(self, chat_id, ja_recebidas: int, timeout: float):
+        """(instante, texto) da mensagem número 'ja_recebidas' + 1 do chat, ou None se não chegar a tempo."""
+        fim = time.monotonic() + timeout
+        with self._lock:
+            while len(self._mensagens_por_chat.get(chat_id, ())) <= ja_recebidas:
+                restante = fim - time.monotonic()
+                if restante <= 0:
+                    return None
+                self._novas_mensagens.wait(restante)
+            return self._mensagens_por_chat[chat_id][ja_recebidas]
+
+    def add_update(self, chat_id, texto: str) -> int:
+        """Simula uma mensagem de usuário chegando ao bot. Retorna o update_id."""
+        with self._lock:
+            update_id = self._proximo_update_id
+            self._proximo_update_id += 1
+            self.updates.append({"update_id": update_id, "message": {
+                "message_id": update_id, "date": int(time.time()), "chat": {"id": chat_id}, "text": texto}})
+            self._novos_updates.notify_all()
+            return update_id
+
+    def _get_updates(self, corpo: dict):
+        offset = int(corpo.get("offset") or 0)
+        limite = int(corpo.get("limit") or 100)
+        fim = time.monotonic() + float(corpo.get("timeout") or 0)
+        with self._lock:
+            self.offsets_pedidos.append(offset)
+            # Como o Telegram: o offset confirma (e descarta) todos os updates anteriores
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            while not self.updates and time.monotonic() < fim:
+                self._novos_updates.wait(fim - time.monotonic())
+            return 200, {"ok": True, "result": self.updates[:limite]}
+
+    def _responder(self, chat_id, texto):
+        """Decide a resposta (status, corpo) para um sendMessage."""
+        with self._lock:
+            self.requisicoes += 1
+            if self.falhas_429.get(chat_id, 0) > 0:
+                self.falhas_429[chat_id] -= 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                             "parameters": {"retry_after": self.retry_after}}
+            if self.falhas_500.get(chat_id, 0) > 0:
+                self.falhas_500[chat_id] -= 1
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            instante = time.monotonic()
+            self.mensagens.append((instante, chat_id, texto))
+            self._mensagens_por_chat.setdefault(chat_id, []).append((instante, texto))
+            self._novas_mensagens.notify_all()
+            return 200, {"ok": True, "result": {"chat": {"id": chat_id}, "text": texto}}
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, como o Telegram
+
+            def setup(self):
+                super().setup()
+                # Sem Nagle: cabeçalho e corpo saem em escritas separadas (o Telegram real não tem esse atraso)
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with standin._lock:
+                    standin.conexoes += 1
+
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if standin.latency_s:
+                    time.sleep(standin.latency_s)
+                if self.path.endswith("/getUpdates"):
+                    status, resposta = standin._get_updates(corpo)
+                elif self.path.endswith("/deleteWebhook"):
+                    status, resposta = 200, {"ok": True, "result": True}
+                else:
+                    status, resposta = standin._responder(corpo.get("chat_id"), corpo.get("text"))
+                dados = json.dumps(resposta).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,135 @@
+"""
+Peças da rota /chat/stream (Server-Sent Events).
+
+O Gemini responde em JSON ({"acao": ..., "payload_acao": {...}}), então os trechos que chegam
+com stream=True são pedaços desse JSON, não do texto para o paciente. O ExtratorDeResposta lê
+os trechos conforme chegam e:
+- assim que aparece o "tool_name" de uma ferramenta conhecida, gera o evento "progresso"
+  ("Consultando horários…"), antes mesmo de o JSON terminar;
+- devolve o texto de "resposta_para_usuario" / "pergunta_para_usuario" aos poucos (eventos "texto"),
+  já sem as aspas e os escapes do JSON.
+
+Eventos enviados ao cliente (event: nome / data: JSON):
+- progresso: {"ferramenta": "...", "texto": "Consultando horários…"}
+- texto: {"texto": "..."}  (trecho novo; o cliente concatena)
+- fim: {"reply": "...", "conversation_id": "...", "substituir": bool}
+  'reply' é a resposta completa, igual à do /chat. Se 'substituir' vier true (ex: a IA mandou
+  um JSON inválido depois de já ter mandado parte do texto), o cliente troca o texto mostrado por ela.
+- erro: {"error": "..."}
+"""
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+CONTENT_TYPE_SSE = "text/event-stream; charset=utf-8"
+# Sem buffer no proxy (nginx/Render), senão os eventos só chegam todos juntos no fim
+HEADERS_SSE = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+TEXTOS_PROGRESSO = {
+    "tool_consultar_horarios_disponiveis": "Consultando horários…",
+    "tool_consultar_horarios_exames": "Consultando horários…",
+    "tool_consultar_exames_disponiveis": "Consultando os exames disponíveis…",
+    "tool_obter_info_clinica": "Consultando as informações da clínica…",
+    "tool_marcar_agendamento": "Marcando sua consulta…",
+    "tool_marcar_exame": "Marcando seu exame…",
+    "tool_listar_meus_agendamentos": "Buscando seus agendamentos…",
+    "tool_listar_meus_exames_agendados": "Buscando seus exames…",
+    "tool_cancelar_agendamento": "Cancelando o agendamento…",
+    "tool_cancelar_exame": "Cancelando o exame…",
+}
+
+_CAMPO_TEXTO = re.compile(r'"(?:resposta_para_usuario|pergunta_para_usuario)"\s*:\s*"')
+_TOOL_NAME = re.compile(r'"tool_name"\s*:\s*"([A-Za-z0-9_]+)"')
+
+Evento = Tuple[str, Dict[str, Any]]
+
+
+class ExtratorDeResposta:
+    """Lê o JSON do modelo trecho a trecho e gera os eventos de progresso e de texto."""
+
+    def __init__(self):
+        self.bruto = ""  # JSON completo recebido até agora (para o json.loads no fim)
+        self.texto = ""  # Texto já enviado ao cliente
+        self.progresso_enviado = False
+        self._inicio = None  # Posição, em 'bruto', do 1o caractere do valor do campo de texto
+        self._pos = 0  # Até onde o valor já foi decodificado
+        self._terminou = False
+
+    def alimentar(self, trecho: str) -> List[Evento]:
+        self.bruto += trecho
+        eventos = []
+        if not self.progresso_enviado:
+            m = _TOOL_NAME.search(self.bruto)
+            if m and m.group(1) in TEXTOS_PROGRESSO:
+                self.progresso_enviado = True
+                eventos.append(evento_progresso(m.group(1)))
+        novo = self._decodificar()
+        if novo:
+            self.texto += novo
+            eventos.append(("texto", {"texto": novo}))
+        return eventos
+
+    def _decodificar(self) -> str:
+        if self._terminou:
+            return ""
+        if self._inicio is None:
+            m = _CAMPO_TEXTO.search(self.bruto)
+            if not m:
+                return ""
+            self._inicio = self._pos = m.end()
+
+        # Avança só até o fim do último caractere completo (um escape pode estar cortado no meio)
+        bruto, i, seguro = self.bruto, self._pos, self._pos
+        try:
+            while i < len(bruto):
+                c = bruto[i]
+                if c == '"':
+                    self._terminou = True
+                    break
+                if c != "\\":
+                    i += 1
+                elif i + 1 >= len(bruto):
+                    break
+                elif bruto[i + 1] != "u":
+                    i += 2
+                elif i + 6 > len(bruto):
+                    break
+                elif 0xD800 <= int(bruto[i + 2:i + 6], 16) <= 0xDBFF:
+                    # Emoji e afins: o par \uD83D\uDE00 tem que ser decodificado junto
+                    if i + 12 > len(bruto):
+                        break
+                    i += 12
+                else:
+                    i += 6
+                seguro = i
+            novo = json.loads(f'"{bruto[self._pos:seguro]}"', strict=False) if seguro > self._pos else ""
+        except ValueError:
+            # JSON estranho: para de transmitir; a resposta final (evento "fim") vem do json.loads completo
+            self._terminou = True
+            return ""
+        self._pos = seguro
+        return novo
+
+
+def evento_progresso(tool_name: str) -> Evento:
+    return "progresso", {"ferramenta": tool_name, "texto": TEXTOS_PROGRESSO.get(tool_name, "Consultando…")}
+
+
+def evento_fim(resposta: str, texto_enviado: str) -> List[Evento]:
+    """O que falta do texto (respostas que não vieram em streaming) e o evento 'fim'."""
+    if resposta.startswith(texto_enviado):
+        resto = resposta[len(texto_enviado):]
+        return ([("texto", {"texto": resto})] if resto else []) + [("fim", {"reply": resposta, "substituir": False})]
+    return [("fim", {"reply": resposta, "substituir": True})]
+
+
+def texto_do_trecho(trecho) -> str:
+    # No SDK, .text levanta ValueError em trechos sem texto (ex: só metadados no último)
+    try:
+        return trecho.text or ""
+    except ValueError:
+        return ""
+
+
+def formatar_sse(evento: str, dados: Dict[str, Any]) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
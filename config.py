@@ -1,8 +1,11 @@
 import os
-import google.generativeai as genai
+import threading
 from dotenv import load_dotenv
 
+from structured_log import campos, get_logger
+
 load_dotenv()
+log = get_logger(__name__)
 
 # --- Carrega e Limpa os Tokens ---
 _gemini_key_bruto = os.getenv("GEMINI_API_KEY")
@@ -11,22 +14,67 @@ _telegram_token_bruto = os.getenv("TELEGRAM_BOT_TOKEN")
 GEMINI_API_KEY = _gemini_key_bruto.strip() if _gemini_key_bruto else None
 TELEGRAM_BOT_TOKEN = _telegram_token_bruto.strip() if _telegram_token_bruto else None
 
-# --- Inicializa o Modelo da IA (só uma vez) ---
-model = None
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('models/gemini-flash-latest')
-        print("API do Gemini configurada com sucesso (usando gemini-flash-latest).")
-    except Exception as e:
-        print(f"ERRO: Falha ao configurar a API do Gemini. Erro: {e}")
-else:
-    print("ERRO: GEMINI_API_KEY não encontrada no .env. A IA não vai funcionar.")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "models/gemini-flash-latest")
+# Carrega o modelo logo depois de o worker subir, numa thread (sem isso, só na 1a mensagem)
+GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "1") == "1"
+
+if not GEMINI_API_KEY:
+    log.error("GEMINI_API_KEY não encontrada no .env. A IA não vai funcionar.")
 
 if not TELEGRAM_BOT_TOKEN:
-    print("ERRO: TELEGRAM_BOT_TOKEN não encontrado no .env. O bot não vai funcionar.")
+    log.error("TELEGRAM_BOT_TOKEN não encontrado no .env. O bot não vai funcionar.")
 
 # Configuração de geração do Gemini
 generation_config = { "response_mime_type": "application/json" }
 
-print("--------------------------------------------------")
\ No newline at end of file
+# --- Modelo da IA (criado só na primeira vez que for usado) ---
+# Importar o google.generativeai leva ~1s (gRPC, protobuf...). Fazer isso no import deste módulo
+# atrasava a subida de todo worker, até para responder o health check '/'.
+_model = None
+_model_pronto = False
+_model_lock = threading.Lock()
+
+
+def _criar_modelo():
+    if not GEMINI_API_KEY:
+        return None
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        # O GenerativeModel só abre o cliente (gRPC) na 1a chamada: pode ser criado antes do fork
+        modelo = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        log.info("API do Gemini configurada", extra=campos(modelo=GEMINI_MODEL_NAME))
+        return modelo
+    except Exception:
+        log.exception("Falha ao configurar a API do Gemini")
+        return None
+
+
+def get_model():
+    """Modelo do Gemini, criado na primeira chamada. Seguro com várias threads."""
+    global _model, _model_pronto
+    if not _model_pronto:
+        with _model_lock:
+            if not _model_pronto:
+                _model = _criar_modelo()
+                _model_pronto = True
+    return _model
+
+
+def model_pronto() -> bool:
+    return _model_pronto
+
+
+def warm_up_model(em_segundo_plano: bool = False) -> None:
+    """
+    Cria o modelo antes da primeira mensagem.
+    Em segundo plano, o worker já atende (o '/' responde na hora); se uma mensagem chegar antes
+    de terminar, ela espera o lock do get_model(). Não usar em segundo plano no master do gunicorn
+    antes do fork: um filho criado com a thread no meio de um import pode travar.
+    """
+    if _model_pronto:
+        return
+    if em_segundo_plano:
+        threading.Thread(target=get_model, name="gemini-warmup", daemon=True).start()
+    else:
+        get_model()
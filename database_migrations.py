@@ -0,0 +1,243 @@
+import sqlite3
+
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# --- Migrações do Esquema ---
+# Cada migração é (versão, descrição, lista de comandos SQL) e roda uma única vez, em ordem.
+# A versão aplicada fica registrada na tabela 'schema_version'.
+# NUNCA altere uma migração já publicada: crie uma nova com a próxima versão.
+MIGRATIONS = [
+    (1, "Índices para horários livres e para os agendamentos de cada paciente", [
+        # Horários de consulta: busca por status/data e, só entre os livres, por médico
+        "CREATE INDEX IF NOT EXISTS idx_horarios_disponiveis_status_data "
+        "ON horarios_disponiveis (status, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS idx_horarios_disponiveis_livres_medico "
+        "ON horarios_disponiveis (medico_id, data_hora_inicio) WHERE status = 'disponivel'",
+        # Horários de exame: mesma ideia, por exame
+        "CREATE INDEX IF NOT EXISTS idx_horarios_exames_status_data "
+        "ON horarios_exames (status, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS idx_horarios_exames_livres_exame "
+        "ON horarios_exames (exame_id, data_hora_inicio) WHERE status = 'disponivel'",
+        # Listagem dos agendamentos do paciente (chat + status)
+        "CREATE INDEX IF NOT EXISTS idx_agendamentos_chat_status "
+        "ON agendamentos (telegram_chat_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_agendamentos_exames_chat_status "
+        "ON agendamentos_exames (telegram_chat_id, status)",
+    ]),
+    (2, "Tabela 'conversas' com o histórico de cada conversa (session_store)", [
+        """
+        CREATE TABLE IF NOT EXISTS conversas (
+            id TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL,
+            expira_em REAL NOT NULL,
+            historico TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conversas_expira_em ON conversas (expira_em)",
+    ]),
+    (3, "Versão das tabelas de referência (info, medicos, exames) para o reference_cache", [
+        """
+        CREATE TABLE IF NOT EXISTS reference_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO reference_version (id, version) VALUES (1, 1)",
+        # Qualquer escrita nas tabelas de referência (de qualquer processo) incrementa a versão
+        "CREATE TRIGGER IF NOT EXISTS trg_info_insert_versao AFTER INSERT ON info "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_info_update_versao AFTER UPDATE ON info "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_info_delete_versao AFTER DELETE ON info "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_medicos_insert_versao AFTER INSERT ON medicos "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_medicos_update_versao AFTER UPDATE ON medicos "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_medicos_delete_versao AFTER DELETE ON medicos "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_exames_insert_versao AFTER INSERT ON exames "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_exames_update_versao AFTER UPDATE ON exames "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_exames_delete_versao AFTER DELETE ON exames "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+    ]),
+    (4, "Tabela 'telegram_updates' com os update_id já recebidos (dedupe do webhook)", [
+        """
+        CREATE TABLE IF NOT EXISTS telegram_updates (
+            update_id INTEGER PRIMARY KEY,
+            recebido_em REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_telegram_updates_recebido_em ON telegram_updates (recebido_em)",
+    ]),
+    (5, "Tabela 'telegram_polling' com o offset do getUpdates (modo polling)", [
+        """
+        CREATE TABLE IF NOT EXISTS telegram_polling (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            proximo_offset INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (6, "Tabela 'horarios_changelog' com as alterações de horários (availability_index)", [
+        # Cada UPDATE/DELETE em horários (de qualquer processo) registra o estado ANTIGO da linha.
+        # Os INSERTs não entram aqui: o índice encontra as linhas novas pelo id (AUTOINCREMENT).
+        """
+        CREATE TABLE IF NOT EXISTS horarios_changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            horario_id INTEGER NOT NULL,
+            dono_antigo INTEGER NOT NULL,
+            inicio_antigo DATETIME NOT NULL
+        )
+        """,
+        "CREATE TRIGGER IF NOT EXISTS trg_horarios_disponiveis_update_changelog AFTER UPDATE ON horarios_disponiveis "
+        "BEGIN INSERT INTO horarios_changelog (tipo, horario_id, dono_antigo, inicio_antigo) "
+        "VALUES ('consulta', OLD.id, OLD.medico_id, OLD.data_hora_inicio); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_horarios_disponiveis_delete_changelog AFTER DELETE ON horarios_disponiveis "
+        "BEGIN INSERT INTO horarios_changelog (tipo, horario_id, dono_antigo, inicio_antigo) "
+        "VALUES ('consulta', OLD.id, OLD.medico_id, OLD.data_hora_inicio); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_horarios_exames_update_changelog AFTER UPDATE ON horarios_exames "
+        "BEGIN INSERT INTO horarios_changelog (tipo, horario_id, dono_antigo, inicio_antigo) "
+        "VALUES ('exame', OLD.id, OLD.exame_id, OLD.data_hora_inicio); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_horarios_exames_delete_changelog AFTER DELETE ON horarios_exames "
+        "BEGIN INSERT INTO horarios_changelog (tipo, horario_id, dono_antigo, inicio_antigo) "
+        "VALUES ('exame', OLD.id, OLD.exame_id, OLD.data_hora_inicio); END",
+    ]),
+    (7, "Agenda recorrente (schedule_engine): modelos semanais e exceções; horários gerados sob demanda", [
+        # Modelo semanal de um médico (tipo 'consulta') ou exame (tipo 'exame'):
+        # toda <dia_semana> (0 = segunda), de hora_inicio a hora_fim, um horário a cada duracao_min
+        """
+        CREATE TABLE IF NOT EXISTS agenda_modelos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL CHECK (tipo IN ('consulta', 'exame')),
+            dono_id INTEGER NOT NULL,
+            dia_semana INTEGER NOT NULL CHECK (dia_semana BETWEEN 0 AND 6),
+            hora_inicio TEXT NOT NULL,
+            hora_fim TEXT NOT NULL,
+            duracao_min INTEGER NOT NULL CHECK (duracao_min > 0),
+            valido_de DATE,
+            valido_ate DATE
+        )
+        """,
+        # Bloqueios (feriados, férias, reuniões): tipo/dono_id NULL = vale para todos
+        """
+        CREATE TABLE IF NOT EXISTS agenda_excecoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT CHECK (tipo IN ('consulta', 'exame')),
+            dono_id INTEGER,
+            inicio DATETIME NOT NULL,
+            fim DATETIME NOT NULL,
+            motivo TEXT
+        )
+        """,
+        # Horários já gravados (marcados) de um dono numa janela, livres ou não
+        "CREATE INDEX IF NOT EXISTS idx_horarios_disponiveis_medico_data "
+        "ON horarios_disponiveis (medico_id, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS idx_horarios_exames_exame_data "
+        "ON horarios_exames (exame_id, data_hora_inicio)",
+        # Modelos e exceções mudam pouco: entram na mesma versão das tabelas de referência
+        "CREATE TRIGGER IF NOT EXISTS trg_agenda_modelos_insert_versao AFTER INSERT ON agenda_modelos "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_agenda_modelos_update_versao AFTER UPDATE ON agenda_modelos "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_agenda_modelos_delete_versao AFTER DELETE ON agenda_modelos "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_agenda_excecoes_insert_versao AFTER INSERT ON agenda_excecoes "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_agenda_excecoes_update_versao AFTER UPDATE ON agenda_excecoes "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_agenda_excecoes_delete_versao AFTER DELETE ON agenda_excecoes "
+        "BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END",
+    ]),
+    (8, "Tabela 'metricas_processos' com o retrato das métricas de cada worker (rota /metrics)", [
+        # Uma linha por processo; 'grupo' = PID do pai (o master do gunicorn) para somar só os irmãos
+        """
+        CREATE TABLE IF NOT EXISTS metricas_processos (
+            grupo INTEGER NOT NULL,
+            pid INTEGER NOT NULL,
+            atualizado_em REAL NOT NULL,
+            retrato TEXT NOT NULL,
+            PRIMARY KEY (grupo, pid)
+        )
+        """,
+    ]),
+    (9, "Tabelas do controle de admissão (admission.py): baldes de fichas e vagas para o modelo", [
+        # Um balde por chave ('chat:<id>' ou 'ip:<endereço>'); sem linha = balde cheio
+        """
+        CREATE TABLE IF NOT EXISTS admissao_baldes (
+            chave TEXT PRIMARY KEY,
+            fichas REAL NOT NULL,
+            atualizado_em REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_admissao_baldes_atualizado_em ON admissao_baldes (atualizado_em)",
+        # Uma linha por mensagem sendo atendida (ativa = 1) ou esperando vaga (ativa = 0), de todos os workers.
+        # A ordem do id é a ordem da fila.
+        """
+        CREATE TABLE IF NOT EXISTS admissao_vagas (
+            id INTEGER PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            ativa INTEGER NOT NULL,
+            desde REAL NOT NULL
+        )
+        """,
+    ]),
+    (10, "Coluna 'processado' em 'telegram_updates': o update_id fica pendente até a resposta sair", [
+        # As linhas antigas já foram atendidas
+        "ALTER TABLE telegram_updates ADD COLUMN processado INTEGER NOT NULL DEFAULT 1",
+    ]),
+    (11, "Remove 'admissao_vagas': as vagas da admissão ficam na memória de cada worker", [
+        "DROP TABLE IF EXISTS admissao_vagas",
+    ]),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Retorna a maior versão de migração já aplicada (0 se nenhuma)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        descricao TEXT NOT NULL,
+        aplicada_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(db_file: str) -> int:
+    """
+    Aplica, em ordem, as migrações ainda pendentes no banco informado.
+    Usa BEGIN IMMEDIATE para que vários workers subindo ao mesmo tempo
+    não apliquem a mesma migração duas vezes. Retorna a versão final do esquema.
+    """
+    conn = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            versao_atual = get_schema_version(conn)
+            for (versao, descricao, comandos) in MIGRATIONS:
+                if versao <= versao_atual:
+                    continue
+                log.info("Aplicando migração", extra=campos(versao=versao, descricao=descricao))
+                for comando in comandos:
+                    conn.execute(comando)
+                conn.execute(
+                    "INSERT INTO schema_version (version, descricao) VALUES (?, ?)",
+                    (versao, descricao)
+                )
+                versao_atual = versao
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        # Atualiza as estatísticas do planejador depois de criar índices
+        conn.execute("PRAGMA optimize")
+        return versao_atual
+    finally:
+        conn.close()
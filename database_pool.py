@@ -0,0 +1,145 @@
+import atexit
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from structured_log import campos, get_logger
+
+# --- Configuração das conexões (pode ser ajustada pelo .env) ---
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "8192"))      # 8 MB de cache de páginas
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))  # 64 MB de mmap
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE = 128  # Statements preparados reaproveitados por conexão
+SQLITE_WRITE_RETRIES = int(os.getenv("SQLITE_WRITE_RETRIES", "5"))  # Tentativas extras se o banco estiver travado
+LOCK_WAIT_THRESHOLD_S = 0.001  # BEGIN IMMEDIATE mais lento que isso = esperou outro escritor (estatística)
+
+log = get_logger(__name__)
+
+# Uma conexão por (thread, arquivo). O registro global existe só para fecharmos tudo na saída.
+_local = threading.local()
+_registry_lock = threading.Lock()
+_all_connections = []
+_generation = 0  # Incrementado ao fechar tudo, invalida as conexões guardadas nas threads
+
+# Contadores simples do processo (lidos por get_pool_stats); as threads atualizam com o _stats_lock
+_stats_lock = threading.Lock()
+_stats = {"lock_retries": 0, "lock_failures": 0, "lock_waits": 0, "lock_wait_s": 0.0}
+
+
+def _open_connection(db_file: str) -> sqlite3.Connection:
+    """
+    Abre uma conexão nova já configurada para uso prolongado:
+    WAL, synchronous=NORMAL, cache e mmap maiores e cache de statements.
+    """
+    conn = sqlite3.connect(
+        db_file,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,  # Autocommit: as escritas abrem a transação explicitamente (write_transaction)
+        check_same_thread=False,  # Só a thread dona usa; o fechamento no atexit pode vir de outra
+        cached_statements=SQLITE_STATEMENT_CACHE,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Seguro com WAL e bem mais rápido que FULL
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def get_connection(db_file: str) -> sqlite3.Connection:
+    """
+    Retorna a conexão de longa duração desta thread para o arquivo informado.
+    A conexão é criada na primeira chamada e reaproveitada nas seguintes.
+    Depois de um fork (workers do gunicorn) as conexões herdadas são descartadas.
+    """
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid or _local.generation != _generation:
+        # Thread nova, processo filho recém-criado ou pool já fechado: começa do zero
+        _local.pid = pid
+        _local.generation = _generation
+        _local.connections = {}
+
+    conn = _local.connections.get(db_file)
+    if conn is None:
+        conn = _open_connection(db_file)
+        _local.connections[db_file] = conn
+        with _registry_lock:
+            _all_connections.append((pid, conn))
+    return conn
+
+
+def _is_locked_error(e: sqlite3.OperationalError) -> bool:
+    mensagem = str(e).lower()
+    return "locked" in mensagem or "busy" in mensagem
+
+
+def write_transaction(db_file: str, fn):
+    """
+    Executa fn(conn) dentro de uma transação BEGIN IMMEDIATE e faz o COMMIT.
+    O lock de escrita é obtido logo no início, então leituras e escritas de fn
+    não podem ser intercaladas com as de outro worker.
+    Se o banco continuar travado depois do busy_timeout, tenta de novo com
+    backoff exponencial (no máximo SQLITE_WRITE_RETRIES vezes).
+    Qualquer exceção dentro de fn desfaz a transação e é repassada.
+    """
+    conn = get_connection(db_file)
+    inicio = time.perf_counter()
+    for tentativa in range(SQLITE_WRITE_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            espera = time.perf_counter() - inicio
+            if espera > LOCK_WAIT_THRESHOLD_S:
+                with _stats_lock:
+                    _stats["lock_waits"] += 1
+                    _stats["lock_wait_s"] += espera
+            break
+        except sqlite3.OperationalError as e:
+            if not _is_locked_error(e) or tentativa == SQLITE_WRITE_RETRIES:
+                with _stats_lock:
+                    _stats["lock_failures"] += 1
+                raise
+            with _stats_lock:
+                _stats["lock_retries"] += 1
+            time.sleep(min(0.05 * (2 ** tentativa), 1.0) * random.uniform(0.5, 1.0))
+
+    try:
+        result = fn(conn)
+        conn.commit()
+        return result
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def get_pool_stats() -> dict:
+    """
+    Retorna uma cópia dos contadores de lock deste processo: novas tentativas, falhas e
+    quantas transações esperaram pelo lock de escrita (e o tempo total esperando).
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def close_all_connections() -> None:
+    """
+    Fecha todas as conexões abertas por este processo.
+    Chamado no atexit e no hook 'worker_exit' do gunicorn (gunicorn.conf.py).
+    """
+    global _generation
+    pid = os.getpid()
+    with _registry_lock:
+        _generation += 1
+        abertas = [conn for (conn_pid, conn) in _all_connections if conn_pid == pid]
+        _all_connections.clear()
+
+    for conn in abertas:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            log.warning("Erro ao fechar conexão", extra=campos(erro=str(e)))
+
+
+atexit.register(close_all_connections)
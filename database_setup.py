@@ -1,7 +1,9 @@
 import sqlite3
 
-def setup_database():
-    conn = sqlite3.connect('clinic.db')
+from database_migrations import run_migrations
+
+def setup_database(db_file: str = 'clinic.db'):
+    conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
 
     # --- Tabela de Informações (Já existe) ---
@@ -129,6 +131,10 @@ def setup_database():
     conn.commit()
     conn.close()
 
+    # --- Migrações versionadas (índices, etc.) ---
+    versao = run_migrations(db_file)
+    print(f"Esquema do banco na versão {versao}.")
+
 if __name__ == "__main__":
     print("Iniciando setup do banco de dados (Fase 5 - Exames)...")
     # --- Certifique-se de que o código das tabelas anteriores está colado acima ---
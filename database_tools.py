@@ -1,448 +1,598 @@
-import sqlite3
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from availability_index import get_availability_index
+from database_pool import get_connection, write_transaction
+from reference_cache import get_reference_cache
+from schedule_engine import get_schedule_engine, is_virtual
+from structured_log import campos, get_logger
+from tool_results import ToolResult, lista, status
 
 DATABASE_FILE = 'clinic.db'
 
-def tool_obter_info_clinica(topic: str) -> str:
+log = get_logger(__name__)
+
+# --- Limites das buscas de horários (o resultado vai inteiro para o prompt da IA) ---
+HORARIOS_LIMITE_PADRAO = int(os.getenv("HORARIOS_LIMITE_PADRAO", "10"))  # Horários por resposta quando a IA não pede 'limite'
+HORARIOS_LIMITE_MAX = 25  # Teto, mesmo que a IA peça mais
+
+# Períodos do dia aceitos no filtro 'periodo': faixa de horas [de, até)
+PERIODOS = {"manha": (0, 12), "manhã": (0, 12), "tarde": (12, 18), "noite": (18, 24)}
+
+def _id_inteiro(valor) -> Optional[int]:
+    """IDs vindos do JSON da IA podem chegar como texto ("5"): converte ou devolve None se não for número."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _atualizar_indice(tipo: str, horario_id: int) -> None:
+    """
+    Atualiza o índice de horários livres depois de uma transação JÁ gravada. Uma falha aqui não muda
+    o resultado da marcação/cancelamento: o índice é descartado e a próxima busca o reconstrói.
+    """
+    index = get_availability_index(DATABASE_FILE)
+    try:
+        index.refresh_slot(tipo, horario_id)
+    except Exception:
+        log.exception("Erro ao atualizar o índice de horários, descartando", extra=campos(tipo=tipo, horario_id=horario_id))
+        index.invalidate()
+
+
+def tool_obter_info_clinica(topic: str) -> ToolResult:
     """
     Busca no banco de dados a informação com base no tópico.
     """
     if not topic:
-        return "Tópico não fornecido."
+        return ToolResult("Tópico não fornecido.", status("parametros_faltando"))
 
-    print(f"--- FERRAMENTA DB: Buscando pelo tópico: {topic} ---")
+    log.debug("Buscando informação da clínica", extra=campos(topic=topic))
 
     try:
-        # Conecta ao DB
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Busca o valor (usamos 'topic = ?' para evitar SQL Injection)
-        cursor.execute("SELECT value FROM info WHERE topic = ?", (topic,))
-        result = cursor.fetchone() # Pega o primeiro resultado
-
-        conn.close()
+        # A tabela 'info' fica no cache de referência (só volta ao SQLite se alguém editar)
+        result = get_reference_cache(DATABASE_FILE).get_info(topic)
 
         if result:
-            # result é uma tupla (ex: ('Rua das Flores...',)), 
-            # então pegamos o primeiro item
-            print(f"--- FERRAMENTA DB: Informação encontrada: {result[0]} ---")
-            return result[0]
+            log.debug("Informação encontrada", extra=campos(topic=topic, resultado=result))
+            return ToolResult(result)
         else:
-            print("--- FERRAMENTA DB: Tópico não encontrado no banco. ---")
-            return f"Informação sobre '{topic}' não encontrada."
+            log.info("Tópico não encontrado no banco", extra=campos(topic=topic))
+            return ToolResult(f"Informação sobre '{topic}' não encontrada.", status("topico_nao_encontrado"))
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao acessar o SQLite: {e} ---")
-        return "Ocorreu um erro ao consultar o banco de dados."
+        log.exception("Erro ao acessar o SQLite", extra=campos(topic=topic))
+        return ToolResult("Ocorreu um erro ao consultar o banco de dados.", status("erro_banco"))
     
-def tool_consultar_horarios_disponiveis(especialidade: str) -> str:
+def _parse_data(valor: str, fim: bool = False) -> str:
+    """
+    Converte a data pedida pela IA para 'AAAA-MM-DD HH:MM:SS'.
+    Aceita 'AAAA-MM-DD', 'AAAA-MM-DD HH:MM' e 'DD/MM/AAAA'. Só a data no fim = até o fim daquele dia.
     """
-    Busca horários disponíveis por especialidade, juntando com os nomes dos médicos.
-    Retorna uma string formatada ou uma mensagem de "não encontrado".
+    valor = str(valor).strip()
+    for formato in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d", "%d/%m/%Y %H:%M", "%d/%m/%Y"):
+        try:
+            data = datetime.strptime(valor, formato)
+        except ValueError:
+            continue
+        if fim and "H" not in formato:
+            data += timedelta(days=1)
+        return data.strftime("%Y-%m-%d %H:%M:%S")
+    raise ValueError(f"data '{valor}' inválida (use AAAA-MM-DD ou DD/MM/AAAA)")
+
+
+def _filtros_horarios(data_inicio, data_fim, periodo, limite, cursor) \
+        -> Tuple[Optional[str], Optional[str], Optional[Tuple[int, int]], int, Optional[int]]:
+    """Valida os filtros opcionais das buscas de horários. Levanta ValueError com a mensagem para a IA."""
+    inicio = _parse_data(data_inicio) if data_inicio else None
+    fim = _parse_data(data_fim, fim=True) if data_fim else None
+    horas = None
+    if periodo:
+        horas = PERIODOS.get(str(periodo).strip().casefold())
+        if horas is None:
+            raise ValueError(f"período '{periodo}' inválido (use manha, tarde ou noite)")
+    if limite and _id_inteiro(limite) is None:
+        raise ValueError(f"limite '{limite}' inválido (use um número de 1 a {HORARIOS_LIMITE_MAX})")
+    limite = _id_inteiro(limite) if limite else HORARIOS_LIMITE_PADRAO
+    if cursor and _id_inteiro(cursor) is None:
+        raise ValueError(f"cursor '{cursor}' inválido (use o número indicado na página anterior)")
+    depois_de = _id_inteiro(cursor) if cursor else None
+    return inicio, fim, horas, max(1, min(limite, HORARIOS_LIMITE_MAX)), depois_de
+
+
+def _formatar_pagina(itens: List[Tuple[int, Optional[str], str]], mais: bool) -> ToolResult:
+    # Ex: "[ID 1: Dra. Ana Silva - 2025-10-24 09:00:00]; [ID 2: ...]" (sem o nome nos exames)
+    resposta = "; ".join(f"[ID {id}: {nome} - {data_hora}]" if nome else f"[ID {id}: {data_hora}]"
+                         for (id, nome, data_hora) in itens)
+    ultimo_id = itens[-1][0]
+    if mais:
+        # O cursor é o ID do último horário mostrado: a próxima busca continua dali
+        resposta += (f" (Mostrando {len(itens)} horários. Há mais: "
+                     f"use cursor={ultimo_id} para ver os próximos.)")
+    return ToolResult(resposta, lista("horarios", itens, cursor=ultimo_id if mais else None))
+
+def tool_consultar_horarios_disponiveis(especialidade: str, data_inicio: Optional[str] = None,
+                                        data_fim: Optional[str] = None, medico: Optional[str] = None,
+                                        periodo: Optional[str] = None, limite: Optional[int] = None,
+                                        cursor: Optional[int] = None) -> ToolResult:
+    """
+    Busca os próximos horários livres de uma especialidade, em ordem de data, com o nome do médico.
+    Retorna no máximo 'limite' horários (padrão 10, máximo 25); se houver mais, o texto traz o cursor da próxima página.
+
+    Args:
+        especialidade: Especialidade desejada (ex: 'Cardiologia'; aceita parte do nome).
+        data_inicio: Opcional. Só horários a partir desta data ('AAAA-MM-DD' ou 'DD/MM/AAAA').
+        data_fim: Opcional. Só horários até esta data, inclusive.
+        medico: Opcional. Parte do nome do médico para filtrar.
+        periodo: Opcional. 'manha' (antes das 12h), 'tarde' (12h às 18h) ou 'noite' (a partir das 18h).
+        limite: Opcional. Quantos horários trazer (padrão 10, máximo 25).
+        cursor: Opcional. ID do último horário já mostrado, para ver os próximos.
     """
     if not especialidade:
-        return "Especialidade não fornecida."
+        return ToolResult("Especialidade não fornecida.", status("parametros_faltando"))
 
-    print(f"--- FERRAMENTA DB: Buscando horários para: {especialidade} ---")
+    log.debug("Buscando horários de consulta", extra=campos(
+        especialidade=especialidade, medico=medico, data_inicio=data_inicio, data_fim=data_fim, periodo=periodo, cursor=cursor))
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        inicio, fim, horas, limite, depois_de = _filtros_horarios(data_inicio, data_fim, periodo, limite, cursor)
+    except ValueError as e:
+        return ToolResult(f"Erro: {e}.", status("filtro_invalido", detalhe=str(e)))
 
-        # Query SQL que junta medicos e horarios, filtrando por especialidade e status
-        query = """
-        SELECT h.id, m.nome, h.data_hora_inicio
-        FROM horarios_disponiveis h
-        JOIN medicos m ON h.medico_id = m.id
-        WHERE m.especialidade LIKE ? AND h.status = 'disponivel'
-        ORDER BY h.data_hora_inicio;
-        """
-
-        # Usamos '%' para permitir buscas parciais (ex: 'Cardio' encontra 'Cardiologia')
-        cursor.execute(query, ('%' + especialidade + '%',))
-        resultados = cursor.fetchall()
-        conn.close()
-
-        if not resultados:
-            print("--- FERRAMENTA DB: Nenhum horário encontrado. ---")
-            return f"Desculpe, não encontramos horários disponíveis para a especialidade '{especialidade}'."
-
-        # Formata a saída para a IA ler
-        # Ex: "ID 1: Dra. Ana Silva - 2025-10-24 09:00:00; ID 2: ..."
-        horarios_formatados = []
-        for (id, nome, data_hora) in resultados:
-            horarios_formatados.append(f"[ID {id}: {nome} - {data_hora}]")
-
-        resposta = "; ".join(horarios_formatados)
-        print(f"--- FERRAMENTA DB: Horários encontrados: {resposta} ---")
+    try:
+        # Resolve a especialidade pelo cache de referência (busca parcial: 'Cardio' encontra 'Cardiologia')
+        cache = get_reference_cache(DATABASE_FILE)
+        especialidades = cache.especialidades_por_termo(especialidade)
+
+        livres = []
+        if especialidades:
+            index = get_availability_index(DATABASE_FILE)
+            filtros = {"inicio": inicio, "fim": fim, "horas": horas, "limite": limite + 1,
+                       "depois_de": depois_de}
+            if medico:
+                # Médicos com esse nome dentro da especialidade pedida
+                da_especialidade = set(cache.medicos_por_especialidade(especialidade))
+                donos = [m for m in cache.medicos_por_nome(medico) if m in da_especialidade]
+                livres = index.livres("consulta", donos=donos, **filtros) if donos else []
+            else:
+                livres = index.livres("consulta", especialidades=especialidades, **filtros)
+
+        if not livres:
+            log.info("Nenhum horário de consulta encontrado", extra=campos(especialidade=especialidade))
+            if any((data_inicio, data_fim, medico, periodo, cursor)):
+                return ToolResult(f"Desculpe, não encontramos horários disponíveis para a especialidade '{especialidade}' com esses filtros.",
+                                  status("sem_horarios", com_filtros=True))
+            return ToolResult(f"Desculpe, não encontramos horários disponíveis para a especialidade '{especialidade}'.",
+                              status("sem_horarios"))
+
+        # Formata a saída para a IA ler (texto e, para o RAG, os dados tipados)
+        itens = [(id, cache.nome_medico(medico_id), data_hora) for (id, medico_id, data_hora) in livres[:limite]]
+        resposta = _formatar_pagina(itens, len(livres) > limite)
+        log.debug("Horários de consulta encontrados", extra=campos(quantidade=len(itens), resultado=resposta))
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao consultar horários: {e} ---")
-        return "Ocorreu um erro ao consultar os horários."
+        log.exception("Erro ao consultar horários de consulta", extra=campos(especialidade=especialidade))
+        return ToolResult("Ocorreu um erro ao consultar os horários.", status("erro_banco"))
     
-
-def tool_marcar_agendamento(horario_id: int, nome_paciente: str, telegram_chat_id: str) -> str:
+def tool_marcar_agendamento(horario_id: int, nome_paciente: str, telegram_chat_id: str) -> ToolResult:
     """
-    Marca um agendamento.
-    1. Atualiza o status do horário para 'agendado'.
+    Marca um agendamento de forma atômica (à prova de dois workers agendando o mesmo horário).
+    1. Atualiza o status do horário para 'agendado' SÓ SE ele ainda estiver 'disponivel'.
     2. Insere o agendamento na tabela 'agendamentos'.
+    Tudo roda numa única transação BEGIN IMMEDIATE.
     Retorna uma mensagem de sucesso ou erro.
     """
     if not horario_id or not nome_paciente or not telegram_chat_id:
-        return "Erro: ID do horário, nome do paciente e ID do chat são obrigatórios."
+        return ToolResult("Erro: ID do horário, nome do paciente e ID do chat são obrigatórios.", status("parametros_faltando"))
+    if _id_inteiro(horario_id) is None:
+        return ToolResult(f"Erro: ID inválido ({horario_id}). Use o número do horário.", status("id_invalido", id=str(horario_id)))
+    horario_id = _id_inteiro(horario_id)
+
+    log.debug("Tentando agendar consulta", extra=campos(horario_id=horario_id, nome_paciente=nome_paciente))
+
+    marcado = {"id": horario_id}  # Id da linha marcada (horário da agenda recorrente só ganha linha agora)
+
+    def _marcar(conn):
+        if is_virtual(horario_id):
+            # Horário gerado pelos modelos da agenda: vira linha dentro desta mesma transação
+            marcado["id"] = get_schedule_engine(DATABASE_FILE).materializar(conn, "consulta", horario_id)
+            if marcado["id"] is None:
+                return "inexistente"
+
+        # Etapa 1: Reserva o horário (o WHERE status = 'disponivel' garante que só um ganha)
+        cursor = conn.execute(
+            "UPDATE horarios_disponiveis SET status = 'agendado' WHERE id = ? AND status = 'disponivel'",
+            (marcado["id"],)
+        )
+        if cursor.rowcount != 1:
+            # Só no caminho de erro descobrimos o motivo (não existe x já ocupado)
+            existe = conn.execute("SELECT 1 FROM horarios_disponiveis WHERE id = ?", (marcado["id"],)).fetchone()
+            return "inexistente" if not existe else "ocupado"
 
-    print(f"--- FERRAMENTA DB: Tentando agendar ID {horario_id} para {nome_paciente} ---")
+        # Etapa 2: Inserir na tabela de agendamentos
+        conn.execute(
+            "INSERT INTO agendamentos (horario_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
+            (marcado["id"], nome_paciente, telegram_chat_id)
+        )
+        return "ok"
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar se o horário ainda está 'disponivel'
-        cursor.execute("SELECT status FROM horarios_disponiveis WHERE id = ?", (horario_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Horário ID não encontrado. ---")
-            return f"Erro: O ID de horário {horario_id} não existe."
-
-        if result[0] != 'disponivel':
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Horário não está mais disponível. ---")
-            return f"Desculpe, o horário {horario_id} não está mais disponível. Alguém pode ter agendado."
-
-        # Etapa 2: Atualizar o status do horário
-        cursor.execute("UPDATE horarios_disponiveis SET status = 'agendado' WHERE id = ?", (horario_id,))
+        resultado = write_transaction(DATABASE_FILE, _marcar)
 
-        # Etapa 3: Inserir na tabela de agendamentos
-        cursor.execute(
-            "INSERT INTO agendamentos (horario_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
-            (horario_id, nome_paciente, telegram_chat_id)
-        )
+        if resultado == "inexistente":
+            log.info("Horário de consulta não encontrado", extra=campos(horario_id=horario_id))
+            return ToolResult(f"Erro: O ID de horário {horario_id} não existe.", status("horario_inexistente", id=horario_id))
 
-        conn.commit()
-        conn.close()
+        if resultado == "ocupado":
+            log.info("Horário de consulta não está mais disponível", extra=campos(horario_id=horario_id))
+            return ToolResult(f"Desculpe, o horário {horario_id} não está mais disponível. Alguém pode ter agendado.",
+                              status("horario_ocupado", id=horario_id))
 
-        print("--- FERRAMENTA DB: Agendamento realizado com sucesso. ---")
-        return "Agendamento confirmado com sucesso!"
+        _atualizar_indice("consulta", marcado["id"])
+        log.info("Agendamento de consulta realizado", extra=campos(horario_id=marcado["id"]))
+        return ToolResult("Agendamento confirmado com sucesso!", status("confirmado"))
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao marcar agendamento: {e} ---")
-        return f"Ocorreu um erro de banco de dados ao tentar marcar o agendamento: {e}"
+        log.exception("Erro ao marcar agendamento de consulta", extra=campos(horario_id=horario_id))
+        return ToolResult(f"Ocorreu um erro de banco de dados ao tentar marcar o agendamento: {e}", status("erro_banco"))
     
  
-
-def tool_listar_meus_agendamentos(telegram_chat_id: str) -> str:
+def tool_listar_meus_agendamentos(telegram_chat_id: str) -> ToolResult:
     """
     Busca os agendamentos futuros confirmados de um usuário específico.
-    Retorna uma string formatada com os IDs dos agendamentos ou "nenhum encontrado".
+    Retorna o texto com os IDs dos agendamentos ou "nenhum encontrado".
     """
     if not telegram_chat_id:
-        return "Erro: ID do chat do Telegram não fornecido."
+        return ToolResult("Erro: ID do chat do Telegram não fornecido.", status("parametros_faltando"))
 
-    print(f"--- FERRAMENTA DB: Listando agendamentos para Chat ID: {telegram_chat_id} ---")
+    log.debug("Listando agendamentos de consulta")
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = get_connection(DATABASE_FILE)
         cursor = conn.cursor()
 
-        # Query que busca agendamentos confirmados futuros do usuário,
-        # juntando com médicos e horários
+        # Query que busca agendamentos confirmados futuros do usuário, juntando com os horários
+        # (o nome do médico vem do cache de referência, sem JOIN com 'medicos')
         query = """
-        SELECT a.id, m.nome, h.data_hora_inicio
+        SELECT a.id, h.medico_id, h.data_hora_inicio
         FROM agendamentos a
         JOIN horarios_disponiveis h ON a.horario_id = h.id
-        JOIN medicos m ON h.medico_id = m.id
         WHERE a.telegram_chat_id = ? AND a.status = 'confirmado' AND h.data_hora_inicio > datetime('now', 'localtime')
         ORDER BY h.data_hora_inicio;
         """
         # Nota: datetime('now', 'localtime') pega a data/hora atual no fuso horário do servidor
 
         cursor.execute(query, (telegram_chat_id,))
-        resultados = cursor.fetchall()
-        conn.close()
+        cache = get_reference_cache(DATABASE_FILE)
+        resultados = [(id, cache.nome_medico(medico_id), data_hora)
+                      for (id, medico_id, data_hora) in cursor.fetchall()]
 
         if not resultados:
-            print("--- FERRAMENTA DB: Nenhum agendamento futuro encontrado. ---")
-            return "Você não possui agendamentos futuros confirmados."
+            log.debug("Nenhum agendamento de consulta futuro")
+            return ToolResult("Você não possui agendamentos futuros confirmados.", lista("agendamentos", []))
 
         # Formata a saída para a IA ler, incluindo o ID do AGENDAMENTO (a.id)
         agendamentos_formatados = []
         for (id_agendamento, nome_medico, data_hora) in resultados:
             agendamentos_formatados.append(f"[ID {id_agendamento}: {nome_medico} - {data_hora}]")
 
-        resposta = "; ".join(agendamentos_formatados)
-        print(f"--- FERRAMENTA DB: Agendamentos encontrados: {resposta} ---")
+        resposta = ToolResult("; ".join(agendamentos_formatados), lista("agendamentos", resultados))
+        log.debug("Agendamentos de consulta encontrados", extra=campos(quantidade=len(resultados), resultado=resposta))
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao listar agendamentos: {e} ---")
-        return f"Ocorreu um erro ao consultar seus agendamentos: {e}"
+        log.exception("Erro ao listar agendamentos de consulta")
+        return ToolResult(f"Ocorreu um erro ao consultar seus agendamentos: {e}", status("erro_banco"))
 
-def tool_cancelar_agendamento(agendamento_id: int, telegram_chat_id: str) -> str:
+def tool_cancelar_agendamento(agendamento_id: int, telegram_chat_id: str) -> ToolResult:
     """
-    Cancela um agendamento específico do usuário.
-    1. Verifica se o agendamento pertence ao usuário.
+    Cancela um agendamento específico do usuário, de forma atômica.
+    1. Libera o horário ('disponivel') SÓ SE o agendamento for do usuário e estiver confirmado.
     2. Atualiza o status do agendamento para 'cancelado'.
-    3. Atualiza o status do horário correspondente de volta para 'disponivel'.
+    Tudo roda numa única transação BEGIN IMMEDIATE.
     Retorna uma mensagem de sucesso ou erro.
     """
     if not agendamento_id or not telegram_chat_id:
-        return "Erro: ID do agendamento e ID do chat são obrigatórios."
-
-    print(f"--- FERRAMENTA DB: Tentando cancelar agendamento ID {agendamento_id} para Chat ID {telegram_chat_id} ---")
-
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar se o agendamento existe, pertence ao usuário e está confirmado
-        cursor.execute(
-            "SELECT horario_id, status FROM agendamentos WHERE id = ? AND telegram_chat_id = ?",
+        return ToolResult("Erro: ID do agendamento e ID do chat são obrigatórios.", status("parametros_faltando"))
+    if _id_inteiro(agendamento_id) is None:
+        return ToolResult(f"Erro: ID inválido ({agendamento_id}). Use o número do agendamento.",
+                          status("id_invalido", id=str(agendamento_id)))
+    agendamento_id = _id_inteiro(agendamento_id)
+
+    log.debug("Tentando cancelar agendamento de consulta", extra=campos(agendamento_id=agendamento_id))
+    liberado = {}
+
+    def _cancelar(conn):
+        # Etapa 1: Libera o horário, validando dono e status do agendamento no mesmo comando
+        cursor = conn.execute(
+            """
+            UPDATE horarios_disponiveis SET status = 'disponivel'
+            WHERE id = (SELECT horario_id FROM agendamentos
+                        WHERE id = ? AND telegram_chat_id = ? AND status = 'confirmado')
+            """,
             (agendamento_id, telegram_chat_id)
         )
-        result = cursor.fetchone()
-
-        if not result:
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Agendamento não encontrado ou não pertence ao usuário. ---")
-            return f"Erro: Agendamento com ID {agendamento_id} não encontrado ou não pertence a você."
-
-        horario_id, status_agendamento = result
-
-        if status_agendamento != 'confirmado':
-            conn.close()
-            print(f"--- FERRAMENTA DB: Erro - Agendamento já está '{status_agendamento}'. ---")
-            return f"Este agendamento (ID {agendamento_id}) não está confirmado (status atual: {status_agendamento}), portanto não pode ser cancelado."
+        if cursor.rowcount != 1:
+            # Caminho de erro: descobre se o agendamento não existe ou já não está confirmado
+            row = conn.execute(
+                "SELECT status FROM agendamentos WHERE id = ? AND telegram_chat_id = ?",
+                (agendamento_id, telegram_chat_id)
+            ).fetchone()
+            return row[0] if row else None
 
         # Etapa 2: Atualizar o status do agendamento para 'cancelado'
-        cursor.execute("UPDATE agendamentos SET status = 'cancelado' WHERE id = ?", (agendamento_id,))
+        conn.execute("UPDATE agendamentos SET status = 'cancelado' WHERE id = ?", (agendamento_id,))
+        liberado["horario_id"] = conn.execute(
+            "SELECT horario_id FROM agendamentos WHERE id = ?", (agendamento_id,)).fetchone()[0]
+        return "ok"
+
+    try:
+        resultado = write_transaction(DATABASE_FILE, _cancelar)
 
-        # Etapa 3: Atualizar o status do horário de volta para 'disponivel'
-        cursor.execute("UPDATE horarios_disponiveis SET status = 'disponivel' WHERE id = ?", (horario_id,))
+        if resultado is None:
+            log.info("Agendamento de consulta não encontrado ou de outro usuário", extra=campos(
+                agendamento_id=agendamento_id))
+            return ToolResult(f"Erro: Agendamento com ID {agendamento_id} não encontrado ou não pertence a você.",
+                              status("agendamento_nao_encontrado", id=agendamento_id))
 
-        conn.commit()
-        conn.close()
+        if resultado != "ok":
+            log.info("Agendamento de consulta não está confirmado", extra=campos(
+                agendamento_id=agendamento_id, status=resultado))
+            return ToolResult(f"Este agendamento (ID {agendamento_id}) não está confirmado (status atual: {resultado}), portanto não pode ser cancelado.",
+                              status("nao_confirmado", id=agendamento_id, status_atual=resultado))
 
-        print("--- FERRAMENTA DB: Agendamento cancelado com sucesso. Horário liberado. ---")
-        return "Agendamento cancelado com sucesso!"
+        _atualizar_indice("consulta", liberado["horario_id"])
+        log.info("Agendamento de consulta cancelado, horário liberado", extra=campos(
+            agendamento_id=agendamento_id, horario_id=liberado["horario_id"]))
+        return ToolResult("Agendamento cancelado com sucesso!", status("cancelado"))
 
     except Exception as e:
-        conn.rollback() # Desfaz as alterações se der erro
-        conn.close()
-        print(f"--- FERRAMENTA DB: ERRO ao cancelar agendamento: {e} ---")
-        return f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento: {e}"
+        # A transação já foi desfeita pelo write_transaction
+        log.exception("Erro ao cancelar agendamento de consulta", extra=campos(agendamento_id=agendamento_id))
+        return ToolResult(f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento: {e}", status("erro_banco"))
     
-def tool_consultar_exames_disponiveis() -> str:
+def tool_consultar_exames_disponiveis() -> ToolResult:
     """
     Lista os tipos de exames simples disponíveis para agendamento.
     """
-    print(f"--- FERRAMENTA DB: Listando tipos de exames disponíveis ---")
+    log.debug("Listando tipos de exames")
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT nome_exame FROM exames ORDER BY nome_exame;")
-        resultados = cursor.fetchall()
-        conn.close()
+        # A lista (e a string formatada) só é refeita quando a tabela 'exames' muda
+        cache = get_reference_cache(DATABASE_FILE)
+        resposta = cache.derived("lista_exames", lambda: "; ".join(nome for (_, nome) in cache.get_exames()))
 
-        if not resultados:
-            return "Não há tipos de exames cadastrados no momento."
+        if not resposta:
+            return ToolResult("Não há tipos de exames cadastrados no momento.", status("sem_exames"))
 
-        nomes_exames = [r[0] for r in resultados]
-        resposta = "; ".join(nomes_exames)
-        print(f"--- FERRAMENTA DB: Exames encontrados: {resposta} ---")
-        return resposta
+        log.debug("Exames encontrados", extra=campos(resultado=resposta))
+        return ToolResult(resposta)
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao listar exames: {e} ---")
-        return f"Ocorreu um erro ao consultar os tipos de exames: {e}"
+        log.exception("Erro ao listar exames")
+        return ToolResult(f"Ocorreu um erro ao consultar os tipos de exames: {e}", status("erro_banco"))
 
-def tool_consultar_horarios_exames(tipo_exame: str) -> str:
+def tool_consultar_horarios_exames(tipo_exame: str, data_inicio: Optional[str] = None,
+                                   data_fim: Optional[str] = None, periodo: Optional[str] = None,
+                                   limite: Optional[int] = None, cursor: Optional[int] = None) -> ToolResult:
     """
-    Busca horários disponíveis para um tipo específico de exame.
-    Retorna uma string formatada com IDs ou "não encontrado".
+    Busca os próximos horários livres para um tipo de exame, em ordem de data, com os IDs.
+    Retorna no máximo 'limite' horários (padrão 10, máximo 25); se houver mais, o texto traz o cursor da próxima página.
+
+    Args:
+        tipo_exame: Exame desejado (ex: 'Hemograma'; aceita parte do nome).
+        data_inicio: Opcional. Só horários a partir desta data ('AAAA-MM-DD' ou 'DD/MM/AAAA').
+        data_fim: Opcional. Só horários até esta data, inclusive.
+        periodo: Opcional. 'manha' (antes das 12h), 'tarde' (12h às 18h) ou 'noite' (a partir das 18h).
+        limite: Opcional. Quantos horários trazer (padrão 10, máximo 25).
+        cursor: Opcional. ID do último horário já mostrado, para ver os próximos.
     """
     if not tipo_exame:
-        return "Tipo de exame não fornecido."
+        return ToolResult("Tipo de exame não fornecido.", status("parametros_faltando"))
 
-    print(f"--- FERRAMENTA DB: Buscando horários para exame: {tipo_exame} ---")
+    log.debug("Buscando horários de exame", extra=campos(
+        tipo_exame=tipo_exame, data_inicio=data_inicio, data_fim=data_fim, periodo=periodo, cursor=cursor))
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        query = """
-        SELECT h.id, h.data_hora_inicio
-        FROM horarios_exames h
-        JOIN exames e ON h.exame_id = e.id
-        WHERE e.nome_exame LIKE ? AND h.status = 'disponivel'
-        ORDER BY h.data_hora_inicio;
-        """
-        cursor.execute(query, ('%' + tipo_exame + '%',))
-        resultados = cursor.fetchall()
-        conn.close()
-
-        if not resultados:
-            print("--- FERRAMENTA DB: Nenhum horário encontrado para este exame. ---")
-            return f"Desculpe, não encontramos horários disponíveis para '{tipo_exame}'."
+        inicio, fim, horas, limite, depois_de = _filtros_horarios(data_inicio, data_fim, periodo, limite, cursor)
+    except ValueError as e:
+        return ToolResult(f"Erro: {e}.", status("filtro_invalido", detalhe=str(e)))
 
-        horarios_formatados = []
-        for (id_horario, data_hora) in resultados:
-            horarios_formatados.append(f"[ID {id_horario}: {data_hora}]")
-
-        resposta = "; ".join(horarios_formatados)
-        print(f"--- FERRAMENTA DB: Horários de exame encontrados: {resposta} ---")
+    try:
+        # Resolve o exame pelo cache de referência (busca parcial, como o LIKE antigo)
+        exame_ids = get_reference_cache(DATABASE_FILE).exames_por_nome(tipo_exame)
+
+        livres = []
+        if exame_ids:
+            livres = get_availability_index(DATABASE_FILE).livres(
+                "exame", donos=exame_ids, inicio=inicio, fim=fim, horas=horas, limite=limite + 1,
+                depois_de=depois_de)
+
+        if not livres:
+            log.info("Nenhum horário de exame encontrado", extra=campos(tipo_exame=tipo_exame))
+            if any((data_inicio, data_fim, periodo, cursor)):
+                return ToolResult(f"Desculpe, não encontramos horários disponíveis para '{tipo_exame}' com esses filtros.",
+                                  status("sem_horarios", com_filtros=True))
+            return ToolResult(f"Desculpe, não encontramos horários disponíveis para '{tipo_exame}'.", status("sem_horarios"))
+
+        itens = [(id_horario, None, data_hora) for (id_horario, _, data_hora) in livres[:limite]]
+        resposta = _formatar_pagina(itens, len(livres) > limite)
+        log.debug("Horários de exame encontrados", extra=campos(quantidade=len(itens), resultado=resposta))
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao consultar horários de exame: {e} ---")
-        return f"Ocorreu um erro ao consultar os horários para '{tipo_exame}': {e}"
+        log.exception("Erro ao consultar horários de exame", extra=campos(tipo_exame=tipo_exame))
+        return ToolResult(f"Ocorreu um erro ao consultar os horários para '{tipo_exame}': {e}", status("erro_banco"))
 
-def tool_marcar_exame(horario_exame_id: int, nome_paciente: str, telegram_chat_id: str) -> str:
+def tool_marcar_exame(horario_exame_id: int, nome_paciente: str, telegram_chat_id: str) -> ToolResult:
     """
-    Marca um agendamento de exame.
-    1. Verifica se o horário está disponível.
-    2. Atualiza o status do horário para 'agendado'.
-    3. Insere o agendamento na tabela 'agendamentos_exames'.
+    Marca um agendamento de exame de forma atômica.
+    1. Atualiza o status do horário para 'agendado' SÓ SE ele ainda estiver 'disponivel'.
+    2. Insere o agendamento na tabela 'agendamentos_exames'.
+    Tudo roda numa única transação BEGIN IMMEDIATE.
     Retorna uma mensagem de sucesso ou erro.
     """
     if not horario_exame_id or not nome_paciente or not telegram_chat_id:
-        return "Erro: ID do horário do exame, nome do paciente e ID do chat são obrigatórios."
-
-    print(f"--- FERRAMENTA DB: Tentando agendar exame (Horário ID {horario_exame_id}) para {nome_paciente} ---")
-
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar disponibilidade
-        cursor.execute("SELECT status FROM horarios_exames WHERE id = ?", (horario_exame_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            conn.close(); return f"Erro: O ID de horário de exame {horario_exame_id} não existe."
-        if result[0] != 'disponivel':
-            conn.close(); return f"Desculpe, o horário {horario_exame_id} não está mais disponível."
-
-        # Etapa 2: Atualizar status do horário
-        cursor.execute("UPDATE horarios_exames SET status = 'agendado' WHERE id = ?", (horario_exame_id,))
+        return ToolResult("Erro: ID do horário do exame, nome do paciente e ID do chat são obrigatórios.", status("parametros_faltando"))
+    if _id_inteiro(horario_exame_id) is None:
+        return ToolResult(f"Erro: ID inválido ({horario_exame_id}). Use o número do horário.",
+                          status("id_invalido", id=str(horario_exame_id)))
+    horario_exame_id = _id_inteiro(horario_exame_id)
+
+    log.debug("Tentando agendar exame", extra=campos(horario_exame_id=horario_exame_id, nome_paciente=nome_paciente))
+
+    marcado = {"id": horario_exame_id}  # Id da linha marcada (horário da agenda recorrente só ganha linha agora)
+
+    def _marcar(conn):
+        if is_virtual(horario_exame_id):
+            # Horário gerado pelos modelos da agenda: vira linha dentro desta mesma transação
+            marcado["id"] = get_schedule_engine(DATABASE_FILE).materializar(conn, "exame", horario_exame_id)
+            if marcado["id"] is None:
+                return "inexistente"
+
+        # Etapa 1: Reserva o horário só se ainda estiver livre
+        cursor = conn.execute(
+            "UPDATE horarios_exames SET status = 'agendado' WHERE id = ? AND status = 'disponivel'",
+            (marcado["id"],)
+        )
+        if cursor.rowcount != 1:
+            existe = conn.execute("SELECT 1 FROM horarios_exames WHERE id = ?", (marcado["id"],)).fetchone()
+            return "inexistente" if not existe else "ocupado"
 
-        # Etapa 3: Inserir na tabela de agendamentos de exames
-        cursor.execute(
+        # Etapa 2: Inserir na tabela de agendamentos de exames
+        conn.execute(
             "INSERT INTO agendamentos_exames (horario_exame_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
-            (horario_exame_id, nome_paciente, telegram_chat_id)
+            (marcado["id"], nome_paciente, telegram_chat_id)
         )
+        return "ok"
+
+    try:
+        resultado = write_transaction(DATABASE_FILE, _marcar)
 
-        conn.commit()
-        conn.close()
+        if resultado == "inexistente":
+            return ToolResult(f"Erro: O ID de horário de exame {horario_exame_id} não existe.",
+                              status("horario_inexistente", id=horario_exame_id))
+        if resultado == "ocupado":
+            return ToolResult(f"Desculpe, o horário {horario_exame_id} não está mais disponível.",
+                              status("horario_ocupado", id=horario_exame_id))
 
-        print("--- FERRAMENTA DB: Agendamento de exame realizado com sucesso. ---")
-        return "Agendamento de exame confirmado com sucesso!"
+        _atualizar_indice("exame", marcado["id"])
+        log.info("Agendamento de exame realizado", extra=campos(horario_exame_id=marcado["id"]))
+        return ToolResult("Agendamento de exame confirmado com sucesso!", status("confirmado"))
 
     except Exception as e:
-        conn.rollback()
-        conn.close()
-        print(f"--- FERRAMENTA DB: ERRO ao marcar agendamento de exame: {e} ---")
-        return f"Ocorreu um erro de banco de dados ao tentar marcar o exame: {e}"
+        log.exception("Erro ao marcar agendamento de exame", extra=campos(horario_exame_id=horario_exame_id))
+        return ToolResult(f"Ocorreu um erro de banco de dados ao tentar marcar o exame: {e}", status("erro_banco"))
     
-def tool_listar_meus_exames_agendados(telegram_chat_id: str) -> str:
+def tool_listar_meus_exames_agendados(telegram_chat_id: str) -> ToolResult:
     """
     Busca os agendamentos de exames futuros confirmados de um usuário específico.
-    Retorna uma string formatada com os IDs dos agendamentos de exame ou "nenhum encontrado".
+    Retorna o texto com os IDs dos agendamentos de exame ou "nenhum encontrado".
     """
     if not telegram_chat_id:
-        return "Erro: ID do chat do Telegram não fornecido."
+        return ToolResult("Erro: ID do chat do Telegram não fornecido.", status("parametros_faltando"))
 
-    print(f"--- FERRAMENTA DB: Listando agendamentos de EXAMES para Chat ID: {telegram_chat_id} ---")
+    log.debug("Listando agendamentos de exame")
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = get_connection(DATABASE_FILE)
         cursor = conn.cursor()
 
-        # Query que busca agendamentos de exames confirmados futuros do usuário,
-        # juntando com exames (nome) e horários (data/hora)
+        # Query que busca agendamentos de exames confirmados futuros do usuário, juntando com os horários
+        # (o nome do exame vem do cache de referência, sem JOIN com 'exames')
         query = """
-        SELECT ae.id, e.nome_exame, he.data_hora_inicio
+        SELECT ae.id, he.exame_id, he.data_hora_inicio
         FROM agendamentos_exames ae
         JOIN horarios_exames he ON ae.horario_exame_id = he.id
-        JOIN exames e ON he.exame_id = e.id
         WHERE ae.telegram_chat_id = ? AND ae.status = 'confirmado' AND he.data_hora_inicio > datetime('now', 'localtime')
         ORDER BY he.data_hora_inicio;
         """
 
         cursor.execute(query, (telegram_chat_id,))
-        resultados = cursor.fetchall()
-        conn.close()
+        cache = get_reference_cache(DATABASE_FILE)
+        resultados = [(id, cache.nome_exame(exame_id), data_hora)
+                      for (id, exame_id, data_hora) in cursor.fetchall()]
 
         if not resultados:
-            print("--- FERRAMENTA DB: Nenhum agendamento de exame futuro encontrado. ---")
-            return "Você não possui agendamentos de exames futuros confirmados."
+            log.debug("Nenhum agendamento de exame futuro")
+            return ToolResult("Você não possui agendamentos de exames futuros confirmados.", lista("agendamentos", []))
 
         # Formata a saída para a IA ler, incluindo o ID do AGENDAMENTO DE EXAME (ae.id)
         agendamentos_formatados = []
         for (id_agendamento_exame, nome_exame, data_hora) in resultados:
             agendamentos_formatados.append(f"[ID {id_agendamento_exame}: {nome_exame} - {data_hora}]")
 
-        resposta = "; ".join(agendamentos_formatados)
-        print(f"--- FERRAMENTA DB: Agendamentos de exame encontrados: {resposta} ---")
+        resposta = ToolResult("; ".join(agendamentos_formatados), lista("agendamentos", resultados, coluna_nome="exame"))
+        log.debug("Agendamentos de exame encontrados", extra=campos(quantidade=len(resultados), resultado=resposta))
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao listar agendamentos de exames: {e} ---")
-        return f"Ocorreu um erro ao consultar seus agendamentos de exames: {e}"
+        log.exception("Erro ao listar agendamentos de exame")
+        return ToolResult(f"Ocorreu um erro ao consultar seus agendamentos de exames: {e}", status("erro_banco"))
 
-def tool_cancelar_exame(agendamento_exame_id: int, telegram_chat_id: str) -> str:
+def tool_cancelar_exame(agendamento_exame_id: int, telegram_chat_id: str) -> ToolResult:
     """
-    Cancela um agendamento de exame específico do usuário.
-    1. Verifica se o agendamento de exame pertence ao usuário.
+    Cancela um agendamento de exame específico do usuário, de forma atômica.
+    1. Libera o horário de exame SÓ SE o agendamento for do usuário e estiver confirmado.
     2. Atualiza o status do agendamento de exame para 'cancelado'.
-    3. Atualiza o status do horário de exame correspondente de volta para 'disponivel'.
+    Tudo roda numa única transação BEGIN IMMEDIATE.
     Retorna uma mensagem de sucesso ou erro.
     """
     if not agendamento_exame_id or not telegram_chat_id:
-        return "Erro: ID do agendamento de exame e ID do chat são obrigatórios."
-
-    print(f"--- FERRAMENTA DB: Tentando cancelar agendamento de EXAME ID {agendamento_exame_id} para Chat ID {telegram_chat_id} ---")
-
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar se o agendamento existe, pertence ao usuário e está confirmado
-        cursor.execute(
-            "SELECT horario_exame_id, status FROM agendamentos_exames WHERE id = ? AND telegram_chat_id = ?",
+        return ToolResult("Erro: ID do agendamento de exame e ID do chat são obrigatórios.", status("parametros_faltando"))
+    if _id_inteiro(agendamento_exame_id) is None:
+        return ToolResult(f"Erro: ID inválido ({agendamento_exame_id}). Use o número do agendamento.",
+                          status("id_invalido", id=str(agendamento_exame_id)))
+    agendamento_exame_id = _id_inteiro(agendamento_exame_id)
+
+    log.debug("Tentando cancelar agendamento de exame", extra=campos(agendamento_exame_id=agendamento_exame_id))
+    liberado = {}
+
+    def _cancelar(conn):
+        # Etapa 1: Libera o horário de exame, validando dono e status no mesmo comando
+        cursor = conn.execute(
+            """
+            UPDATE horarios_exames SET status = 'disponivel'
+            WHERE id = (SELECT horario_exame_id FROM agendamentos_exames
+                        WHERE id = ? AND telegram_chat_id = ? AND status = 'confirmado')
+            """,
             (agendamento_exame_id, telegram_chat_id)
         )
-        result = cursor.fetchone()
-
-        if not result:
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Agendamento de exame não encontrado ou não pertence ao usuário. ---")
-            return f"Erro: Agendamento de exame com ID {agendamento_exame_id} não encontrado ou não pertence a você."
-
-        horario_exame_id, status_agendamento = result
-
-        if status_agendamento != 'confirmado':
-            conn.close()
-            print(f"--- FERRAMENTA DB: Erro - Agendamento de exame já está '{status_agendamento}'. ---")
-            return f"Este agendamento de exame (ID {agendamento_exame_id}) não está confirmado (status atual: {status_agendamento}), portanto não pode ser cancelado."
+        if cursor.rowcount != 1:
+            row = conn.execute(
+                "SELECT status FROM agendamentos_exames WHERE id = ? AND telegram_chat_id = ?",
+                (agendamento_exame_id, telegram_chat_id)
+            ).fetchone()
+            return row[0] if row else None
 
         # Etapa 2: Atualizar o status do agendamento de exame para 'cancelado'
-        cursor.execute("UPDATE agendamentos_exames SET status = 'cancelado' WHERE id = ?", (agendamento_exame_id,))
+        conn.execute("UPDATE agendamentos_exames SET status = 'cancelado' WHERE id = ?", (agendamento_exame_id,))
+        liberado["horario_exame_id"] = conn.execute(
+            "SELECT horario_exame_id FROM agendamentos_exames WHERE id = ?", (agendamento_exame_id,)).fetchone()[0]
+        return "ok"
+
+    try:
+        resultado = write_transaction(DATABASE_FILE, _cancelar)
 
-        # Etapa 3: Atualizar o status do horário de exame de volta para 'disponivel'
-        # (Certifique-se que a tabela é horarios_exames)
-        cursor.execute("UPDATE horarios_exames SET status = 'disponivel' WHERE id = ?", (horario_exame_id,))
+        if resultado is None:
+            log.info("Agendamento de exame não encontrado ou de outro usuário", extra=campos(
+                agendamento_exame_id=agendamento_exame_id))
+            return ToolResult(f"Erro: Agendamento de exame com ID {agendamento_exame_id} não encontrado ou não pertence a você.",
+                              status("agendamento_nao_encontrado", id=agendamento_exame_id))
 
-        conn.commit()
-        conn.close()
+        if resultado != "ok":
+            log.info("Agendamento de exame não está confirmado", extra=campos(
+                agendamento_exame_id=agendamento_exame_id, status=resultado))
+            return ToolResult(f"Este agendamento de exame (ID {agendamento_exame_id}) não está confirmado (status atual: {resultado}), portanto não pode ser cancelado.",
+                              status("nao_confirmado", id=agendamento_exame_id, status_atual=resultado))
 
-        print("--- FERRAMENTA DB: Agendamento de exame cancelado com sucesso. Horário liberado. ---")
-        return "Agendamento de exame cancelado com sucesso!"
+        _atualizar_indice("exame", liberado["horario_exame_id"])
+        log.info("Agendamento de exame cancelado, horário liberado", extra=campos(
+            agendamento_exame_id=agendamento_exame_id, horario_exame_id=liberado["horario_exame_id"]))
+        return ToolResult("Agendamento de exame cancelado com sucesso!", status("cancelado"))
 
     except Exception as e:
-        conn.rollback() # Desfaz as alterações se der erro
-        conn.close()
-        print(f"--- FERRAMENTA DB: ERRO ao cancelar agendamento de exame: {e} ---")
-        return f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento do exame: {e}"
\ No newline at end of file
+        # A transação já foi desfeita pelo write_transaction
+        log.exception("Erro ao cancelar agendamento de exame", extra=campos(agendamento_exame_id=agendamento_exame_id))
+        return ToolResult(f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento do exame: {e}", status("erro_banco"))
\ No newline at end of file
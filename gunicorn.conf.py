@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+# Carregado automaticamente pelo 'gunicorn api:app' (procfile).
+import os
+
+from database_pool import close_all_connections
+
+# GUNICORN_PRELOAD=1: o master importa o app (e o google.generativeai) uma vez e os workers
+# herdam tudo no fork, em vez de cada um importar de novo. Os workers sobem quase na hora,
+# mas mudanças no código só valem reiniciando o master (não só os workers).
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        from config import warm_up_model
+        # Síncrono: nada de thread de import rodando no master na hora do fork
+        warm_up_model()
+        # Conexões SQLite abertas no master (migrações, índice) não podem ser usadas pelos filhos
+        close_all_connections()
+
+
+def post_worker_init(worker):
+    from config import GEMINI_WARMUP, warm_up_model
+
+    # O worker já atende o '/' enquanto o modelo carrega numa thread
+    if GEMINI_WARMUP:
+        warm_up_model(em_segundo_plano=True)
+
+
+def worker_exit(server, worker):
+    # Import aqui dentro: o master não precisa carregar o agente (Gemini) só por causa deste hook
+    from telegram_ingest import close_dispatcher
+    from telegram_sender import close_telegram_sender
+
+    # Processa as mensagens do Telegram ainda na fila, entrega as respostas e fecha as conexões SQLite do worker
+    close_dispatcher()
+    close_telegram_sender()
+    close_all_connections()
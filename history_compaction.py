@@ -0,0 +1,153 @@
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+# --- Configuração da compactação do histórico (pode ser ajustada pelo .env) ---
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))  # Tokens máximos do histórico no prompt
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", "6"))   # Últimas mensagens mantidas na íntegra
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))   # Tamanho máximo do resumo das antigas
+SUMMARY_LINE_CHARS = 160  # Cada mensagem antiga vira no máximo uma linha deste tamanho no resumo
+
+SUMMARY_PREFIX = "Resumo da conversa anterior (mensagens antigas compactadas):"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimativa local e barata de tokens (sem chamada de rede).
+    Para português o Gemini fica perto de 1 token a cada ~4 caracteres.
+    """
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def _part_text(part: Dict[str, Any]) -> str:
+    if "text" in part:
+        return part["text"]
+    # Partes de ferramenta (functionResponse/functionCall) contam pelo JSON serializado
+    return json.dumps(part, ensure_ascii=False, default=str)
+
+
+def estimate_contents_tokens(contents: List[Dict[str, Any]]) -> int:
+    """Soma a estimativa de tokens de uma lista de mensagens no formato do Gemini."""
+    return sum(estimate_tokens(_part_text(part)) for message in contents for part in message.get("parts", []))
+
+
+def _valid_history(chat_history: Any) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    O histórico vem do cliente (/chat): descarta o que não está no formato do Gemini (mensagem que
+    não é dict, 'parts' que não é lista, parte que não é dict, functionResponse que não é dict)
+    em vez de deixar o erro estourar na montagem do prompt. Retorna (histórico, quantas descartadas).
+    """
+    if not isinstance(chat_history, list):
+        return [], 1 if chat_history else 0
+    validas, descartadas = [], 0
+    for message in chat_history:
+        parts = message.get("parts") if isinstance(message, dict) else None
+        if not isinstance(parts, list):
+            descartadas += 1
+            continue
+        boas = []
+        for part in parts:
+            if not isinstance(part, dict) or not isinstance(part.get("functionResponse", {}), dict):
+                continue
+            if "text" in part and not isinstance(part["text"], str):
+                part = {**part, "text": str(part["text"])}
+            boas.append(part)
+        if not boas:
+            descartadas += 1
+            continue
+        mudou = len(boas) != len(parts) or any(b is not p for (b, p) in zip(boas, parts))
+        validas.append({**message, "parts": boas} if mudou else message)
+    return validas, descartadas
+
+
+def _drop_used_tool_outputs(history: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Troca por um marcador curto os resultados de ferramenta que já foram usados,
+    isto é, que têm alguma resposta do modelo depois deles. Retorna (histórico, quantos trocados).
+    """
+    ultimo_model = max((i for i, m in enumerate(history) if m.get("role") == "model"), default=-1)
+    resultado, trocados = [], 0
+    for i, message in enumerate(history):
+        parts = message.get("parts", [])
+        if i < ultimo_model and any("functionResponse" in p for p in parts):
+            novas_parts = []
+            for p in parts:
+                if "functionResponse" in p:
+                    nome = p["functionResponse"].get("name", "ferramenta")
+                    novas_parts.append({"text": f"[resultado de {nome} já utilizado e omitido]"})
+                    trocados += 1
+                else:
+                    novas_parts.append(p)
+            message = {**message, "parts": novas_parts}
+        resultado.append(message)
+    return resultado, trocados
+
+
+def _summarize(messages: List[Dict[str, Any]], token_budget: int) -> str:
+    """
+    Resumo extrativo das mensagens antigas: uma linha curta por mensagem,
+    mantendo as MAIS RECENTES que couberem no orçamento (IDs e nomes costumam estar nelas).
+    Um resumo anterior que esteja entre as mensagens é carregado adiante (resumo rolante).
+    """
+    linhas = []
+    for message in messages:
+        texto = " ".join(_part_text(p) for p in message.get("parts", [])).replace("\n", " ").strip()
+        if texto.startswith(SUMMARY_PREFIX):
+            texto = texto[len(SUMMARY_PREFIX):].strip()
+            linhas.append(texto[:SUMMARY_LINE_CHARS * 2])
+            continue
+        quem = "Paciente" if message.get("role") == "user" else "Atendente"
+        linhas.append(f"{quem}: {texto[:SUMMARY_LINE_CHARS]}")
+
+    escolhidas, usados = [], estimate_tokens(SUMMARY_PREFIX)
+    for linha in reversed(linhas):
+        custo = estimate_tokens(linha) + 1
+        if usados + custo > token_budget:
+            break
+        escolhidas.append(linha)
+        usados += custo
+    return SUMMARY_PREFIX + "\n" + "\n".join(reversed(escolhidas))
+
+
+def compact_history(chat_history: List[Dict[str, Any]], token_budget: int = HISTORY_TOKEN_BUDGET,
+                    keep_messages: int = HISTORY_KEEP_MESSAGES) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Garante que o histórico caiba em 'token_budget' tokens estimados:
+    1. Resultados de ferramenta já usados viram um marcador curto.
+    2. As últimas 'keep_messages' mensagens ficam na íntegra.
+    3. As mais antigas são dobradas num único resumo (mensagem 'user' no início).
+    4. Se ainda assim estourar, as mensagens recentes mais antigas saem (as 2 últimas sempre ficam).
+    Mensagens fora do formato do Gemini são descartadas antes (stats['mensagens_invalidas']).
+    Retorna (histórico compactado, estatísticas com tokens antes/depois).
+    """
+    chat_history, invalidas = _valid_history(chat_history)
+    tokens_antes = estimate_contents_tokens(chat_history)
+    historico, tool_outputs_removidos = _drop_used_tool_outputs(chat_history)
+    resumidas = 0
+
+    if estimate_contents_tokens(historico) > token_budget:
+        if keep_messages:
+            antigas, recentes = historico[:-keep_messages], historico[-keep_messages:]
+        else:
+            antigas, recentes = historico, []
+        if antigas:
+            resumo = _summarize(antigas, min(SUMMARY_TOKEN_BUDGET, token_budget // 2))
+            historico = [{"role": "user", "parts": [{"text": resumo}]}] + recentes
+            resumidas = len(antigas)
+
+        while len(historico) > 2 and estimate_contents_tokens(historico) > token_budget:
+            # Remove a mensagem recente mais antiga (o resumo, se houver, fica no topo)
+            historico.pop(1 if resumidas else 0)
+
+    stats = {
+        "tokens_antes": tokens_antes,
+        "tokens_depois": estimate_contents_tokens(historico),
+        "mensagens_antes": len(chat_history),
+        "mensagens_depois": len(historico),
+        "mensagens_resumidas": resumidas,
+        "tool_outputs_removidos": tool_outputs_removidos,
+        "mensagens_invalidas": invalidas,
+    }
+    return historico, stats
@@ -0,0 +1,205 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Optional
+
+import database_tools
+from reference_cache import get_reference_cache
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# Liga/desliga o roteador rápido (pode ser ajustado pelo .env)
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ROUTER", "1") == "1"
+MAX_WORDS_FAST_PATH = 12  # Mensagens longas sempre vão para a IA
+
+RESPOSTA_SAUDACAO = "Olá! Em que posso ajudar com agendamentos ou informações da clínica?"
+RESPOSTA_DESPEDIDA = "Por nada! Se precisar de mais alguma coisa, é só chamar. Até logo!"
+RESPOSTA_INDISPONIVEL = ("Desculpe, nosso assistente está instável no momento e não consegui concluir seu pedido. "
+                         "Por favor, tente de novo em alguns minutos.")
+
+# --- Regras (aplicadas sobre o texto normalizado: minúsculo, sem acento e sem pontuação) ---
+_SAUDACAO = re.compile(
+    r"^(oi+|ola|opa|hey|hello|e ai|bom dia|boa tarde|boa noite)"
+    r"( (oi+|ola|tudo bem|tudo bom|como vai|bom dia|boa tarde|boa noite|pessoal|clinica( zenith)?))*$"
+)
+_DESPEDIDA = re.compile(
+    r"^((muito )?obrigad[oa]( (pela ajuda|por tudo))?|valeu|tchau|ate (logo|mais|breve)|falou|ok obrigad[oa])"
+    r"( (tchau|ate (logo|mais|breve)|obrigad[oa]|valeu))*$"
+)
+_INFO_TOPICOS = [
+    ("endereco", re.compile(r"\b(endereco|onde (fica|ficam|e a clinica|voces ficam)|localizacao|como (chego|chegar))\b")),
+    ("horario_funcionamento", re.compile(
+        r"\b(horario(s)? de (funcionamento|atendimento)|funcionamento|que horas (abre|fecha|voces abrem|voces fecham)"
+        r"|(abre|abrem|fecha|fecham) (que|a que) horas|abrem (no|aos) sabado)\b")),
+    ("convenios_aceitos", re.compile(r"\b(convenio(s)?|plano(s)? de saude|aceita(m)? (plano|unimed|bradesco|sulamerica))\b")),
+]
+_LISTAR_EXAMES = re.compile(r"\b(quais|que) (sao os |tipos de )?exames\b")
+_LISTAR_ESPECIALIDADES = re.compile(r"\b(quais|que) (sao as )?especialidades\b")
+
+# Palavras que indicam uma ação (agendar, cancelar...) -> a IA precisa conduzir o fluxo
+_BLOQUEIOS = re.compile(
+    r"\b(marcar|marca|agendar|agenda|agendamento|agendamentos|cancelar|cancela|cancelamento|desmarcar|remarcar"
+    r"|horarios? (livres?|disponiveis?|vagos?)|vaga|vagas|consulta|consultas|meus|minha|minhas|id)\b"
+)
+
+_stats_lock = threading.Lock()
+_stats = {"mensagens": 0, "roteadas": 0, "para_llm": 0, "tempo_total_us": 0.0, "por_rota": {}}
+
+
+def normalize(text: str) -> str:
+    """Minúsculo, sem acentos e só com letras/números separados por um espaço."""
+    sem_acento = unicodedata.normalize("NFKD", text.lower())
+    sem_acento = "".join(c for c in sem_acento if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", sem_acento).split())
+
+
+def _build_lexicon(cache) -> dict:
+    especialidades = sorted({m[2] for m in cache.get_medicos()})
+    exames = sorted(nome for (_, nome) in cache.get_exames())
+    termos = set()
+    for nome in especialidades + exames:
+        # 'Eletrocardiograma (ECG)' -> {'eletrocardiograma', 'ecg'}; prefixos curtos pegam 'cardio'
+        for palavra in normalize(nome).split():
+            if len(palavra) >= 4 and palavra not in ("exame", "geral"):
+                termos.add(palavra)
+                termos.add(palavra[:6])
+            elif len(palavra) == 3:
+                termos.add(palavra)
+    return {"especialidades": especialidades, "exames": exames, "termos": termos}
+
+
+def _get_lexicon() -> dict:
+    """
+    Léxico pré-calculado com as especialidades dos médicos e os nomes dos exames,
+    já normalizados. Se a mensagem cita algum deles, é um pedido específico e vai para a IA.
+    Fica no cache de referência: só é refeito quando medicos/exames mudam.
+    """
+    cache = get_reference_cache(database_tools.DATABASE_FILE)
+    return cache.derived("lexicon_router", lambda: _build_lexicon(cache))
+
+
+def _cita_lexicon(palavras: list) -> bool:
+    termos = _get_lexicon()["termos"]
+    return any(p in termos or p[:6] in termos for p in palavras if len(p) >= 3)
+
+
+def classify(text: str) -> Optional[str]:
+    """
+    Decide a rota de uma mensagem sem chamar a IA.
+    Retorna o nome da rota (ex: 'saudacao', 'info:endereco') ou None se a IA deve responder.
+    """
+    normalizado = normalize(text)
+    palavras = normalizado.split()
+    if not palavras or len(palavras) > MAX_WORDS_FAST_PATH or _BLOQUEIOS.search(normalizado):
+        return None
+
+    if _SAUDACAO.match(normalizado):
+        return "saudacao"
+    if _DESPEDIDA.match(normalizado):
+        return "despedida"
+
+    if _cita_lexicon(palavras):
+        return None
+
+    if _LISTAR_EXAMES.search(normalizado):
+        return "listar_exames"
+    if _LISTAR_ESPECIALIDADES.search(normalizado):
+        return "listar_especialidades"
+
+    topicos = [topico for (topico, regra) in _INFO_TOPICOS if regra.search(normalizado)]
+    if len(topicos) == 1:
+        return f"info:{topicos[0]}"
+    return None  # Nenhuma regra ou mais de um tópico: deixa para a IA
+
+
+def answer(route: str) -> Optional[str]:
+    """Monta a resposta de uma rota direto do banco (ou de um texto fixo). None = deixar para a IA."""
+    if route == "saudacao":
+        return RESPOSTA_SAUDACAO
+    if route == "despedida":
+        return RESPOSTA_DESPEDIDA
+    if route == "listar_exames":
+        exames = _get_lexicon()["exames"]
+        return f"Os exames que realizamos são: {', '.join(exames)}. Qual deles você gostaria de agendar?"
+    if route == "listar_especialidades":
+        especialidades = _get_lexicon()["especialidades"]
+        return f"Atendemos nas especialidades: {', '.join(especialidades)}. Qual delas você procura?"
+    if route.startswith("info:"):
+        # Tópico não cadastrado (None): a IA decide o que dizer
+        return get_reference_cache(database_tools.DATABASE_FILE).get_info(route[len("info:"):])
+    raise ValueError(f"Rota desconhecida: {route}")
+
+
+def route_message(text: str) -> Optional[str]:
+    """
+    Tenta responder a mensagem localmente (sem Gemini).
+    Retorna a resposta pronta ou None quando a mensagem deve seguir para a IA.
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+
+    inicio = time.perf_counter()
+    try:
+        route = classify(text)
+        resposta = answer(route) if route else None
+        if resposta is None:
+            route = None
+    except Exception:
+        log.exception("Erro ao rotear mensagem, seguindo para a IA")
+        route, resposta = None, None
+    decorrido_us = (time.perf_counter() - inicio) * 1_000_000
+
+    with _stats_lock:
+        _stats["mensagens"] += 1
+        _stats["tempo_total_us"] += decorrido_us
+        if route:
+            _stats["roteadas"] += 1
+            _stats["por_rota"][route] = _stats["por_rota"].get(route, 0) + 1
+        else:
+            _stats["para_llm"] += 1
+
+    if route:
+        log.info("Respondido sem IA", extra=campos(rota=route, decorrido_us=round(decorrido_us)))
+    return resposta
+
+
+def degraded_reply(text: str) -> str:
+    """
+    Resposta quando a IA está fora do ar (model_client.ModeloIndisponivel): as regras do roteador
+    sem as travas que mandam a mensagem para a IA (tamanho, palavras de ação, termos do cadastro),
+    porque agora não há IA para mandar. Sem regra que sirva, um aviso para tentar de novo depois.
+    """
+    normalizado = normalize(text)
+    route = None
+    if _SAUDACAO.match(normalizado):
+        route = "saudacao"
+    elif _DESPEDIDA.match(normalizado):
+        route = "despedida"
+    elif _LISTAR_EXAMES.search(normalizado):
+        route = "listar_exames"
+    elif _LISTAR_ESPECIALIDADES.search(normalizado):
+        route = "listar_especialidades"
+    else:
+        topicos = [topico for (topico, regra) in _INFO_TOPICOS if regra.search(normalizado)]
+        if len(topicos) == 1:
+            route = f"info:{topicos[0]}"
+    try:
+        resposta = answer(route) if route else None
+    except Exception:
+        log.exception("Erro ao montar a resposta degradada")
+        resposta = None
+    log.info("Resposta degradada (IA indisponível)", extra=campos(rota=route or "aviso"))
+    return resposta or RESPOSTA_INDISPONIVEL
+
+
+def get_router_stats() -> dict:
+    """Taxa de acerto do roteador e latência média de decisão deste processo."""
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["por_rota"] = dict(_stats["por_rota"])
+    stats["taxa_roteada"] = stats["roteadas"] / stats["mensagens"] if stats["mensagens"] else 0.0
+    stats["latencia_media_us"] = stats["tempo_total_us"] / stats["mensagens"] if stats["mensagens"] else 0.0
+    return stats
@@ -0,0 +1,295 @@
+"""
+Métricas do chatbot (contadores e histogramas) no formato de texto do Prometheus, para a rota /metrics.
+
+No caminho quente, registrar uma medida é só somar num dicionário em memória (um lock, sem I/O).
+Com vários workers do gunicorn, cada processo publica o seu retrato a cada METRICS_FLUSH_S segundos
+na tabela 'metricas_processos' do SQLite (uma linha por processo); a rota /metrics publica o retrato
+do worker que atendeu e soma as linhas de todos os workers irmãos (mesmo processo pai).
+Workers que já saíram continuam somando: contadores do Prometheus só crescem.
+
+Séries principais:
+- clinica_mensagem_segundos{caminho}: tempo total de process_web_message, pelo caminho que a
+  mensagem seguiu (roteador, resposta, pergunta, template, rag, json_invalido, erro...)
+- clinica_stream_primeiro_evento_segundos: tempo até o 1o evento do /chat/stream (o que o paciente espera)
+- clinica_etapa_segundos{etapa}: roteador, prompt, llm_1, json, ferramenta, template, llm_2
+- clinica_ferramenta_segundos{ferramenta} e clinica_ferramenta_erros_total{ferramenta}
+- clinica_llm_chamadas_por_mensagem, clinica_llm_chamadas_total, clinica_json_invalido_total
+- clinica_prompt_tokens (estimativa do history_compaction)
+- clinica_prompt_prefixo_tokens_total{modo}: tokens do prefixo fixo (prompt_prefix.py) reaproveitados,
+  do cache de contexto do Gemini (modo="cache") ou sem recriar os objetos (modo="compartilhado")
+- clinica_telegram_envio_segundos e clinica_telegram_envios_total{resultado}
+- clinica_admissao_*: controle de admissão (admission.py): admitidas, enfileiradas, recusadas por motivo,
+  espera na fila e mensagens em atendimento/na fila agora
+- clinica_sqlite_lock_*: contadores do database_pool (novas tentativas, falhas, esperas pelo lock)
+- clinica_modelo_*: cliente do Gemini (model_client.py): novas tentativas, hedges, desistências e o
+  estado do circuit breaker (gauge: somado entre os workers, é quantos estão em cada estado)
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+import database_pool
+import database_tools
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+METRICS_FLUSH_S = float(os.getenv("METRICS_FLUSH_S", "5"))  # 0 = só publica quando /metrics é chamada
+METRICS_RETENCAO_S = 24 * 3600  # Linhas de execuções antigas (outro processo pai) são apagadas depois disso
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_FERRAMENTA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BUCKETS_TOKENS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# nome -> (tipo, ajuda, buckets)
+DEFINICOES = {
+    "clinica_mensagem_segundos": ("histogram", "Tempo total de process_web_message, pelo caminho seguido", BUCKETS_SEGUNDOS),
+    "clinica_stream_primeiro_evento_segundos": ("histogram", "Do início da mensagem ao 1o evento do /chat/stream (progresso ou texto)", BUCKETS_SEGUNDOS),
+    "clinica_etapa_segundos": ("histogram", "Tempo de cada etapa do atendimento de uma mensagem", BUCKETS_SEGUNDOS),
+    "clinica_ferramenta_segundos": ("histogram", "Tempo de execução das ferramentas do database_tools", BUCKETS_FERRAMENTA),
+    "clinica_ferramenta_erros_total": ("counter", "Ferramentas que devolveram 'Erro...'", None),
+    "clinica_ferramentas_por_acao": ("histogram", "Ferramentas pedidas numa mesma ação CHAMAR_FERRAMENTA", (1, 2, 3, 4, 5)),
+    "clinica_llm_chamadas_por_mensagem": ("histogram", "Chamadas ao modelo por mensagem", (0, 1, 2, 3)),
+    "clinica_llm_chamadas_total": ("counter", "Chamadas ao modelo (Gemini)", None),
+    "clinica_json_invalido_total": ("counter", "Respostas do modelo que não eram JSON válido", None),
+    "clinica_prompt_tokens": ("histogram", "Tamanho estimado do prompt enviado ao modelo (tokens)", BUCKETS_TOKENS),
+    "clinica_prompt_prefixo_tokens_total": ("counter", "Tokens do prefixo fixo (system prompt e ferramentas) reaproveitados, por modo", None),
+    "clinica_telegram_envio_segundos": ("histogram", "Da entrada na fila do telegram_sender até a entrega", BUCKETS_SEGUNDOS),
+    "clinica_telegram_envios_total": ("counter", "Mensagens enviadas ao Telegram, por resultado", None),
+    "clinica_modelo_retries_total": ("counter", "Novas tentativas de chamada ao modelo, pelo motivo da falha anterior", None),
+    "clinica_modelo_hedges_total": ("counter", "Pedidos duplicados (hedge) ao modelo, por qual respondeu primeiro", None),
+    "clinica_modelo_falhas_total": ("counter", "Chamadas ao modelo que desistiram (resposta degradada), por motivo", None),
+    "clinica_modelo_breaker_estado": ("gauge", "Workers com o circuit breaker do modelo em cada estado", None),
+    "clinica_modelo_breaker_aberturas_total": ("counter", "Vezes que o circuit breaker do modelo abriu", None),
+    "clinica_admissao_admitidas_total": ("counter", "Mensagens admitidas pelo controle de admissão (com vaga para o agente)", None),
+    "clinica_admissao_enfileiradas_total": ("counter", "Mensagens que esperaram vaga na fila da admissão", None),
+    "clinica_admissao_recusadas_total": ("counter", "Mensagens recusadas com 429, por motivo (chat, ip, fila_cheia, espera)", None),
+    "clinica_admissao_espera_segundos": ("histogram", "Tempo esperando vaga na fila da admissão", BUCKETS_SEGUNDOS),
+    "clinica_admissao_em_voo": ("gauge", "Mensagens em atendimento (somando os workers)", None),
+    "clinica_admissao_na_fila": ("gauge", "Mensagens esperando vaga (somando os workers)", None),
+    "clinica_sqlite_lock_retries_total": ("counter", "Novas tentativas de BEGIN IMMEDIATE (banco travado)", None),
+    "clinica_sqlite_lock_failures_total": ("counter", "Transações de escrita que desistiram do lock", None),
+    "clinica_sqlite_lock_waits_total": ("counter", "Transações de escrita que esperaram outro escritor", None),
+    "clinica_sqlite_lock_wait_segundos_total": ("counter", "Tempo total esperando o lock de escrita", None),
+}
+
+# Contadores do database_pool lidos na hora de publicar (já são por processo)
+_COLETADOS = {
+    "lock_retries": "clinica_sqlite_lock_retries_total",
+    "lock_failures": "clinica_sqlite_lock_failures_total",
+    "lock_waits": "clinica_sqlite_lock_waits_total",
+    "lock_wait_s": "clinica_sqlite_lock_wait_segundos_total",
+}
+
+_lock = threading.Lock()
+_contadores: Dict[Tuple[str, tuple], float] = {}
+_histogramas: Dict[Tuple[str, tuple], list] = {}  # [contagem por bucket..., contagem +Inf, soma]
+_medidores: Dict[Tuple[str, tuple], float] = {}  # Gauges: valor atual (somado entre os workers, como os contadores)
+_pid: Optional[int] = None
+_aviso_publicacao = False
+
+
+def _garantir_processo() -> None:
+    """Na 1a medida de cada processo (inclusive depois do fork do gunicorn), zera o que veio do pai
+    e sobe a thread que publica o retrato no SQLite."""
+    global _pid
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _contadores.clear()
+        _histogramas.clear()
+        _medidores.clear()
+        _pid = os.getpid()
+    if METRICS_FLUSH_S > 0:
+        threading.Thread(target=_publicar_periodicamente, name="metricas", daemon=True).start()
+
+
+def incrementar(nome: str, valor: float = 1, **labels) -> None:
+    _garantir_processo()
+    chave = (nome, tuple(sorted(labels.items())))
+    with _lock:
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+
+def definir(nome: str, valor: float, **labels) -> None:
+    _garantir_processo()
+    with _lock:
+        _medidores[(nome, tuple(sorted(labels.items())))] = valor
+
+
+def observar(nome: str, valor: float, **labels) -> None:
+    _garantir_processo()
+    buckets = DEFINICOES[nome][2]
+    chave = (nome, tuple(sorted(labels.items())))
+    with _lock:
+        hist = _histogramas.get(chave)
+        if hist is None:
+            hist = _histogramas[chave] = [0] * (len(buckets) + 1) + [0.0]
+        hist[bisect_left(buckets, valor)] += 1
+        hist[-1] += valor
+
+
+class MedicaoMensagem:
+    """
+    Mede o atendimento de uma mensagem: cada etapa() fecha o trecho desde a etapa anterior,
+    'caminho' diz como a mensagem terminou e concluir() registra o total e as chamadas ao modelo.
+    """
+    __slots__ = ("inicio", "marca", "chamadas_llm", "caminho", "evento_enviado")
+
+    def __init__(self):
+        self.inicio = self.marca = time.perf_counter()
+        self.chamadas_llm = 0
+        self.caminho = "erro"
+        self.evento_enviado = False
+
+    def etapa(self, nome: str) -> None:
+        agora = time.perf_counter()
+        observar("clinica_etapa_segundos", agora - self.marca, etapa=nome)
+        self.marca = agora
+
+    def llm(self) -> None:
+        """Marca o começo de uma chamada ao modelo (o tempo até aqui entra na etapa anterior)."""
+        self.chamadas_llm += 1
+        incrementar("clinica_llm_chamadas_total")
+
+    def ferramenta(self, tool_name: str, segundos: float, tool_result) -> None:
+        observar("clinica_ferramenta_segundos", segundos, ferramenta=tool_name)
+        if isinstance(tool_result, str) and tool_result.startswith("Erro"):
+            incrementar("clinica_ferramenta_erros_total", ferramenta=tool_name)
+
+    def primeiro_evento(self) -> None:
+        """Streaming: registra só o 1o evento enviado ao cliente (as chamadas seguintes não fazem nada)."""
+        if not self.evento_enviado:
+            self.evento_enviado = True
+            observar("clinica_stream_primeiro_evento_segundos", time.perf_counter() - self.inicio)
+
+    def concluir(self) -> None:
+        observar("clinica_mensagem_segundos", time.perf_counter() - self.inicio, caminho=self.caminho)
+        observar("clinica_llm_chamadas_por_mensagem", self.chamadas_llm)
+
+
+# --- Retratos e publicação (multi-processo) ---
+
+def retrato() -> dict:
+    """Cópia serializável das métricas deste processo (mais os contadores do database_pool)."""
+    with _lock:
+        contadores = [[n, list(map(list, l)), v] for ((n, l), v) in [*_contadores.items(), *_medidores.items()]]
+        histogramas = [[n, list(map(list, l)), list(h)] for ((n, l), h) in _histogramas.items()]
+    pool = database_pool.get_pool_stats()
+    for chave, nome in _COLETADOS.items():
+        contadores.append([nome, [], pool.get(chave, 0)])
+    return {"contadores": contadores, "histogramas": histogramas}
+
+
+def publicar(db_file: str = None) -> None:
+    """Grava o retrato deste processo na tabela 'metricas_processos'."""
+    global _aviso_publicacao
+    db_file = db_file or database_tools.DATABASE_FILE
+    dados = json.dumps(retrato(), separators=(",", ":"))
+    agora = time.time()
+    try:
+        database_pool.write_transaction(db_file, lambda conn: (
+            conn.execute("INSERT OR REPLACE INTO metricas_processos (grupo, pid, atualizado_em, retrato) "
+                         "VALUES (?, ?, ?, ?)", (os.getppid(), os.getpid(), agora, dados)),
+            conn.execute("DELETE FROM metricas_processos WHERE grupo != ? AND atualizado_em < ?",
+                         (os.getppid(), agora - METRICS_RETENCAO_S))))
+    except Exception as e:
+        if not _aviso_publicacao:
+            _aviso_publicacao = True
+            log.warning("Não foi possível publicar as métricas no SQLite", extra=campos(erro=str(e)))
+
+
+def _publicar_periodicamente() -> None:
+    pid = os.getpid()
+    while _pid == pid:
+        time.sleep(METRICS_FLUSH_S)
+        publicar()
+
+
+def _somar(total: dict, dados: dict) -> None:
+    for (nome, labels, valor) in dados["contadores"]:
+        chave = (nome, tuple(map(tuple, labels)))
+        total["contadores"][chave] = total["contadores"].get(chave, 0) + valor
+    for (nome, labels, hist) in dados["histogramas"]:
+        chave = (nome, tuple(map(tuple, labels)))
+        atual = total["histogramas"].get(chave)
+        total["histogramas"][chave] = list(hist) if atual is None else [a + b for (a, b) in zip(atual, hist)]
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    partes = [k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+              for (k, v) in labels]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if isinstance(valor, float) and not valor.is_integer() else str(int(valor))
+
+
+def renderizar(total: dict, processos: int = 1) -> str:
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+    linhas: List[str] = []
+    por_nome: Dict[str, list] = {}
+    for ((nome, labels), valor) in total["contadores"].items():
+        por_nome.setdefault(nome, []).append((labels, valor))
+    for ((nome, labels), hist) in total["histogramas"].items():
+        por_nome.setdefault(nome, []).append((labels, hist))
+
+    for nome in sorted(por_nome):
+        tipo, ajuda, buckets = DEFINICOES.get(nome, ("untyped", nome, None))
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        for (labels, valor) in sorted(por_nome[nome]):
+            if tipo != "histogram":
+                linhas.append(f"{nome}{_labels(labels)} {_numero(valor)}")
+                continue
+            acumulado = 0
+            for (limite, contagem) in zip(list(buckets) + ["+Inf"], valor[:-1]):
+                acumulado += contagem
+                linhas.append(f'{nome}_bucket{_labels(labels, f"le={json.dumps(str(limite))}")} {acumulado}')
+            linhas.append(f"{nome}_sum{_labels(labels)} {_numero(valor[-1])}")
+            linhas.append(f"{nome}_count{_labels(labels)} {acumulado}")
+    linhas.append("# HELP clinica_metricas_processos Processos somados nesta resposta")
+    linhas.append("# TYPE clinica_metricas_processos gauge")
+    linhas.append(f"clinica_metricas_processos {processos}")
+    return "\n".join(linhas) + "\n"
+
+
+def gerar_metricas(db_file: str = None) -> str:
+    """Conteúdo da rota /metrics: soma deste processo com os workers irmãos (mesmo processo pai)."""
+    db_file = db_file or database_tools.DATABASE_FILE
+    _garantir_processo()
+    publicar(db_file)
+    total = {"contadores": {}, "histogramas": {}}
+    processos = 0
+    try:
+        linhas = database_pool.get_connection(db_file).execute(
+            "SELECT pid, retrato FROM metricas_processos WHERE grupo = ?", (os.getppid(),)).fetchall()
+    except Exception as e:
+        log.warning("Não foi possível ler as métricas dos outros workers", extra=campos(erro=str(e)))
+        linhas = []
+    for (pid, dados) in linhas:
+        if pid != os.getpid():
+            _somar(total, json.loads(dados))
+            processos += 1
+    _somar(total, retrato())  # Este processo: o retrato mais novo, direto da memória
+    return renderizar(total, processos + 1)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@atexit.register
+def _publicar_na_saida() -> None:
+    if _pid == os.getpid():
+        with _lock:
+            _medidores.clear()  # Um worker que saiu não está mais em estado nenhum
+        publicar()
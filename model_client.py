@@ -0,0 +1,401 @@
+"""
+Cliente do modelo (Gemini): prazo por chamada, novas tentativas, hedge e circuit breaker.
+
+Antes, o agent chamava modelo.generate_content direto: sem timeout, uma chamada travada segurava o
+worker do gunicorn até ele ser morto, e qualquer falha virava "ocorreu um erro interno grave".
+Agora toda chamada passa por CLIENTE_MODELO.gerar() / gerar_async():
+- prazo: cada tentativa tem MODEL_TIMEOUT_S (vai para o SDK em request_options e também é
+  cobrado aqui) e a chamada inteira, com as novas tentativas, MODEL_DEADLINE_S;
+- novas tentativas (MODEL_RETRIES) só para falhas passageiras (timeout, 5xx, 429, rede), com
+  espera exponencial limitada e jitter (MODEL_BACKOFF_BASE_S, MODEL_BACKOFF_MAX_S);
+- hedge (MODEL_HEDGE=1, desligado por padrão porque gasta cota): se a resposta demora mais que o
+  p95 das últimas chamadas, dispara um 2o pedido igual e fica com o que chegar primeiro, no máximo
+  em MODEL_HEDGE_MAX_FRACAO das chamadas. Não vale para stream;
+- circuit breaker: MODEL_BREAKER_FALHAS chamadas seguidas sem sucesso abrem o circuito por
+  MODEL_BREAKER_ABERTO_S; enquanto aberto, gerar() falha na hora com ModeloIndisponivel e o agent
+  responde com a resposta degradada. Depois disso, uma chamada de teste (meio-aberto) decide se fecha.
+
+Erros que não são passageiros (ex: InvalidArgument) sobem como estão e não contam para o breaker.
+O estado do breaker é por processo (cada worker do gunicorn tem o seu).
+Com stream=True, o prazo e as novas tentativas valem até o 1o trecho chegar.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+from metrics import definir, incrementar
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+MODEL_TIMEOUT_S = float(os.getenv("MODEL_TIMEOUT_S", "8"))
+# Duas chamadas por mensagem (RAG) têm que caber no timeout do worker do gunicorn (30s)
+MODEL_DEADLINE_S = float(os.getenv("MODEL_DEADLINE_S", "12"))
+MODEL_RETRIES = int(os.getenv("MODEL_RETRIES", "2"))
+MODEL_BACKOFF_BASE_S = float(os.getenv("MODEL_BACKOFF_BASE_S", "0.2"))
+MODEL_BACKOFF_MAX_S = float(os.getenv("MODEL_BACKOFF_MAX_S", "2"))
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "0") == "1"
+MODEL_HEDGE_MAX_FRACAO = float(os.getenv("MODEL_HEDGE_MAX_FRACAO", "0.1"))
+MODEL_HEDGE_MIN_S = float(os.getenv("MODEL_HEDGE_MIN_S", "0.5"))  # Nunca antes disso, mesmo com p95 menor
+MODEL_HEDGE_THREADS = int(os.getenv("MODEL_HEDGE_THREADS", "16"))
+MODEL_BREAKER_FALHAS = int(os.getenv("MODEL_BREAKER_FALHAS", "5"))
+MODEL_BREAKER_ABERTO_S = float(os.getenv("MODEL_BREAKER_ABERTO_S", "30"))
+
+JANELA_LATENCIA = 200  # Últimas chamadas bem-sucedidas usadas no p95 do hedge
+MIN_AMOSTRAS_HEDGE = 20
+
+FECHADO, ABERTO, MEIO_ABERTO = "fechado", "aberto", "meio_aberto"
+
+# Nomes (na hierarquia da exceção) das falhas passageiras do google.api_core, sem importá-lo aqui
+_PASSAGEIRAS = {"ServerError": "indisponivel", "TooManyRequests": "limite", "RetryError": "indisponivel"}
+
+
+class ModeloIndisponivel(Exception):
+    """O modelo não respondeu (breaker aberto ou falhas passageiras até esgotar o prazo)."""
+
+    def __init__(self, motivo: str, causa: Optional[BaseException] = None):
+        super().__init__(f"Modelo indisponível ({motivo})" + (f": {causa!r}" if causa else ""))
+        self.motivo = motivo
+
+
+def motivo_passageiro(erro: BaseException) -> Optional[str]:
+    """Motivo ('timeout', 'limite', 'indisponivel', 'rede') se vale tentar de novo; None se não."""
+    if isinstance(erro, TimeoutError):
+        return "timeout"
+    nomes = [c.__name__ for c in type(erro).__mro__]
+    if "DeadlineExceeded" in nomes or "GatewayTimeout" in nomes:
+        return "timeout"
+    for nome in nomes:
+        if nome in _PASSAGEIRAS:
+            return _PASSAGEIRAS[nome]
+    if isinstance(erro, ConnectionError):
+        return "rede"
+    return None
+
+
+def _no_meio_do_stream(erro: Exception) -> None:
+    # Depois do 1o trecho não dá para tentar de novo (parte do texto já foi para o paciente)
+    motivo = motivo_passageiro(erro)
+    if motivo is None:
+        raise erro
+    incrementar("clinica_modelo_falhas_total", motivo=motivo)
+    raise ModeloIndisponivel(motivo, erro) from erro
+
+
+def _no_contexto(fn, *args, **kwargs):
+    return lambda: contextvars.copy_context().run(fn, *args, **kwargs)
+
+
+class CircuitBreaker:
+    def __init__(self, falhas: Optional[int] = None, aberto_s: Optional[float] = None):
+        self.limite_falhas = falhas or MODEL_BREAKER_FALHAS
+        self.aberto_s = aberto_s or MODEL_BREAKER_ABERTO_S
+        self.estado = FECHADO
+        self.falhas_seguidas = 0
+        self._aberto_ate = 0.0
+        self._teste_desde: Optional[float] = None  # Início da chamada de teste do meio-aberto
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _publicar(self) -> None:
+        for estado in (FECHADO, ABERTO, MEIO_ABERTO):
+            definir("clinica_modelo_breaker_estado", 1 if estado == self.estado else 0, estado=estado)
+
+    def _mudar(self, estado: str) -> None:
+        anterior, self.estado = self.estado, estado
+        self._publicar()
+        if estado == ABERTO:
+            incrementar("clinica_modelo_breaker_aberturas_total")
+        nivel = log.warning if estado == ABERTO else log.info
+        nivel("Circuit breaker do modelo mudou de estado", extra=campos(
+            de=anterior, para=estado, falhas_seguidas=self.falhas_seguidas))
+
+    def permitir(self) -> bool:
+        """True se a chamada pode ir para a API. No meio-aberto, só uma chamada de teste por vez."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # 1a chamada do processo (o metrics zera tudo depois do fork do gunicorn)
+                self._pid = os.getpid()
+                self._publicar()
+            if self.estado == FECHADO:
+                return True
+            if self.estado == ABERTO:
+                if time.monotonic() < self._aberto_ate:
+                    return False
+                self._mudar(MEIO_ABERTO)
+            # Uma chamada de teste que sumiu (ex: cancelada) não segura o meio-aberto para sempre
+            if self._teste_desde is not None and time.monotonic() - self._teste_desde < MODEL_DEADLINE_S:
+                return False
+            self._teste_desde = time.monotonic()
+            return True
+
+    def sucesso(self) -> None:
+        with self._lock:
+            self.falhas_seguidas = 0
+            self._teste_desde = None
+            if self.estado != FECHADO:
+                self._mudar(FECHADO)
+
+    def falha(self) -> None:
+        with self._lock:
+            self.falhas_seguidas += 1
+            self._teste_desde = None
+            if self.estado == MEIO_ABERTO or (self.estado == FECHADO and self.falhas_seguidas >= self.limite_falhas):
+                self._aberto_ate = time.monotonic() + self.aberto_s
+                self._mudar(ABERTO)
+
+    def liberar(self) -> None:
+        """A chamada de teste terminou sem dizer nada sobre a API (ex: erro não passageiro)."""
+        with self._lock:
+            self._teste_desde = None
+
+
+class ClienteDoModelo:
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._latencias = deque(maxlen=JANELA_LATENCIA)
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._stats = {"chamadas": 0, "tentativas": 0, "retries": 0, "hedges": 0, "hedges_venceram": 0,
+                       "falhas": 0, "rejeitadas_breaker": 0}
+
+    # --- Estatísticas ---
+
+    def _contar(self, chave: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[chave] += n
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["breaker"] = self.breaker.estado
+        stats["p95_s"] = self.p95()
+        return stats
+
+    def _registrar_latencia(self, segundos: float) -> None:
+        with self._lock:
+            self._latencias.append(segundos)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencias) < MIN_AMOSTRAS_HEDGE:
+                return None
+            ordenadas = sorted(self._latencias)
+        return ordenadas[int(0.95 * (len(ordenadas) - 1))]
+
+    def _atraso_hedge(self) -> Optional[float]:
+        """Quando disparar o hedge (segundos), ou None se não for disparar nesta chamada."""
+        if not MODEL_HEDGE:
+            return None
+        p95 = self.p95()
+        with self._lock:
+            if p95 is None or self._stats["hedges"] >= MODEL_HEDGE_MAX_FRACAO * self._stats["chamadas"]:
+                return None
+        return max(p95, MODEL_HEDGE_MIN_S)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=MODEL_HEDGE_THREADS, thread_name_prefix="modelo")
+        return self._pool
+
+    # --- Tentativas, espera e breaker (comum às versões sync e async) ---
+
+    def _espera(self, tentativa: int) -> float:
+        # Exponencial limitada com "full jitter": espalha as novas tentativas dos vários workers
+        return random.uniform(0, min(MODEL_BACKOFF_MAX_S, MODEL_BACKOFF_BASE_S * 2 ** tentativa))
+
+    def _iniciar(self) -> float:
+        if not self.breaker.permitir():
+            self._contar("rejeitadas_breaker")
+            incrementar("clinica_modelo_falhas_total", motivo="breaker_aberto")
+            raise ModeloIndisponivel("breaker_aberto")
+        self._contar("chamadas")
+        return time.monotonic() + MODEL_DEADLINE_S
+
+    def _proxima_espera(self, erro: BaseException, tentativa: int, prazo: float) -> float:
+        """Espera antes de tentar de novo; levanta se não vale (ou não dá tempo de) tentar de novo."""
+        motivo = motivo_passageiro(erro)
+        if motivo is None:
+            self.breaker.liberar()
+            raise erro
+        espera = self._espera(tentativa)
+        restante = prazo - time.monotonic()
+        if tentativa >= MODEL_RETRIES or restante - espera < 0.05 * MODEL_TIMEOUT_S:
+            self._contar("falhas")
+            self.breaker.falha()
+            incrementar("clinica_modelo_falhas_total", motivo=motivo)
+            log.warning("Modelo sem resposta, desistindo", extra=campos(motivo=motivo, tentativas=tentativa + 1,
+                                                                      erro=repr(erro)[:200]))
+            raise ModeloIndisponivel(motivo, erro) from erro
+        self._contar("retries")
+        incrementar("clinica_modelo_retries_total", motivo=motivo)
+        log.info("Falha passageira do modelo, tentando de novo", extra=campos(
+            motivo=motivo, tentativa=tentativa + 1, espera_s=round(espera, 3)))
+        return espera
+
+    def _sucesso(self, inicio: float, stream: bool) -> None:
+        self.breaker.sucesso()
+        if not stream:
+            self._registrar_latencia(time.monotonic() - inicio)
+
+    @staticmethod
+    def _com_timeout(kwargs: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        opcoes = dict(kwargs.get("request_options") or {})
+        opcoes["timeout"] = timeout
+        return {**kwargs, "request_options": opcoes}
+
+    # --- Síncrono (api.py / Flask, telegram) ---
+
+    def gerar(self, modelo, contents, stream: bool = False, **kwargs):
+        """Como modelo.generate_content(contents, stream, **kwargs), com prazo, tentativas, hedge e breaker."""
+        prazo = self._iniciar()
+        tentativa = 0
+        while True:
+            timeout = min(MODEL_TIMEOUT_S, prazo - time.monotonic())
+            inicio = time.monotonic()
+            self._contar("tentativas")
+            try:
+                if stream:
+                    # O timeout do SDK vale para o stream inteiro: o que resta do prazo, não o de uma tentativa
+                    resposta = self._primeiro_trecho(modelo.generate_content(
+                        contents, stream=True, **self._com_timeout(kwargs, prazo - time.monotonic())))
+                else:
+                    resposta = self._tentar(modelo, contents, kwargs, timeout)
+                self._sucesso(inicio, stream)
+                return resposta
+            except Exception as erro:
+                time.sleep(self._proxima_espera(erro, tentativa, prazo))
+                tentativa += 1
+
+    def _tentar(self, modelo, contents, kwargs, timeout: float):
+        atraso = self._atraso_hedge()
+        chamada = _no_contexto(modelo.generate_content, contents, **self._com_timeout(kwargs, timeout))
+        if atraso is None or atraso >= timeout:
+            return chamada()  # O SDK corta a chamada no request_options['timeout']
+
+        # Hedge: o original numa thread; se passar do p95, um 2o pedido igual; vale o 1o que responder
+        inicio = time.monotonic()
+        pendentes = {self._executor().submit(chamada): "original"}
+        feitos, _ = wait(pendentes, timeout=atraso)
+        hedge = not feitos
+        if hedge:
+            self._contar("hedges")
+            pendentes[self._executor().submit(chamada)] = "hedge"
+        erro = None
+        while pendentes:
+            feitos, _ = wait(pendentes, timeout=max(0.0, timeout - (time.monotonic() - inicio)),
+                             return_when=FIRST_COMPLETED)
+            if not feitos:
+                raise TimeoutError(f"modelo sem resposta em {timeout:.1f}s")
+            for futuro in feitos:
+                quem = pendentes.pop(futuro)
+                if futuro.exception() is None:
+                    if hedge:
+                        self._registrar_hedge(quem)
+                    return futuro.result()
+                erro = futuro.exception()
+        raise erro
+
+    def _registrar_hedge(self, vencedor: str) -> None:
+        incrementar("clinica_modelo_hedges_total", vencedor=vencedor)
+        if vencedor == "hedge":
+            self._contar("hedges_venceram")
+
+    @staticmethod
+    def _primeiro_trecho(resposta):
+        # O 1o trecho é o que mostra se a chamada funcionou: até ele, vale tentar de novo
+        iterador = iter(resposta)
+        primeiro = next(iterador, None)
+
+        def trechos():
+            if primeiro is not None:
+                yield primeiro
+            try:
+                yield from iterador
+            except Exception as erro:
+                _no_meio_do_stream(erro)
+        return trechos()
+
+    # --- Assíncrono (asgi.py) ---
+
+    async def gerar_async(self, modelo, contents, stream: bool = False, **kwargs):
+        """Como await modelo.generate_content_async(...); com stream=True devolve um iterável assíncrono."""
+        prazo = self._iniciar()
+        tentativa = 0
+        while True:
+            timeout = min(MODEL_TIMEOUT_S, prazo - time.monotonic())
+            inicio = time.monotonic()
+            self._contar("tentativas")
+            try:
+                if stream:
+                    # wait_for: o 1o trecho tem que chegar no prazo de uma tentativa
+                    resposta = await asyncio.wait_for(self._stream_async(modelo, contents, kwargs, prazo), timeout)
+                else:
+                    resposta = await self._tentar_async(modelo, contents, kwargs, timeout)
+                self._sucesso(inicio, stream)
+                return resposta
+            except Exception as erro:
+                await asyncio.sleep(self._proxima_espera(erro, tentativa, prazo))
+                tentativa += 1
+
+    async def _tentar_async(self, modelo, contents, kwargs, timeout: float):
+        chamada = lambda: modelo.generate_content_async(contents, **self._com_timeout(kwargs, timeout))
+        atraso = self._atraso_hedge()
+        if atraso is None or atraso >= timeout:
+            return await asyncio.wait_for(chamada(), timeout)
+
+        inicio = time.monotonic()
+        pendentes = {asyncio.ensure_future(chamada()): "original"}
+        feitos, _ = await asyncio.wait(pendentes, timeout=atraso)
+        hedge = not feitos
+        if hedge:
+            self._contar("hedges")
+            pendentes[asyncio.ensure_future(chamada())] = "hedge"
+        erro = None
+        try:
+            while pendentes:
+                feitos, _ = await asyncio.wait(pendentes, timeout=max(0.0, timeout - (time.monotonic() - inicio)),
+                                               return_when=asyncio.FIRST_COMPLETED)
+                if not feitos:
+                    raise TimeoutError(f"modelo sem resposta em {timeout:.1f}s")
+                for tarefa in feitos:
+                    quem = pendentes.pop(tarefa)
+                    if tarefa.exception() is None:
+                        if hedge:
+                            self._registrar_hedge(quem)
+                        return tarefa.result()
+                    erro = tarefa.exception()
+            raise erro
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()  # O pedido que perdeu não precisa terminar
+
+    async def _stream_async(self, modelo, contents, kwargs, prazo: float):
+        resposta = await modelo.generate_content_async(
+            contents, stream=True, **self._com_timeout(kwargs, prazo - time.monotonic()))
+        iterador = resposta.__aiter__()
+        try:
+            primeiro = await iterador.__anext__()
+        except StopAsyncIteration:
+            primeiro = None
+
+        async def trechos():
+            if primeiro is not None:
+                yield primeiro
+            try:
+                async for trecho in iterador:
+                    yield trecho
+            except Exception as erro:
+                _no_meio_do_stream(erro)
+        return trechos()
+
+
+CLIENTE_MODELO = ClienteDoModelo()
@@ -0,0 +1,157 @@
+"""
+Prefixo fixo do prompt: o system prompt e as declarações das ferramentas, montados uma vez por processo.
+
+Antes, cada chamada ao modelo (duas por mensagem que passa pelo RAG) montava a mensagem do system
+prompt de novo e passava as funções Python em 'tools': o SDK inspeciona a assinatura e a docstring
+de cada uma e gera as declarações a cada generate_content (~15ms de CPU para as 10 ferramentas).
+
+Agora, na 1a vez que um modelo é usado, preparar(modelo) monta um PrefixoPreparado:
+- modo "cache": o system prompt e as ferramentas vão uma vez para o cache de contexto do Gemini
+  (CachedContent, PROMPT_CACHE=1). As chamadas usam o modelo ligado ao cache e mandam só o
+  histórico e a mensagem; o cache é recriado PROMPT_CACHE_MARGEM_S antes de vencer;
+- modo "compartilhado": sem cache (desligado, modelo que não suporta, prompt abaixo do mínimo
+  de tokens da API...), a mensagem do system prompt e as ferramentas já convertidas são os mesmos
+  objetos em todas as chamadas, sem cópia nem conversão por mensagem. Se a criação do cache
+  falhou, tenta de novo depois de PROMPT_CACHE_RETRY_S.
+
+Os objetos do prefixo são compartilhados entre threads: não alterar.
+Tokens do prefixo reaproveitados em cada chamada: clinica_prompt_prefixo_tokens_total{modo}.
+"""
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import generation_config
+from history_compaction import estimate_tokens
+from metrics import incrementar
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "1") == "1"
+PROMPT_CACHE_TTL_S = int(os.getenv("PROMPT_CACHE_TTL_S", "3600"))
+PROMPT_CACHE_MARGEM_S = int(os.getenv("PROMPT_CACHE_MARGEM_S", "300"))  # Recria antes de vencer
+PROMPT_CACHE_RETRY_S = int(os.getenv("PROMPT_CACHE_RETRY_S", "600"))  # Depois de uma falha ao criar
+
+_stats_lock = threading.Lock()
+_stats = {"chamadas": 0, "tokens_reusados": 0, "tokens_em_cache": 0, "caches_criados": 0, "falhas_cache": 0}
+
+
+def declaracao_da_ferramenta(funcao: Callable) -> Dict[str, Any]:
+    """Forma aproximada do FunctionDeclaration que o SDK gera (nome, docstring e parâmetros)."""
+    parametros = {}
+    for nome, parametro in inspect.signature(funcao).parameters.items():
+        tipo = parametro.annotation
+        parametros[nome] = {"type": getattr(tipo, "__name__", str(tipo)).lower()}
+    return {"name": funcao.__name__, "description": inspect.getdoc(funcao) or "",
+            "parameters": {"type": "object", "properties": parametros}}
+
+
+def _converter_ferramentas(ferramentas: List[Callable]):
+    from google.generativeai.types import content_types
+    return content_types.to_function_library(ferramentas)
+
+
+def _criar_cache(modelo, contents: List[Dict[str, Any]], ferramentas, ttl_s: int):
+    """(modelo ligado ao cache, nome do cache). Falha (ex: modelo sem model_name) vira o modo compartilhado."""
+    import datetime
+    import google.generativeai as genai
+    from google.generativeai import caching
+    cache = caching.CachedContent.create(model=modelo.model_name, contents=contents, tools=ferramentas,
+                                         ttl=datetime.timedelta(seconds=ttl_s))
+    return genai.GenerativeModel.from_cached_content(cache), cache.name
+
+
+class PrefixoPreparado:
+    """O que cada chamada ao modelo usa: o modelo, o começo do 'contents' e os kwargs (compartilhados)."""
+    __slots__ = ("base", "modelo", "cabeca", "kwargs", "ferramentas", "modo", "nome_cache", "tokens", "renovar_em")
+
+    def __init__(self, base, modelo, cabeca: tuple, kwargs: Dict[str, Any], ferramentas, modo: str,
+                 tokens: int, renovar_em: float = float("inf"), nome_cache: Optional[str] = None):
+        self.base = base
+        self.modelo = modelo
+        self.cabeca = cabeca
+        self.kwargs = kwargs
+        self.ferramentas = ferramentas
+        self.modo = modo
+        self.nome_cache = nome_cache
+        self.tokens = tokens
+        self.renovar_em = renovar_em
+
+    def contents(self, historico: List[Dict[str, Any]], mensagem: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [*self.cabeca, *historico, mensagem]
+
+    def registrar_chamada(self) -> Dict[str, Any]:
+        """Conta os tokens do prefixo reaproveitados nesta chamada e devolve os kwargs dela."""
+        incrementar("clinica_prompt_prefixo_tokens_total", self.tokens, modo=self.modo)
+        with _stats_lock:
+            _stats["chamadas"] += 1
+            _stats["tokens_reusados"] += self.tokens
+            if self.modo == "cache":
+                _stats["tokens_em_cache"] += self.tokens
+        return self.kwargs
+
+
+class PrefixoDoPrompt:
+    def __init__(self, texto_sistema: str, ferramentas: Iterable[Callable]):
+        self.texto_sistema = texto_sistema
+        self.mensagem_sistema = {"role": "user", "parts": [{"text": texto_sistema}]}
+        self.ferramentas = list(ferramentas)
+        self.tokens_sistema = estimate_tokens(texto_sistema)
+        declaracoes = [declaracao_da_ferramenta(f) for f in self.ferramentas]
+        self.tokens = self.tokens_sistema + estimate_tokens(json.dumps(declaracoes, ensure_ascii=False))
+        self._lock = threading.Lock()
+        self._preparados: Dict[int, PrefixoPreparado] = {}
+
+    def pronto(self, modelo) -> bool:
+        preparado = self._preparados.get(id(modelo))
+        return preparado is not None and preparado.base is modelo and time.monotonic() < preparado.renovar_em
+
+    def preparar(self, modelo) -> Optional[PrefixoPreparado]:
+        """Prefixo para as chamadas a 'modelo' (None sem modelo). Só a 1a vez (e a renovação) custa."""
+        if not modelo:
+            return None
+        if self.pronto(modelo):
+            return self._preparados[id(modelo)]
+        with self._lock:
+            if not self.pronto(modelo):
+                anterior = self._preparados.get(id(modelo))
+                ferramentas = anterior.ferramentas if anterior is not None and anterior.base is modelo else None
+                self._preparados[id(modelo)] = self._montar(modelo, ferramentas)
+            return self._preparados[id(modelo)]
+
+    def _montar(self, modelo, ferramentas) -> PrefixoPreparado:
+        if ferramentas is None:
+            ferramentas = _converter_ferramentas(self.ferramentas)
+        renovar_em = float("inf")
+        if PROMPT_CACHE:
+            try:
+                criado = _criar_cache(modelo, [self.mensagem_sistema], ferramentas, PROMPT_CACHE_TTL_S)
+            except Exception as e:
+                # Ex: prompt abaixo do mínimo de tokens do cache, modelo sem suporte, rede
+                log.warning("Cache de contexto indisponível; usando o prefixo compartilhado",
+                            extra=campos(erro=str(e)[:200], nova_tentativa_s=PROMPT_CACHE_RETRY_S))
+                with _stats_lock:
+                    _stats["falhas_cache"] += 1
+                criado = None
+                renovar_em = time.monotonic() + PROMPT_CACHE_RETRY_S
+            if criado is not None:
+                modelo_com_cache, nome = criado
+                with _stats_lock:
+                    _stats["caches_criados"] += 1
+                log.info("Cache de contexto criado", extra=campos(cache=nome, tokens=self.tokens, ttl_s=PROMPT_CACHE_TTL_S))
+                return PrefixoPreparado(
+                    modelo, modelo_com_cache, (), {"generation_config": generation_config}, ferramentas, "cache",
+                    self.tokens, renovar_em=time.monotonic() + PROMPT_CACHE_TTL_S - PROMPT_CACHE_MARGEM_S,
+                    nome_cache=nome)
+        return PrefixoPreparado(
+            modelo, modelo, (self.mensagem_sistema,), {"tools": ferramentas, "generation_config": generation_config},
+            ferramentas, "compartilhado", self.tokens, renovar_em=renovar_em)
+
+
+def get_prefix_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from database_pool import get_connection
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# Intervalo mínimo entre conferências do data_version na mesma thread (segundos).
+# Limita o quanto uma edição feita por outro worker demora para aparecer.
+REFERENCE_CHECK_INTERVAL = float(os.getenv("REFERENCE_CHECK_INTERVAL", "0.5"))
+
+# Tabelas de referência (quase nunca mudam): info, medicos e exames.
+# A migração 3 cria a tabela 'reference_version' e triggers que incrementam a versão
+# a cada INSERT/UPDATE/DELETE nessas tabelas, feitos por qualquer processo.
+# A migração 7 faz o mesmo para os modelos da agenda recorrente (schedule_engine, via derived()).
+
+
+class ReferenceCache:
+    """
+    Cache local (por processo) das tabelas info, medicos e exames.
+
+    - Carrega tudo na primeira leitura (lazy).
+    - Confere o 'PRAGMA data_version' da conexão da thread (no máximo a cada
+      REFERENCE_CHECK_INTERVAL segundos): ele só muda quando OUTRA conexão grava no banco.
+      Só então relê a 'reference_version'; se ela mudou, recarrega as tabelas.
+    - Escritas administrativas feitas por este mesmo processo devem chamar refresh().
+    - derived() guarda valores calculados a partir das tabelas (strings formatadas,
+      léxicos), descartados junto com o cache.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._local = threading.local()  # data_version visto por cada thread (é por conexão)
+        self._version = None
+        self._info: Dict[str, str] = {}
+        self._medicos: List[Tuple[int, str, str]] = []
+        self._exames: List[Tuple[int, str]] = []
+        self._derived: Dict[str, Any] = {}
+        self.stats = {"loads": 0, "checks": 0}
+
+    def _load(self, conn, version: int) -> None:
+        self._info = dict(conn.execute("SELECT topic, value FROM info"))
+        self._medicos = conn.execute("SELECT id, nome, especialidade FROM medicos ORDER BY id").fetchall()
+        self._exames = conn.execute("SELECT id, nome_exame FROM exames ORDER BY nome_exame").fetchall()
+        self._derived = {}
+        self._version = version
+        self.stats["loads"] += 1
+        log.info("Tabelas de referência carregadas", extra=campos(versao=version))
+
+    def _ensure_fresh(self) -> None:
+        agora = time.monotonic()
+        if self._version is not None and agora < getattr(self._local, "proxima_conferencia", 0.0):
+            return  # Conferido há pouco por esta thread
+
+        conn = get_connection(self.db_file)
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        self._local.proxima_conferencia = agora + REFERENCE_CHECK_INTERVAL
+        if self._version is not None and getattr(self._local, "data_version", None) == data_version:
+            return  # Ninguém gravou no banco desde a última conferência desta thread
+
+        with self._lock:
+            self.stats["checks"] += 1
+            row = conn.execute("SELECT version FROM reference_version WHERE id = 1").fetchone()
+            version = row[0] if row else 0
+            if version != self._version:
+                self._load(conn, version)
+        self._local.data_version = data_version
+
+    def refresh(self) -> None:
+        """Força a recarga no próximo acesso (use depois de editar info/medicos/exames)."""
+        with self._lock:
+            self._version = None
+
+    @property
+    def version(self) -> Optional[int]:
+        self._ensure_fresh()
+        return self._version
+
+    def get_info(self, topic: str) -> Optional[str]:
+        self._ensure_fresh()
+        return self._info.get(topic)
+
+    def get_medicos(self) -> List[Tuple[int, str, str]]:
+        """Lista de (id, nome, especialidade)."""
+        self._ensure_fresh()
+        return self._medicos
+
+    def get_exames(self) -> List[Tuple[int, str]]:
+        """Lista de (id, nome_exame) em ordem alfabética."""
+        self._ensure_fresh()
+        return self._exames
+
+    def nome_medico(self, medico_id: int) -> str:
+        return self.derived("nomes_medicos", lambda: {m[0]: m[1] for m in self._medicos}).get(medico_id, "")
+
+    def nome_exame(self, exame_id: int) -> str:
+        return self.derived("nomes_exames", lambda: dict(self._exames)).get(exame_id, "")
+
+    def medicos_por_especialidade(self, termo: str) -> List[int]:
+        """IDs dos médicos cuja especialidade contém 'termo' (como o LIKE '%termo%' antigo)."""
+        termo = termo.casefold()
+        return [m[0] for m in self.get_medicos() if termo in m[2].casefold()]
+
+    def medicos_por_nome(self, termo: str) -> List[int]:
+        """IDs dos médicos cujo nome contém 'termo'."""
+        termo = termo.casefold()
+        return [m[0] for m in self.get_medicos() if termo in m[1].casefold()]
+
+    def especialidades_por_termo(self, termo: str) -> List[str]:
+        """Especialidades (sem repetição) que contêm 'termo'."""
+        termo = termo.casefold()
+        return sorted({m[2] for m in self.get_medicos() if termo in m[2].casefold()})
+
+    def exames_por_nome(self, termo: str) -> List[int]:
+        """IDs dos exames cujo nome contém 'termo'."""
+        termo = termo.casefold()
+        return [e[0] for e in self.get_exames() if termo in e[1].casefold()]
+
+    def derived(self, key: str, builder: Callable[[], Any]) -> Any:
+        """Valor calculado a partir das tabelas, refeito só quando o cache recarrega."""
+        self._ensure_fresh()
+        derived = self._derived
+        if key not in derived:
+            derived[key] = builder()
+        return derived[key]
+
+
+_caches: Dict[str, ReferenceCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_reference_cache(db_file: str) -> ReferenceCache:
+    """Retorna o cache de referência do processo para o arquivo informado."""
+    cache = _caches.get(db_file)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(db_file, ReferenceCache(db_file))
+    return cache
+
+
+def refresh_reference_cache(db_file: str) -> None:
+    """Hook para escritas administrativas: invalida o cache deste processo."""
+    get_reference_cache(db_file).refresh()
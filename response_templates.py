@@ -0,0 +1,180 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# --- Modo de resposta por ferramenta ---
+# "template": o resultado vira a resposta final por um template em português (sem 2a chamada à IA)
+# "llm": o resultado volta para o Gemini gerar a resposta (comportamento antigo)
+# Os templates leem os dados tipados do resultado (ToolResult.dados, ver tool_results.py), nunca o
+# texto: só ficam em "template" as ferramentas que devolvem dados completos. A info da clínica e a
+# lista de exames são texto livre e vão para a IA (as perguntas comuns já saem pelo intent_router).
+TOOL_RENDER_MODE = {
+    "tool_obter_info_clinica": "llm",
+    "tool_consultar_horarios_disponiveis": "template",
+    "tool_marcar_agendamento": "template",
+    "tool_listar_meus_agendamentos": "template",
+    "tool_cancelar_agendamento": "template",
+    "tool_consultar_exames_disponiveis": "llm",
+    "tool_consultar_horarios_exames": "template",
+    "tool_marcar_exame": "template",
+    "tool_listar_meus_exames_agendados": "template",
+    "tool_cancelar_exame": "template",
+}
+
+# Ferramentas forçadas para o modo "llm" pelo .env (ex: TOOL_RENDER_LLM=tool_marcar_agendamento,tool_marcar_exame)
+for _tool_name in filter(None, os.getenv("TOOL_RENDER_LLM", "").split(",")):
+    TOOL_RENDER_MODE[_tool_name.strip()] = "llm"
+
+_stats_lock = threading.Lock()
+_stats = {"renderizadas": 0, "enviadas_para_llm": 0}
+
+
+def _data_br(data_hora: str) -> str:
+    # '2025-10-24 09:00:00' -> '24/10/2025 às 09:00'
+    data, hora = data_hora.split(" ")
+    ano, mes, dia = data.split("-")
+    return f"{dia}/{mes}/{ano} às {hora[:5]}"
+
+
+def _lista(dados: Dict[str, Any]) -> Optional[str]:
+    # dados de tool_results.lista(): itens (id, nome do médico/exame ou None, 'AAAA-MM-DD HH:MM:SS')
+    if not dados.get("itens"):
+        return None
+    return "\n".join(f"- ID {item_id}: {nome + ' — ' if nome else ''}{_data_br(data_hora)}"
+                     for (item_id, nome, data_hora) in dados["itens"])
+
+
+def _mais_horarios(dados: Dict[str, Any]) -> str:
+    if dados.get("cursor") is None:
+        return ""
+    return "\nHá mais horários: posso mostrar os próximos ou filtrar por data ou período do dia (manhã, tarde, noite)."
+
+
+def _com_filtros(dados: Dict[str, Any]) -> str:
+    return " com esses filtros" if dados.get("com_filtros") else ""
+
+
+def _horarios_consulta(args, dados):
+    especialidade = args.get("especialidade", "a especialidade")
+    if dados.get("status") == "sem_horarios":
+        return (f"Desculpe, não encontramos horários disponíveis para a especialidade '{especialidade}'"
+                f"{_com_filtros(dados)}. Gostaria de procurar outra especialidade?")
+    lista = _lista(dados)
+    if lista is None:
+        return None
+    return (f"Encontrei estes horários disponíveis para {especialidade}:\n{lista}"
+            f"{_mais_horarios(dados)}\nQual ID você prefere? Para confirmar, também preciso do seu nome completo.")
+
+
+def _horarios_exame(args, dados):
+    tipo_exame = args.get("tipo_exame", "o exame")
+    if dados.get("status") == "sem_horarios":
+        return (f"Desculpe, não encontramos horários disponíveis para '{tipo_exame}'{_com_filtros(dados)}. "
+                "Gostaria de ver outro tipo de exame?")
+    lista = _lista(dados)
+    if lista is None:
+        return None
+    return (f"Estes são os horários disponíveis para {tipo_exame}:\n{lista}"
+            f"{_mais_horarios(dados)}\nQual ID você prefere? Para confirmar, também preciso do seu nome completo.")
+
+
+def _meus_agendamentos(args, dados):
+    if dados.get("tipo") != "agendamentos":
+        return None
+    lista = _lista(dados)
+    if lista is None:
+        return "Você não possui agendamentos futuros confirmados. Posso ajudar a agendar uma consulta?"
+    return f"Estes são os seus agendamentos confirmados:\n{lista}\nSe quiser cancelar algum, me informe o ID."
+
+
+def _meus_exames(args, dados):
+    if dados.get("tipo") != "agendamentos":
+        return None
+    lista = _lista(dados)
+    if lista is None:
+        return "Você não possui agendamentos de exames futuros confirmados. Posso ajudar a agendar um exame?"
+    return f"Estes são os seus exames agendados:\n{lista}\nSe quiser cancelar algum, me informe o ID."
+
+
+def _confirmacao(sucesso: str, texto_sucesso: str):
+    def render(args, dados):
+        codigo = dados.get("status")
+        if codigo == sucesso:
+            return texto_sucesso.format(**args)
+        if codigo == "horario_ocupado":
+            return f"Desculpe, o horário {dados['id']} não está mais disponível. Alguém pode ter agendado."
+        if codigo == "nao_confirmado":
+            return (f"Este agendamento (ID {dados['id']}) não está confirmado (status atual: {dados['status_atual']}), "
+                    "portanto não pode ser cancelado.")
+        return None  # Erros e validações: a IA explica ao paciente
+    return render
+
+
+_TEMPLATES = {
+    "tool_consultar_horarios_disponiveis": _horarios_consulta,
+    "tool_consultar_horarios_exames": _horarios_exame,
+    "tool_listar_meus_agendamentos": _meus_agendamentos,
+    "tool_listar_meus_exames_agendados": _meus_exames,
+    "tool_marcar_agendamento": _confirmacao(
+        "confirmado",
+        "Pronto, {nome_paciente}! Sua consulta (horário ID {horario_id}) está confirmada. Posso ajudar em algo mais?"),
+    "tool_marcar_exame": _confirmacao(
+        "confirmado",
+        "Pronto, {nome_paciente}! Seu exame (horário ID {horario_exame_id}) está confirmado. Posso ajudar em algo mais?"),
+    "tool_cancelar_agendamento": _confirmacao(
+        "cancelado",
+        "Seu agendamento (ID {agendamento_id}) foi cancelado e o horário foi liberado. Posso ajudar em algo mais?"),
+    "tool_cancelar_exame": _confirmacao(
+        "cancelado",
+        "Seu exame (ID {agendamento_exame_id}) foi cancelado e o horário foi liberado. Posso ajudar em algo mais?"),
+}
+
+
+def _aplicar(tool_name: str, tool_args: Dict[str, Any], tool_result: Any) -> Optional[str]:
+    """O template com os dados tipados do resultado, ou None (sem template, sem dados ou caso não previsto)."""
+    template = _TEMPLATES.get(tool_name)
+    dados = getattr(tool_result, "dados", None)
+    if template is None or not isinstance(dados, dict):
+        return None
+    try:
+        return template(tool_args, dados)
+    except (KeyError, ValueError, TypeError, IndexError) as e:
+        log.warning("Falha ao renderizar template, usando a IA", extra=campos(ferramenta=tool_name, erro=repr(e)))
+        return None
+
+
+def render_tool_result(tool_name: str, tool_args: Dict[str, Any], tool_result: Any) -> Optional[str]:
+    """
+    Tenta transformar o resultado da ferramenta direto na resposta final.
+    Retorna None quando a ferramenta está no modo "llm" ou o resultado precisa
+    ser interpretado pela IA (erros, resultado sem dados tipados) -> faz a 2a chamada.
+    """
+    resposta = None
+    if TOOL_RENDER_MODE.get(tool_name) == "template":
+        resposta = _aplicar(tool_name, tool_args, tool_result)
+
+    with _stats_lock:
+        _stats["renderizadas" if resposta is not None else "enviadas_para_llm"] += 1
+    return resposta
+
+
+def render_degraded(tool_name: str, tool_args: Dict[str, Any], tool_result: Any) -> str:
+    """
+    Resposta final sem a 2a chamada quando a IA está fora do ar (a ferramenta já rodou: uma
+    marcação feita tem que chegar ao paciente). O template, mesmo com a ferramenta no modo "llm",
+    ou o próprio texto do resultado.
+    """
+    resposta = _aplicar(tool_name, tool_args, tool_result)
+    return resposta if resposta is not None else str(tool_result)
+
+
+def get_render_stats() -> dict:
+    """Quantas respostas saíram de template (= chamadas à IA evitadas) e quantas foram para a IA."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["chamadas_llm_evitadas"] = stats["renderizadas"]
+    return stats
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from database_pool import get_connection, write_transaction
+from reference_cache import get_reference_cache, refresh_reference_cache
+
+# Tabela de horários e coluna do "dono" (médico ou exame) de cada tipo
+TIPOS = {
+    "consulta": ("horarios_disponiveis", "medico_id"),
+    "exame": ("horarios_exames", "exame_id"),
+}
+
+AGENDA_HORIZONTE_DIAS = int(os.getenv("AGENDA_HORIZONTE_DIAS", "365"))  # Até onde a agenda gera horários
+
+# Horários gerados pelos modelos não têm linha no banco: o ID codifica o dono e a data/hora.
+# id = AGENDA_ID_BASE + minutos desde 2020-01-01 * 10000 + dono (até 9999 médicos/exames).
+# A base fica acima de qualquer id de linha (o availability_index já limita os ids a 32 bits).
+AGENDA_ID_BASE = 10 ** 10
+_DONOS_POR_MINUTO = 10_000
+_EPOCH = datetime(1970, 1, 1)
+_ORIGEM_TS = int((datetime(2020, 1, 1) - _EPOCH).total_seconds())
+_DIA = 86400
+
+
+def _ts(data_hora: datetime) -> int:
+    return int((data_hora - _EPOCH).total_seconds())
+
+
+def _agora_ts() -> int:
+    # Mesmo relógio das ferramentas (datetime('now', 'localtime') no SQLite)
+    return _ts(datetime.now().replace(microsecond=0))
+
+
+def _minutos(hora: str) -> int:
+    h, m = hora.split(":")[:2]
+    return int(h) * 60 + int(m)
+
+
+def _formatar(ts: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+
+
+def is_virtual(horario_id: Any) -> bool:
+    """True se o ID é de um horário gerado pela agenda (ainda sem linha no banco)."""
+    try:
+        return int(horario_id) >= AGENDA_ID_BASE
+    except (TypeError, ValueError):
+        return False
+
+
+def virtual_id(ts: int, dono: int) -> int:
+    return AGENDA_ID_BASE + (ts - _ORIGEM_TS) // 60 * _DONOS_POR_MINUTO + dono
+
+
+def decode_virtual(horario_id: int) -> Tuple[int, int]:
+    """ID gerado pela agenda -> (segundos desde 1970, dono)."""
+    minutos, dono = divmod(int(horario_id) - AGENDA_ID_BASE, _DONOS_POR_MINUTO)
+    return _ORIGEM_TS + minutos * 60, dono
+
+
+class ScheduleEngine:
+    """
+    Agenda recorrente: em vez de uma linha por horário livre, modelos semanais por médico/exame
+    (tabela 'agenda_modelos') e bloqueios ('agenda_excecoes', ex: feriados), migração 7.
+
+    - Os horários livres de uma janela são calculados na hora, dia a dia, até atingir o limite.
+    - Só o horário marcado vira linha em horarios_disponiveis/horarios_exames (materializar()).
+      A partir daí ele segue o caminho normal: cancelar volta o status para 'disponivel' e o
+      availability_index passa a mostrá-lo pelo id da linha; a agenda não gera mais aquele horário.
+    - Modelos e exceções ficam no derived() do reference_cache: os triggers da migração 7
+      incrementam a 'reference_version', então edições de qualquer processo aparecem sozinhas.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.stats = {"buscas": 0, "dias_gerados": 0, "materializados": 0}
+
+    # --- Modelos e exceções ---
+
+    def _carregar(self) -> Dict[str, Any]:
+        conn = get_connection(self.db_file)
+        modelos: Dict[str, Dict[int, Dict[int, list]]] = {tipo: {} for tipo in TIPOS}
+        for (tipo, dono, dia_semana, hora_inicio, hora_fim, duracao, valido_de, valido_ate) in conn.execute(
+                "SELECT tipo, dono_id, dia_semana, hora_inicio, hora_fim, duracao_min, valido_de, valido_ate "
+                "FROM agenda_modelos"):
+            modelos[tipo].setdefault(dono, {}).setdefault(dia_semana, []).append((
+                _minutos(hora_inicio), _minutos(hora_fim), duracao,
+                _ts(datetime.fromisoformat(valido_de)) if valido_de else None,
+                _ts(datetime.fromisoformat(valido_ate)) if valido_ate else None,
+            ))
+        excecoes = [(tipo, dono, _ts(datetime.fromisoformat(inicio)), _ts(datetime.fromisoformat(fim)))
+                    for (tipo, dono, inicio, fim) in conn.execute(
+                        "SELECT tipo, dono_id, inicio, fim FROM agenda_excecoes")]
+        return {"modelos": modelos, "excecoes": excecoes}
+
+    def _agenda(self) -> Dict[str, Any]:
+        return get_reference_cache(self.db_file).derived("agenda", self._carregar)
+
+    def tem_modelos(self, tipo: str) -> bool:
+        return bool(self._agenda()["modelos"].get(tipo))
+
+    def _ocorrencias(self, tipo: str, dono: int, dia_ts: int, excecoes: list) -> List[int]:
+        """Horários (início) de um dono num dia, já sem os bloqueados."""
+        dia_semana = (dia_ts // _DIA + 3) % 7  # 1970-01-01 foi uma quinta-feira (3 = quinta, 0 = segunda)
+        bloqueios = [(inicio, fim) for (ex_tipo, ex_dono, inicio, fim) in excecoes
+                     if ex_tipo in (None, tipo) and ex_dono in (None, dono)]
+        horarios = []
+        for (inicio, fim, duracao, valido_de, valido_ate) in self._agenda()["modelos"][tipo].get(dono, {}).get(dia_semana, ()):
+            if (valido_de is not None and dia_ts < valido_de) or (valido_ate is not None and dia_ts > valido_ate):
+                continue
+            passo = duracao * 60
+            gerados = range(dia_ts + inicio * 60, dia_ts + fim * 60 - passo + 1, passo)
+            if bloqueios:
+                gerados = [ts for ts in gerados
+                           if not any(b_inicio < ts + passo and ts < b_fim for (b_inicio, b_fim) in bloqueios)]
+            horarios.extend(gerados)
+        return horarios
+
+    def _gravados(self, tipo: str, donos: List[int], dia_ts: int) -> set:
+        """(dono, início) dos horários que já têm linha no banco nesse dia (livres ou marcados)."""
+        tabela, dono = TIPOS[tipo]
+        marcadores = ",".join("?" * len(donos))
+        return set(get_connection(self.db_file).execute(
+            f"SELECT {dono}, CAST(strftime('%s', data_hora_inicio) AS INTEGER) FROM {tabela} "
+            f"WHERE {dono} IN ({marcadores}) AND data_hora_inicio >= ? AND data_hora_inicio < ?",
+            (*donos, _formatar(dia_ts), _formatar(dia_ts + _DIA))))
+
+    # --- Buscas ---
+
+    def livres(self, tipo: str, donos: Iterable[int], inicio: Optional[int] = None, fim: Optional[int] = None,
+               horas: Optional[Tuple[int, int]] = None, depois_de: Optional[Tuple[int, int, int]] = None,
+               limite: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        """
+        Próximos horários livres gerados pelos modelos, como (segundos, dono, id virtual), em ordem.
+        - inicio/fim: janela [inicio, fim) em segundos; nunca antes de agora nem além do horizonte;
+        - horas: faixa de horas do dia [de, até); depois_de: (segundos, dono, id) do cursor.
+        """
+        modelos = self._agenda()["modelos"].get(tipo, {})
+        donos = sorted({d for d in donos if d in modelos})
+        if not donos:
+            return []
+        self.stats["buscas"] += 1
+
+        agora = _agora_ts()
+        desde = max(agora, inicio or 0, depois_de[0] if depois_de else 0)
+        ate = agora - agora % _DIA + (AGENDA_HORIZONTE_DIAS + 1) * _DIA
+        if fim is not None:
+            ate = min(ate, fim)
+
+        # O id virtual é função de (instante, dono): basta comparar esse par com o do cursor
+        cursor = depois_de[:2] if depois_de else None
+        todas_excecoes = self._agenda()["excecoes"]
+        resultado = []
+        dia_ts = desde - desde % _DIA
+        while dia_ts < ate:
+            excecoes = [e for e in todas_excecoes if e[2] < dia_ts + _DIA and dia_ts < e[3]]
+            candidatos = []
+            for dono in donos:
+                for ts in self._ocorrencias(tipo, dono, dia_ts, excecoes):
+                    if desde <= ts < ate and (horas is None or horas[0] <= ts // 3600 % 24 < horas[1]) \
+                            and (cursor is None or (ts, dono) > cursor):
+                        candidatos.append((ts, dono))
+            self.stats["dias_gerados"] += 1
+            if candidatos:
+                gravados = self._gravados(tipo, donos, dia_ts)
+                candidatos.sort()
+                for (ts, dono) in candidatos:
+                    if (dono, ts) not in gravados:
+                        resultado.append((ts, dono, virtual_id(ts, dono)))
+                        if limite is not None and len(resultado) >= limite:
+                            return resultado
+            dia_ts += _DIA
+        return resultado
+
+    def ocorrencia_valida(self, tipo: str, dono: int, ts: int) -> bool:
+        """O horário sai de um modelo, não está bloqueado, não passou e está dentro do horizonte."""
+        agora = _agora_ts()
+        if ts < agora or ts >= agora + (AGENDA_HORIZONTE_DIAS + 1) * _DIA:
+            return False
+        dia_ts = ts - ts % _DIA
+        return ts in self._ocorrencias(tipo, dono, dia_ts, self._agenda()["excecoes"])
+
+    def materializar(self, conn, tipo: str, horario_id: int) -> Optional[int]:
+        """
+        Dentro da transação de marcação: devolve o id da LINHA do horário gerado pela agenda,
+        inserindo-a como 'disponivel' se ainda não existir (a marcação então a ocupa normalmente).
+        None se o ID não corresponde a um horário da agenda.
+        """
+        ts, dono = decode_virtual(horario_id)
+        if not self.ocorrencia_valida(tipo, dono, ts):
+            return None
+        tabela, coluna = TIPOS[tipo]
+        row = conn.execute(
+            f"SELECT id FROM {tabela} WHERE {coluna} = ? AND data_hora_inicio = ? "
+            "ORDER BY status = 'disponivel' DESC LIMIT 1", (dono, _formatar(ts))).fetchone()
+        if row:
+            return row[0]  # Já virou linha antes (marcado e talvez cancelado depois)
+        self.stats["materializados"] += 1
+        return conn.execute(
+            f"INSERT INTO {tabela} ({coluna}, data_hora_inicio, status) VALUES (?, ?, 'disponivel')",
+            (dono, _formatar(ts))).lastrowid
+
+
+_engines: Dict[str, ScheduleEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_schedule_engine(db_file: str) -> ScheduleEngine:
+    """Retorna a agenda recorrente do processo para o arquivo informado."""
+    engine = _engines.get(db_file)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.setdefault(db_file, ScheduleEngine(db_file))
+    return engine
+
+
+# --- Cadastro (scripts administrativos) ---
+
+def adicionar_modelo(db_file: str, tipo: str, dono_id: int, dia_semana: int, hora_inicio: str, hora_fim: str,
+                     duracao_min: int, valido_de: Optional[str] = None, valido_ate: Optional[str] = None) -> int:
+    """
+    Cadastra um modelo semanal. Ex: adicionar_modelo(db, 'consulta', 1, 0, '08:00', '12:00', 30)
+    = Dra. Ana Silva, toda segunda, das 8h às 12h, de 30 em 30 minutos.
+    """
+    if tipo not in TIPOS:
+        raise ValueError(f"tipo '{tipo}' inválido (use consulta ou exame)")
+    modelo_id = write_transaction(db_file, lambda conn: conn.execute(
+        "INSERT INTO agenda_modelos (tipo, dono_id, dia_semana, hora_inicio, hora_fim, duracao_min, valido_de, valido_ate) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (tipo, dono_id, dia_semana, hora_inicio, hora_fim, duracao_min, valido_de, valido_ate)).lastrowid)
+    refresh_reference_cache(db_file)  # O data_version não muda para a conexão que gravou
+    return modelo_id
+
+
+def adicionar_excecao(db_file: str, inicio: str, fim: str, tipo: Optional[str] = None,
+                      dono_id: Optional[int] = None, motivo: Optional[str] = None) -> int:
+    """
+    Bloqueia [inicio, fim) na agenda. Sem tipo/dono_id vale para todos.
+    Ex: adicionar_excecao(db, '2026-12-25', '2026-12-26', motivo='Natal').
+    """
+    excecao_id = write_transaction(db_file, lambda conn: conn.execute(
+        "INSERT INTO agenda_excecoes (tipo, dono_id, inicio, fim, motivo) VALUES (?, ?, ?, ?, ?)",
+        (tipo, dono_id, inicio, fim, motivo)).lastrowid)
+    refresh_reference_cache(db_file)
+    return excecao_id
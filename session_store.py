@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import database_tools
+from database_pool import get_connection, write_transaction
+
+# --- Configuração do armazenamento de conversas (pode ser ajustada pelo .env) ---
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))    # Conversas mantidas em memória (LRU)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))      # Conversa expira após 1h parada
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))      # Mensagens guardadas por conversa
+SESSION_PURGE_EVERY = 200  # A cada N gravações, apaga do SQLite as conversas expiradas
+
+
+class SessionStore:
+    """
+    Guarda o histórico de cada conversa no servidor, substituindo o 'chat_history'
+    que o front-end enviava inteiro a cada mensagem.
+
+    Duas camadas:
+    - Memória: LRU limitado a SESSION_MAX_SESSIONS conversas, com TTL por conversa.
+    - SQLite (tabela 'conversas'): sobrevive a reinícios e é compartilhada entre os
+      workers do gunicorn. Cada gravação incrementa 'versao'; na leitura, a cópia em
+      memória só é usada se a versão bater com a do banco (outro worker pode ter gravado).
+    """
+
+    def __init__(self, db_file: str, max_sessions: int = SESSION_MAX_SESSIONS,
+                 ttl_seconds: int = SESSION_TTL_SECONDS, max_messages: int = SESSION_MAX_MESSAGES):
+        self.db_file = db_file
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._cache = OrderedDict()  # conversation_id -> (versao, expira_em, historico)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def new_conversation_id() -> str:
+        return uuid.uuid4().hex
+
+    def get_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Retorna o histórico da conversa (lista vazia se não existir ou tiver expirado)."""
+        agora = time.time()
+        row = get_connection(self.db_file).execute(
+            "SELECT versao, expira_em FROM conversas WHERE id = ?", (conversation_id,)
+        ).fetchone()
+
+        if not row or row[1] < agora:
+            with self._lock:
+                self._cache.pop(conversation_id, None)
+                if row:
+                    self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+            return []
+
+        versao = row[0]
+        with self._lock:
+            entrada = self._cache.get(conversation_id)
+            if entrada and entrada[0] == versao:
+                self._cache.move_to_end(conversation_id)
+                self._stats["hits"] += 1
+                return list(entrada[2])
+            self._stats["misses"] += 1
+
+        # Não estava em memória (ou outro worker gravou depois): lê o JSON do banco
+        row = get_connection(self.db_file).execute(
+            "SELECT versao, expira_em, historico FROM conversas WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if not row:
+            return []
+        historico = json.loads(row[2])
+        self._remember(conversation_id, row[0], row[1], historico)
+        return list(historico)
+
+    def append_turn(self, conversation_id: str, user_message: str, bot_reply: str,
+                    historico_inicial: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Acrescenta a mensagem do usuário e a resposta do bot ao histórico.
+        'historico_inicial' só é usado se a conversa ainda não existir no banco
+        (compatibilidade com o front-end antigo, que ainda manda o histórico inteiro).
+        """
+        agora = time.time()
+        expira_em = agora + self.ttl_seconds
+        novas = [
+            {"role": "user", "parts": [{"text": user_message}]},
+            {"role": "model", "parts": [{"text": bot_reply}]},
+        ]
+
+        def _gravar(conn):
+            # Lê e grava na mesma transação: duas mensagens simultâneas da mesma conversa não se perdem
+            row = conn.execute(
+                "SELECT versao, expira_em, historico FROM conversas WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            if row and row[1] >= agora:
+                versao, historico = row[0] + 1, json.loads(row[2])
+            else:
+                versao, historico = (row[0] + 1 if row else 1), list(historico_inicial or [])
+
+            historico = (historico + novas)[-self.max_messages:]
+            conn.execute(
+                """
+                INSERT INTO conversas (id, versao, expira_em, historico) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET versao = excluded.versao, expira_em = excluded.expira_em,
+                                              historico = excluded.historico
+                """,
+                (conversation_id, versao, expira_em, json.dumps(historico, ensure_ascii=False))
+            )
+            return versao, historico
+
+        versao, historico = write_transaction(self.db_file, _gravar)
+        self._remember(conversation_id, versao, expira_em, historico)
+
+        with self._lock:
+            self._writes += 1
+            purgar = self._writes % SESSION_PURGE_EVERY == 0
+        if purgar:
+            self.purge_expired()
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._cache.pop(conversation_id, None)
+        write_transaction(self.db_file, lambda conn: conn.execute(
+            "DELETE FROM conversas WHERE id = ?", (conversation_id,)))
+
+    def purge_expired(self) -> int:
+        """Apaga do SQLite (e da memória) as conversas expiradas. Retorna quantas foram apagadas."""
+        agora = time.time()
+        with self._lock:
+            vencidas = [cid for cid, (_, expira_em, _) in self._cache.items() if expira_em < agora]
+            for cid in vencidas:
+                del self._cache[cid]
+            self._stats["expirations"] += len(vencidas)
+        return write_transaction(self.db_file, lambda conn: conn.execute(
+            "DELETE FROM conversas WHERE expira_em < ?", (agora,)).rowcount)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Contadores de acerto/erro/remoção do cache em memória deste processo."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions_in_memory"] = len(self._cache)
+        return stats
+
+    def _remember(self, conversation_id, versao, expira_em, historico) -> None:
+        with self._lock:
+            self._cache[conversation_id] = (versao, expira_em, historico)
+            self._cache.move_to_end(conversation_id)
+            while len(self._cache) > self.max_sessions:
+                self._cache.popitem(last=False)
+                self._stats["evictions"] += 1
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Retorna o SessionStore do processo (criado na primeira chamada)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(database_tools.DATABASE_FILE)
+    return _store
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 # Carrega as variáveis de ambiente
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
 
 def set_webhook():
     if not TELEGRAM_BOT_TOKEN:
@@ -23,6 +24,9 @@ def set_webhook():
 
     # A URL da API do Telegram para configurar o webhook
     api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook?url={webhook_url}"
+    if TELEGRAM_WEBHOOK_SECRET:
+        # O Telegram devolve esse valor no header X-Telegram-Bot-Api-Secret-Token (conferido pelo webhook)
+        api_url += f"&secret_token={TELEGRAM_WEBHOOK_SECRET}"
 
     try:
         print(f"Configurando webhook para: {webhook_url}")
@@ -0,0 +1,224 @@
+"""
+Logs estruturados (uma linha JSON por registro) sem I/O no caminho da requisição.
+
+- Quem loga só põe o registro numa fila (QueueHandler). Uma thread (QueueListener) formata,
+  aplica a redação e escreve no stdout. Com a fila cheia (LOG_FILA_MAX), o registro é descartado
+  e contado, em vez de travar a requisição esperando o stdout.
+- Cada registro leva os IDs de correlação do contexto atual (request_id, chat_id, conversation_id...),
+  definidos com contexto_log(...) nas entradas: rota /chat e worker do Telegram.
+- Dados do paciente vão em campos separados (extra=campos(...)), nunca no texto da mensagem.
+  Os campos listados em LOG_REDIGIR (também dentro de dicts, como os tool_args) saem como hash
+  curto (LOG_REDACAO=hash, dá para correlacionar sem expor), '***' (mascara) ou sem redação (nenhuma).
+- Registros DEBUG (resultados inteiros de ferramentas, tamanho do prompt) são amostrados:
+  com LOG_LEVEL=DEBUG, só a fração LOG_AMOSTRA_DEBUG deles é escrita.
+
+Uso: log = get_logger(__name__); log.info("Agendamento confirmado", extra=campos(horario_id=12))
+LOG_FORMATO=texto troca o JSON por linhas legíveis ("--- mensagem --- campo=valor"), para desenvolvimento.
+"""
+import atexit
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()  # LOG_* do .env valem mesmo se este módulo for importado antes do config.py
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json")  # json | texto
+LOG_REDACAO = os.getenv("LOG_REDACAO", "hash")  # hash | mascara | nenhuma
+LOG_REDIGIR = frozenset(c.strip() for c in os.getenv(
+    "LOG_REDIGIR", "nome_paciente,mensagem,resposta,resultado,historico").split(",") if c.strip())
+LOG_REDACAO_SAL = os.getenv("LOG_REDACAO_SAL", "")  # Sal do hash: sem ele, nomes comuns são fáceis de adivinhar
+LOG_AMOSTRA_DEBUG = float(os.getenv("LOG_AMOSTRA_DEBUG", "0.1"))
+LOG_FILA_MAX = int(os.getenv("LOG_FILA_MAX", "10000"))
+
+_contexto: contextvars.ContextVar = contextvars.ContextVar("log_contexto", default={})
+
+
+def campos(**valores) -> Dict[str, Any]:
+    """Campos estruturados de um registro: log.info("...", extra=campos(horario_id=1))."""
+    return {"campos": valores}
+
+
+def novo_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextlib.contextmanager
+def contexto_log(**ids):
+    """IDs de correlação para todos os registros feitos dentro do bloco (inclusive em código async)."""
+    token = _contexto.set({**_contexto.get(), **{k: v for (k, v) in ids.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+
+def contexto_atual() -> Dict[str, Any]:
+    return _contexto.get()
+
+
+# --- Redação ---
+
+def _redigir_valor(valor: Any) -> str:
+    if LOG_REDACAO == "mascara":
+        return "***"
+    digest = hashlib.sha256(f"{LOG_REDACAO_SAL}{valor}".encode("utf-8", "replace")).hexdigest()
+    return f"h:{digest[:10]}"
+
+
+def redigir(dados: Any) -> Any:
+    """Troca os campos de LOG_REDIGIR (em qualquer nível de dicts/listas) pela versão redigida."""
+    if LOG_REDACAO == "nenhuma":
+        return dados
+    if isinstance(dados, dict):
+        return {k: (_redigir_valor(v) if k in LOG_REDIGIR and v is not None else redigir(v)) for (k, v) in dados.items()}
+    if isinstance(dados, (list, tuple)):
+        return [redigir(v) for v in dados]
+    return dados
+
+
+# --- Formatação (roda na thread do listener) ---
+
+def _registro(record: logging.LogRecord) -> Dict[str, Any]:
+    dados = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+        "nivel": record.levelname,
+        "modulo": record.name.removeprefix("clinica."),
+        "msg": record.getMessage(),
+    }
+    dados.update(getattr(record, "contexto", None) or {})
+    dados.update(getattr(record, "campos", None) or {})
+    if record.exc_text:
+        dados["excecao"] = record.exc_text
+    return redigir(dados)
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(_registro(record), ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    """O estilo antigo dos prints ("--- mensagem ---"), com os campos no fim."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados = _registro(record)
+        extras = " ".join(f"{k}={v}" for (k, v) in dados.items() if k not in ("ts", "nivel", "modulo", "msg", "excecao"))
+        linha = f"--- {dados['modulo'].upper()}: {dados['msg']} ---" + (f" {extras}" if extras else "")
+        if record.levelno >= logging.WARNING:
+            linha = f"{record.levelname} {linha}"
+        return linha + (f"\n{dados['excecao']}" if "excecao" in dados else "")
+
+
+class _SaidaPadrao(logging.StreamHandler):
+    """Escreve sempre no sys.stdout da hora (os benchmarks redirecionam o stdout para silenciar)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, _valor):
+        pass
+
+
+# --- Fila (roda na thread de quem loga) ---
+
+class _ContextoEAmostragem(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and random.random() >= LOG_AMOSTRA_DEBUG:
+            return False
+        record.contexto = _contexto.get()
+        return True
+
+
+class _FilaHandler(logging.handlers.QueueHandler):
+    def __init__(self, fila: queue.Queue):
+        super().__init__(fila)
+        self.descartados = 0
+        self.pid = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Sem formatar aqui: só congela a mensagem (args podem mudar depois) e o traceback
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.pid != os.getpid():
+            _iniciar_listener()
+        super().emit(record)
+
+
+_handler = _FilaHandler(queue.Queue(maxsize=LOG_FILA_MAX))
+_handler.addFilter(_ContextoEAmostragem())
+_listener = None
+_listener_lock = threading.Lock()
+
+_raiz = logging.getLogger("clinica")
+_raiz.setLevel(LOG_LEVEL)
+_raiz.addHandler(_handler)
+_raiz.propagate = False
+
+
+def _iniciar_listener() -> None:
+    """Sobe a thread que escreve os logs (uma por processo: depois do fork do gunicorn, sobe de novo)."""
+    global _listener
+    with _listener_lock:
+        if _handler.pid == os.getpid():
+            return
+        if _handler.pid is not None:
+            # Processo filho (fork): a fila herdada pode ter registros do pai e um lock em uso
+            _handler.queue = queue.Queue(maxsize=LOG_FILA_MAX)
+        saida = _SaidaPadrao()
+        saida.setFormatter(FormatoTexto() if LOG_FORMATO == "texto" else FormatoJSON())
+        _listener = logging.handlers.QueueListener(_handler.queue, saida)
+        _listener.start()
+        _handler.pid = os.getpid()
+
+
+def get_logger(nome: str) -> logging.Logger:
+    return logging.getLogger(f"clinica.{nome}")
+
+
+def get_log_stats() -> Dict[str, int]:
+    return {"na_fila": _handler.queue.qsize(), "descartados": _handler.descartados}
+
+
+def flush_logs(timeout: float = 5.0) -> None:
+    """Espera a fila esvaziar (testes e saída do processo)."""
+    fim = time.monotonic() + timeout
+    while _handler.queue.unfinished_tasks and time.monotonic() < fim:
+        time.sleep(0.005)
+
+
+@atexit.register
+def _parar_listener() -> None:
+    if _listener is not None and _handler.pid == os.getpid():
+        flush_logs()
+        try:
+            _listener.stop()
+        except queue.Full:
+            pass
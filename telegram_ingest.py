@@ -0,0 +1,362 @@
+"""
+Ingestão das mensagens do Telegram (webhook e polling): dedupe pelo update_id, filas por chat e o
+pipeline update -> agente -> resposta.
+
+O update_id fica como pendente no SQLite até a resposta sair. Se o atendimento falhar, ou se o
+worker for desligado com a mensagem ainda na fila, o update_id é liberado e um reenvio do mesmo
+update é processado de novo. Se o worker morrer sem conseguir liberar, o reenvio assume o update
+depois de TELEGRAM_PENDENTE_EXPIRA_S segundos. O Telegram só reenvia o que não recebeu 200: um update
+já confirmado que estava na fila de um worker morto não volta sozinho.
+
+Limite: a ordem por chat vale dentro de UM processo (as filas ficam na memória). Com vários workers
+do gunicorn, duas mensagens do mesmo chat podem cair em workers diferentes e ser atendidas ao mesmo
+tempo, fora de ordem. Para garantir a ordem, a rota /webhook/telegram (ou o telegram_polling.py)
+deve rodar num único processo.
+"""
+import os
+import queue
+import threading
+import time
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+import database_tools
+from admission import RESPOSTA_OCUPADO, AdmissaoRecusada, get_admission
+from agent import process_web_message
+from database_pool import write_transaction
+from session_store import get_session_store
+from structured_log import campos, contexto_log, get_logger, novo_request_id
+from telegram_utils import parse_webhook_data, send_telegram_message
+
+log = get_logger(__name__)
+
+# --- Configuração da ingestão (pode ser ajustada pelo .env) ---
+TELEGRAM_INGEST_WORKERS = int(os.getenv("TELEGRAM_INGEST_WORKERS", "8"))
+TELEGRAM_INGEST_QUEUE = int(os.getenv("TELEGRAM_INGEST_QUEUE", "1000"))  # Capacidade total da fila
+TELEGRAM_UPDATE_TTL_SECONDS = 24 * 3600  # O Telegram só reenvia updates das últimas 24h
+TELEGRAM_DEDUPE_PURGE_EVERY = 500        # A cada N updates novos, apaga os update_id antigos
+# Um update pendente há mais tempo que isso (worker morto no meio) pode ser assumido por um reenvio
+TELEGRAM_PENDENTE_EXPIRA_S = float(os.getenv("TELEGRAM_PENDENTE_EXPIRA_S", "600"))
+# Se definido, o webhook só aceita requisições com o header X-Telegram-Bot-Api-Secret-Token igual a ele
+# (o set_webhook.py envia o mesmo valor como 'secret_token')
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or None
+
+
+class ChatDispatcher:
+    """
+    Pool de workers que processa mensagens em segundo plano.
+
+    Cada chat cai sempre na mesma fila (chat_id -> worker), então as mensagens de um
+    chat são tratadas em ordem, enquanto chats diferentes rodam em paralelo (só dentro deste
+    processo: as filas ficam na memória).
+    As filas são limitadas: submit() retorna False quando não há espaço (backpressure).
+    """
+
+    def __init__(self, handler: Callable[[Any, Any], None], workers: int = TELEGRAM_INGEST_WORKERS,
+                 max_queue: int = TELEGRAM_INGEST_QUEUE, name: str = "telegram-ingest"):
+        self.handler = handler
+        self.name = name
+        self._queues = [queue.Queue(maxsize=max(1, max_queue // workers)) for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"enfileiradas": 0, "processadas": 0, "erros": 0, "rejeitadas_fila_cheia": 0,
+                       "fila_max": 0, "espera_total_s": 0.0, "espera_max_s": 0.0, "processamento_total_s": 0.0,
+                       "com_lag": 0, "lag_total_s": 0.0, "lag_max_s": 0.0}
+
+    def submit(self, chat_id, item, enviado_em: Optional[float] = None,
+               ao_concluir: Optional[Callable[[bool], None]] = None) -> bool:
+        """
+        Enfileira o item do chat. Retorna False se a fila do chat estiver cheia.
+        'enviado_em' (epoch, ex: o 'date' da mensagem do Telegram) mede o lag de ponta a ponta.
+        'ao_concluir(ok)' roda depois do handler (ok=False se ele falhou) ou, com ok=False, se o
+        close() descartar o item ainda na fila.
+        """
+        self._ensure_started()
+        try:
+            self._queues[hash(chat_id) % len(self._queues)].put_nowait(
+                (time.monotonic(), enviado_em, chat_id, item, ao_concluir))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejeitadas_fila_cheia"] += 1
+            return False
+        profundidade = self.depth()
+        with self._stats_lock:
+            self._stats["enfileiradas"] += 1
+            self._stats["fila_max"] = max(self._stats["fila_max"], profundidade)
+        return True
+
+    def depth(self) -> int:
+        return sum(fila.qsize() for fila in self._queues)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Espera todas as filas esvaziarem. Retorna False se o tempo acabar antes."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        for fila in self._queues:
+            while fila.unfinished_tasks:
+                if limite is not None and time.monotonic() >= limite:
+                    return False
+                time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Processa o que já está na fila (até 'timeout' segundos) e para os workers.
+        O que sobrar na fila é descartado, com ao_concluir(False).
+        """
+        if not self._started:
+            return
+        self.join(timeout)
+        descartadas = 0
+        for fila in self._queues:
+            while True:
+                try:
+                    entrada = fila.get_nowait()
+                except queue.Empty:
+                    break
+                if entrada is not None:
+                    descartadas += 1
+                    self._concluir(entrada[2], entrada[4], False)
+                fila.task_done()
+        if descartadas:
+            log.warning("Mensagens do Telegram descartadas ao desligar", extra=campos(quantidade=descartadas))
+        for fila in self._queues:
+            fila.put(None)
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._started = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas de backpressure: profundidade da fila e tempo de espera até um worker pegar o item."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["fila_atual"] = self.depth()
+        stats["espera_media_s"] = stats["espera_total_s"] / stats["processadas"] if stats["processadas"] else 0.0
+        stats["processamento_medio_s"] = (stats["processamento_total_s"] / stats["processadas"]
+                                          if stats["processadas"] else 0.0)
+        stats["lag_medio_s"] = stats["lag_total_s"] / stats["com_lag"] if stats["com_lag"] else 0.0
+        return stats
+
+    def _ensure_started(self) -> None:
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._threads = []
+            for i, fila in enumerate(self._queues):
+                thread = threading.Thread(target=self._worker, args=(fila,), name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def _worker(self, fila: queue.Queue) -> None:
+        while True:
+            entrada = fila.get()
+            if entrada is None:
+                fila.task_done()
+                return
+            enfileirado_em, enviado_em, chat_id, item, ao_concluir = entrada
+            inicio = time.monotonic()
+            erro = False
+            try:
+                self.handler(chat_id, item)
+            except Exception:
+                erro = True
+                log.exception("Falha ao processar mensagem do Telegram", extra=campos(chat_id=chat_id))
+            finally:
+                self._concluir(chat_id, ao_concluir, not erro)
+                fim = time.monotonic()
+                espera = inicio - enfileirado_em
+                with self._stats_lock:
+                    self._stats["processadas"] += 1
+                    self._stats["erros"] += 1 if erro else 0
+                    self._stats["espera_total_s"] += espera
+                    self._stats["espera_max_s"] = max(self._stats["espera_max_s"], espera)
+                    self._stats["processamento_total_s"] += fim - inicio
+                    if enviado_em is not None:
+                        # Da mensagem enviada pelo usuário até a resposta pronta
+                        lag = max(0.0, time.time() - enviado_em)
+                        self._stats["com_lag"] += 1
+                        self._stats["lag_total_s"] += lag
+                        self._stats["lag_max_s"] = max(self._stats["lag_max_s"], lag)
+                fila.task_done()
+
+    @staticmethod
+    def _concluir(chat_id, ao_concluir: Optional[Callable[[bool], None]], ok: bool) -> None:
+        if ao_concluir is None:
+            return
+        try:
+            ao_concluir(ok)
+        except Exception:
+            log.exception("Falha ao concluir mensagem do Telegram", extra=campos(chat_id=chat_id))
+
+
+# --- Dedupe de update_id (tabela 'telegram_updates', compartilhada entre os workers do gunicorn) ---
+
+_dedupe_lock = threading.Lock()
+_novos_desde_purga = 0
+
+
+def _reservar(conn, update_id: int, agora: float) -> bool:
+    if conn.execute("INSERT OR IGNORE INTO telegram_updates (update_id, recebido_em, processado) VALUES (?, ?, 0)",
+                    (update_id, agora)).rowcount == 1:
+        return True
+    # Ainda pendente, de um worker que morreu antes de responder ou liberar: o reenvio assume o update
+    return conn.execute(
+        "UPDATE telegram_updates SET recebido_em = ? WHERE update_id = ? AND processado = 0 AND recebido_em < ?",
+        (agora, update_id, agora - TELEGRAM_PENDENTE_EXPIRA_S)).rowcount == 1
+
+
+def register_update(update_id: int, db_file: str = None) -> bool:
+    """
+    Grava o update_id como pendente. Retorna False se ele já tinha sido recebido (reenvio do
+    Telegram), a não ser que esteja pendente há mais de TELEGRAM_PENDENTE_EXPIRA_S segundos.
+    """
+    global _novos_desde_purga
+    db_file = db_file or database_tools.DATABASE_FILE
+    agora = time.time()
+    novo = write_transaction(db_file, lambda conn: _reservar(conn, update_id, agora))
+
+    if novo:
+        with _dedupe_lock:
+            _novos_desde_purga += 1
+            purgar = _novos_desde_purga >= TELEGRAM_DEDUPE_PURGE_EVERY
+            if purgar:
+                _novos_desde_purga = 0
+        if purgar:
+            write_transaction(db_file, lambda conn: conn.execute(
+                "DELETE FROM telegram_updates WHERE recebido_em < ?", (agora - TELEGRAM_UPDATE_TTL_SECONDS,)))
+    return novo
+
+
+def forget_update(update_id: int, db_file: str = None) -> None:
+    """Remove o update_id (o update não foi atendido e um reenvio deve ser processado de novo)."""
+    db_file = db_file or database_tools.DATABASE_FILE
+    write_transaction(db_file, lambda conn: conn.execute(
+        "DELETE FROM telegram_updates WHERE update_id = ?", (update_id,)))
+
+
+def complete_update(update_id: int, db_file: str = None) -> None:
+    """Marca o update_id como atendido: daqui em diante um reenvio é só 'duplicado'."""
+    db_file = db_file or database_tools.DATABASE_FILE
+    write_transaction(db_file, lambda conn: conn.execute(
+        "UPDATE telegram_updates SET processado = 1 WHERE update_id = ?", (update_id,)))
+
+
+# --- Pipeline: update do Telegram -> agente -> resposta ---
+
+def process_telegram_message(chat_id, user_message: str) -> None:
+    """Roda no worker: carrega o histórico do chat, chama o agente e envia a resposta."""
+    store = get_session_store()
+    conversation_id = f"telegram:{chat_id}"
+    with contexto_log(request_id=novo_request_id(), chat_id=chat_id, conversation_id=conversation_id):
+        # Mesmo limite de mensagens em atendimento do /chat neste processo (admission.py)
+        try:
+            vaga = get_admission().entrar()
+        except AdmissaoRecusada:
+            send_telegram_message(chat_id, RESPOSTA_OCUPADO)
+            return
+        with vaga:
+            chat_history = store.get_history(conversation_id)
+            bot_reply = process_web_message(user_message, chat_history, chat_id=str(chat_id))
+            store.append_turn(conversation_id, user_message, bot_reply)
+        send_telegram_message(chat_id, bot_reply)
+
+
+_dispatcher: Optional[ChatDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> ChatDispatcher:
+    """Dispatcher compartilhado do processo (webhook e polling usam o mesmo)."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = ChatDispatcher(process_telegram_message)
+    return _dispatcher
+
+
+def handle_update(update: Any, dispatcher: ChatDispatcher = None) -> str:
+    """
+    Valida o update, faz o dedupe pelo update_id e enfileira a mensagem.
+    Não espera a IA: quem chama responde 200 ao Telegram na hora. O update_id fica pendente até o
+    worker terminar; se o atendimento falhar ou o worker desligar antes, ele é liberado.
+    Usado pelo webhook (api.py/asgi.py) e pelo modo polling (telegram_polling.py).
+
+    Retorna 'enfileirado', 'duplicado', 'ignorado' (não é mensagem de texto), 'limitado' (o chat
+    passou da taxa do admission.py; a mensagem é descartada e o paciente recebe o RESPOSTA_OCUPADO,
+    como no 429 do /chat), 'invalido' ou 'fila_cheia' (o chamador deve responder erro para o
+    Telegram reenviar).
+    """
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        return "invalido"
+    update_id = update["update_id"]
+    if not register_update(update_id):
+        return "duplicado"
+
+    try:
+        status = _despachar(update, dispatcher, partial(_concluir, update_id))
+    except Exception:
+        # Falhou antes de a mensagem ser entregue (ex: lock do SQLite esgotado): o update_id não
+        # pode ficar como visto, senão o reenvio (ou o próximo getUpdates) vira 'duplicado' e se perde
+        _esquecer(update_id)
+        raise
+    if status == "fila_cheia":
+        _esquecer(update_id)
+    elif status != "enfileirado":
+        # 'ignorado' e 'limitado' já terminaram aqui
+        _concluir(update_id, True)
+    return status
+
+
+def _despachar(update: Dict[str, Any], dispatcher: Optional[ChatDispatcher],
+               ao_concluir: Callable[[bool], None]) -> str:
+    try:
+        chat_id, user_message = parse_webhook_data(update)
+    except (KeyError, TypeError):
+        chat_id, user_message = None, None
+    if chat_id is None or not user_message or not user_message.strip():
+        return "ignorado"
+    try:
+        get_admission().limitar(chat=f"telegram:{chat_id}")
+    except AdmissaoRecusada:
+        # Responde 200 mesmo assim (um reenvio do Telegram só gastaria outra ficha), mas avisa o
+        # paciente em vez de ficar em silêncio; o envio vai para a fila do telegram_sender
+        send_telegram_message(chat_id, RESPOSTA_OCUPADO)
+        return "limitado"
+
+    enviado_em = update["message"].get("date")
+    if not (dispatcher or get_dispatcher()).submit(chat_id, user_message.strip(), enviado_em, ao_concluir):
+        return "fila_cheia"
+    return "enfileirado"
+
+
+def _concluir(update_id: int, ok: bool) -> None:
+    """Fim do atendimento (no worker): marca o update como atendido ou o libera para reenvio."""
+    if not ok:
+        _esquecer(update_id)
+        return
+    try:
+        complete_update(update_id)
+    except Exception:
+        # Fica pendente: um reenvio depois de TELEGRAM_PENDENTE_EXPIRA_S seria atendido de novo
+        log.exception("Não foi possível marcar o update_id como atendido", extra=campos(update_id=update_id))
+
+
+def _esquecer(update_id: int) -> None:
+    try:
+        forget_update(update_id)
+    except Exception:
+        log.exception("Não foi possível liberar o update_id para reenvio", extra=campos(update_id=update_id))
+
+
+def get_ingest_stats() -> Dict[str, Any]:
+    return get_dispatcher().get_stats() if _dispatcher is not None else {}
+
+
+def close_dispatcher() -> None:
+    if _dispatcher is not None:
+        _dispatcher.close()
@@ -0,0 +1,186 @@
+# telegram_polling.py
+# Modo polling: busca as mensagens com getUpdates em vez de receber o webhook.
+# Útil em servidores atrás de NAT (sem ngrok nem set_webhook.py).
+#
+# Para rodar: python telegram_polling.py
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import requests
+
+import database_tools
+from database_migrations import run_migrations
+from database_pool import get_connection, write_transaction
+from telegram_ingest import ChatDispatcher, get_dispatcher, handle_update
+from structured_log import campos, get_logger
+from telegram_sender import TELEGRAM_API_BASE
+
+log = get_logger(__name__)
+
+# --- Configuração do polling (pode ser ajustada pelo .env) ---
+TELEGRAM_POLL_TIMEOUT = int(os.getenv("TELEGRAM_POLL_TIMEOUT", "30"))  # Long polling: segundos que o Telegram segura a requisição
+TELEGRAM_POLL_LIMIT = int(os.getenv("TELEGRAM_POLL_LIMIT", "100"))     # Updates por chamada (máximo do Telegram)
+TELEGRAM_POLL_BACKOFF_MAX = 30.0  # Espera máxima entre tentativas quando o Telegram/rede falha
+
+
+class TelegramPoller:
+    """
+    Busca updates com getUpdates e entrega ao mesmo pipeline do webhook (handle_update):
+    dedupe pelo update_id, fila por chat e workers do telegram_ingest.
+
+    O offset (último update_id confirmado + 1) fica na tabela 'telegram_polling' e é
+    gravado depois de cada lote enfileirado, então um reinício continua de onde parou.
+    Se a fila encher, o lote para ali e o resto é buscado de novo no próximo getUpdates.
+    """
+
+    def __init__(self, token: Optional[str], api_base: str = TELEGRAM_API_BASE,
+                 dispatcher: ChatDispatcher = None, db_file: str = None,
+                 poll_timeout: int = TELEGRAM_POLL_TIMEOUT, limit: int = TELEGRAM_POLL_LIMIT):
+        self.base_url = f"{api_base.rstrip('/')}/bot{token}"
+        self.dispatcher = dispatcher
+        self.db_file = db_file or database_tools.DATABASE_FILE
+        self.poll_timeout = poll_timeout
+        self.limit = limit
+        self.session = requests.Session()
+        self.offset = self._load_offset()
+        self._stop = threading.Event()
+        self._inicio = time.monotonic()
+        self._recentes = deque()  # Instantes dos updates recebidos no último minuto (updates/s recente)
+        self._stats = {"chamadas": 0, "updates": 0, "enfileirados": 0, "duplicados": 0, "limitados": 0, "ignorados": 0,
+                       "fila_cheia": 0, "erros": 0, "lag_recebimento_total_s": 0.0, "lag_recebimento_max_s": 0.0}
+
+    # --- Offset persistido ---
+
+    def _load_offset(self) -> int:
+        row = get_connection(self.db_file).execute(
+            "SELECT proximo_offset FROM telegram_polling WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def _save_offset(self, offset: int) -> None:
+        write_transaction(self.db_file, lambda conn: conn.execute(
+            "INSERT INTO telegram_polling (id, proximo_offset) VALUES (1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET proximo_offset = excluded.proximo_offset", (offset,)))
+        self.offset = offset
+
+    # --- API do Telegram ---
+
+    def _call(self, method: str, payload: Dict[str, Any], read_timeout: float) -> Dict[str, Any]:
+        response = self.session.post(f"{self.base_url}/{method}", json=payload, timeout=(3.05, read_timeout))
+        if response.status_code == 409 and method == "getUpdates":
+            # Webhook ainda configurado: o Telegram não deixa usar getUpdates ao mesmo tempo
+            log.warning("Webhook ativo no Telegram, removendo para usar getUpdates")
+            self.session.post(f"{self.base_url}/deleteWebhook", json={}, timeout=(3.05, 10)).raise_for_status()
+            return {"ok": True, "result": []}
+        response.raise_for_status()
+        return response.json()
+
+    def poll_once(self) -> int:
+        """Um getUpdates (long polling). Retorna quantos updates chegaram."""
+        dados = self._call("getUpdates", {
+            "offset": self.offset,
+            "timeout": self.poll_timeout,
+            "limit": self.limit,
+            "allowed_updates": ["message"],
+        }, read_timeout=self.poll_timeout + 10)
+        updates: List[Dict[str, Any]] = dados.get("result", [])
+        self._stats["chamadas"] += 1
+        if not updates:
+            return 0
+
+        agora = time.time()
+        proximo_offset = self.offset
+        cheia = False
+        try:
+            for update in updates:
+                data = (update.get("message") or {}).get("date")
+                if isinstance(data, (int, float)):
+                    lag = max(0.0, agora - data)
+                    self._stats["lag_recebimento_total_s"] += lag
+                    self._stats["lag_recebimento_max_s"] = max(self._stats["lag_recebimento_max_s"], lag)
+
+                status = handle_update(update, self.dispatcher)
+                if status == "fila_cheia":
+                    # Backpressure: este update e os seguintes voltam no próximo getUpdates
+                    self._stats["fila_cheia"] += 1
+                    cheia = True
+                    break
+                self._stats["updates"] += 1
+                self._recentes.append(time.monotonic())
+                self._stats[{"enfileirado": "enfileirados", "duplicado": "duplicados",
+                             "limitado": "limitados"}.get(status, "ignorados")] += 1
+                proximo_offset = max(proximo_offset, update.get("update_id", -1) + 1)
+        finally:
+            # Se um update falhar no meio do lote (ex: banco travado), os anteriores já foram entregues:
+            # o offset avança só até eles e o que falhou volta no próximo getUpdates
+            if proximo_offset != self.offset:
+                self._save_offset(proximo_offset)
+        if cheia:
+            self._stop.wait(0.5)  # Dá tempo para os workers esvaziarem a fila
+        return len(updates)
+
+    # --- Loop principal ---
+
+    def run(self) -> None:
+        """
+        Faz getUpdates até stop(). Erros de rede/Telegram e do banco (ex: lock do SQLite esgotado no
+        dedupe ou no offset) esperam com backoff e tentam de novo: a thread nunca morre por um erro.
+        """
+        log.info("Iniciando getUpdates", extra=campos(offset=self.offset))
+        falhas = 0
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                falhas = 0
+            except (requests.exceptions.RequestException, ValueError) as e:
+                falhas += 1
+                espera = self._falhou(falhas)
+                log.error("Falha no getUpdates", extra=campos(erro=f"{type(e).__name__}: {e}", nova_tentativa_s=espera))
+                self._stop.wait(espera)
+            except Exception:
+                falhas += 1
+                espera = self._falhou(falhas)
+                log.exception("Erro ao processar os updates", extra=campos(nova_tentativa_s=espera))
+                self._stop.wait(espera)
+        self.session.close()
+
+    def _falhou(self, falhas: int) -> float:
+        self._stats["erros"] += 1
+        return min(TELEGRAM_POLL_BACKOFF_MAX, 2 ** falhas)
+
+    def stop(self) -> None:
+        """Para o loop depois do getUpdates em andamento."""
+        self._stop.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Updates por segundo (total e do último minuto) e lag entre a mensagem e o recebimento."""
+        agora = time.monotonic()
+        while self._recentes and agora - self._recentes[0] > 60:
+            self._recentes.popleft()
+        stats = dict(self._stats)
+        stats["offset"] = self.offset
+        stats["updates_por_segundo"] = stats["updates"] / max(agora - self._inicio, 1e-9)
+        stats["updates_por_segundo_1min"] = len(self._recentes) / min(60.0, max(agora - self._inicio, 1e-9))
+        stats["lag_recebimento_medio_s"] = (stats["lag_recebimento_total_s"] / stats["updates"]
+                                            if stats["updates"] else 0.0)
+        # Lag de ponta a ponta (mensagem do usuário -> resposta pronta) vem dos workers
+        stats["ingestao"] = (self.dispatcher or get_dispatcher()).get_stats()
+        return stats
+
+
+if __name__ == "__main__":
+    from config import TELEGRAM_BOT_TOKEN
+    from telegram_ingest import close_dispatcher
+    from telegram_sender import close_telegram_sender
+
+    run_migrations(database_tools.DATABASE_FILE)
+    poller = TelegramPoller(TELEGRAM_BOT_TOKEN)
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        log.info("Encerrando")
+    finally:
+        close_dispatcher()
+        close_telegram_sender()
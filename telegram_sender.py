@@ -0,0 +1,335 @@
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from structured_log import campos, get_logger
+
+log = get_logger(__name__)
+
+# --- Configuração do envio (pode ser ajustada pelo .env) ---
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_SENDER_WORKERS = int(os.getenv("TELEGRAM_SENDER_WORKERS", "4"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "4"))  # Tentativas extras em 429/5xx/rede
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "3.05"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+
+# Limites do Telegram: ~30 mensagens/s no total e ~1 mensagem/s por chat (com pequenas rajadas)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+TELEGRAM_MAX_TEXT = 4096  # Tamanho máximo de uma mensagem no Telegram
+TELEGRAM_BATCH_MAX = 20   # Mensagens retiradas da fila de uma vez (para juntar as do mesmo chat)
+
+
+class TokenBucket:
+    """Balde de fichas: 'rate' fichas por segundo, acumulando no máximo 'capacity'."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Consome uma ficha e retorna quantos segundos esperar até ela valer (0 = já pode enviar)."""
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (agora - self._last) * self.rate)
+            self._last = agora
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def idle(self) -> bool:
+        """True quando o balde já encheu de novo (pode ser descartado)."""
+        with self._lock:
+            return self._tokens + (time.monotonic() - self._last) * self.rate >= self.capacity
+
+
+class _Envio:
+    __slots__ = ("chat_id", "text", "future", "enfileirado_em")
+
+    def __init__(self, chat_id, text: str):
+        self.chat_id = chat_id
+        self.text = text
+        self.future: Future = Future()
+        self.enfileirado_em = time.monotonic()
+
+
+def split_text(text: str, limit: int = TELEGRAM_MAX_TEXT) -> List[str]:
+    """Quebra textos maiores que o limite do Telegram, de preferência em quebras de linha."""
+    partes = []
+    while len(text) > limit:
+        corte = text.rfind("\n", 0, limit)
+        if corte <= 0:
+            corte = limit
+        partes.append(text[:corte])
+        text = text[corte:].lstrip("\n")
+    partes.append(text)
+    return partes
+
+
+class TelegramSender:
+    """
+    Envio de mensagens para a API do Telegram em segundo plano.
+
+    - Uma requests.Session com pool de conexões keep-alive (sem handshake TCP+TLS por mensagem).
+    - Uma fila por worker; cada chat sempre cai no mesmo worker, então a ordem das
+      mensagens de um chat é preservada.
+    - Balde de fichas global e por chat seguindo os limites do Telegram.
+    - Mensagens do mesmo chat que estão na fila ao mesmo tempo são juntadas numa só.
+    - Retry com backoff exponencial em erros de rede/5xx; no 429 espera o 'retry_after'.
+    """
+
+    def __init__(self, token: Optional[str], api_base: str = TELEGRAM_API_BASE,
+                 workers: int = TELEGRAM_SENDER_WORKERS, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 chat_rate: float = TELEGRAM_CHAT_RATE, chat_burst: float = TELEGRAM_CHAT_BURST):
+        self.url = f"{api_base.rstrip('/')}/bot{token}/sendMessage"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets: Dict[object, TokenBucket] = {}
+        self._chat_lock = threading.Lock()
+
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"enfileiradas": 0, "enviadas": 0, "falhas": 0, "tentativas_extras": 0,
+                       "respostas_429": 0, "agrupadas": 0, "requisicoes": 0,
+                       "espera_rate_limit_s": 0.0, "latencia_total_s": 0.0}
+
+    # --- API pública ---
+
+    def send(self, chat_id, text: str) -> Future:
+        """
+        Enfileira a mensagem e retorna na hora. O Future resolve para True (entregue)
+        ou False (falhou depois das tentativas).
+        """
+        self._ensure_started()
+        envio = _Envio(chat_id, text)
+        with self._stats_lock:
+            self._stats["enfileiradas"] += 1
+        self._queues[hash(chat_id) % len(self._queues)].put(envio)
+        return envio.future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Espera a fila esvaziar. Retorna False se o tempo acabar antes."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        for fila in self._queues:
+            while fila.unfinished_tasks:
+                if limite is not None and time.monotonic() >= limite:
+                    return False
+                time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Entrega o que ainda está na fila (até 'timeout' segundos) e para os workers."""
+        if not self._started:
+            return
+        self.flush(timeout)
+        for fila in self._queues:
+            fila.put(None)
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self.session.close()
+        self._started = False
+
+    def get_stats(self) -> dict:
+        """Métricas de entrega deste processo."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["na_fila"] = sum(fila.qsize() for fila in self._queues)
+        stats["latencia_media_s"] = stats["latencia_total_s"] / stats["enviadas"] if stats["enviadas"] else 0.0
+        return stats
+
+    # --- Internos ---
+
+    def _ensure_started(self) -> None:
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._threads = []
+            for i, fila in enumerate(self._queues):
+                thread = threading.Thread(target=self._worker, args=(fila,), name=f"telegram-sender-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def _worker(self, fila: queue.Queue) -> None:
+        while True:
+            primeiro = fila.get()
+            if primeiro is None:
+                fila.task_done()
+                return
+            lote = [primeiro]
+            parar = False
+            while len(lote) < TELEGRAM_BATCH_MAX:
+                try:
+                    item = fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    parar = True
+                    break
+                lote.append(item)
+
+            try:
+                for grupo in self._agrupar(lote):
+                    try:
+                        self._entregar(grupo)
+                    except Exception:
+                        # Erro inesperado (não de rede): a thread segue viva e quem espera o envio recebe False
+                        self._falhar(grupo)
+            finally:
+                for _ in range(len(lote) + (1 if parar else 0)):
+                    fila.task_done()
+            if parar:
+                return
+
+    def _falhar(self, grupo: List[_Envio]) -> None:
+        log.exception("Erro inesperado ao enviar ao Telegram", extra=campos(chat_id=grupo[0].chat_id))
+        pendentes = [envio for envio in grupo if not envio.future.done()]
+        with self._stats_lock:
+            self._stats["falhas"] += len(pendentes)
+        for envio in pendentes:
+            envio.future.set_result(False)
+
+    def _agrupar(self, lote: List[_Envio]) -> List[List[_Envio]]:
+        """
+        Junta as mensagens do lote que são do mesmo chat (na ordem em que chegaram)
+        enquanto couberem numa mensagem do Telegram.
+        """
+        grupos: List[List[_Envio]] = []
+        abertos: Dict[object, List[_Envio]] = {}
+        for envio in lote:
+            grupo = abertos.get(envio.chat_id)
+            if grupo is not None and sum(len(e.text) + 2 for e in grupo) + len(envio.text) <= TELEGRAM_MAX_TEXT:
+                grupo.append(envio)
+            else:
+                grupo = abertos[envio.chat_id] = [envio]
+                grupos.append(grupo)
+        return grupos
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        with self._chat_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 10_000:
+                    # Descarta os baldes que já encheram (chats parados) para não crescer sem limite
+                    self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle()}
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+            return bucket
+
+    def _esperar_ficha(self, chat_id) -> None:
+        espera = max(self._chat_bucket(chat_id).reserve(), self._global_bucket.reserve())
+        if espera > 0:
+            with self._stats_lock:
+                self._stats["espera_rate_limit_s"] += espera
+            time.sleep(espera)
+
+    def _entregar(self, grupo: List[_Envio]) -> None:
+        chat_id = grupo[0].chat_id
+        ok = True
+        for parte in split_text("\n\n".join(e.text for e in grupo)):
+            if not self._post(chat_id, parte):
+                ok = False
+                break
+
+        agora = time.monotonic()
+        with self._stats_lock:
+            if ok:
+                self._stats["enviadas"] += len(grupo)
+                self._stats["agrupadas"] += len(grupo) - 1
+                self._stats["latencia_total_s"] += sum(agora - e.enfileirado_em for e in grupo)
+            else:
+                self._stats["falhas"] += len(grupo)
+        for envio in grupo:
+            envio.future.set_result(ok)
+        if ok:
+            log.info("Mensagem enviada ao Telegram", extra=campos(chat_id=chat_id, partes=len(grupo)))
+
+    def _post(self, chat_id, text: str) -> bool:
+        """Uma mensagem, com as novas tentativas. Retorna True se o Telegram aceitou."""
+        payload = {"chat_id": chat_id, "text": text}
+        for tentativa in range(TELEGRAM_SEND_RETRIES + 1):
+            self._esperar_ficha(chat_id)
+            espera = None
+            try:
+                with self._stats_lock:
+                    self._stats["requisicoes"] += 1
+                response = self.session.post(self.url, json=payload,
+                                             timeout=(TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT))
+                if response.status_code == 200:
+                    return True
+                if response.status_code == 429:
+                    with self._stats_lock:
+                        self._stats["respostas_429"] += 1
+                    try:
+                        espera = float(response.json().get("parameters", {}).get("retry_after", 1))
+                    except (ValueError, TypeError, AttributeError):  # Corpo que não é o JSON esperado
+                        espera = 1.0
+                elif response.status_code < 500:
+                    # 400 (chat inexistente), 403 (bot bloqueado)...: tentar de novo não adianta
+                    log.error("Telegram recusou a mensagem", extra=campos(
+                        chat_id=chat_id, status=response.status_code, resposta_telegram=response.text[:200]))
+                    return False
+                erro = f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                erro = f"{type(e).__name__}: {e}"
+
+            if tentativa == TELEGRAM_SEND_RETRIES:
+                log.error("Desistindo de enviar ao Telegram", extra=campos(chat_id=chat_id, tentativas=tentativa + 1, erro=erro))
+                return False
+            if espera is None:
+                espera = min(8.0, 0.25 * 2 ** tentativa) * random.uniform(0.5, 1.0)
+            with self._stats_lock:
+                self._stats["tentativas_extras"] += 1
+            time.sleep(espera)
+        return False
+
+
+_sender: Optional[TelegramSender] = None
+_sender_lock = threading.Lock()
+
+
+def get_telegram_sender() -> TelegramSender:
+    """Sender compartilhado do processo (criado na primeira mensagem)."""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                from config import TELEGRAM_BOT_TOKEN
+                _sender = TelegramSender(TELEGRAM_BOT_TOKEN)
+    return _sender
+
+
+def get_sender_stats() -> dict:
+    return get_telegram_sender().get_stats() if _sender is not None else {}
+
+
+def close_telegram_sender() -> None:
+    """Entrega as mensagens pendentes e encerra os workers (saída do processo/worker)."""
+    if _sender is not None:
+        _sender.close()
+
+
+atexit.register(close_telegram_sender)
@@ -1,28 +1,27 @@
-import requests
-from config import TELEGRAM_BOT_TOKEN # Importa o token do nosso novo config
+import time
+
+from metrics import incrementar, observar
+from telegram_sender import get_telegram_sender
+
 
 def send_telegram_message(chat_id, message_text):
     """
     Envia uma mensagem de texto simples para o usuário via API do Telegram.
-    (Esta é a mesma função que estava no main.py)
+    A mensagem entra na fila do telegram_sender (pool keep-alive, rate limit e retries)
+    e a função retorna na hora. Quem precisar saber se foi entregue pode esperar
+    o Future retornado (.result() -> True/False).
     """
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    headers = {"Content-Type": "application/json"}
-    payload = {"chat_id": chat_id, "text": message_text}
-
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() 
-        print(f"--- Mensagem enviada para o Chat ID {chat_id} ---")
-        print(f"Conteúdo: {message_text}")
-        print(f"Resposta do Telegram: {response.json()}")
-        print("-----------------------------------------")
-    except requests.exceptions.RequestException as e:
-        print(f"================================================================")
-        print(f"ERRO FATAL AO TENTAR ENVIAR MENSAGEM (Telegram):")
-        print(f"Tipo exato do Erro: {type(e)}")
-        print(f"Mensagem de Erro completa: {e}")
-        print(f"================================================================")
+    inicio = time.perf_counter()
+    future = get_telegram_sender().send(chat_id, message_text)
+    future.add_done_callback(lambda f: _medir_envio(inicio, f))
+    return future
+
+
+def _medir_envio(inicio: float, future) -> None:
+    # Tempo da fila até a entrega (ou a desistência) vai para as métricas (rota /metrics)
+    entregue = not future.cancelled() and future.exception() is None and bool(future.result())
+    observar("clinica_telegram_envio_segundos", time.perf_counter() - inicio)
+    incrementar("clinica_telegram_envios_total", resultado="entregue" if entregue else "falha")
 
 def parse_webhook_data(request_data: dict) -> tuple[str | None, str | None]:
     """
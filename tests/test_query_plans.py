@@ -0,0 +1,25 @@
+"""
+Regressão dos planos de consulta (benchmarks/check_query_plans.py): as consultas reais das
+ferramentas, com o índice de horários e o cache de referência frios, não podem fazer SCAN
+completo nas tabelas grandes, e toda ferramenta precisa ter ao menos uma consulta conferida.
+"""
+import pytest
+
+from benchmarks.check_query_plans import TOOL_CALLS, query_plans
+
+
+@pytest.fixture(scope="module")
+def planos():
+    # Menor que o padrão do script, mas grande o bastante para o planejador preferir os índices
+    return query_plans(num_horarios=20_000)
+
+
+@pytest.mark.parametrize("tool_name", sorted(TOOL_CALLS))
+def test_ferramenta_tem_consulta_conferida(planos, tool_name):
+    assert planos[tool_name], f"{tool_name} não rodou nenhuma consulta nas tabelas grandes"
+
+
+@pytest.mark.parametrize("tool_name", sorted(TOOL_CALLS))
+def test_sem_scan_completo(planos, tool_name):
+    ruins = [(plano, sql) for (sql, plano, scans) in planos[tool_name] if scans]
+    assert not ruins, f"{tool_name} faz SCAN completo: {ruins}"
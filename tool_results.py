@@ -0,0 +1,102 @@
+"""
+Resultados das ferramentas do database_tools em duas formas.
+
+As ferramentas continuam devolvendo o texto em português de sempre (templates, roteador, logs e
+métricas usam esse texto), mas como ToolResult: uma str que também carrega os dados tipados em
+.dados. Na 2a chamada à IA (RAG), compactar() escolhe o que vai no functionResponse:
+- listas de horários/agendamentos viram tabela por colunas, com chaves curtas, nomes de médicos
+  (ou exames) sem repetição e datas como dias depois de uma data base;
+- erros e confirmações viram um código curto ({"status": "horario_ocupado", "id": 12});
+- se a forma compacta não for menor (ex: um horário só), ou sem dados tipados, vai o texto antigo.
+
+TOOL_RESULT_COMPACTO=0 desliga a forma compacta (sempre o texto).
+"""
+import json
+import os
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from history_compaction import estimate_tokens
+
+TOOL_RESULT_COMPACTO = os.getenv("TOOL_RESULT_COMPACTO", "1") == "1"
+
+_stats_lock = threading.Lock()
+_stats = {"compactos": 0, "texto": 0, "tokens_texto": 0, "tokens_enviados": 0}
+
+
+class ToolResult(str):
+    """O texto de sempre da ferramenta, com os dados tipados em .dados (ou None)."""
+
+    def __new__(cls, texto: str, dados: Optional[Dict[str, Any]] = None):
+        resultado = super().__new__(cls, texto)
+        resultado.dados = dados
+        return resultado
+
+
+def lista(tipo: str, itens: List[Tuple[int, Optional[str], str]], coluna_nome: str = "medico",
+          cursor: Optional[int] = None) -> Dict[str, Any]:
+    """Dados de uma lista: itens (id, nome do médico/exame ou None, 'AAAA-MM-DD HH:MM:SS')."""
+    return {"tipo": tipo, "itens": itens, "coluna_nome": coluna_nome, "cursor": cursor}
+
+
+def status(codigo: str, **extras) -> Dict[str, Any]:
+    return {"status": codigo, **extras}
+
+
+def _tabela(dados: Dict[str, Any]) -> Dict[str, Any]:
+    itens = dados["itens"]
+    if not itens:
+        return {dados["tipo"]: []}
+    datas = [date.fromisoformat(data_hora[:10]) for (_, _, data_hora) in itens]
+    base = min(datas)
+    nomes = list(dict.fromkeys(nome for (_, nome, _) in itens if nome))
+    compacto: Dict[str, Any] = {"tipo": dados["tipo"], "base": base.isoformat()}
+
+    colunas = ["id"]
+    if len(nomes) == 1:
+        compacto[dados["coluna_nome"]] = nomes[0]  # Um nome só: nem precisa de coluna
+    elif nomes:
+        colunas.append(f"{dados['coluna_nome']}_idx")
+        compacto[f"{dados['coluna_nome']}s"] = nomes
+    colunas += ["dias_apos_base", "hora"]
+
+    indice = {nome: i for (i, nome) in enumerate(nomes)}
+    linhas = []
+    for (item_id, nome, data_hora), dia in zip(itens, datas):
+        linha = [item_id]
+        if len(nomes) > 1:
+            linha.append(indice.get(nome))
+        linha += [(dia - base).days, data_hora[11:16]]
+        linhas.append(linha)
+    compacto["cols"] = colunas
+    compacto["rows"] = linhas
+    if dados.get("cursor") is not None:
+        compacto["cursor_proxima_pagina"] = dados["cursor"]
+    return compacto
+
+
+def _json(valor: Any) -> str:
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":"))
+
+
+def compactar(tool_result: Any) -> Any:
+    """O que vai no 'response' do functionResponse: a forma compacta, se for menor, ou o texto."""
+    dados = getattr(tool_result, "dados", None)
+    if not TOOL_RESULT_COMPACTO or dados is None:
+        return tool_result if not isinstance(tool_result, ToolResult) else str(tool_result)
+
+    compacto = dados if "status" in dados else _tabela(dados)
+    tokens_texto = estimate_tokens(_json(str(tool_result)))
+    tokens_compacto = estimate_tokens(_json(compacto))
+    usar_compacto = tokens_compacto < tokens_texto
+    with _stats_lock:
+        _stats["compactos" if usar_compacto else "texto"] += 1
+        _stats["tokens_texto"] += tokens_texto
+        _stats["tokens_enviados"] += tokens_compacto if usar_compacto else tokens_texto
+    return compacto if usar_compacto else str(tool_result)
+
+
+def get_compact_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)